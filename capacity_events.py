@@ -0,0 +1,128 @@
+"""
+Capacity-change events and the dispatcher that fills freed slots from the queue.
+
+Whatever can give a group a free slot publishes an event: an order closed
+(release_group), a capacity change, a group added or deleted, an order moved
+to another group. `publish` only records the event and wakes the dispatcher,
+so it is safe to call from synchronous code and inside a transaction. The one
+dispatcher task then runs a matching pass for each burst of events (events
+published while a pass runs cause one more pass), so no two handlers ever
+match the queue at the same time.
+
+Every CAPACITY_RECONCILE_SECONDS, and once at startup, the dispatcher also
+recounts each group's load from its open orders and repairs drift in
+load/busy (orders closed or moved outside the bot, manual DB edits, a crash
+between an order update and its counter update), then runs a pass whether or
+not anything was published.
+"""
+import asyncio
+import os
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from db import conn, cursor, logger
+
+CAPACITY_RECONCILE_SECONDS = float(os.getenv("CAPACITY_RECONCILE_SECONDS", "300"))
+
+# Set by the stale-order reaper (order_reaper.py)
+EXPIRED_STATUS = "Прострочено"
+# Orders in these states no longer occupy their group
+FINISHED_STATUSES = ("Завершено", "Незавершено (менеджер)", EXPIRED_STATUS)
+# WHERE condition for open orders. The statuses are literals, not bound, so SQLite can match
+# partial indexes on open orders (ix_orders_open_activity)
+OPEN_ORDER_SQL = "status NOT IN ({})".format(", ".join(f"'{status}'" for status in FINISHED_STATUSES))
+
+
+class LoadDrift(NamedTuple):
+    group_id: int  # Telegram chat id
+    load: int  # counter before the repair
+    open_orders: int
+
+
+def reconcile_group_load() -> List[LoadDrift]:
+    """Set every group's load/busy from its open orders (caller commits); returns the groups that drifted."""
+    cursor.execute(
+        "SELECT g.group_id, g.load, g.busy, g.capacity, COUNT(o.id) FROM manager_groups g "
+        "LEFT JOIN orders o ON o.group_id = g.group_id AND o.status NOT IN (?, ?, ?) "
+        "GROUP BY g.id",
+        FINISHED_STATUSES,
+    )
+    drifted = []
+    for group_id, load, busy, capacity, open_orders in cursor.fetchall():
+        if load != open_orders or bool(busy) != (open_orders >= capacity):
+            cursor.execute("UPDATE manager_groups SET load=?, busy=? WHERE group_id=?",
+                           (open_orders, int(open_orders >= capacity), group_id))
+            drifted.append(LoadDrift(group_id, load, open_orders))
+    return drifted
+
+
+class CapacityDispatcher:
+    def __init__(self, reconcile_seconds: float = CAPACITY_RECONCILE_SECONDS):
+        self.reconcile_seconds = reconcile_seconds
+        self._drain: Optional[Callable[[], Awaitable[Any]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+
+        self.events: Counter = Counter()  # reason -> published events
+        self.passes = 0
+        self.repaired = 0
+        self.failed = 0
+
+    def start(self, drain: Callable[[], Awaitable[Any]]) -> None:
+        """Run `drain()` (one matching pass over the queue) on every burst of events and every sweep."""
+        self._drain = drain
+        self._wake = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def publish(self, reason: str, group_id: Optional[int] = None) -> None:
+        """A slot may have been freed; `group_id` is informational. Before start() only counted."""
+        self.events[reason] += 1
+        logger.debug("Capacity event %s (group %s)", reason, group_id)
+        if self._wake is not None:
+            self._wake.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"events": dict(self.events), "passes": self.passes, "repaired": self.repaired, "failed": self.failed}
+
+    async def run_once(self, reconcile: bool = False) -> List[LoadDrift]:
+        drifted = []
+        if reconcile:
+            drifted = reconcile_group_load()
+            conn.commit()
+            for drift in drifted:
+                logger.warning("Group %s load drifted: counter %s, open orders %s",
+                               drift.group_id, drift.load, drift.open_orders)
+            self.repaired += len(drifted)
+        await self._drain()
+        self.passes += 1
+        return drifted
+
+    async def _run(self):
+        next_sweep = time.monotonic()
+        while True:
+            self._wake.clear()
+            sweep = time.monotonic() >= next_sweep
+            if sweep:
+                next_sweep = time.monotonic() + self.reconcile_seconds
+            try:
+                await self.run_once(reconcile=sweep)
+            except Exception as e:
+                self.failed += 1
+                logger.warning("Capacity dispatcher error: %s", e)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(0.0, next_sweep - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+
+capacity_dispatcher = CapacityDispatcher()
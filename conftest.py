@@ -0,0 +1,7 @@
+"""
+pytest setup: queries that full-scan orders or order_photos fail the test run
+(SQL_STRICT_SCANS, see query_profiler.py). Set before db.py is first imported.
+"""
+import os
+
+os.environ.setdefault("SQL_STRICT_SCANS", "orders,order_photos")
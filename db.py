@@ -4,10 +4,12 @@ import os
 import signal
 import sqlite3
 import sys
-from typing import Iterable
+from typing import Iterable, Optional
 
 from dotenv import load_dotenv
 
+from query_profiler import ProfiledConnection
+
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
@@ -22,6 +24,8 @@ ADMIN_ID = min(ADMIN_IDS) if ADMIN_IDS else None
 
 LOCK_FILE = os.getenv("LOCK_FILE", "bot.lock")
 DB_FILE = os.getenv("DB_FILE", "orders.db")
+# Orders a new manager group works on at once; per group: /group_capacity
+GROUP_CAPACITY = max(1, int(os.getenv("GROUP_CAPACITY", "1")))
 
 logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s",
@@ -57,7 +61,8 @@ for sig in (signal.SIGINT, signal.SIGTERM):
     except Exception:
         pass
 
-conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+# Statements are timed, logged when slow and audited for full scans; see query_profiler.py
+conn = sqlite3.connect(DB_FILE, check_same_thread=False, factory=ProfiledConnection)
 conn.execute("PRAGMA foreign_keys = ON")
 conn.execute("PRAGMA journal_mode = WAL")
 conn.execute("PRAGMA synchronous = NORMAL")
@@ -97,6 +102,31 @@ def _ensure_indexes():
         ON order_photos(order_id, stage)
         """)
         cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_order_photos_review
+        ON order_photos(review_id)
+        """)
+        # album review a moderation button was pressed under (its control message)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_photo_reviews_message
+        ON photo_reviews(chat_id, message_id)
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_photo_reviews_album
+        ON photo_reviews(order_id, stage, media_group_id) WHERE media_group_id IS NOT NULL
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_order_photos_phash
+        ON order_photos(phash) WHERE phash IS NOT NULL
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_order_forms_order
+        ON order_forms(order_id)
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_outbox_due
+        ON outbox(next_attempt_at) WHERE status = 'pending'
+        """)
+        cursor.execute("""
         CREATE INDEX IF NOT EXISTS ix_actions_order_created
         ON order_actions_log(order_id, created_at)
         """)
@@ -117,6 +147,43 @@ def _ensure_indexes():
         CREATE INDEX IF NOT EXISTS ix_manager_groups_bank
         ON manager_groups(bank, is_admin_group)
         """)
+        # claims take the lowest priority of a bank (bank groups) or of the whole queue (admin groups)
+        cursor.execute("DROP INDEX IF EXISTS ix_queue_bank")
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_queue_bank_priority
+        ON queue(bank, priority, id)
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_queue_priority
+        ON queue(priority, id)
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_queue_user
+        ON queue(user_id)
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_orders_user_status
+        ON orders(user_id, status)
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_orders_group_status
+        ON orders(group_id, status)
+        """)
+        # a user's latest order (WHERE user_id=? ORDER BY id DESC LIMIT 1) without sorting all their orders
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_orders_user
+        ON orders(user_id)
+        """)
+        # orders waiting for stage-2 data; the literal list must match stage2_group_text's query
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_orders_stage2_waiting
+        ON orders(phone_code_session, id) WHERE stage2_status IN ('waiting_manager_data','data_received')
+        """)
+        # Open orders only (FINISHED_STATUSES in capacity_events.py); the reaper's range scan
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS ix_orders_open_activity
+        ON orders(last_activity) WHERE status NOT IN ('Завершено', 'Незавершено (менеджер)', 'Прострочено')
+        """)
         cursor.execute("""
         CREATE INDEX IF NOT EXISTS ix_bank_instructions_bank_action
         ON bank_instructions(bank_name, action, step_number)
@@ -194,9 +261,11 @@ def ensure_schema():
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         group_id INTEGER UNIQUE,
         name TEXT,
-        busy INTEGER DEFAULT 0,
+        busy INTEGER DEFAULT 0,  -- load >= capacity, kept in step with load
         bank TEXT,  -- NULL for admin groups, specific bank name for bank groups
-        is_admin_group INTEGER DEFAULT 0  -- 1 for admin groups that can see all orders
+        is_admin_group INTEGER DEFAULT 0,  -- 1 for admin groups that can see all orders
+        capacity INTEGER NOT NULL DEFAULT 1,  -- orders the group works on at once
+        load INTEGER NOT NULL DEFAULT 0  -- orders assigned and not finished yet
     );
     """)
     _executescript("""
@@ -284,7 +353,23 @@ def ensure_schema():
         username TEXT,
         bank TEXT,
         action TEXT,
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        priority REAL NOT NULL DEFAULT 0,  -- virtual arrival time, lowest served first (queue_policy.py)
+        -- the user's "you are in the queue" message, kept up to date by queue_eta.py
+        status_message_id INTEGER,
+        status_text TEXT,
+        status_updated_at REAL  -- unix time of the last edit
+    );
+    """)
+    # Exponentially weighted order durations for queue ETAs, see queue_eta.py
+    _executescript("""
+    CREATE TABLE IF NOT EXISTS service_times (
+        bank TEXT NOT NULL,  -- '' for all banks
+        group_id INTEGER NOT NULL,  -- 0 for all groups of the bank
+        avg_seconds REAL NOT NULL,
+        samples INTEGER NOT NULL DEFAULT 1,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (bank, group_id)
     );
     """)
     # admins table for unified admin authorization
@@ -294,6 +379,113 @@ def ensure_schema():
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP
     );
     """)
+    # PTB persistence (chat_data/user_data/bot_data/conversation states), see persistence.py
+    _executescript("""
+    CREATE TABLE IF NOT EXISTS persistence_store (
+        namespace TEXT NOT NULL,  -- chat_data | user_data | bot_data | conv:<handler name>
+        key TEXT NOT NULL,
+        data TEXT NOT NULL,  -- JSON
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (namespace, key)
+    );
+    """)
+    # Transactional outbox: messages written together with the state change, delivered by outbox.py
+    _executescript("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        idem_key TEXT NOT NULL UNIQUE,  -- producer-chosen, re-enqueueing the same key is a no-op
+        chat_id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        options TEXT,  -- JSON: parse_mode / reply_markup
+        status TEXT NOT NULL DEFAULT 'pending',  -- pending | sending | sent | dead
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,  -- unix time
+        last_error TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        sent_at DATETIME
+    );
+    """)
+    # Timed events (reminders, refreshes, expiries) fired by the sweeper in scheduled_events.py
+    _executescript("""
+    CREATE TABLE IF NOT EXISTS scheduled_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,  -- selects the handler
+        key TEXT NOT NULL UNIQUE,  -- scheduling the same key again moves the event
+        due_at REAL NOT NULL,  -- unix time
+        payload TEXT,  -- JSON
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    # One moderation post (media group + control message) per submitted album
+    _executescript("""
+    CREATE TABLE IF NOT EXISTS photo_reviews (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        order_id INTEGER NOT NULL,
+        stage INTEGER NOT NULL,
+        chat_id INTEGER,
+        message_id INTEGER,  -- control message with the consolidated keyboard
+        media_group_id TEXT,  -- Telegram album the photos came in; late photos of it join this review
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
+    );
+    """)
+    # Denormalized per-stage photo counters, maintained by triggers on order_photos (active photos only)
+    progress_existed = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='order_stage_progress'"
+    ).fetchone() is not None
+    _executescript("""
+    CREATE TABLE IF NOT EXISTS order_stage_progress (
+        order_id INTEGER NOT NULL,
+        stage INTEGER NOT NULL,  -- 1-based, same as order_photos.stage
+        pending INTEGER NOT NULL DEFAULT 0,
+        approved INTEGER NOT NULL DEFAULT 0,
+        rejected INTEGER NOT NULL DEFAULT 0,
+        required INTEGER,  -- required_photos of the step, NULL if not defined
+        PRIMARY KEY (order_id, stage),
+        FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+
+    CREATE TRIGGER IF NOT EXISTS trg_order_photos_progress_ins
+    AFTER INSERT ON order_photos WHEN NEW.active = 1
+    BEGIN
+        INSERT OR IGNORE INTO order_stage_progress (order_id, stage) VALUES (NEW.order_id, NEW.stage);
+        UPDATE order_stage_progress SET
+            pending = pending + (NEW.confirmed = 0),
+            approved = approved + (NEW.confirmed = 1),
+            rejected = rejected + (NEW.confirmed = -1)
+        WHERE order_id = NEW.order_id AND stage = NEW.stage;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_order_photos_progress_upd
+    AFTER UPDATE OF confirmed, active, order_id, stage ON order_photos
+    BEGIN
+        UPDATE order_stage_progress SET
+            pending = pending - (OLD.confirmed = 0),
+            approved = approved - (OLD.confirmed = 1),
+            rejected = rejected - (OLD.confirmed = -1)
+        WHERE OLD.active = 1 AND order_id = OLD.order_id AND stage = OLD.stage;
+        INSERT OR IGNORE INTO order_stage_progress (order_id, stage)
+        SELECT NEW.order_id, NEW.stage WHERE NEW.active = 1;
+        UPDATE order_stage_progress SET
+            pending = pending + (NEW.confirmed = 0),
+            approved = approved + (NEW.confirmed = 1),
+            rejected = rejected + (NEW.confirmed = -1)
+        WHERE NEW.active = 1 AND order_id = NEW.order_id AND stage = NEW.stage;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_order_photos_progress_del
+    AFTER DELETE ON order_photos WHEN OLD.active = 1
+    BEGIN
+        UPDATE order_stage_progress SET
+            pending = pending - (OLD.confirmed = 0),
+            approved = approved - (OLD.confirmed = 1),
+            rejected = rejected - (OLD.confirmed = -1)
+        WHERE order_id = OLD.order_id AND stage = OLD.stage;
+    END;
+    """)
+    if not progress_existed:
+        rebuild_stage_progress()
     # Migrations (ensure missing columns if old DB)
     _ensure_columns("orders",
                     [
@@ -314,17 +506,103 @@ def ensure_schema():
             "stage2_complete": "ALTER TABLE orders ADD COLUMN stage2_complete INTEGER DEFAULT 0"
         }
     )
+    # Inactivity tracking for the stale-order reaper (order_reaper.py)
+    cursor.execute("PRAGMA table_info('orders')")
+    activity_existed = any(row[1] == "last_activity" for row in cursor.fetchall())
+    _ensure_columns("orders",
+                    ["last_activity", "expiry_warned_at"],
+        {
+            "last_activity": "ALTER TABLE orders ADD COLUMN last_activity REAL",  # unix time
+            "expiry_warned_at": "ALTER TABLE orders ADD COLUMN expiry_warned_at REAL"
+        }
+    )
+    if not activity_existed:
+        # Latest of creation, logged action and photo for the orders that predate the column
+        cursor.execute("""
+        UPDATE orders SET last_activity = (julianday(MAX(
+            COALESCE(created_at, ''),
+            COALESCE((SELECT MAX(created_at) FROM order_actions_log WHERE order_id = orders.id), ''),
+            COALESCE((SELECT MAX(created_at) FROM order_photos WHERE order_id = orders.id), '')
+        )) - 2440587.5) * 86400.0
+        """)
+        conn.commit()
+    _executescript("""
+    CREATE TRIGGER IF NOT EXISTS trg_orders_activity_ins
+    AFTER INSERT ON orders WHEN NEW.last_activity IS NULL
+    BEGIN
+        UPDATE orders SET last_activity = (julianday('now') - 2440587.5) * 86400.0 WHERE id = NEW.id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_order_actions_activity
+    AFTER INSERT ON order_actions_log
+    BEGIN
+        UPDATE orders SET last_activity = (julianday('now') - 2440587.5) * 86400.0 WHERE id = NEW.order_id;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_order_photos_activity
+    AFTER INSERT ON order_photos
+    BEGIN
+        UPDATE orders SET last_activity = (julianday('now') - 2440587.5) * 86400.0 WHERE id = NEW.order_id;
+    END;
+    """)
+    # Migrations for order_photos (album review)
+    _ensure_columns("order_photos",
+                    ["review_id", "review_draft", "phash", "dup_of", "quality_note"],
+        {
+            "review_id": "ALTER TABLE order_photos ADD COLUMN review_id INTEGER",
+            # decision toggled by a manager but not applied yet: 1 / -1 / NULL
+            "review_draft": "ALTER TABLE order_photos ADD COLUMN review_draft INTEGER",
+            # 64-bit perceptual hash (signed) and the closest earlier near-duplicate, see handlers/photo_hash.py
+            "phash": "ALTER TABLE order_photos ADD COLUMN phash INTEGER",
+            "dup_of": "ALTER TABLE order_photos ADD COLUMN dup_of INTEGER",
+            # automatic blur/crop pre-screening result "<issue>:<confidence>", see handlers/photo_quality.py
+            "quality_note": "ALTER TABLE order_photos ADD COLUMN quality_note TEXT"
+        }
+    )
+    # Migrations for photo_reviews
+    _ensure_columns("photo_reviews",
+                    ["media_group_id"],
+        {
+            "media_group_id": "ALTER TABLE photo_reviews ADD COLUMN media_group_id TEXT"
+        }
+    )
     # Migrations for manager_groups
+    cursor.execute("PRAGMA table_info('manager_groups')")
+    load_existed = any(row[1] == "load" for row in cursor.fetchall())
     _ensure_columns("manager_groups",
-                    ["bank", "is_admin_group"],
+                    ["bank", "is_admin_group", "capacity", "load"],
         {
             "bank": "ALTER TABLE manager_groups ADD COLUMN bank TEXT",
-            "is_admin_group": "ALTER TABLE manager_groups ADD COLUMN is_admin_group INTEGER DEFAULT 0"
+            "is_admin_group": "ALTER TABLE manager_groups ADD COLUMN is_admin_group INTEGER DEFAULT 0",
+            "capacity": "ALTER TABLE manager_groups ADD COLUMN capacity INTEGER NOT NULL DEFAULT 1",
+            "load": "ALTER TABLE manager_groups ADD COLUMN load INTEGER NOT NULL DEFAULT 0"
         }
     )
+    _ensure_columns("queue",
+                    ["status_message_id", "status_text", "status_updated_at", "priority"],
+        {
+            "status_message_id": "ALTER TABLE queue ADD COLUMN status_message_id INTEGER",
+            "status_text": "ALTER TABLE queue ADD COLUMN status_text TEXT",
+            "status_updated_at": "ALTER TABLE queue ADD COLUMN status_updated_at REAL",
+            # rows queued before priorities existed keep their FIFO order
+            "priority": "ALTER TABLE queue ADD COLUMN priority REAL NOT NULL DEFAULT 0"
+        }
+    )
+    if not load_existed:
+        # Count the open orders of groups that predate the column (FINISHED_STATUSES in capacity_events.py);
+        # afterwards the counters are kept up to date and checked by the capacity reconcile
+        cursor.execute("""
+        UPDATE manager_groups SET load = (
+            SELECT COUNT(*) FROM orders o WHERE o.group_id = manager_groups.group_id
+            AND o.status NOT IN ('Завершено', 'Незавершено (менеджер)', 'Прострочено')
+        )
+        """)
+        cursor.execute("UPDATE manager_groups SET busy = (load >= capacity)")
+        conn.commit()
     # Migrations for banks table
     _ensure_columns("banks",
-                    ["price", "description", "min_age", "register_price", "change_price", "register_min_age", "change_min_age"],
+                    ["price", "description", "min_age", "register_price", "change_price", "register_min_age", "change_min_age",
+                     "sla_minutes"],
         {
             "price": "ALTER TABLE banks ADD COLUMN price TEXT",
             "description": "ALTER TABLE banks ADD COLUMN description TEXT",
@@ -332,7 +610,9 @@ def ensure_schema():
             "register_price": "ALTER TABLE banks ADD COLUMN register_price TEXT",
             "change_price": "ALTER TABLE banks ADD COLUMN change_price TEXT", 
             "register_min_age": "ALTER TABLE banks ADD COLUMN register_min_age INTEGER DEFAULT 18",
-            "change_min_age": "ALTER TABLE banks ADD COLUMN change_min_age INTEGER DEFAULT 18"
+            "change_min_age": "ALTER TABLE banks ADD COLUMN change_min_age INTEGER DEFAULT 18",
+            # queue waiting-time target; NULL uses QUEUE_SLA_MINUTES (queue_policy.py)
+            "sla_minutes": "ALTER TABLE banks ADD COLUMN sla_minutes INTEGER"
         }
     )
     # Migrations for bank_instructions table to support stage types
@@ -346,8 +626,36 @@ def ensure_schema():
     )
     _ensure_indexes()
 
+def rebuild_stage_progress():
+    """Recompute order_stage_progress counters from order_photos (keeps `required`)."""
+    cursor.execute("""
+    INSERT INTO order_stage_progress (order_id, stage, pending, approved, rejected)
+    SELECT order_id, stage, SUM(confirmed = 0), SUM(confirmed = 1), SUM(confirmed = -1)
+    FROM order_photos WHERE active = 1
+    GROUP BY order_id, stage
+    ON CONFLICT(order_id, stage) DO UPDATE SET
+        pending = excluded.pending, approved = excluded.approved, rejected = excluded.rejected
+    """)
+    conn.commit()
+
 ensure_schema()
 
+def get_stage_progress(order_id: int, stage_db: int):
+    """(pending, approved, rejected, required) for an order stage, or None if no photos were submitted."""
+    cursor.execute(
+        "SELECT pending, approved, rejected, required FROM order_stage_progress WHERE order_id=? AND stage=?",
+        (order_id, stage_db),
+    )
+    return cursor.fetchone()
+
+def set_stage_required(order_id: int, stage_db: int, required):
+    """Remember required_photos of the step next to its counters (caller commits)."""
+    cursor.execute(
+        "INSERT INTO order_stage_progress (order_id, stage, required) VALUES (?, ?, ?) "
+        "ON CONFLICT(order_id, stage) DO UPDATE SET required=excluded.required",
+        (order_id, stage_db, required),
+    )
+
 def log_action(order_id: int, actor: str, action_type: str, payload: str = None):
     try:
         cursor.execute("INSERT INTO order_actions_log (order_id, actor, action_type, payload) VALUES (?,?,?,?)",
@@ -458,14 +766,33 @@ def record_data_usage(order_id: int, bank: str, phone_number: str = None, email:
 def add_manager_group(group_id: int, name: str, bank: str = None, is_admin: bool = False) -> bool:
     """Add a new manager group"""
     try:
-        cursor.execute("INSERT INTO manager_groups (group_id, name, bank, is_admin_group) VALUES (?,?,?,?)",
-                      (group_id, name, bank, 1 if is_admin else 0))
+        cursor.execute("INSERT INTO manager_groups (group_id, name, bank, is_admin_group, capacity) VALUES (?,?,?,?,?)",
+                      (group_id, name, bank, 1 if is_admin else 0, GROUP_CAPACITY))
         conn.commit()
         return True
     except Exception as e:
         logger.warning("add_manager_group failed: %s", e)
         return False
 
+def set_group_capacity(group_id: int, capacity: int) -> bool:
+    """Change how many orders a group works on at once (0 pauses it); False if there is no such group"""
+    cursor.execute("UPDATE manager_groups SET capacity=?, busy=(load >= ?) WHERE group_id=?",
+                   (capacity, capacity, group_id))
+    conn.commit()
+    return cursor.rowcount > 0
+
+def get_group_utilization():
+    """(group_id, name, bank, is_admin_group, load, capacity) of every group, admin groups first"""
+    cursor.execute("SELECT group_id, name, bank, is_admin_group, load, capacity FROM manager_groups "
+                   "ORDER BY is_admin_group DESC, bank, id")
+    return cursor.fetchall()
+
+def set_bank_sla(name: str, minutes: Optional[int]) -> bool:
+    """Set the bank's queue waiting-time target (None restores the default); False if there is no such bank"""
+    cursor.execute("UPDATE banks SET sla_minutes=? WHERE name=?", (minutes, name))
+    conn.commit()
+    return cursor.rowcount > 0
+
 def get_bank_groups(bank: str = None):
     """Get manager groups for a specific bank or all groups if bank is None"""
     if bank:
@@ -627,6 +954,18 @@ def get_banks():
     cursor.execute("SELECT name, is_active, register_enabled, change_enabled, price, description, min_age, register_price, change_price, register_min_age, change_min_age FROM banks ORDER BY name")
     return cursor.fetchall()
 
+def get_bank_id(bank_name: str):
+    """banks.id of a bank by name (compact callback_data refers to banks by id)"""
+    cursor.execute("SELECT id FROM banks WHERE name=?", (bank_name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def get_bank_name(bank_id: int):
+    """Bank name by banks.id, None if the bank was deleted"""
+    cursor.execute("SELECT name FROM banks WHERE id=?", (bank_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
 def get_bank_details(bank_name: str, action: str = None):
     """Get specific bank details (price, description, min_age) - optionally action-specific"""
     cursor.execute("SELECT price, description, min_age, register_price, change_price, register_min_age, change_min_age FROM banks WHERE name=?", (bank_name,))
@@ -733,14 +1072,14 @@ def generate_order_questionnaire(order_id: int, bank_name: str) -> str:
         if not template:
             return f"❌ Шаблон анкети для банку '{bank_name}' не знайдено"
         
-        # Get order photos
+        # Per-stage photo counters (order_stage_progress)
         cursor.execute("""
-            SELECT stage, file_unique_id, created_at 
-            FROM order_photos 
-            WHERE order_id = ? AND active = 1 
-            ORDER BY stage, created_at
+            SELECT stage, pending + approved + rejected
+            FROM order_stage_progress
+            WHERE order_id = ? AND pending + approved + rejected > 0
+            ORDER BY stage
         """, (order_id,))
-        photos = cursor.fetchall()
+        stage_counts = cursor.fetchall()
         
         # Build questionnaire
         questionnaire = f"📋 <b>Анкета замовлення #{order_id}</b>\n"
@@ -773,16 +1112,10 @@ def generate_order_questionnaire(order_id: int, bank_name: str) -> str:
                 questionnaire += f"• {field_name}: [Буде заповнено менеджером]\n"
         
         # Add photos section
-        if photos:
-            questionnaire += f"\n<b>📸 Скріни ({len(photos)} шт.):</b>\n"
-            stages = {}
-            for stage_num, file_id, photo_time in photos:
-                if stage_num not in stages:
-                    stages[stage_num] = []
-                stages[stage_num].append((file_id, photo_time))
-            
-            for stage_num in sorted(stages.keys()):
-                questionnaire += f"Етап {stage_num + 1}: {len(stages[stage_num])} фото\n"
+        if stage_counts:
+            questionnaire += f"\n<b>📸 Скріни ({sum(c for _, c in stage_counts)} шт.):</b>\n"
+            for stage_num, count in stage_counts:
+                questionnaire += f"Етап {stage_num + 1}: {count} фото\n"
         else:
             questionnaire += "\n📸 Скріни: Немає прикріплених фото\n"
             
@@ -1,15 +1,20 @@
 import os
+from collections import Counter
 
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from db import ADMIN_ID, conn, cursor, is_admin, logger, add_admin_db, remove_admin_db, list_admins_db, ensure_requisites_stages_for_all_banks
-from handlers.photo_handlers import (
-    assign_queued_clients_to_free_groups,
-    free_group_db_by_chatid,
-)
+from db import ADMIN_ID, GROUP_CAPACITY, conn, cursor, is_admin, logger, add_admin_db, remove_admin_db, list_admins_db, ensure_requisites_stages_for_all_banks, set_bank_sla, set_group_capacity
+from capacity_events import FINISHED_STATUSES, OPEN_ORDER_SQL, capacity_dispatcher
+from handlers.broadcast import run_broadcast
+from handlers.photo_handlers import close_order
 from handlers.templates_store import del_template, list_templates, set_template
+from queue_eta import queue_status_notifier
+from queue_policy import QUEUE_SLA_MINUTES, queue_policy
+from queue_scheduler import format_load, release_group
+from query_profiler import query_profiler
 from states import user_states
+from telemetry import format_perf, format_sql
 
 async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.message.from_user.id):
@@ -64,8 +69,10 @@ async def add_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         return await update.message.reply_text("❌ ID групи має бути числом")
     name = " ".join(context.args[1:])
-    cursor.execute("INSERT OR IGNORE INTO manager_groups (group_id, name) VALUES (?, ?)", (group_id, name))
+    cursor.execute("INSERT OR IGNORE INTO manager_groups (group_id, name, capacity) VALUES (?, ?, ?)",
+                   (group_id, name, GROUP_CAPACITY))
     conn.commit()
+    capacity_dispatcher.publish("group_added", group_id)
     await update.message.reply_text(f"✅ Групу '{name}' додано")
 
 async def del_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -79,24 +86,81 @@ async def del_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await update.message.reply_text("❌ ID групи має бути числом")
     cursor.execute("DELETE FROM manager_groups WHERE group_id=?", (group_id,))
     conn.commit()
+    capacity_dispatcher.publish("group_deleted", group_id)
     await update.message.reply_text("✅ Групу видалено")
 
 async def list_groups(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.message.from_user.id):
         return await update.message.reply_text("⛔ Немає доступу")
-    cursor.execute("SELECT group_id, name, busy FROM manager_groups ORDER BY id ASC")
+    cursor.execute("SELECT group_id, name, busy, load, capacity FROM manager_groups ORDER BY id ASC")
     groups = cursor.fetchall()
     if not groups:
         return await update.message.reply_text("📭 Немає груп")
     text = "📋 Список груп:\n"
-    for gid, name, busy in groups:
-        text += f"• {name} ({gid}) — {'🔴 Зайнята' if busy else '🟢 Вільна'}\n"
+    for gid, name, busy, load, capacity in groups:
+        text += f"• {name} ({gid}) — {'🔴 Зайнята' if busy else '🟢 Вільна'}, {format_load(load, capacity)}\n"
     await update.message.reply_text(text)
 
+async def group_capacity_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.message.from_user.id):
+        return await update.message.reply_text("⛔ Немає доступу")
+    if len(context.args) != 2:
+        return await update.message.reply_text("Використання: /group_capacity <group_id> <кількість замовлень>")
+    try:
+        group_id, capacity = int(context.args[0]), int(context.args[1])
+    except ValueError:
+        return await update.message.reply_text("❌ ID групи та кількість мають бути числами")
+    if capacity < 0:
+        return await update.message.reply_text("❌ Кількість не може бути відʼємною")
+    if not set_group_capacity(group_id, capacity):
+        return await update.message.reply_text("❌ Групу не знайдено")
+    note = " (група на паузі)" if capacity == 0 else ""
+    await update.message.reply_text(f"✅ Група {group_id} тепер веде до {capacity} замовлень одночасно{note}")
+    # A bigger capacity frees slots for the queue
+    capacity_dispatcher.publish("capacity_changed", group_id)
+
+async def bank_sla_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.message.from_user.id):
+        return await update.message.reply_text("⛔ Немає доступу")
+    if len(context.args) < 2:
+        return await update.message.reply_text(
+            f"Використання: /bank_sla <хвилини|default> <назва банку>\nЗа замовчуванням: {QUEUE_SLA_MINUTES:g} хв")
+    value, bank = context.args[0], " ".join(context.args[1:])
+    try:
+        minutes = None if value == "default" else int(value)
+    except ValueError:
+        return await update.message.reply_text("❌ Вкажіть кількість хвилин або default")
+    if minutes is not None and minutes <= 0:
+        return await update.message.reply_text("❌ Кількість хвилин має бути додатною")
+    if not set_bank_sla(bank, minutes):
+        return await update.message.reply_text("❌ Банк не знайдено")
+    # clients already waiting move according to the new target
+    queue_policy.rescore()
+    conn.commit()
+    queue_status_notifier.wake()
+    target = f"{minutes} хв" if minutes is not None else f"за замовчуванням ({QUEUE_SLA_MINUTES:g} хв)"
+    await update.message.reply_text(f"✅ Цільовий час очікування для {bank}: {target}")
+
+async def perf_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.message.from_user.id):
+        return await update.message.reply_text("⛔ Немає доступу")
+    await update.message.reply_text(format_perf(context.application))
+
+async def sql_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.message.from_user.id):
+        return await update.message.reply_text("⛔ Немає доступу")
+    arg = context.args[0] if context.args else "total"
+    if arg == "reset":
+        query_profiler.reset()
+        return await update.message.reply_text("✅ Статистику запитів скинуто.")
+    if arg not in ("total", "max", "count"):
+        return await update.message.reply_text("Використання: /sql [total|max|count|reset]")
+    await update.message.reply_text(format_sql(arg))
+
 async def show_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.message.from_user.id):
         return await update.message.reply_text("⛔ У вас немає прав для цієї команди.")
-    cursor.execute("SELECT id, user_id, username, bank, action, created_at FROM queue ORDER BY id ASC")
+    cursor.execute("SELECT id, user_id, username, bank, action, created_at FROM queue ORDER BY priority, id")
     rows = cursor.fetchall()
     if not rows:
         return await update.message.reply_text("📭 Черга пуста.")
@@ -172,7 +236,10 @@ async def finish_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ Вкажіть order_id. Приклад: /finish_order 123")
             return
         order_id = int(args[0])
-        cursor.execute("SELECT user_id, group_id, bank FROM orders WHERE id=? AND status!='Завершено'", (order_id,))
+        cursor.execute(
+            f"SELECT user_id, group_id, bank FROM orders WHERE id=? AND status NOT IN ({','.join('?' * len(FINISHED_STATUSES))})",
+            (order_id, *FINISHED_STATUSES),
+        )
         row = cursor.fetchone()
         if not row:
             await update.message.reply_text("❌ Замовлення не знайдено або вже завершено.")
@@ -192,8 +259,11 @@ async def finish_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
             new_status = "Незавершено (менеджер)"
             completion_type = "неповне"
 
-        cursor.execute("UPDATE orders SET status=? WHERE id=?", (new_status, order_id,))
+        closed = close_order(order_id, new_status, group_chat_id)
         conn.commit()
+        if not closed:
+            await update.message.reply_text("❌ Замовлення не знайдено або вже завершено.")
+            return
 
         # Generate and send questionnaire
         try:
@@ -219,12 +289,6 @@ async def finish_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
             logger.warning(f"Failed to generate questionnaire for order {order_id}: {e}")
             await update.message.reply_text(f"✅ Замовлення {order_id} завершено ({completion_type}). (Помилка генерації анкети: {e})")
 
-        if group_chat_id:
-            try:
-                free_group_db_by_chatid(group_chat_id)
-            except Exception:
-                pass
-
         user_states.pop(client_user_id, None)
 
         try:
@@ -234,11 +298,6 @@ async def finish_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         logger.info(f"Order {order_id} завершено адміністратором.")
 
-        try:
-            await assign_queued_clients_to_free_groups(context)
-        except Exception:
-            pass
-
     except Exception as e:
         logger.exception("finish_order error: %s", e)
         await update.message.reply_text("⚠️ Сталася помилка під час завершення замовлення.")
@@ -250,47 +309,80 @@ async def finish_all_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        cursor.execute("SELECT id, user_id, group_id FROM orders WHERE status!='Завершено' AND status!='Незавершено (менеджер)'")
+        # One set-wise transaction; notifications are sent afterwards by the broadcast engine
+        cursor.execute(f"""
+            UPDATE orders
+            SET status = CASE WHEN EXISTS (SELECT 1 FROM order_forms f WHERE f.order_id = orders.id)
+                              THEN 'Завершено' ELSE 'Незавершено (менеджер)' END
+            WHERE {OPEN_ORDER_SQL}
+            RETURNING user_id, group_id
+        """)
         rows = cursor.fetchall()
-        finished_count = 0
-        freed_groups = set()
-
-        for order_id, client_user_id, group_chat_id in rows:
-            # Check if order form exists to determine completion type
-            cursor.execute("SELECT form_data FROM order_forms WHERE order_id=?", (order_id,))
-            form_row = cursor.fetchone()
-            
-            if form_row:
-                new_status = "Завершено"
-            else:
-                new_status = "Незавершено (менеджер)"
-                
-            cursor.execute("UPDATE orders SET status=? WHERE id=?", (new_status, order_id,))
-            user_states.pop(client_user_id, None)
-            if group_chat_id:
-                freed_groups.add(group_chat_id)
-            try:
-                await context.bot.send_message(chat_id=client_user_id, text="🏁 Ваше замовлення було завершено адміністратором.")
-            except Exception:
-                pass
-            finished_count += 1
-
-        for gid in freed_groups:
-            try:
-                free_group_db_by_chatid(gid)
-            except Exception:
-                pass
-
+        freed_groups = Counter(group_chat_id for _, group_chat_id in rows if group_chat_id)
+        for group_chat_id, orders in freed_groups.items():
+            release_group(group_chat_id, orders)
         cursor.execute("DELETE FROM queue")
         conn.commit()
 
+        client_ids = [client_user_id for client_user_id, _ in rows]
+        for client_user_id in client_ids:
+            user_states.pop(client_user_id, None)
+
+        finished_count = len(rows)
         await update.message.reply_text(f"✅ Завершено всі незавершені замовлення: {finished_count} шт. Чергу очищено.")
         logger.info(f"Всі незавершені замовлення завершено ({finished_count} шт). Черга очищена.")
 
+        if client_ids:
+            context.application.create_task(
+                run_broadcast(
+                    context.bot, client_ids, "🏁 Ваше замовлення було завершено адміністратором.",
+                    title="Сповіщення про завершення", progress_chat_id=update.effective_chat.id,
+                ),
+                update=update,
+            )
+
     except Exception as e:
+        conn.rollback()
         logger.exception("finish_all_orders error: %s", e)
         await update.message.reply_text("⚠️ Сталася помилка під час завершення всіх замовлень.")
 
+_BROADCAST_AUDIENCES = {
+    # users with an order that is still in progress
+    "active": f"SELECT DISTINCT user_id FROM orders WHERE {OPEN_ORDER_SQL}",
+    # everyone who ever placed an order
+    "all": "SELECT DISTINCT user_id FROM orders",
+    "queue": "SELECT DISTINCT user_id FROM queue",
+}
+
+async def broadcast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/broadcast <active|all|queue> <текст> — розсилка користувачам"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ Доступ тільки для адміністратора.")
+        return
+
+    args = context.args or []
+    if len(args) < 2 or args[0] not in _BROADCAST_AUDIENCES:
+        await update.message.reply_text(
+            "Використання: /broadcast <active|all|queue> <текст>\n"
+            "active — користувачі з незавершеними замовленнями, all — усі, queue — черга."
+        )
+        return
+
+    # Keep the admin's line breaks: take the text after the audience word from the raw message
+    text = update.message.text.split(None, 2)[2].strip()
+    cursor.execute(_BROADCAST_AUDIENCES[args[0]])
+    chat_ids = [row[0] for row in cursor.fetchall()]
+    if not chat_ids:
+        await update.message.reply_text("📭 Немає отримувачів.")
+        return
+
+    logger.info("Admin %s started broadcast to '%s' (%s users)", update.effective_user.id, args[0], len(chat_ids))
+    context.application.create_task(
+        run_broadcast(context.bot, chat_ids, text, title=f"Розсилка ({args[0]})",
+                      progress_chat_id=update.effective_chat.id),
+        update=update,
+    )
+
 async def orders_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if not is_admin(user_id):
@@ -304,7 +396,9 @@ async def orders_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         completed = cursor.fetchone()[0]
         cursor.execute("SELECT COUNT(*) FROM orders WHERE status='Незавершено (менеджер)'")
         incomplete = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM orders WHERE status!='Завершено' AND status!='Незавершено (менеджер)'")
+        cursor.execute("SELECT COUNT(*) FROM orders WHERE status='Прострочено'")
+        expired = cursor.fetchone()[0]
+        cursor.execute(f"SELECT COUNT(*) FROM orders WHERE {OPEN_ORDER_SQL}")
         active = cursor.fetchone()[0]
         
         completion_rate = (completed / total * 100) if total > 0 else 0
@@ -314,6 +408,7 @@ async def orders_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"📈 Всього: {total}\n"
             f"✅ Завершено повністю: {completed} ({completion_rate:.1f}%)\n"
             f"⚠️ Завершено неповно: {incomplete}\n"
+            f"⌛ Прострочено: {expired}\n"
             f"🔄 Активних: {active}\n\n"
             f"💡 <i>Неповні замовлення - це ті, які менеджер завершив вручну, але клієнт не пройшов повний процес реєстрації/перев'язки.</i>"
         )
@@ -358,12 +453,17 @@ async def admin_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "<b>/history [user_id]</b> — Останні 10 замовлень або останнє замовлення користувача.\n"
         "<b>/addgroup &lt;group_id&gt; &lt;назва&gt;</b> — Додати групу менеджерів.\n"
         "<b>/delgroup &lt;group_id&gt;</b> — Видалити групу.\n"
-        "<b>/groups</b> — Список груп.\n"
+        "<b>/groups</b> — Список груп із завантаженням.\n"
+        "<b>/group_capacity &lt;group_id&gt; &lt;n&gt;</b> — Скільки замовлень група веде одночасно (0 — пауза).\n"
+        "<b>/bank_sla &lt;хвилини|default&gt; &lt;банк&gt;</b> — Цільовий час очікування в черзі для банку.\n"
         "<b>/queue</b> — Черга очікування.\n"
         "<b>/status</b> — Статус вашого останнього замовлення (для користувача).\n"
         "<b>/finish_order &lt;order_id&gt;</b> — Закрити замовлення.\n"
         "<b>/finish_all_orders</b> — Закрити всі незавершені замовлення.\n"
+        "<b>/broadcast &lt;active|all|queue&gt; &lt;текст&gt;</b> — Розсилка користувачам з прогресом у цьому чаті.\n"
         "<b>/orders_stats</b> — Статистика замовлень.\n"
+        "<b>/perf</b> — Швидкодія: затримки обробників, Bot API та БД, частота оновлень.\n"
+        "<b>/sql [total|max|count|reset]</b> — Найдорожчі запити до БД і повні сканування таблиць.\n"
         "<b>/myorders</b> — Список ваших замовлень (для користувача).\n"
         "<b>/order &lt;order_id&gt;</b> — Картка замовлення (для адміна).\n"
         "<b>/tmpl_list</b> — список текстових шаблонів для швидких відповідей.\n"
@@ -533,6 +633,7 @@ async def add_bank_group_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE)
         from db import add_manager_group, log_action
 
         if add_manager_group(group_id, name, bank, False):
+            capacity_dispatcher.publish("group_added", group_id)
             log_action(0, f"admin_{update.effective_user.id}", "add_bank_group", f"{bank}:{group_id}:{name}")
             await update.message.reply_text(f"✅ Групу '{name}' для банку '{bank}' додано!")
         else:
@@ -556,6 +657,7 @@ async def add_admin_group_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE
         from db import add_manager_group, log_action
 
         if add_manager_group(group_id, name, None, True):
+            capacity_dispatcher.publish("group_added", group_id)
             log_action(0, f"admin_{update.effective_user.id}", "add_admin_group", f"{group_id}:{name}")
             await update.message.reply_text(f"✅ Адмін групу '{name}' додано!")
         else:
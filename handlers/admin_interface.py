@@ -2,13 +2,19 @@
 Unified Admin Interface - Complete management of all admin functions through interface
 This replaces scattered command-line functions with a unified menu-driven interface
 """
+import html
 import logging
+from typing import Any, Awaitable, Callable, Dict
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
 
+from capacity_events import OPEN_ORDER_SQL
 from db import is_admin, cursor, conn, list_admins_db, add_admin_db, remove_admin_db
+from handlers.callback_router import router
 from handlers.templates_store import list_templates
+from outbox import OUTBOX_KEEP_DAYS, dead_letters, outbox_counts, outbox_dispatcher, requeue_dead
+from queue_scheduler import format_load
 
 logger = logging.getLogger(__name__)
 
@@ -49,6 +55,21 @@ async def admin_interface_menu(update: Update, context: ContextTypes.DEFAULT_TYP
         parse_mode='HTML'
     )
 
+# callback_data -> view(query) of the admin panel, see admin_view()
+_VIEWS: Dict[str, Callable[[Any], Awaitable[None]]] = {}
+
+
+def admin_view(*specs: str):
+    """Register an admin panel view for exact callback_data; it is served by admin_interface_callback."""
+    def decorator(view):
+        for spec in specs:
+            _VIEWS[spec] = view
+            router.add(spec, admin_interface_callback)
+        return view
+    return decorator
+
+
+@router.route("admin_banks")
 async def admin_interface_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle admin interface callbacks"""
     query = update.callback_query
@@ -65,104 +86,13 @@ async def admin_interface_callback(update: Update, context: ContextTypes.DEFAULT
         # Redirect to bank management
         from handlers.bank_management import banks_management_menu
         await banks_management_menu(update, context)
+        return
 
-    elif data == "admin_groups":
-        await admin_groups_menu(query)
-
-    elif data == "admin_orders":
-        await admin_orders_menu(query)
-
-    elif data == "admin_admins":
-        await admin_admins_menu(query)
-
-    elif data == "admin_stats":
-        await admin_stats_menu(query)
-
-    elif data == "admin_system":
-        await admin_system_menu(query)
-
-    elif data == "admin_templates":
-        await admin_templates_menu(query)
-
-    elif data == "admin_help":
-        await admin_help_menu(query)
-
-    elif data == "back_to_admin":
-        await show_admin_main_menu(query)
-
-    # Groups management callbacks
-    elif data == "groups_menu":
-        # Handle groups_menu callback from bank_management
-        await admin_groups_menu(query)
-    elif data == "groups_list":
-        await groups_list(query)
-    elif data == "groups_add_bank":
-        await groups_add_bank(query)
-    elif data == "groups_add_admin":
-        await groups_add_admin(query)
-    elif data == "groups_delete":
-        await groups_delete(query)
-
-    # Orders management callbacks
-    elif data == "orders_active":
-        await orders_active(query)
-    elif data == "orders_queue":
-        await orders_queue(query)
-    elif data == "orders_history":
-        await orders_history(query)
-    elif data == "orders_finish":
-        await orders_finish(query)
-    elif data == "orders_stats":
-        await orders_stats(query)
-    elif data == "orders_forms":
-        await orders_forms(query)
-
-    # Admins management callbacks
-    elif data == "admins_list":
-        await admins_list(query)
-    elif data == "admins_add":
-        await admins_add(query)
-    elif data == "admins_remove":
-        await admins_remove(query)
-
-    # Stats callbacks
-    elif data == "stats_general":
-        await stats_general(query)
-    elif data == "stats_banks":
-        await stats_banks(query)
-    elif data == "stats_groups":
-        await stats_groups(query)
-    elif data == "stats_period":
-        await stats_period(query)
-    elif data == "stats_export":
-        await stats_export(query)
-
-    # System callbacks
-    elif data == "system_general":
-        await system_general(query)
-    elif data == "system_bank_visibility":
-        await system_bank_visibility(query)
-    elif data == "system_cleanup":
-        await system_cleanup(query)
-    elif data == "system_backup":
-        await system_backup(query)
-    elif data == "system_restart":
-        await system_restart(query)
-
-    # Templates callbacks
-    elif data == "templates_list":
-        await templates_list(query)
-    elif data == "templates_set":
-        await templates_set(query)
-    elif data == "templates_del":
-        await templates_del(query)
-    elif data == "templates_messages":
-        await templates_messages(query)
-    elif data == "templates_instructions":
-        await templates_instructions(query)
-    elif data == "templates_sync":
-        await templates_sync(query)
+    view = _VIEWS.get(data)
+    if view is not None:
+        await view(query)
 
+@admin_view("back_to_admin")
 async def show_admin_main_menu(query):
     """Show main admin menu"""
     keyboard = [
@@ -187,6 +117,7 @@ async def show_admin_main_menu(query):
         parse_mode='HTML'
     )
 
+@admin_view("admin_groups")
 async def admin_groups_menu(query):
     """Groups management menu"""
     keyboard = [
@@ -197,9 +128,12 @@ async def admin_groups_menu(query):
         [InlineKeyboardButton("🔙 Назад", callback_data="back_to_admin")]
     ]
 
-    text = "👥 <b>Управління групами</b>\n\nОберіть дію:"
+    cursor.execute("SELECT COALESCE(SUM(load), 0), COALESCE(SUM(capacity), 0) FROM manager_groups")
+    load, capacity = cursor.fetchone()
+    text = f"👥 <b>Управління групами</b>\n\n📊 Завантаження: {format_load(load, capacity)}\n\nОберіть дію:"
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@admin_view("admin_orders")
 async def admin_orders_menu(query):
     """Orders management menu"""
     keyboard = [
@@ -215,6 +149,7 @@ async def admin_orders_menu(query):
     text = "📋 <b>Управління замовленнями</b>\n\nОберіть дію:"
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@admin_view("admin_admins")
 async def admin_admins_menu(query):
     """Admins management menu"""
     keyboard = [
@@ -227,6 +162,7 @@ async def admin_admins_menu(query):
     text = "👨‍💼 <b>Управління адміністраторами</b>\n\nОберіть дію:"
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@admin_view("admin_stats")
 async def admin_stats_menu(query):
     """Statistics menu"""
     keyboard = [
@@ -241,6 +177,7 @@ async def admin_stats_menu(query):
     text = "📊 <b>Статистика та звіти</b>\n\nОберіть тип звіту:"
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@admin_view("admin_system")
 async def admin_system_menu(query):
     """System settings menu"""
     keyboard = [
@@ -248,6 +185,7 @@ async def admin_system_menu(query):
         [InlineKeyboardButton("🏦 Видимість банків", callback_data="system_bank_visibility")],
         [InlineKeyboardButton("🔄 Очистка бази даних", callback_data="system_cleanup")],
         [InlineKeyboardButton("📤 Резервне копіювання", callback_data="system_backup")],
+        [InlineKeyboardButton("📮 Outbox (недоставлені)", callback_data="system_outbox")],
         [InlineKeyboardButton("🔄 Перезапуск бота", callback_data="system_restart")],
         [InlineKeyboardButton("🔙 Назад", callback_data="back_to_admin")]
     ]
@@ -255,6 +193,7 @@ async def admin_system_menu(query):
     text = "⚙️ <b>Системні налаштування</b>\n\nОберіть дію:"
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@admin_view("admin_templates")
 async def admin_templates_menu(query):
     """Templates and instructions menu"""
     keyboard = [
@@ -267,6 +206,7 @@ async def admin_templates_menu(query):
     text = "📝 <b>Шаблони та інструкції</b>\n\nОберіть тип для управління:"
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@admin_view("admin_help")
 async def admin_help_menu(query):
     """Admin help menu"""
     text = (
@@ -413,15 +353,17 @@ async def groups_delete(query):
 
 # ============= Orders Management Handlers =============
 
+@admin_view("orders_active")
 async def orders_active(query):
     """Show active orders"""
     try:
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT o.id, o.user_id, o.username, o.bank, o.action, o.status, o.group_id, o.created_at,
-                   mg.name as group_name
+                   mg.name as group_name, p.pending, p.approved, p.rejected, p.required
             FROM orders o
             LEFT JOIN manager_groups mg ON o.group_id = mg.group_id
-            WHERE o.status != 'Завершено' AND o.status != 'Незавершено (менеджер)'
+            LEFT JOIN order_stage_progress p ON p.order_id = o.id AND p.stage = o.stage + 1
+            WHERE o.{OPEN_ORDER_SQL}
             ORDER BY o.created_at DESC
             LIMIT 20
         """)
@@ -431,11 +373,14 @@ async def orders_active(query):
             text = "📋 <b>Активні замовлення</b>\n\n✅ Немає активних замовлень"
         else:
             text = f"📋 <b>Активні замовлення</b> ({len(orders)})\n\n"
-            for order_id, user_id, username, bank, action, status, group_id, created_at, group_name in orders:
+            for (order_id, user_id, username, bank, action, status, group_id, created_at, group_name,
+                 pending, approved, rejected, required) in orders:
                 text += f"🆔 <b>#{order_id}</b>\n"
                 text += f"👤 @{username} (ID: {user_id})\n"
                 text += f"🏦 {bank} - {action}\n"
                 text += f"📍 {status}\n"
+                if pending is not None:
+                    text += f"📸 ✅ {approved}{f'/{required}' if required else ''} · ⏳ {pending} · ❌ {rejected}\n"
                 if group_name:
                     text += f"👥 {group_name}\n"
                 text += f"⏰ {created_at}\n\n"
@@ -450,10 +395,11 @@ async def orders_active(query):
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="admin_orders")]])
         )
 
+@admin_view("orders_queue")
 async def orders_queue(query):
     """Show order queue"""
     try:
-        cursor.execute("SELECT id, user_id, username, bank, action, created_at FROM queue ORDER BY created_at")
+        cursor.execute("SELECT id, user_id, username, bank, action, created_at FROM queue ORDER BY priority, id")
         queue_items = cursor.fetchall()
         
         if not queue_items:
@@ -475,6 +421,7 @@ async def orders_queue(query):
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="admin_orders")]])
         )
 
+@admin_view("orders_history")
 async def orders_history(query):
     """Show recent completed orders"""
     try:
@@ -507,6 +454,7 @@ async def orders_history(query):
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="admin_orders")]])
         )
 
+@admin_view("orders_finish")
 async def orders_finish(query):
     """Show instructions for finishing orders"""
     text = (
@@ -523,6 +471,7 @@ async def orders_finish(query):
     keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_orders")]]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@admin_view("orders_stats")
 async def orders_stats(query):
     """Show order statistics"""
     try:
@@ -536,7 +485,10 @@ async def orders_stats(query):
         cursor.execute("SELECT COUNT(*) FROM orders WHERE status = 'Незавершено (менеджер)'")
         incomplete_orders = cursor.fetchone()[0]
         
-        cursor.execute("SELECT COUNT(*) FROM orders WHERE status != 'Завершено' AND status != 'Незавершено (менеджер)'")
+        cursor.execute("SELECT COUNT(*) FROM orders WHERE status = 'Прострочено'")
+        expired_orders = cursor.fetchone()[0]
+        
+        cursor.execute(f"SELECT COUNT(*) FROM orders WHERE {OPEN_ORDER_SQL}")
         active_orders = cursor.fetchone()[0]
         
         cursor.execute("SELECT COUNT(*) FROM queue")
@@ -560,6 +512,7 @@ async def orders_stats(query):
             f"• Всього замовлень: {total_orders}\n"
             f"• Завершено повністю: {completed_orders}\n"
             f"• Завершено неповно: {incomplete_orders}\n"
+            f"• Прострочено (неактивність): {expired_orders}\n"
             f"• Активних: {active_orders}\n"
             f"• У черзі: {queue_count}\n\n"
         )
@@ -580,6 +533,7 @@ async def orders_stats(query):
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="admin_orders")]])
         )
 
+@admin_view("orders_forms")
 async def orders_forms(query):
     """Show information about order forms"""
     try:
@@ -621,6 +575,7 @@ async def orders_forms(query):
 
 # ============= Admin Management Handlers =============
 
+@admin_view("admins_list")
 async def admins_list(query):
     """Show list of administrators"""
     try:
@@ -643,6 +598,7 @@ async def admins_list(query):
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="admin_admins")]])
         )
 
+@admin_view("admins_add")
 async def admins_add(query):
     """Show instructions for adding admin"""
     text = (
@@ -660,6 +616,7 @@ async def admins_add(query):
     keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_admins")]]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@admin_view("admins_remove")
 async def admins_remove(query):
     """Show instructions for removing admin"""
     try:
@@ -690,6 +647,7 @@ async def admins_remove(query):
 
 # ============= Statistics Handlers =============
 
+@admin_view("stats_general")
 async def stats_general(query):
     """Show general statistics"""
     try:
@@ -743,6 +701,7 @@ async def stats_general(query):
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="admin_stats")]])
         )
 
+@admin_view("stats_banks")
 async def stats_banks(query):
     """Show bank statistics"""
     try:
@@ -778,11 +737,12 @@ async def stats_banks(query):
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="admin_stats")]])
         )
 
+@admin_view("stats_groups")
 async def stats_groups(query):
     """Show group statistics"""
     try:
         cursor.execute("""
-            SELECT mg.name, mg.bank, mg.is_admin_group, mg.busy,
+            SELECT mg.name, mg.bank, mg.is_admin_group, mg.busy, mg.load, mg.capacity,
                    COUNT(o.id) as total_orders
             FROM manager_groups mg
             LEFT JOIN orders o ON mg.group_id = o.group_id
@@ -795,11 +755,11 @@ async def stats_groups(query):
             text = "👥 <b>Статистика груп</b>\n\n❌ Груп не знайдено"
         else:
             text = "👥 <b>Статистика груп</b>\n\n"
-            for name, bank, is_admin, busy, orders_count in group_stats:
+            for name, bank, is_admin, busy, load, capacity, orders_count in group_stats:
                 status = "🔴 Зайнята" if busy else "🟢 Вільна"
                 group_type = "👨‍💼 Адмін" if is_admin else f"🏦 {bank or 'Не вказано'}"
                 text += f"<b>{name}</b> - {group_type}\n"
-                text += f"• Статус: {status}\n"
+                text += f"• Статус: {status}, {format_load(load, capacity)}\n"
                 text += f"• Замовлень оброблено: {orders_count}\n\n"
         
         keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_stats")]]
@@ -812,6 +772,7 @@ async def stats_groups(query):
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="admin_stats")]])
         )
 
+@admin_view("stats_period")
 async def stats_period(query):
     """Show period statistics"""
     text = (
@@ -828,6 +789,7 @@ async def stats_period(query):
     keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_stats")]]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@admin_view("stats_export")
 async def stats_export(query):
     """Show export options"""
     text = (
@@ -846,6 +808,7 @@ async def stats_export(query):
 
 # ============= System Management Handlers =============
 
+@admin_view("system_general")
 async def system_general(query):
     """Show general system settings"""
     text = (
@@ -862,6 +825,7 @@ async def system_general(query):
     keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_system")]]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@admin_view("system_bank_visibility")
 async def system_bank_visibility(query):
     """Show bank visibility settings"""
     try:
@@ -902,6 +866,7 @@ async def system_bank_visibility(query):
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="admin_system")]])
         )
 
+@admin_view("system_cleanup")
 async def system_cleanup(query):
     """Show cleanup options"""
     text = (
@@ -919,6 +884,7 @@ async def system_cleanup(query):
     keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_system")]]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@admin_view("system_backup")
 async def system_backup(query):
     """Show backup options"""
     text = (
@@ -935,6 +901,7 @@ async def system_backup(query):
     keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_system")]]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@admin_view("system_restart")
 async def system_restart(query):
     """Show restart options"""
     text = (
@@ -952,8 +919,53 @@ async def system_restart(query):
     keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_system")]]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@admin_view("system_outbox")
+async def system_outbox(query):
+    """Outbox state and dead letters (notifications that could not be delivered)"""
+    try:
+        counts = outbox_counts()
+        text = (
+            "📮 <b>Outbox</b>\n\n"
+            f"⏳ В черзі: {counts.get('pending', 0) + counts.get('sending', 0)}\n"
+            f"✅ Доставлено (за {OUTBOX_KEEP_DAYS} дн.): {counts.get('sent', 0)}\n"
+            f"☠️ Недоставлені: {counts.get('dead', 0)}\n"
+        )
+        rows = dead_letters(10)
+        if rows:
+            text += "\n<b>Останні недоставлені:</b>\n"
+            for outbox_id, chat_id, body, attempts, last_error, created_at in rows:
+                preview = body if len(body) <= 60 else body[:57] + "..."
+                text += (
+                    f"\n#{outbox_id} → <code>{chat_id}</code> ({created_at}, спроб: {attempts})\n"
+                    f"   {html.escape(preview)}\n"
+                    f"   ❗ {html.escape(last_error or '-')}\n"
+                )
+
+        keyboard = []
+        if rows:
+            keyboard.append([InlineKeyboardButton("🔁 Повторити всі недоставлені", callback_data="system_outbox_retry")])
+        keyboard.append([InlineKeyboardButton("🔄 Оновити", callback_data="system_outbox")])
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="admin_system")])
+        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+
+    except Exception as e:
+        logger.error("system_outbox failed: %s", e)
+        await query.edit_message_text(
+            "❌ Помилка при отриманні стану outbox",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="admin_system")]])
+        )
+
+@admin_view("system_outbox_retry")
+async def system_outbox_retry(query):
+    """Re-queue all dead letters"""
+    count = requeue_dead()
+    outbox_dispatcher.wake()
+    logger.info("Outbox: %s dead letters re-queued by admin", count)
+    await system_outbox(query)
+
 # ============= Templates Management Handlers =============
 
+@admin_view("templates_list")
 async def templates_list(query):
     """Show list of templates"""
     try:
@@ -977,6 +989,7 @@ async def templates_list(query):
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="admin_templates")]])
         )
 
+@admin_view("templates_set")
 async def templates_set(query):
     """Show instructions for setting templates"""
     text = (
@@ -995,6 +1008,7 @@ async def templates_set(query):
     keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_templates")]]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@admin_view("templates_del")
 async def templates_del(query):
     """Show instructions for deleting templates"""
     try:
@@ -1023,10 +1037,12 @@ async def templates_del(query):
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="admin_templates")]])
         )
 
+@admin_view("templates_messages")
 async def templates_messages(query):
     """Handle templates messages submenu"""
     await templates_list(query)
 
+@admin_view("templates_instructions")
 async def templates_instructions(query):
     """Show bank instructions management"""
     text = (
@@ -1043,6 +1059,7 @@ async def templates_instructions(query):
     keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_templates")]]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@admin_view("templates_sync")
 async def templates_sync(query):
     """Show sync options"""
     text = (
@@ -0,0 +1,254 @@
+"""
+Album aggregation for incoming screenshots.
+
+Photos of one album (or one single photo) are collected under an album key and
+handed to a flush callback once no new photo arrived for the debounce window.
+All pending albums share one deadline heap driven by a single background task,
+instead of one asyncio task per incoming photo.
+
+The debounce window is adaptive: a photo sent on its own is flushed right away,
+an album is closed as soon as the expected number of photos arrived, and the
+idle window for everything else is learned from observed gaps between photos
+of the same album.
+
+Photos of an album that arrive after it was closed start a new batch under the
+same key. Flushes of one key run one after another, so the callback of such a
+batch sees the earlier one completed and can merge into it (photo_handlers
+adds them to the album's review instead of posting a second one).
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from metrics import Histogram, Summary
+
+logger = logging.getLogger(__name__)
+
+# flush_callback(album_key, photos, username, bot)
+FlushCallback = Callable[[Hashable, List[Tuple[str, str]], str, Any], Awaitable[None]]
+
+
+class _PendingAlbum:
+    __slots__ = ("key", "photos", "username", "bot", "first_seen", "last_seen", "deadline", "close_reason")
+
+    def __init__(self, key: Hashable, username: str, bot: Any, now: float):
+        self.key = key
+        self.photos: List[Tuple[str, str]] = []
+        self.username = username
+        self.bot = bot
+        self.first_seen = now
+        self.last_seen = now
+        self.deadline = now
+        self.close_reason = "idle"
+
+
+class _GapEstimator:
+    """
+    Smoothed inter-photo gap inside albums (same scheme as TCP RTO: mean + 4 * deviation).
+    Until enough gaps were observed the configured maximum window is used.
+    """
+    __slots__ = ("min_window", "max_window", "min_samples", "mean", "dev", "samples")
+
+    def __init__(self, min_window: float, max_window: float, min_samples: int = 5):
+        self.min_window = min_window
+        self.max_window = max_window
+        self.min_samples = min_samples
+        self.mean = 0.0
+        self.dev = 0.0
+        self.samples = 0
+
+    def observe(self, gap: float):
+        # Gaps longer than the current maximum are separate sends, not album parts
+        if gap < 0 or gap > self.max_window:
+            return
+        if self.samples == 0:
+            self.mean = gap
+            self.dev = gap / 2
+        else:
+            self.dev += 0.25 * (abs(gap - self.mean) - self.dev)
+            self.mean += 0.125 * (gap - self.mean)
+        self.samples += 1
+
+    def window(self) -> float:
+        if self.samples < self.min_samples:
+            return self.max_window
+        return min(self.max_window, max(self.min_window, self.mean + 4 * self.dev))
+
+
+class AlbumAggregator:
+    def __init__(self, flush_callback: FlushCallback, debounce_seconds: float,
+                 max_pending_albums: int = 500, max_photos_per_album: int = 10,
+                 min_debounce_seconds: float = 0.3):
+        self._flush_callback = flush_callback
+        self.debounce_seconds = debounce_seconds
+        self.max_pending_albums = max_pending_albums
+        self.max_photos_per_album = max_photos_per_album
+        self._gaps = _GapEstimator(min_debounce_seconds, debounce_seconds)
+
+        self._pending: Dict[Hashable, _PendingAlbum] = {}
+        # (deadline, seq, key); stale entries are skipped lazily when popped
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._flush_tasks: Set[asyncio.Task] = set()
+        # latest flush per album key; the next flush of the key waits for it
+        self._key_flushes: Dict[Hashable, asyncio.Task] = {}
+        self._closed = False
+
+        self.album_size = Summary()
+        self.debounce_wait = Summary()
+        self.flush_latency = Histogram()
+        self.forced_flushes = 0
+        self.failed_flushes = 0
+        # Why albums were flushed
+        self.close_reasons: Dict[str, int] = {"single": 0, "complete": 0, "idle": 0, "forced": 0, "shutdown": 0}
+
+    # ---------- public API ----------
+
+    def add(self, key: Hashable, file_id: str, file_unique_id: str, username: str, bot: Any,
+            in_album: bool = True, expected: Optional[int] = None) -> None:
+        """
+        Register one incoming photo and (re)arm the album deadline.
+        in_album=False: photo was sent without media_group_id and is flushed immediately.
+        expected: number of photos the stage needs; the album closes once it is reached.
+        """
+        now = time.monotonic()
+        album = self._pending.get(key)
+        if album is None:
+            if len(self._pending) >= self.max_pending_albums:
+                self._force_flush_oldest()
+            album = _PendingAlbum(key, username, bot, now)
+            self._pending[key] = album
+        elif album.photos:
+            self._gaps.observe(now - album.last_seen)
+        album.bot = bot
+        album.last_seen = now
+        if file_unique_id not in [fu for _, fu in album.photos]:
+            album.photos.append((file_id, file_unique_id))
+
+        limit = self.max_photos_per_album
+        if expected and expected > 0:
+            limit = min(limit, expected)
+        if not in_album:
+            self._schedule(album, now, "single")
+        elif len(album.photos) >= limit:
+            self._schedule(album, now, "complete")
+        else:
+            self._schedule(album, now + self._gaps.window(), "idle")
+        if self._closed:
+            # Late photo during shutdown: nobody will wait for the deadline
+            self._start_flush(key, "shutdown")
+            return
+        self._ensure_loop()
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def current_window(self) -> float:
+        """Idle window currently applied to albums that are not complete yet."""
+        return self._gaps.window()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending_albums": len(self._pending),
+            "in_flight_flushes": len(self._flush_tasks),
+            "album_size": self.album_size.as_dict(),
+            "debounce_wait_s": self.debounce_wait.as_dict(),
+            "flush_latency_s": self.flush_latency.as_dict(),
+            "forced_flushes": self.forced_flushes,
+            "failed_flushes": self.failed_flushes,
+            "idle_window_s": round(self._gaps.window(), 3),
+            "close_reasons": dict(self.close_reasons),
+        }
+
+    async def shutdown(self) -> None:
+        """Flush every pending album right away and wait for in-flight flushes."""
+        self._closed = True
+        if self._loop_task and not self._loop_task.done():
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+        for key in list(self._pending):
+            self._start_flush(key, "shutdown")
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        logger.info("Album aggregator stopped: %s", self.stats())
+
+    # ---------- scheduling ----------
+
+    def _schedule(self, album: _PendingAlbum, deadline: float, reason: str):
+        album.deadline = deadline
+        album.close_reason = reason
+        heapq.heappush(self._heap, (deadline, next(self._seq), album.key))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _force_flush_oldest(self):
+        oldest = min(self._pending.values(), key=lambda a: a.first_seen)
+        self.forced_flushes += 1
+        logger.warning("Album aggregator full (%d albums), flushing %s early", len(self._pending), oldest.key)
+        self._start_flush(oldest.key, "forced")
+
+    def _ensure_loop(self):
+        if self._closed:
+            return
+        if self._loop_task is None or self._loop_task.done():
+            # Event is created here so it belongs to the running loop
+            self._wakeup = asyncio.Event()
+            self._loop_task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                deadline, _, key = heapq.heappop(self._heap)
+                album = self._pending.get(key)
+                # Skip entries superseded by a later photo of the same album
+                if album is None or album.deadline != deadline:
+                    continue
+                self._start_flush(key)
+
+            timeout = (self._heap[0][0] - now) if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _start_flush(self, key: Hashable, reason: Optional[str] = None):
+        album = self._pending.pop(key, None)
+        if album is None or not album.photos:
+            return
+        reason = reason or album.close_reason
+        self.close_reasons[reason] = self.close_reasons.get(reason, 0) + 1
+        previous = self._key_flushes.get(key)
+        task = asyncio.get_running_loop().create_task(self._flush(album, previous))
+        self._flush_tasks.add(task)
+        self._key_flushes[key] = task
+        task.add_done_callback(lambda t: self._flush_done(key, t))
+
+    def _flush_done(self, key: Hashable, task: asyncio.Task):
+        self._flush_tasks.discard(task)
+        if self._key_flushes.get(key) is task:
+            del self._key_flushes[key]
+
+    async def _flush(self, album: _PendingAlbum, previous: Optional[asyncio.Task] = None):
+        if previous is not None and not previous.done():
+            # late photos of an album: let the earlier batch finish first
+            await asyncio.wait([previous])
+        started = time.monotonic()
+        self.album_size.observe(len(album.photos))
+        self.debounce_wait.observe(started - album.first_seen)
+        try:
+            await self._flush_callback(album.key, album.photos, album.username, album.bot)
+        except Exception as e:
+            self.failed_flushes += 1
+            logger.exception("Album flush failed for %s: %s", album.key, e)
+        finally:
+            self.flush_latency.observe(time.monotonic() - started)
@@ -6,11 +6,11 @@ import logging
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes, ConversationHandler
 
+from capacity_events import capacity_dispatcher
 from db import (
     add_bank,
-    add_manager_group,
     delete_bank,
-    get_bank_groups,
+    get_group_utilization,
     get_banks,
     get_bank_form_template,
     set_bank_form_template,
@@ -19,14 +19,35 @@ from db import (
     log_action,
     update_bank,
 )
+from handlers.callback_codec import (
+    BANK_DELETE,
+    BANK_DELETE_CONFIRM,
+    BANK_EDIT,
+    BANK_EDIT_FIELD,
+    BANK_TOGGLE,
+    GROUP_BANK_PICK,
+    TEMPLATE_CREATE,
+    TEMPLATE_DELETE,
+    TEMPLATE_DELETE_CONFIRM,
+    TEMPLATE_EDIT,
+)
+from handlers.callback_router import router
+from queue_scheduler import format_load
+from states import (
+    BANK_DESCRIPTION_INPUT,
+    BANK_MIN_AGE_INPUT,
+    BANK_NAME_INPUT,
+    BANK_PRICE_INPUT,
+    BANK_SETTINGS_INPUT,
+)
 
 logger = logging.getLogger(__name__)
 
-# Conversation states
-BANK_NAME_INPUT, BANK_PRICE_INPUT, BANK_DESCRIPTION_INPUT, BANK_MIN_AGE_INPUT, BANK_SETTINGS_INPUT = range(5)
+# Conversation states (the ones client_bot uses live in states.py)
 INSTRUCTION_BANK_SELECT, INSTRUCTION_ACTION_SELECT, INSTRUCTION_STEP_INPUT = range(5, 8)
 GROUP_BANK_SELECT, GROUP_NAME_INPUT = range(8, 10)
 
+@router.route("banks_menu")
 async def banks_management_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Main banks management menu"""
     if not is_admin(update.effective_user.id):
@@ -60,6 +81,7 @@ async def banks_management_menu(update: Update, context: ContextTypes.DEFAULT_TY
         logger.warning("banks_management_menu called without valid update.callback_query or update.message")
         return
 
+@router.route("banks_list")
 async def list_banks_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """List all banks with their settings"""
     if not is_admin(update.effective_user.id):
@@ -308,6 +330,7 @@ async def bank_settings_handler(update: Update, context: ContextTypes.DEFAULT_TY
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
     return BANK_SETTINGS_INPUT
 
+@router.route("instructions_menu")
 async def instructions_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Instructions management menu"""
     if not is_admin(update.effective_user.id):
@@ -333,6 +356,7 @@ async def instructions_menu_handler(update: Update, context: ContextTypes.DEFAUL
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route("groups_menu")
 async def groups_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Groups management menu"""
     if not is_admin(update.effective_user.id):
@@ -349,9 +373,12 @@ async def groups_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         [InlineKeyboardButton("🔙 Назад", callback_data="banks_menu")]
     ]
 
-    text = "👥 <b>Управління групами</b>\n\nОберіть дію:"
+    groups = get_group_utilization()
+    load, capacity = sum(g[4] for g in groups), sum(g[5] for g in groups)
+    text = f"👥 <b>Управління групами</b>\n\n📊 Завантаження: {format_load(load, capacity)}\n\nОберіть дію:"
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route("groups_list")
 async def list_groups_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """List all manager groups"""
     if not is_admin(update.effective_user.id):
@@ -360,21 +387,23 @@ async def list_groups_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await query.answer()
 
-    groups = get_bank_groups()
+    groups = get_group_utilization()
 
     if not groups:
         text = "📋 <b>Список груп</b>\n\n❌ Немає зареєстрованих груп"
     else:
         text = "📋 <b>Список груп</b>\n\n"
-        for group_id, name, bank, is_admin_group in groups:
+        for group_id, name, bank, is_admin_group, load, capacity in groups:
             group_type = "👨‍💼 Адмін група" if is_admin_group else f"🏦 Група банку '{bank}'"
             text += f"ID: {group_id}\n"
             text += f"Назва: {name}\n"
-            text += f"Тип: {group_type}\n\n"
+            text += f"Тип: {group_type}\n"
+            text += f"Завантаження: {format_load(load, capacity)}\n\n"
 
     keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="groups_menu")]]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route("banks_edit")
 async def edit_bank_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Edit bank handler - show list of banks to edit"""
     if not is_admin(update.effective_user.id):
@@ -393,11 +422,12 @@ async def edit_bank_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         keyboard = []
         for name, is_active, register_enabled, change_enabled, price, description, min_age, _, _, _, _ in banks:
             status = "✅" if is_active else "❌"
-            keyboard.append([InlineKeyboardButton(f"{status} {name}", callback_data=f"edit_bank_{name}")])
+            keyboard.append([InlineKeyboardButton(f"{status} {name}", callback_data=BANK_EDIT.encode(bank=name))])
         keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="banks_menu")])
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route("banks_delete")
 async def delete_bank_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Delete bank handler - show list of banks to delete"""
     if not is_admin(update.effective_user.id):
@@ -415,11 +445,12 @@ async def delete_bank_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         text = "🗑️ <b>Видалити банк</b>\n\n⚠️ <b>Увага!</b> Видалення банку призведе до видалення всіх його інструкцій.\n\nОберіть банк для видалення:"
         keyboard = []
         for name, is_active, register_enabled, change_enabled, price, description, min_age, _, _, _, _ in banks:
-            keyboard.append([InlineKeyboardButton(f"🗑️ {name}", callback_data=f"delete_bank_{name}")])
+            keyboard.append([InlineKeyboardButton(f"🗑️ {name}", callback_data=BANK_DELETE.encode(bank=name))])
         keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="banks_menu")])
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route(BANK_EDIT)
 async def edit_bank_settings_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle editing specific bank settings"""
     if not is_admin(update.effective_user.id):
@@ -429,7 +460,7 @@ async def edit_bank_settings_handler(update: Update, context: ContextTypes.DEFAU
     await query.answer()
 
     # Extract bank name from callback data
-    bank_name = query.data.replace("edit_bank_", "")
+    bank_name = context.match["bank"]
     
     # Get current bank settings
     banks = get_banks()
@@ -460,16 +491,17 @@ async def edit_bank_settings_handler(update: Update, context: ContextTypes.DEFAU
     text += "\nЩо бажаєте змінити?"
 
     keyboard = [
-        [InlineKeyboardButton("🔄 Статус банку", callback_data=f"toggle_active_{bank_name}")],
-        [InlineKeyboardButton("📝 Реєстрація", callback_data=f"toggle_register_{bank_name}")],
-        [InlineKeyboardButton("🔗 Перев'язка", callback_data=f"toggle_change_{bank_name}")],
-        [InlineKeyboardButton("💰 Змінити ціну", callback_data=f"edit_price_{bank_name}")],
-        [InlineKeyboardButton("📝 Змінити опис", callback_data=f"edit_description_{bank_name}")],
+        [InlineKeyboardButton("🔄 Статус банку", callback_data=BANK_TOGGLE.encode(field="active", bank=bank_name))],
+        [InlineKeyboardButton("📝 Реєстрація", callback_data=BANK_TOGGLE.encode(field="register", bank=bank_name))],
+        [InlineKeyboardButton("🔗 Перев'язка", callback_data=BANK_TOGGLE.encode(field="change", bank=bank_name))],
+        [InlineKeyboardButton("💰 Змінити ціну", callback_data=BANK_EDIT_FIELD.encode(field="price", bank=bank_name))],
+        [InlineKeyboardButton("📝 Змінити опис", callback_data=BANK_EDIT_FIELD.encode(field="description", bank=bank_name))],
         [InlineKeyboardButton("🔙 Назад", callback_data="banks_edit")]
     ]
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route(BANK_TOGGLE, BANK_EDIT_FIELD)
 async def toggle_bank_setting_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle toggling bank settings"""
     if not is_admin(update.effective_user.id):
@@ -478,10 +510,9 @@ async def toggle_bank_setting_handler(update: Update, context: ContextTypes.DEFA
     query = update.callback_query
     await query.answer()
 
-    data = query.data
-    
-    if data.startswith("toggle_active_"):
-        bank_name = data.replace("toggle_active_", "")
+    field, bank_name = context.match["field"], context.match["bank"]
+
+    if field == "active":
         # Get current status
         banks = get_banks()
         current_active = None
@@ -499,8 +530,7 @@ async def toggle_bank_setting_handler(update: Update, context: ContextTypes.DEFA
             else:
                 await query.edit_message_text(f"❌ Помилка при зміні статусу банку '{bank_name}'")
     
-    elif data.startswith("toggle_register_"):
-        bank_name = data.replace("toggle_register_", "")
+    elif field == "register":
         # Get current status
         banks = get_banks()
         current_register = None
@@ -518,8 +548,7 @@ async def toggle_bank_setting_handler(update: Update, context: ContextTypes.DEFA
             else:
                 await query.edit_message_text(f"❌ Помилка при зміні налаштувань реєстрації для банку '{bank_name}'")
     
-    elif data.startswith("toggle_change_"):
-        bank_name = data.replace("toggle_change_", "")
+    elif field == "change":
         # Get current status
         banks = get_banks()
         current_change = None
@@ -537,8 +566,7 @@ async def toggle_bank_setting_handler(update: Update, context: ContextTypes.DEFA
             else:
                 await query.edit_message_text(f"❌ Помилка при зміні налаштувань перев'язки для банку '{bank_name}'")
     
-    elif data.startswith("edit_price_"):
-        bank_name = data.replace("edit_price_", "")
+    elif field == "price":
         context.user_data['editing_bank'] = bank_name
         context.user_data['editing_field'] = 'price'
         
@@ -549,8 +577,7 @@ async def toggle_bank_setting_handler(update: Update, context: ContextTypes.DEFA
         # This would need a separate conversation handler or we can use a simpler approach
         # For now, let's make it a simple text edit
         
-    elif data.startswith("edit_description_"):
-        bank_name = data.replace("edit_description_", "")
+    elif field == "description":
         context.user_data['editing_bank'] = bank_name
         context.user_data['editing_field'] = 'description'
         
@@ -594,6 +621,7 @@ async def update_bank_field_handler(update: Update, context: ContextTypes.DEFAUL
     context.user_data.pop('editing_bank', None)
     context.user_data.pop('editing_field', None)
 
+@router.route(BANK_DELETE)
 async def confirm_delete_bank_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle bank deletion confirmation"""
     if not is_admin(update.effective_user.id):
@@ -603,7 +631,7 @@ async def confirm_delete_bank_handler(update: Update, context: ContextTypes.DEFA
     await query.answer()
 
     # Extract bank name from callback data
-    bank_name = query.data.replace("delete_bank_", "")
+    bank_name = context.match["bank"]
 
     text = f"🗑️ <b>Видалення банку</b>\n\n"
     text += f"⚠️ <b>Увага!</b> Ви дійсно хочете видалити банк '<b>{bank_name}</b>'?\n\n"
@@ -614,12 +642,13 @@ async def confirm_delete_bank_handler(update: Update, context: ContextTypes.DEFA
     text += "Підтвердіть дію:"
 
     keyboard = [
-        [InlineKeyboardButton("✅ Так, видалити", callback_data=f"confirm_delete_bank_{bank_name}")],
+        [InlineKeyboardButton("✅ Так, видалити", callback_data=BANK_DELETE_CONFIRM.encode(bank=bank_name))],
         [InlineKeyboardButton("❌ Скасувати", callback_data="banks_delete")]
     ]
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route(BANK_DELETE_CONFIRM)
 async def final_delete_bank_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Final bank deletion handler"""
     if not is_admin(update.effective_user.id):
@@ -629,7 +658,7 @@ async def final_delete_bank_handler(update: Update, context: ContextTypes.DEFAUL
     await query.answer()
 
     # Extract bank name from callback data
-    bank_name = query.data.replace("confirm_delete_bank_", "")
+    bank_name = context.match["bank"]
 
     if delete_bank(bank_name):
         text = f"✅ Банк '{bank_name}' та всі його інструкції успішно видалено"
@@ -639,6 +668,7 @@ async def final_delete_bank_handler(update: Update, context: ContextTypes.DEFAUL
 
     await query.edit_message_text(text)
 
+@router.route("groups_add_bank")
 async def add_bank_group_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Add bank group handler - show list of banks to select"""
     if not is_admin(update.effective_user.id):
@@ -657,7 +687,7 @@ async def add_bank_group_handler(update: Update, context: ContextTypes.DEFAULT_T
         keyboard = []
         for name, is_active, _, _, _, _, _, _, _, _, _ in banks:
             if is_active:  # Only show active banks
-                keyboard.append([InlineKeyboardButton(f"🏦 {name}", callback_data=f"select_bank_for_group_{name}")])
+                keyboard.append([InlineKeyboardButton(f"🏦 {name}", callback_data=GROUP_BANK_PICK.encode(bank=name))])
         
         if not any(is_active for _, is_active, _, _, _, _, _, _, _, _, _ in banks):
             text = "➕ <b>Додати групу для банку</b>\n\n❌ Немає активних банків.\nСпочатку активуйте хоча б один банк."
@@ -666,6 +696,7 @@ async def add_bank_group_handler(update: Update, context: ContextTypes.DEFAULT_T
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route("groups_add_admin")
 async def add_admin_group_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Add admin group handler"""
     if not is_admin(update.effective_user.id):
@@ -686,6 +717,7 @@ async def add_admin_group_handler(update: Update, context: ContextTypes.DEFAULT_
     keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="groups_menu")]]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route(GROUP_BANK_PICK)
 async def select_bank_for_group_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle bank selection for group creation"""
     if not is_admin(update.effective_user.id):
@@ -695,7 +727,7 @@ async def select_bank_for_group_handler(update: Update, context: ContextTypes.DE
     await query.answer()
 
     # Extract bank name from callback data
-    bank_name = query.data.replace("select_bank_for_group_", "")
+    bank_name = context.match["bank"]
 
     text = f"➕ <b>Додати групу для банку '{bank_name}'</b>\n\n"
     text += "Для додавання групи банку використовуйте команду:\n"
@@ -713,6 +745,7 @@ async def select_bank_for_group_handler(update: Update, context: ContextTypes.DE
     ]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route("groups_delete")
 async def delete_group_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Delete group handler - show list of groups to delete"""
     if not is_admin(update.effective_user.id):
@@ -744,6 +777,7 @@ async def delete_group_handler(update: Update, context: ContextTypes.DEFAULT_TYP
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route("delete_group_{group_id:int}")
 async def confirm_delete_group_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle group deletion confirmation"""
     if not is_admin(update.effective_user.id):
@@ -753,7 +787,7 @@ async def confirm_delete_group_handler(update: Update, context: ContextTypes.DEF
     await query.answer()
 
     # Extract group ID from callback data
-    group_id = int(query.data.replace("delete_group_", ""))
+    group_id = context.match["group_id"]
 
     # Import here to avoid circular imports
     from db import cursor
@@ -791,6 +825,7 @@ async def confirm_delete_group_handler(update: Update, context: ContextTypes.DEF
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route("confirm_delete_group_{group_id:int}")
 async def final_delete_group_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Final group deletion handler"""
     if not is_admin(update.effective_user.id):
@@ -800,7 +835,7 @@ async def final_delete_group_handler(update: Update, context: ContextTypes.DEFAU
     await query.answer()
 
     # Extract group ID from callback data
-    group_id = int(query.data.replace("confirm_delete_group_", ""))
+    group_id = context.match["group_id"]
 
     # Import here to avoid circular imports
     from db import conn, cursor
@@ -818,6 +853,7 @@ async def final_delete_group_handler(update: Update, context: ContextTypes.DEFAU
     try:
         cursor.execute("DELETE FROM manager_groups WHERE group_id=?", (group_id,))
         conn.commit()
+        capacity_dispatcher.publish("group_deleted", group_id)
         
         if is_admin_group:
             text = f"✅ Адмін групу '{name}' (ID: {group_id}) успішно видалено"
@@ -831,6 +867,7 @@ async def final_delete_group_handler(update: Update, context: ContextTypes.DEFAU
 
     await query.edit_message_text(text)
 
+@router.route("form_templates_menu")
 async def form_templates_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Form templates management menu"""
     if not is_admin(update.effective_user.id):
@@ -857,6 +894,7 @@ async def form_templates_menu_handler(update: Update, context: ContextTypes.DEFA
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route("form_templates_list")
 async def form_templates_list_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """List all form templates"""
     if not is_admin(update.effective_user.id):
@@ -890,6 +928,7 @@ async def form_templates_list_handler(update: Update, context: ContextTypes.DEFA
     keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="form_templates_menu")]]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route("form_templates_create")
 async def form_templates_create_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Create new form template for a bank"""
     if not is_admin(update.effective_user.id):
@@ -907,12 +946,13 @@ async def form_templates_create_handler(update: Update, context: ContextTypes.DE
         text = "➕ <b>Створити шаблон анкети</b>\n\nОберіть банк для якого створити шаблон:"
         keyboard = []
         for name, is_active, _, _, _, _, _, _, _, _, _ in banks:
-            keyboard.append([InlineKeyboardButton(f"🏦 {name}", callback_data=f"create_template_{name}")])
+            keyboard.append([InlineKeyboardButton(f"🏦 {name}", callback_data=TEMPLATE_CREATE.encode(bank=name))])
         
         keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="form_templates_menu")])
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route("form_templates_edit")
 async def form_templates_edit_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Edit existing form template"""
     if not is_admin(update.effective_user.id):
@@ -936,7 +976,7 @@ async def form_templates_edit_handler(update: Update, context: ContextTypes.DEFA
             if template:
                 has_templates = True
                 field_count = len(template.get('fields', []))
-                keyboard.append([InlineKeyboardButton(f"🏦 {name} ({field_count} полів)", callback_data=f"edit_template_{name}")])
+                keyboard.append([InlineKeyboardButton(f"🏦 {name} ({field_count} полів)", callback_data=TEMPLATE_EDIT.encode(bank=name))])
         
         if not has_templates:
             text = "✏️ <b>Редагувати шаблон</b>\n\n❌ Немає шаблонів для редагування.\nСпочатку створіть шаблон."
@@ -945,6 +985,7 @@ async def form_templates_edit_handler(update: Update, context: ContextTypes.DEFA
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route("form_templates_delete")
 async def form_templates_delete_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Delete form template"""
     if not is_admin(update.effective_user.id):
@@ -968,7 +1009,7 @@ async def form_templates_delete_handler(update: Update, context: ContextTypes.DE
             if template:
                 has_templates = True
                 field_count = len(template.get('fields', []))
-                keyboard.append([InlineKeyboardButton(f"🗑️ {name} ({field_count} полів)", callback_data=f"delete_template_{name}")])
+                keyboard.append([InlineKeyboardButton(f"🗑️ {name} ({field_count} полів)", callback_data=TEMPLATE_DELETE.encode(bank=name))])
         
         if not has_templates:
             text = "🗑️ <b>Видалити шаблон</b>\n\n❌ Немає шаблонів для видалення."
@@ -977,6 +1018,7 @@ async def form_templates_delete_handler(update: Update, context: ContextTypes.DE
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route(TEMPLATE_CREATE)
 async def create_template_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle creation of template for specific bank"""
     if not is_admin(update.effective_user.id):
@@ -986,14 +1028,14 @@ async def create_template_handler(update: Update, context: ContextTypes.DEFAULT_
     await query.answer()
 
     # Extract bank name from callback data
-    bank_name = query.data.replace("create_template_", "")
+    bank_name = context.match["bank"]
     
     # Check if template already exists
     existing_template = get_bank_form_template(bank_name)
     if existing_template:
         text = f"⚠️ <b>Шаблон вже існує</b>\n\nДля банку '{bank_name}' вже є шаблон з {len(existing_template.get('fields', []))} полями.\n\nЩо бажаєте зробити?"
         keyboard = [
-            [InlineKeyboardButton("✏️ Редагувати існуючий", callback_data=f"edit_template_{bank_name}")],
+            [InlineKeyboardButton("✏️ Редагувати існуючий", callback_data=TEMPLATE_EDIT.encode(bank=bank_name))],
             [InlineKeyboardButton("🗑️ Видалити і створити новий", callback_data=f"recreate_template_{bank_name}")],
             [InlineKeyboardButton("🔙 Назад", callback_data="form_templates_create")]
         ]
@@ -1018,12 +1060,13 @@ async def create_template_handler(update: Update, context: ContextTypes.DEFAULT_
             text = f"❌ <b>Помилка!</b>\n\nНе вдалося створити шаблон для банку '{bank_name}'"
         
         keyboard = [
-            [InlineKeyboardButton("✏️ Редагувати шаблон", callback_data=f"edit_template_{bank_name}")],
+            [InlineKeyboardButton("✏️ Редагувати шаблон", callback_data=TEMPLATE_EDIT.encode(bank=bank_name))],
             [InlineKeyboardButton("🔙 Назад", callback_data="form_templates_create")]
         ]
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route(TEMPLATE_EDIT)
 async def edit_template_handler_specific(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle editing of template for specific bank"""
     if not is_admin(update.effective_user.id):
@@ -1033,7 +1076,7 @@ async def edit_template_handler_specific(update: Update, context: ContextTypes.D
     await query.answer()
 
     # Extract bank name from callback data
-    bank_name = query.data.replace("edit_template_", "")
+    bank_name = context.match["bank"]
     
     template = get_bank_form_template(bank_name)
     if not template:
@@ -1059,6 +1102,7 @@ async def edit_template_handler_specific(update: Update, context: ContextTypes.D
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route(TEMPLATE_DELETE)
 async def delete_template_handler_specific(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle deletion of template for specific bank"""
     if not is_admin(update.effective_user.id):
@@ -1068,7 +1112,7 @@ async def delete_template_handler_specific(update: Update, context: ContextTypes
     await query.answer()
 
     # Extract bank name from callback data
-    bank_name = query.data.replace("delete_template_", "")
+    bank_name = context.match["bank"]
     
     template = get_bank_form_template(bank_name)
     if not template:
@@ -1089,12 +1133,13 @@ async def delete_template_handler_specific(update: Update, context: ContextTypes
         text += "\n⚠️ Ця дія незворотна!"
         
         keyboard = [
-            [InlineKeyboardButton("✅ Так, видалити", callback_data=f"confirm_delete_template_{bank_name}")],
+            [InlineKeyboardButton("✅ Так, видалити", callback_data=TEMPLATE_DELETE_CONFIRM.encode(bank=bank_name))],
             [InlineKeyboardButton("❌ Скасувати", callback_data="form_templates_delete")]
         ]
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route(TEMPLATE_DELETE_CONFIRM)
 async def confirm_delete_template_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Confirm and execute template deletion"""
     if not is_admin(update.effective_user.id):
@@ -1104,7 +1149,7 @@ async def confirm_delete_template_handler(update: Update, context: ContextTypes.
     await query.answer()
 
     # Extract bank name from callback data
-    bank_name = query.data.replace("confirm_delete_template_", "")
+    bank_name = context.match["bank"]
     
     if delete_bank_form_template(bank_name):
         text = f"✅ <b>Шаблон видалено!</b>\n\nШаблон для банку '{bank_name}' успішно видалено."
@@ -1115,6 +1160,7 @@ async def confirm_delete_template_handler(update: Update, context: ContextTypes.
     keyboard = [[InlineKeyboardButton("🔙 Назад до шаблонів", callback_data="form_templates_menu")]]
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route("migrate_from_file")
 async def migrate_from_file_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle migration from file callback"""
     if not is_admin(update.effective_user.id):
@@ -1138,6 +1184,7 @@ async def migrate_from_file_handler(update: Update, context: ContextTypes.DEFAUL
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route("confirm_migrate_from_file")
 async def confirm_migrate_from_file_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Confirm and execute migration from file"""
     if not is_admin(update.effective_user.id):
@@ -0,0 +1,126 @@
+"""
+Bulk notifications with bounded concurrency.
+
+`run_broadcast` sends one text to many chats through a fixed pool of worker
+tasks. Every send goes through the OutboundScheduler with bulk priority, so the
+pool size only bounds the number of requests in flight; pacing is left to the
+rate limiter, and interactive replies still overtake the broadcast. Progress is
+reported by editing a single message in the admin chat.
+
+Callers commit their state change first and start the broadcast with
+`application.create_task`, so the handler does not wait for the fan-out.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Iterable, NamedTuple, Optional
+
+from telegram.error import Forbidden
+
+from rate_limiter import PRIORITY_BULK, PRIORITY_NORMAL
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+# Minimal interval between edits of the progress message
+_PROGRESS_SECONDS = 3.0
+
+
+class BroadcastResult(NamedTuple):
+    total: int
+    sent: int
+    blocked: int   # user blocked the bot / chat gone
+    failed: int
+    elapsed: float
+
+
+class _Progress:
+    __slots__ = ("total", "sent", "blocked", "failed")
+
+    def __init__(self, total: int):
+        self.total = total
+        self.sent = 0
+        self.blocked = 0
+        self.failed = 0
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.blocked + self.failed
+
+    def render(self, title: str, finished: bool = False) -> str:
+        head = "✅" if finished else "📣"
+        text = f"{head} {title}: {self.done}/{self.total}\n✉️ Доставлено: {self.sent}"
+        if self.blocked:
+            text += f"\n🚫 Заблокували бота: {self.blocked}"
+        if self.failed:
+            text += f"\n⚠️ Помилки: {self.failed}"
+        return text
+
+
+async def _edit_progress(bot: Any, message: Any, text: str):
+    try:
+        await bot.edit_message_text(
+            chat_id=message.chat_id, message_id=message.message_id, text=text,
+            rate_limit_args={"priority": PRIORITY_NORMAL},
+        )
+    except Exception as e:
+        logger.debug("Broadcast progress edit failed: %s", e)
+
+
+async def run_broadcast(bot: Any, chat_ids: Iterable[int], text: str, title: str = "Розсилка",
+                        progress_chat_id: Optional[int] = None, parse_mode: Optional[str] = None,
+                        concurrency: int = BROADCAST_CONCURRENCY) -> BroadcastResult:
+    """Send `text` to every chat (duplicates dropped) with at most `concurrency` requests in flight."""
+    targets = list(dict.fromkeys(chat_ids))
+    progress = _Progress(len(targets))
+    started = time.monotonic()
+
+    message = None
+    if progress_chat_id is not None:
+        try:
+            message = await bot.send_message(chat_id=progress_chat_id, text=progress.render(title))
+        except Exception as e:
+            logger.warning("Broadcast progress message failed: %s", e)
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for chat_id in targets:
+        queue.put_nowait(chat_id)
+
+    async def worker():
+        while True:
+            try:
+                chat_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode,
+                                       rate_limit_args={"priority": PRIORITY_BULK})
+                progress.sent += 1
+            except Forbidden:
+                progress.blocked += 1
+            except Exception as e:
+                progress.failed += 1
+                logger.warning("Broadcast to %s failed: %s", chat_id, e)
+
+    async def reporter():
+        shown = 0
+        while True:
+            await asyncio.sleep(_PROGRESS_SECONDS)
+            if progress.done != shown:
+                shown = progress.done
+                await _edit_progress(bot, message, progress.render(title))
+
+    report_task = asyncio.ensure_future(reporter()) if message is not None else None
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, len(targets))))))
+    finally:
+        if report_task is not None:
+            report_task.cancel()
+
+    result = BroadcastResult(progress.total, progress.sent, progress.blocked, progress.failed,
+                             time.monotonic() - started)
+    if message is not None:
+        await _edit_progress(bot, message, progress.render(title, finished=True) + f"\n⏱ {result.elapsed:.0f} с")
+    logger.info("Broadcast '%s' finished: %s", title, result)
+    return result
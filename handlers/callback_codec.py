@@ -0,0 +1,340 @@
+"""
+Compact callback_data codec.
+
+Every inline button the bot builds is described by a Payload: a short opcode
+and typed fields. Encoded data is the opcode followed by the fields, each after
+a ".": integers in base 36 (signed), choices as the base-36 index of the value,
+banks as base-36 `banks.id`, and free text only as the last field. So
+`bank_ПриватБанк Business_register` (43 bytes) becomes `b.3.0`, and no payload
+can outgrow Telegram's 64-byte limit because of a long Cyrillic bank name.
+
+Payloads are registered once here, so all handler modules share one opcode
+table, and routed with `@router.route(PAYLOAD)`; the router decodes the fields
+and the handler reads them from `context.match` like any other route:
+
+    InlineKeyboardButton(name, callback_data=BANK_PICK.encode(bank=name, action="change"))
+
+    @router.route(BANK_PICK)
+    async def handler(update, context):
+        bank, action = context.match["bank"], context.match["action"]
+
+Buttons already sent before the codec carry the old text formats
+(`bank_{bank}_{action}`, `approve_{user_id}_{photo_id}`, ...). Each is registered
+with `codec.legacy(PAYLOAD, spec)`: it decodes to the same payload and fields
+and the router serves it with the payload's handler. Nothing encodes them.
+"""
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from db import get_bank_id, get_bank_name
+
+MAX_CALLBACK_BYTES = 64
+SEP = "."
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+_OPCODE = re.compile(r"[A-Za-z]{1,3}")
+_BASE36 = re.compile(r"-?[0-9a-z]+")
+_LEGACY_FIELD = re.compile(r"\{(\w+)\}")
+
+
+def to_base36(value: int) -> str:
+    if value < 0:
+        return "-" + to_base36(-value)
+    digits = []
+    while True:
+        value, rem = divmod(value, 36)
+        digits.append(_DIGITS[rem])
+        if not value:
+            return "".join(reversed(digits))
+
+
+def from_base36(text: str) -> int:
+    if not _BASE36.fullmatch(text) or text.startswith("-0") or (len(text) > 1 and text.startswith("0")):
+        raise ValueError(f"not a canonical base-36 number: {text!r}")
+    return int(text, 36)
+
+
+class Field:
+    """Converts one field between its value and its text in callback_data."""
+    greedy = False  # may contain SEP; only allowed as the last field
+
+    def encode(self, value: Any) -> str:
+        raise NotImplementedError
+
+    def decode(self, text: str) -> Any:
+        raise NotImplementedError
+
+
+class Int(Field):
+    def encode(self, value: int) -> str:
+        return to_base36(int(value))
+
+    def decode(self, text: str) -> int:
+        return from_base36(text)
+
+
+class Choice(Field):
+    def __init__(self, *values: str):
+        self.values = values
+
+    def encode(self, value: str) -> str:
+        return to_base36(self.values.index(value))
+
+    def decode(self, text: str) -> str:
+        index = from_base36(text)
+        if not 0 <= index < len(self.values):
+            raise ValueError(f"choice index out of range: {text!r}")
+        return self.values[index]
+
+
+class Bank(Field):
+    """Bank name in handlers, banks.id on the wire."""
+
+    def encode(self, value: str) -> str:
+        bank_id = get_bank_id(value)
+        if bank_id is None:
+            raise ValueError(f"unknown bank: {value!r}")
+        return to_base36(bank_id)
+
+    def decode(self, text: str) -> str:
+        name = get_bank_name(from_base36(text))
+        if name is None:
+            raise ValueError(f"bank {text!r} no longer exists")
+        return name
+
+
+class Text(Field):
+    greedy = True
+
+    def encode(self, value: str) -> str:
+        return str(value)
+
+    def decode(self, text: str) -> str:
+        return text
+
+
+INT, BANK, TEXT = Int(), Bank(), Text()
+ACTION = Choice("register", "change")
+
+
+class Payload:
+    def __init__(self, opcode: str, name: str, fields: List[Tuple[str, Field]]):
+        self.opcode = opcode
+        self.name = name
+        self.fields = fields
+        self.prefix = opcode + SEP if fields else opcode
+        self.legacy: List["LegacyFormat"] = []
+
+    def encode(self, **values: Any) -> str:
+        if set(values) != {name for name, _ in self.fields}:
+            raise TypeError(f"{self.name}: expected fields {[n for n, _ in self.fields]}, got {sorted(values)}")
+        parts = []
+        for name, field in self.fields:
+            text = field.encode(values[name])
+            if not field.greedy and (SEP in text or not text):
+                raise ValueError(f"{self.name}.{name}: cannot encode {values[name]!r}")
+            parts.append(text)
+        data = self.prefix + SEP.join(parts)
+        if len(data.encode("utf-8")) > MAX_CALLBACK_BYTES:
+            raise ValueError(f"{self.name}: callback_data longer than {MAX_CALLBACK_BYTES} bytes: {data!r}")
+        return data
+
+    def decode_fields(self, rest: str) -> Optional[Dict[str, Any]]:
+        """Fields from the data after the prefix; None if it is not a valid encoding of this payload."""
+        if not self.fields:
+            return {} if not rest else None
+        parts = rest.split(SEP, len(self.fields) - 1)
+        if len(parts) != len(self.fields):
+            return None
+        values = {}
+        try:
+            for (name, field), text in zip(self.fields, parts):
+                if not field.greedy and SEP in text:
+                    return None
+                values[name] = field.decode(text)
+        except ValueError:
+            return None
+        return values
+
+    def decode(self, data: str) -> Optional[Dict[str, Any]]:
+        if not data.startswith(self.prefix):
+            return None
+        return self.decode_fields(data[len(self.prefix):])
+
+    def __repr__(self):
+        return f"Payload({self.opcode!r}, {self.name!r})"
+
+
+class LegacyFormat:
+    """
+    Pre-codec callback_data of a payload: literal text with `{field}` placeholders.
+    Ints are decimal, choices their value, banks and text are taken as is.
+    """
+
+    def __init__(self, payload: Payload, spec: str):
+        fields = dict(payload.fields)
+        names = _LEGACY_FIELD.findall(spec)
+        if sorted(names) != sorted(fields):
+            raise ValueError(f"{payload.name}: legacy format {spec!r} must name fields {sorted(fields)}")
+        self.payload = payload
+        self.spec = spec
+        first = _LEGACY_FIELD.search(spec)
+        self.prefix = spec[:first.start()] if first else spec
+        pattern, example = [], [self.prefix]
+        pos = len(self.prefix)
+        for m in _LEGACY_FIELD.finditer(spec, pos):
+            literal = spec[pos:m.start()]
+            pattern.append(re.escape(literal))
+            example.append(literal)
+            field = fields[m.group(1)]
+            if isinstance(field, Int):
+                regex, sample = r"-?\d+", "1"
+            elif isinstance(field, Choice):
+                regex, sample = "|".join(re.escape(v) for v in field.values), field.values[0]
+            else:
+                regex, sample = r".+?", "x"
+            pattern.append(f"(?P<{m.group(1)}>{regex})")
+            example.append(sample)
+            pos = m.end()
+        pattern.append(re.escape(spec[pos:]))
+        example.append(spec[pos:])
+        self._tail = re.compile("".join(pattern), re.DOTALL)
+        self.example = "".join(example)
+
+    def decode_fields(self, rest: str) -> Optional[Dict[str, Any]]:
+        m = self._tail.fullmatch(rest)
+        if m is None:
+            return None
+        values = m.groupdict()
+        for name, field in self.payload.fields:
+            if isinstance(field, Int):
+                values[name] = int(values[name])
+        return values
+
+    def __repr__(self):
+        return f"LegacyFormat({self.spec!r} -> {self.payload.name!r})"
+
+
+class CallbackCodec:
+    def __init__(self):
+        self.payloads: Dict[str, Payload] = {}
+        self.legacy_formats: List[LegacyFormat] = []
+
+    def register(self, opcode: str, name: str, **fields: Field) -> Payload:
+        if not _OPCODE.fullmatch(opcode):
+            raise ValueError(f"opcode must be 1-3 letters: {opcode!r}")
+        if opcode in self.payloads:
+            raise ValueError(f"opcode {opcode!r} already used by {self.payloads[opcode]!r}")
+        items = list(fields.items())
+        if any(field.greedy for _, field in items[:-1]):
+            raise ValueError(f"{name}: only the last field may be free text")
+        payload = self.payloads[opcode] = Payload(opcode, name, items)
+        return payload
+
+    def legacy(self, payload: Payload, spec: str) -> LegacyFormat:
+        """Also accept `spec`, the payload's callback_data from before the codec."""
+        fmt = LegacyFormat(payload, spec)
+        payload.legacy.append(fmt)
+        self.legacy_formats.append(fmt)
+        # longest prefix first, as the router resolves them
+        self.legacy_formats.sort(key=lambda f: len(f.prefix), reverse=True)
+        return fmt
+
+    def decode(self, data: str) -> Optional[Tuple[Payload, Dict[str, Any]]]:
+        payload = self.payloads.get(data.split(SEP, 1)[0])
+        if payload is not None:
+            values = payload.decode(data)
+            if values is not None:
+                return payload, values
+        for fmt in self.legacy_formats:
+            if data.startswith(fmt.prefix):
+                values = fmt.decode_fields(data[len(fmt.prefix):])
+                if values is not None:
+                    return fmt.payload, values
+        return None
+
+
+codec = CallbackCodec()
+
+# ---------- payloads ----------
+
+# Client menu
+BANK_PICK = codec.register("b", "bank_pick", bank=BANK, action=ACTION)
+
+# Data reuse confirmation (handlers/data_validation.py)
+REUSE_CONFIRM = codec.register("rc", "confirm_reuse", order_id=INT, bank=BANK)
+REUSE_CANCEL = codec.register("rx", "cancel_reuse", order_id=INT)
+
+# Per-photo moderation (REVIEW_MODE=per_photo)
+PHOTO_APPROVE = codec.register("pa", "approve", user_id=INT, photo_id=INT)
+PHOTO_REJECT = codec.register("pr", "reject", user_id=INT, photo_id=INT)
+PHOTO_REJECT_TEMPLATE = codec.register("pt", "rejtmpl", user_id=INT, photo_id=INT, key=TEXT)
+PHOTO_SKIP_STAGE = codec.register("ps", "skip", user_id=INT, stage=INT)
+PHOTO_FINISH = codec.register("pf", "finish", user_id=INT)
+PHOTO_MESSAGE = codec.register("pm", "msg", user_id=INT)
+
+# Album moderation (REVIEW_MODE=album)
+REVIEW_TOGGLE = codec.register("rt", "review_toggle", review_id=INT, photo_id=INT)
+REVIEW_APPROVE_ALL = codec.register("ra", "review_approve_all", review_id=INT)
+REVIEW_REJECT_ALL = codec.register("rr", "review_reject_all", review_id=INT)
+REVIEW_APPLY = codec.register("rs", "review_apply", review_id=INT)
+# reason for the photos being rejected: every pending one (reject all) or the toggled drafts (apply)
+REVIEW_SCOPE = Choice("all", "drafts")
+REVIEW_REASON = codec.register("rq", "review_reason", review_id=INT, scope=REVIEW_SCOPE, key=TEXT)
+REVIEW_REASON_CUSTOM = codec.register("rw", "review_reason_custom", review_id=INT, scope=REVIEW_SCOPE)
+REVIEW_BACK = codec.register("rb", "review_back", review_id=INT)
+
+# Idle order warning (order_reaper.py)
+ORDER_KEEPALIVE = codec.register("ok", "order_keepalive", order_id=INT)
+
+# Bank management (handlers/bank_management.py)
+BANK_EDIT = codec.register("be", "edit_bank", bank=BANK)
+BANK_TOGGLE = codec.register("bt", "toggle_bank", field=Choice("active", "register", "change"), bank=BANK)
+BANK_EDIT_FIELD = codec.register("bf", "edit_bank_field", field=Choice("price", "description"), bank=BANK)
+BANK_DELETE = codec.register("bd", "delete_bank", bank=BANK)
+BANK_DELETE_CONFIRM = codec.register("bD", "confirm_delete_bank", bank=BANK)
+GROUP_BANK_PICK = codec.register("gb", "select_bank_for_group", bank=BANK)
+TEMPLATE_CREATE = codec.register("tc", "create_template", bank=BANK)
+TEMPLATE_EDIT = codec.register("te", "edit_template", bank=BANK)
+TEMPLATE_DELETE = codec.register("td", "delete_template", bank=BANK)
+TEMPLATE_DELETE_CONFIRM = codec.register("tD", "confirm_delete_template", bank=BANK)
+
+# Instruction management (handlers/instruction_management.py)
+STAGES_EDIT = codec.register("se", "edit_bank_stages", bank=BANK)
+STAGE_EDIT = codec.register("sE", "edit_stage", bank=BANK, action=ACTION, step=INT)
+STAGE_CLEAR = codec.register("sc", "clear_stage_content", bank=BANK, action=ACTION, step=INT)
+STAGES_REORDER = codec.register("sr", "reorder_bank_stages", bank=BANK)
+# bank picker of the "add stage" conversation; handled by its ConversationHandler, not the router
+INSTR_BANK = codec.register("ib", "instr_bank", bank=BANK)
+
+# ---------- pre-codec formats ----------
+
+codec.legacy(BANK_PICK, "bank_{bank}_{action}")
+codec.legacy(REUSE_CONFIRM, "confirm_reuse_{order_id}_{bank}")
+codec.legacy(REUSE_CANCEL, "cancel_reuse_{order_id}")
+codec.legacy(PHOTO_APPROVE, "approve_{user_id}_{photo_id}")
+codec.legacy(PHOTO_REJECT, "reject_{user_id}_{photo_id}")
+codec.legacy(PHOTO_REJECT_TEMPLATE, "rejtmpl_{user_id}_{photo_id}_{key}")
+codec.legacy(PHOTO_SKIP_STAGE, "skip_{user_id}_{stage}")
+codec.legacy(PHOTO_FINISH, "finish_{user_id}")
+codec.legacy(PHOTO_MESSAGE, "msg_{user_id}")
+codec.legacy(REVIEW_TOGGLE, "rvt_{review_id}_{photo_id}")
+codec.legacy(REVIEW_APPROVE_ALL, "rva_{review_id}")
+codec.legacy(REVIEW_REJECT_ALL, "rvr_{review_id}")
+codec.legacy(REVIEW_APPLY, "rvs_{review_id}")
+codec.legacy(ORDER_KEEPALIVE, "order_keepalive_{order_id}")
+codec.legacy(BANK_EDIT, "edit_bank_{bank}")
+codec.legacy(BANK_TOGGLE, "toggle_{field}_{bank}")
+codec.legacy(BANK_EDIT_FIELD, "edit_{field}_{bank}")
+codec.legacy(BANK_DELETE, "delete_bank_{bank}")
+codec.legacy(BANK_DELETE_CONFIRM, "confirm_delete_bank_{bank}")
+codec.legacy(GROUP_BANK_PICK, "select_bank_for_group_{bank}")
+codec.legacy(TEMPLATE_CREATE, "create_template_{bank}")
+codec.legacy(TEMPLATE_EDIT, "edit_template_{bank}")
+codec.legacy(TEMPLATE_DELETE, "delete_template_{bank}")
+codec.legacy(TEMPLATE_DELETE_CONFIRM, "confirm_delete_template_{bank}")
+codec.legacy(STAGES_EDIT, "edit_bank_stages_{bank}")
+codec.legacy(STAGE_EDIT, "edit_stage_{bank}_{action}_{step}")
+codec.legacy(STAGE_CLEAR, "clear_stage_content_{bank}_{action}_{step}")
+codec.legacy(STAGES_REORDER, "reorder_bank_{bank}")
+codec.legacy(STAGES_REORDER, "reorder_stages_{bank}")
+codec.legacy(INSTR_BANK, "instr_bank_{bank}")
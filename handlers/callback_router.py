@@ -0,0 +1,315 @@
+"""
+Callback query routing on a prefix trie.
+
+Handlers register the callback_data shapes they serve with `@router.route(spec)`
+and the application gets one CallbackQueryHandler (`router.handler()`) instead
+of a regex handler per shape. A spec is literal text with typed fields:
+
+    "banks_menu"                                   exact data
+    "delete_group_{group_id:int}"                  int field
+    "edit_bank_stages_{bank}"                      str field (may contain "_")
+    "bank_{bank}_{action:register|change}"         one of the listed words
+    "age_confirm_*"                                any remainder
+
+or a compact Payload from handlers/callback_codec.py (its opcode is the prefix);
+a Payload also brings routes for its pre-codec formats (`codec.legacy`).
+
+The literal text before the first field is the route's prefix. Resolution walks
+the trie along callback_data and tries the routes with the longest matching
+prefix first (exact routes, then typed, then wildcards), falling back to
+shorter prefixes when the fields do not parse; so "edit_bank_stages_X" reaches
+its own route even though "edit_bank_{bank}" would accept it too. Parsed fields
+are available to the handler as `context.match["bank"]`.
+
+`validate()` runs at startup: routes with the same shape raise RouteConflictError,
+routes that can never be reached (or that would take data from another
+CallbackQueryHandler of the application) are reported.
+
+Routes may also be declared with a LazyCallback (handlers/lazy.py) before their
+module is imported; the module's own declarations then bind to them.
+"""
+import logging
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Pattern, Union
+
+from telegram.ext import BaseHandler, CallbackQueryHandler, ConversationHandler
+
+from handlers.callback_codec import LegacyFormat, Payload
+from handlers.lazy import LazyCallback
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+HandlerCallback = Callable[[Any, Any], Awaitable[Any]]
+
+_FIELD = re.compile(r"\{(\w+)(?::([^}]+))?\}|\*")
+_INT = r"-?\d+"
+_STR = r".+?"
+
+
+class RouteConflictError(ValueError):
+    pass
+
+
+class Route:
+    __slots__ = ("spec", "func", "prefix", "rank", "shape", "example", "_tail", "_ints", "_payload",
+                 "timing", "errors")
+
+    def __init__(self, spec: Union[str, Payload, LegacyFormat], func: HandlerCallback):
+        self.func = func
+        self.timing = Histogram()
+        self.errors = 0
+        self._ints: List[str] = []
+        self._payload: Optional[Union[Payload, LegacyFormat]] = None
+
+        if isinstance(spec, Payload):
+            # opcodes are unique in the codec, so there is nothing to cross-check by example
+            self.spec, self.prefix, self.rank = spec.name, spec.prefix, 1
+            self.shape, self.example, self._tail = f"codec:{spec.opcode}", None, None
+            self._payload = spec
+            return
+        if isinstance(spec, LegacyFormat):
+            # served under the payload's name, so handlers see the same context.match
+            self.spec, self.prefix, self.rank = spec.payload.name, spec.prefix, 1
+            self.shape, self.example, self._tail = f"legacy:{spec.spec}", spec.example, None
+            self._payload = spec
+            return
+
+        self.spec = spec
+        first = _FIELD.search(spec)
+        self.prefix = spec[:first.start()] if first else spec
+        if first is None:
+            # exact route
+            self.rank, self._tail, self.shape, self.example = 0, None, spec, spec
+            return
+
+        pattern, shape, example = [], [self.prefix], [self.prefix]
+        pos = first.start()
+        for field in _FIELD.finditer(spec, pos):
+            literal = spec[pos:field.start()]
+            pattern.append(re.escape(literal))
+            shape.append(literal)
+            example.append(literal)
+            pos = field.end()
+            if field.group(0) == "*":
+                if pos != len(spec):
+                    raise ValueError(f"route {spec!r}: '*' must end the spec")
+                pattern.append(".*")
+                shape.append("*")
+                continue
+            name, kind = field.group(1), field.group(2) or "str"
+            if kind == "int":
+                regex, sample = _INT, "1"
+                self._ints.append(name)
+            elif kind == "str":
+                regex, sample = _STR, "x"
+            else:
+                choices = kind.split("|")
+                regex, sample = "|".join(re.escape(c) for c in choices), choices[0]
+                kind = "|".join(sorted(choices))
+            pattern.append(f"(?P<{name}>{regex})")
+            shape.append("{" + kind + "}")
+            example.append(sample)
+        pattern.append(re.escape(spec[pos:]))
+        shape.append(spec[pos:])
+        example.append(spec[pos:])
+
+        self.rank = 2 if spec.endswith("*") else 1
+        self._tail: Optional[Pattern] = re.compile("".join(pattern), re.DOTALL)
+        self.shape = "".join(shape)
+        self.example = "".join(example)
+
+    def parse(self, rest: str) -> Optional[Dict[str, Any]]:
+        """Fields of the callback_data after the prefix, or None if it does not fit this route."""
+        if self._payload is not None:
+            return self._payload.decode_fields(rest)
+        if self._tail is None:
+            return {} if not rest else None
+        m = self._tail.fullmatch(rest)
+        if m is None:
+            return None
+        args = m.groupdict()
+        for name in self._ints:
+            args[name] = int(args[name])
+        return args
+
+    def __repr__(self):
+        return f"Route({self.spec!r} -> {getattr(self.func, '__qualname__', self.func)})"
+
+
+class RouteMatch:
+    """Resolved route with its parsed fields; also what `context.match` holds in a routed handler."""
+    __slots__ = ("route", "args")
+
+    def __init__(self, route: Route, args: Dict[str, Any]):
+        self.route = route
+        self.args = args
+
+    @property
+    def name(self) -> str:
+        """Spec of the route, or the payload name for codec routes."""
+        return self.route.spec
+
+    def __getitem__(self, name: str) -> Any:
+        return self.args[name]
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return self.args.get(name, default)
+
+
+class _Node:
+    __slots__ = ("children", "routes")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.routes: List[Route] = []
+
+
+class CallbackRouter:
+    def __init__(self):
+        self._root = _Node()
+        self.routes: List[Route] = []
+        self.unmatched = 0
+
+    # ---------- registration ----------
+
+    def route(self, *specs: Union[str, Payload]) -> Callable[[HandlerCallback], HandlerCallback]:
+        """Decorator: serve every spec with the decorated `handler(update, context)`."""
+        def decorator(func: HandlerCallback) -> HandlerCallback:
+            for spec in specs:
+                self.add(spec, func)
+            return func
+        return decorator
+
+    def add(self, spec: Union[str, Payload, LegacyFormat], func: HandlerCallback) -> Route:
+        if isinstance(spec, Payload):
+            for fmt in spec.legacy:
+                self.add(fmt, func)
+        route = Route(spec, func)
+        for existing in self.routes:
+            if existing.shape != route.shape:
+                continue
+            if existing.func is func:
+                return existing  # module imported twice
+            if isinstance(existing.func, LazyCallback) and existing.func.targets(func):
+                existing.func.bind(func)  # module of a lazy route is being imported
+                return existing
+            if isinstance(func, LazyCallback) and func.targets(existing.func):
+                func.bind(existing.func)  # module was imported before the lazy declaration
+                existing.func = func
+                return existing
+        node = self._root
+        for ch in route.prefix:
+            node = node.children.setdefault(ch, _Node())
+        node.routes.append(route)
+        # stable: registration order within the same rank
+        node.routes.sort(key=lambda r: r.rank)
+        self.routes.append(route)
+        return route
+
+    # ---------- resolution ----------
+
+    def resolve(self, data: Any) -> Optional[RouteMatch]:
+        if not isinstance(data, str):
+            return None
+        candidates = []
+        node = self._root
+        if node.routes:
+            candidates.append((0, node))
+        for depth, ch in enumerate(data, 1):
+            node = node.children.get(ch)
+            if node is None:
+                break
+            if node.routes:
+                candidates.append((depth, node))
+        for depth, node in reversed(candidates):
+            rest = data[depth:]
+            for route in node.routes:
+                args = route.parse(rest)
+                if args is not None:
+                    return RouteMatch(route, args)
+        return None
+
+    def matches(self, data: Any) -> Optional[RouteMatch]:
+        """CallbackQueryHandler pattern: PTB stores the result in `context.matches`."""
+        match = self.resolve(data)
+        if match is None:
+            self.unmatched += 1
+        return match
+
+    def handler(self) -> CallbackQueryHandler:
+        return CallbackQueryHandler(self.dispatch, pattern=self.matches)
+
+    async def dispatch(self, update: Any, context: Any) -> Any:
+        match = context.matches[0] if getattr(context, "matches", None) else None
+        if not isinstance(match, RouteMatch):
+            match = self.resolve(update.callback_query.data)
+            if match is None:
+                return None
+            context.matches = [match]
+        route = match.route
+        started = time.perf_counter()
+        try:
+            return await route.func(update, context)
+        except Exception:
+            route.errors += 1
+            raise
+        finally:
+            route.timing.observe(time.perf_counter() - started)
+
+    # ---------- diagnostics ----------
+
+    def validate(self, foreign_patterns: Iterable[Any] = ()) -> List[str]:
+        """
+        Raise RouteConflictError for routes with the same shape and different handlers;
+        return (and log) routes that are unreachable or overlap `foreign_patterns`
+        (regex patterns of the application's other CallbackQueryHandlers).
+        """
+        by_shape: Dict[str, Route] = {}
+        for route in self.routes:
+            other = by_shape.setdefault(route.shape, route)
+            if other is not route and other.func is not route.func:
+                raise RouteConflictError(f"ambiguous routes: {other!r} and {route!r}")
+
+        problems = []
+        checked = [route for route in self.routes if route.example is not None]
+        for route in checked:
+            match = self.resolve(route.example)
+            if match is not None and match.route.shape != route.shape:
+                problems.append(f"{route!r} is shadowed by {match.route!r} (e.g. {route.example!r})")
+        foreign = [p for p in foreign_patterns if isinstance(p, (str, re.Pattern))]
+        for route in checked:
+            for pattern in foreign:
+                if re.match(pattern, route.example):
+                    text = pattern.pattern if isinstance(pattern, re.Pattern) else pattern
+                    problems.append(f"{route!r} overlaps handler pattern {text!r} (e.g. {route.example!r})")
+        for problem in problems:
+            logger.warning("Callback router: %s", problem)
+        return problems
+
+    def stats(self) -> Dict[str, Any]:
+        timings = {
+            (route.spec + " (legacy)" if route.shape.startswith("legacy:") else route.spec):
+                dict(route.timing.as_dict(), errors=route.errors)
+            for route in self.routes if route.timing.count
+        }
+        return {"routes": len(self.routes), "unmatched": self.unmatched, "timings": timings}
+
+
+def callback_patterns(handlers: Iterable[BaseHandler]) -> List[Any]:
+    """Patterns of the CallbackQueryHandlers in `handlers`, including those inside conversations."""
+    patterns = []
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            nested = list(handler.entry_points) + list(handler.fallbacks)
+            for state_handlers in handler.states.values():
+                nested.extend(state_handlers)
+            patterns.extend(callback_patterns(nested))
+        elif isinstance(handler, CallbackQueryHandler) and handler.pattern is not None:
+            patterns.append(handler.pattern)
+    return patterns
+
+
+# One router for the whole bot; handler modules register on import
+router = CallbackRouter()
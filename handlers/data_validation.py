@@ -7,6 +7,8 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
 
 from db import check_data_uniqueness, cursor, log_action, record_data_usage
+from handlers.callback_codec import REUSE_CANCEL, REUSE_CONFIRM
+from handlers.callback_router import router
 
 logger = logging.getLogger(__name__)
 
@@ -42,9 +44,9 @@ async def check_and_confirm_data_uniqueness(update: Update, context: ContextType
 
     keyboard = [
         [InlineKeyboardButton("✅ Так, використати",
-                            callback_data=f"confirm_reuse_{order_id}_{bank}")],
+                            callback_data=REUSE_CONFIRM.encode(order_id=order_id, bank=bank))],
         [InlineKeyboardButton("❌ Ні, скасувати",
-                            callback_data=f"cancel_reuse_{order_id}")]
+                            callback_data=REUSE_CANCEL.encode(order_id=order_id))]
     ]
 
     # Store data in context for later use
@@ -61,50 +63,42 @@ async def check_and_confirm_data_uniqueness(update: Update, context: ContextType
 
     return False  # Data needs confirmation
 
+@router.route(REUSE_CONFIRM, REUSE_CANCEL)
 async def handle_data_reuse_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle confirmation/cancellation of data reuse"""
     query = update.callback_query
     await query.answer()
 
-    data = query.data
+    order_id = context.match["order_id"]
 
-    if data.startswith("confirm_reuse_"):
-        # Extract order_id and bank from callback data
-        parts = data.split("_")
-        if len(parts) >= 4:
-            order_id = int(parts[2])
-            bank = "_".join(parts[3:])  # Handle bank names with underscores
+    if context.match.name == REUSE_CONFIRM.name:
+        bank = context.match["bank"]
 
-            # Get pending data
-            pending_data = context.user_data.get(f'pending_data_{order_id}')
-            if pending_data:
-                phone_number = pending_data.get('phone_number')
-                email = pending_data.get('email')
+        # Get pending data
+        pending_data = context.user_data.get(f'pending_data_{order_id}')
+        if pending_data:
+            phone_number = pending_data.get('phone_number')
+            email = pending_data.get('email')
 
-                # Record the usage
-                record_data_usage(order_id, bank, phone_number, email)
-                log_action(order_id, f"manager_{update.effective_user.id}", "confirm_data_reuse",
-                          f"phone: {phone_number}, email: {email}")
-
-                # Clean up
-                context.user_data.pop(f'pending_data_{order_id}', None)
-
-                await query.edit_message_text("✅ Дані підтверджено та збережено.")
-                return True
-
-    elif data.startswith("cancel_reuse_"):
-        # Extract order_id
-        parts = data.split("_")
-        if len(parts) >= 3:
-            order_id = int(parts[2])
+            # Record the usage
+            record_data_usage(order_id, bank, phone_number, email)
+            log_action(order_id, f"manager_{update.effective_user.id}", "confirm_data_reuse",
+                      f"phone: {phone_number}, email: {email}")
 
             # Clean up
             context.user_data.pop(f'pending_data_{order_id}', None)
 
-            log_action(order_id, f"manager_{update.effective_user.id}", "cancel_data_reuse", "")
+            await query.edit_message_text("✅ Дані підтверджено та збережено.")
+            return True
+
+    else:
+        # Clean up
+        context.user_data.pop(f'pending_data_{order_id}', None)
+
+        log_action(order_id, f"manager_{update.effective_user.id}", "cancel_data_reuse", "")
 
-            await query.edit_message_text("❌ Використання даних скасовано.")
-            return False
+        await query.edit_message_text("❌ Використання даних скасовано.")
+        return False
 
     return False
 
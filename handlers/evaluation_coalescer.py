@@ -0,0 +1,102 @@
+"""
+Coalescing of stage evaluations after moderation decisions.
+
+Every approve/reject marks its (order, stage) dirty; the evaluation runs once
+after a quiet window without further decisions for that pair, serialized per
+order by an asyncio.Lock, so a burst of decisions produces one evaluation and
+at most one stage transition.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# evaluate(user_id, order_id, stage_db, context)
+EvaluateCallback = Callable[[int, int, int, Any], Awaitable[None]]
+_Key = Tuple[int, int]  # (order_id, stage_db)
+
+
+class EvaluationCoalescer:
+    def __init__(self, evaluate: EvaluateCallback, quiet_seconds: float):
+        self._evaluate = evaluate
+        self.quiet_seconds = quiet_seconds
+        # (order_id, stage_db) -> (user_id, context, timer)
+        self._dirty: Dict[_Key, Tuple[int, Any, asyncio.TimerHandle]] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._lock_users: Dict[int, int] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.marked = 0
+        self.coalesced = 0
+        self.evaluated = 0
+
+    def mark_dirty(self, user_id: int, order_id: int, stage_db: int, context: Any) -> None:
+        """Schedule an evaluation of (order, stage); repeated marks within the window are merged."""
+        key = (order_id, stage_db)
+        self.marked += 1
+        prev = self._dirty.get(key)
+        if prev:
+            prev[2].cancel()
+            self.coalesced += 1
+        loop = asyncio.get_running_loop()
+        timer = loop.call_later(self.quiet_seconds, self._fire, key)
+        self._dirty[key] = (user_id, context, timer)
+
+    def pending_count(self) -> int:
+        return len(self._dirty)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._dirty),
+            "marked": self.marked,
+            "coalesced": self.coalesced,
+            "evaluated": self.evaluated,
+        }
+
+    async def flush(self) -> None:
+        """Run every pending evaluation now (used on shutdown)."""
+        for key in list(self._dirty):
+            self._fire(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    # ---------- internals ----------
+
+    def _fire(self, key: _Key):
+        entry = self._dirty.pop(key, None)
+        if entry is None:
+            return
+        user_id, context, timer = entry
+        timer.cancel()
+        task = asyncio.get_running_loop().create_task(self._run(user_id, key, context))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _acquire_lock_ref(self, order_id: int) -> asyncio.Lock:
+        lock = self._locks.get(order_id)
+        if lock is None:
+            lock = self._locks[order_id] = asyncio.Lock()
+        self._lock_users[order_id] = self._lock_users.get(order_id, 0) + 1
+        return lock
+
+    def _release_lock_ref(self, order_id: int):
+        # Drop locks of idle orders so the dict does not grow with every order ever moderated
+        users = self._lock_users.get(order_id, 1) - 1
+        if users <= 0:
+            self._lock_users.pop(order_id, None)
+            self._locks.pop(order_id, None)
+        else:
+            self._lock_users[order_id] = users
+
+    async def _run(self, user_id: int, key: _Key, context: Any):
+        order_id, stage_db = key
+        lock = self._acquire_lock_ref(order_id)
+        try:
+            async with lock:
+                self.evaluated += 1
+                await self._evaluate(user_id, order_id, stage_db, context)
+        except Exception as e:
+            logger.exception("Stage evaluation failed for order %s stage %s: %s", order_id, stage_db, e)
+        finally:
+            self._release_lock_ref(order_id)
@@ -13,6 +13,16 @@ from db import (
     reorder_bank_instructions, get_next_step_number, get_instruction_by_id,
     get_instruction_by_step
 )
+from handlers.callback_codec import INSTR_BANK, STAGE_CLEAR, STAGE_EDIT, STAGES_EDIT, STAGES_REORDER, codec
+from handlers.callback_router import router
+from states import (
+    INSTR_ACTION_SELECT,
+    INSTR_BANK_SELECT,
+    INSTR_PHOTO_INPUT,
+    INSTR_STAGE_CONFIG,
+    INSTR_STAGE_TYPE_SELECT,
+    INSTR_TEXT_INPUT,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -24,10 +34,10 @@ def _iter_banks_basic():
         # We only need the first 4 columns
         yield bank_row[:4]
 
-# Conversation states for enhanced instruction management
-INSTR_BANK_SELECT, INSTR_ACTION_SELECT, INSTR_STAGE_TYPE_SELECT, INSTR_STAGE_CONFIG, INSTR_TEXT_INPUT, INSTR_PHOTO_INPUT = range(10, 16)
+# Conversation states for enhanced instruction management (INSTR_BANK_SELECT..INSTR_PHOTO_INPUT are in states.py)
 INSTR_EDIT_SELECT, INSTR_EDIT_FIELD, INSTR_REORDER_SELECT = range(15, 18)
 
+@router.route("instructions_list")
 async def instructions_list_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """List all instructions for all banks with enhanced stage information"""
     if not is_admin(update.effective_user.id):
@@ -110,7 +120,7 @@ async def instructions_add_handler(update: Update, context: ContextTypes.DEFAULT
 
     for bank_name, is_active, register_enabled, change_enabled in banks:
         if is_active:
-            keyboard.append([InlineKeyboardButton(bank_name, callback_data=f"instr_bank_{bank_name}")])
+            keyboard.append([InlineKeyboardButton(bank_name, callback_data=INSTR_BANK.encode(bank=bank_name))])
 
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="instructions_menu")])
 
@@ -122,11 +132,11 @@ async def instruction_bank_select_handler(update: Update, context: ContextTypes.
     query = update.callback_query
     await query.answer()
 
-    data = query.data
-    if not data.startswith("instr_bank_"):
+    decoded = codec.decode(query.data)
+    if decoded is None or decoded[0] is not INSTR_BANK:
         return ConversationHandler.END
 
-    bank_name = data[11:]  # Remove "instr_bank_" prefix
+    bank_name = decoded[1]["bank"]
     context.user_data['instr_bank'] = bank_name
 
     text = f"🔄 <b>Виберіть тип операції для '{bank_name}':</b>\n\n"
@@ -189,7 +199,7 @@ async def instruction_action_select_handler(update: Update, context: ContextType
         text += f"📄 {info['description']}\n\n"
         keyboard.append([InlineKeyboardButton(f"{emoji}{info['name']}", callback_data=f"stage_type_{stage_type}")])
 
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="instr_bank_" + bank_name)])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=INSTR_BANK.encode(bank=bank_name))])
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
     return INSTR_STAGE_TYPE_SELECT
@@ -618,6 +628,7 @@ async def instruction_skip_photos_handler(update: Update, context: ContextTypes.
 
     return ConversationHandler.END
 
+@router.route("instr_add_another")
 async def instruction_add_another_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle adding another instruction step"""
     query = update.callback_query
@@ -627,6 +638,7 @@ async def instruction_add_another_handler(update: Update, context: ContextTypes.
     await instructions_add_handler(update, context)
     return INSTR_BANK_SELECT
 
+@router.route("instructions_edit")
 async def instructions_edit_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start editing instruction stages"""
     if not is_admin(update.effective_user.id):
@@ -654,7 +666,7 @@ async def instructions_edit_handler(update: Update, context: ContextTypes.DEFAUL
             
             if register_instructions or change_instructions:
                 total_stages = len(register_instructions) + len(change_instructions)
-                keyboard.append([InlineKeyboardButton(f"{bank_name} ({total_stages} етапів)", callback_data=f"edit_bank_stages_{bank_name}")])
+                keyboard.append([InlineKeyboardButton(f"{bank_name} ({total_stages} етапів)", callback_data=STAGES_EDIT.encode(bank=bank_name))])
 
     if not keyboard:
         text = "❌ Немає банків з етапами для редагування"
@@ -663,6 +675,7 @@ async def instructions_edit_handler(update: Update, context: ContextTypes.DEFAUL
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route(STAGES_EDIT)
 async def edit_bank_stages_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show stages for a specific bank for editing"""
     if not is_admin(update.effective_user.id):
@@ -671,7 +684,7 @@ async def edit_bank_stages_handler(update: Update, context: ContextTypes.DEFAULT
     query = update.callback_query
     await query.answer()
 
-    bank_name = query.data.replace("edit_bank_stages_", "")
+    bank_name = context.match["bank"]
     
     register_instructions = get_bank_instructions(bank_name, "register")
     change_instructions = get_bank_instructions(bank_name, "change")
@@ -686,7 +699,7 @@ async def edit_bank_stages_handler(update: Update, context: ContextTypes.DEFAULT
             step_number, instruction_text, images_json, age_req, req_photos, step_type, step_data, step_order = instr
             stage_name = stage_types.get(step_type, {}).get('name', step_type)
             text += f"  {step_order}. {stage_name} - {instruction_text[:40]}...\n"
-            keyboard.append([InlineKeyboardButton(f"✏️ Етап {step_order} (Реєстрація)", callback_data=f"edit_stage_{bank_name}_register_{step_number}")])
+            keyboard.append([InlineKeyboardButton(f"✏️ Етап {step_order} (Реєстрація)", callback_data=STAGE_EDIT.encode(bank=bank_name, action="register", step=step_number))])
         text += "\n"
 
     if change_instructions:
@@ -695,15 +708,16 @@ async def edit_bank_stages_handler(update: Update, context: ContextTypes.DEFAULT
             step_number, instruction_text, images_json, age_req, req_photos, step_type, step_data, step_order = instr
             stage_name = stage_types.get(step_type, {}).get('name', step_type)
             text += f"  {step_order}. {stage_name} - {instruction_text[:40]}...\n"
-            keyboard.append([InlineKeyboardButton(f"✏️ Етап {step_order} (Перев'язка)", callback_data=f"edit_stage_{bank_name}_change_{step_number}")])
+            keyboard.append([InlineKeyboardButton(f"✏️ Етап {step_order} (Перев'язка)", callback_data=STAGE_EDIT.encode(bank=bank_name, action="change", step=step_number))])
 
     keyboard.extend([
-        [InlineKeyboardButton("🔄 Змінити порядок", callback_data=f"reorder_stages_{bank_name}")],
+        [InlineKeyboardButton("🔄 Змінити порядок", callback_data=STAGES_REORDER.encode(bank=bank_name))],
         [InlineKeyboardButton("🔙 Назад", callback_data="instructions_edit")]
     ])
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route(STAGE_EDIT)
 async def edit_stage_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle editing individual instruction stage"""
     if not is_admin(update.effective_user.id):
@@ -712,27 +726,7 @@ async def edit_stage_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
     
-    # Parse callback data: edit_stage_{bank_name}_{action}_{step_number}
-    try:
-        parts = query.data.split("_", 3)
-        if len(parts) < 4:
-            await query.edit_message_text("❌ Некоректні дані")
-            return
-            
-        bank_name = parts[2]
-        action_step = parts[3]
-        
-        # Split action and step_number
-        if "_" in action_step:
-            action, step_number_str = action_step.rsplit("_", 1)
-            step_number = int(step_number_str)
-        else:
-            await query.edit_message_text("❌ Некоректний формат даних")
-            return
-            
-    except (ValueError, IndexError) as e:
-        await query.edit_message_text("❌ Помилка парсингу даних")
-        return
+    bank_name, action, step_number = context.match["bank"], context.match["action"], context.match["step"]
     
     # Get the instruction
     instruction = get_instruction_by_step(bank_name, action, step_number)
@@ -777,13 +771,14 @@ async def edit_stage_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         [InlineKeyboardButton("🖼️ Змінити зображення", callback_data=f"edit_field_images_{bank_name}_{action}_{step_number}")],
         [InlineKeyboardButton("🔞 Змінити вікові вимоги", callback_data=f"edit_field_age_{bank_name}_{action}_{step_number}")],
         [InlineKeyboardButton("📷 Змінити к-сть фото", callback_data=f"edit_field_photos_{bank_name}_{action}_{step_number}")],
-        [InlineKeyboardButton("🗑️ Очистити текст і зображення", callback_data=f"clear_stage_content_{bank_name}_{action}_{step_number}")],
+        [InlineKeyboardButton("🗑️ Очистити текст і зображення", callback_data=STAGE_CLEAR.encode(bank=bank_name, action=action, step=step_number))],
         [InlineKeyboardButton("❌ Видалити етап", callback_data=f"delete_stage_{bank_name}_{action}_{step_number}")],
-        [InlineKeyboardButton("🔙 Назад", callback_data=f"edit_bank_stages_{bank_name}")]
+        [InlineKeyboardButton("🔙 Назад", callback_data=STAGES_EDIT.encode(bank=bank_name))]
     ]
     
     await query.edit_message_text(text_display, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route(STAGE_CLEAR)
 async def clear_stage_content_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle clearing text and images from stage"""
     if not is_admin(update.effective_user.id):
@@ -792,27 +787,7 @@ async def clear_stage_content_handler(update: Update, context: ContextTypes.DEFA
     query = update.callback_query
     await query.answer()
     
-    # Parse callback data: clear_stage_content_{bank_name}_{action}_{step_number}
-    try:
-        parts = query.data.split("_", 4)
-        if len(parts) < 5:
-            await query.edit_message_text("❌ Некоректні дані")
-            return
-            
-        bank_name = parts[3]
-        action_step = parts[4]
-        
-        # Split action and step_number
-        if "_" in action_step:
-            action, step_number_str = action_step.rsplit("_", 1)
-            step_number = int(step_number_str)
-        else:
-            await query.edit_message_text("❌ Некоректний формат даних")
-            return
-            
-    except (ValueError, IndexError) as e:
-        await query.edit_message_text("❌ Помилка парсингу даних")
-        return
+    bank_name, action, step_number = context.match["bank"], context.match["action"], context.match["step"]
     
     # Clear text and images
     success = update_bank_instruction(
@@ -830,13 +805,14 @@ async def clear_stage_content_handler(update: Update, context: ContextTypes.DEFA
             f"🔄 Дія: {'Реєстрація' if action == 'register' else 'Перевʼязка'}\n"
             f"📋 Етап: {step_number}",
             reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Назад до етапу", callback_data=f"edit_stage_{bank_name}_{action}_{step_number}")],
-                [InlineKeyboardButton("🔙 До списку етапів", callback_data=f"edit_bank_stages_{bank_name}")]
+                [InlineKeyboardButton("🔙 Назад до етапу", callback_data=STAGE_EDIT.encode(bank=bank_name, action=action, step=step_number))],
+                [InlineKeyboardButton("🔙 До списку етапів", callback_data=STAGES_EDIT.encode(bank=bank_name))]
             ])
         )
     else:
         await query.edit_message_text("❌ Помилка при очищенні етапу")
 
+@router.route("instructions_reorder")
 async def instructions_reorder_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start reordering instruction stages"""
     if not is_admin(update.effective_user.id):
@@ -864,7 +840,7 @@ async def instructions_reorder_handler(update: Update, context: ContextTypes.DEF
             
             if len(register_instructions) > 1 or len(change_instructions) > 1:
                 total_stages = len(register_instructions) + len(change_instructions)
-                keyboard.append([InlineKeyboardButton(f"{bank_name} ({total_stages} етапів)", callback_data=f"reorder_bank_{bank_name}")])
+                keyboard.append([InlineKeyboardButton(f"{bank_name} ({total_stages} етапів)", callback_data=STAGES_REORDER.encode(bank=bank_name))])
 
     if not keyboard:
         text = "❌ Немає банків з достатньою кількістю етапів для зміни порядку"
@@ -873,6 +849,7 @@ async def instructions_reorder_handler(update: Update, context: ContextTypes.DEF
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route(STAGES_REORDER)
 async def reorder_bank_stages_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show reordering interface for a specific bank"""
     if not is_admin(update.effective_user.id):
@@ -881,7 +858,7 @@ async def reorder_bank_stages_handler(update: Update, context: ContextTypes.DEFA
     query = update.callback_query
     await query.answer()
 
-    bank_name = query.data.replace("reorder_bank_", "").replace("reorder_stages_", "")
+    bank_name = context.match["bank"]
     
     register_instructions = get_bank_instructions(bank_name, "register")
     change_instructions = get_bank_instructions(bank_name, "change")
@@ -927,7 +904,7 @@ async def reorder_bank_stages_handler(update: Update, context: ContextTypes.DEFA
                 buttons.append(InlineKeyboardButton(f"Етап {i+1}", callback_data="noop"))
                 keyboard.append(buttons)
 
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f"edit_bank_stages_{bank_name}")])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=STAGES_EDIT.encode(bank=bank_name))])
 
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
@@ -1086,6 +1063,12 @@ async def sync_instructions_to_file_cmd(update: Update, context: ContextTypes.DE
         logger.error(f"Error syncing instructions: {e}")
         await update.message.reply_text(f"❌ Помилка при синхронізації: {e}")
 
+@router.route("sync_to_file")
+async def sync_to_file_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    await sync_instructions_to_file_cmd(update, context)
+
 # Conversation handler helper
 async def cancel_instruction_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel instruction management conversation"""
@@ -0,0 +1,66 @@
+"""
+Handler callbacks whose module is imported on first use.
+
+`lazy("handlers.bank_management", "add_bank_handler")` can be given to any PTB
+handler or declared as a router route in place of the function itself; the
+module is imported the first time an update reaches it. The admin modules are
+large and most processes only ever serve users, so client_bot declares them
+this way (see handlers/routes.py) instead of importing them at startup.
+
+When the module is imported, its own `@router.route(...)` declarations bind to
+the lazy routes declared for the same callback_data (see CallbackRouter.add).
+"""
+import importlib
+import logging
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class LazyCallback:
+    __slots__ = ("module", "name", "_func")
+
+    def __init__(self, module: str, name: str):
+        self.module = module
+        self.name = name
+        self._func: Optional[Callable[..., Any]] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._func is not None
+
+    def targets(self, func: Any) -> bool:
+        """True if `func` is the function this callback stands for."""
+        return (getattr(func, "__module__", None), getattr(func, "__name__", None)) == (self.module, self.name)
+
+    def bind(self, func: Callable[..., Any]) -> None:
+        self._func = func
+
+    def resolve(self) -> Callable[..., Any]:
+        if self._func is None:
+            started = time.perf_counter()
+            module = importlib.import_module(self.module)
+            func = getattr(module, self.name)
+            if self._func is None:
+                self._func = func
+            logger.info("Loaded %s for %s in %.1f ms", self.module, self.name, (time.perf_counter() - started) * 1000)
+        return self._func
+
+    async def __call__(self, update: Any, context: Any) -> Any:
+        return await self.resolve()(update, context)
+
+    def __repr__(self):
+        return f"LazyCallback({self.module!r}, {self.name!r}{', loaded' if self.loaded else ''})"
+
+
+_callbacks: Dict[Tuple[str, str], LazyCallback] = {}
+
+
+def lazy(module: str, name: str) -> LazyCallback:
+    """The (shared) lazy callback for `module.name`."""
+    key = (module, name)
+    callback = _callbacks.get(key)
+    if callback is None:
+        callback = _callbacks[key] = LazyCallback(module, name)
+    return callback
@@ -3,6 +3,8 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
 
 from db import cursor, get_banks, get_bank_details
+from handlers.callback_codec import BANK_PICK
+from handlers.callback_router import router
 from handlers.photo_handlers import assign_group_or_queue, create_order_in_db, send_instruction
 from states import find_age_requirement, user_states
 
@@ -57,6 +59,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception:
             pass
 
+@router.route("menu_banks", "menu_info", "back_to_main", "type_register", "type_change", BANK_PICK)
 async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -109,7 +112,7 @@ async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 if min_age > 18:
                     button_text += " 🔞"
             
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"bank_{bank}_{action}")])
+            keyboard.append([InlineKeyboardButton(button_text, callback_data=BANK_PICK.encode(bank=bank, action=action))])
         
         keyboard.append([InlineKeyboardButton("Назад", callback_data="menu_banks")])
         
@@ -124,12 +127,8 @@ async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(f"Оберіть банк (з ціною):{explanation}", reply_markup=InlineKeyboardMarkup(keyboard))
         return
 
-    if data.startswith("bank_"):
-        try:
-            _, bank, action = data.split("_", 2)
-        except ValueError:
-            await query.edit_message_text("❌ Некоректний вибір. Спробуйте ще раз.")
-            return
+    if context.match.name == BANK_PICK.name:
+        bank, action = context.match["bank"], context.match["action"]
 
         user_id = query.from_user.id
         
@@ -153,6 +152,7 @@ async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(text, reply_markup=keyboard)
         return
 
+@router.route("age_confirm_{answer:yes|no}")
 async def age_confirm_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -167,8 +167,8 @@ async def age_confirm_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     if data == "age_confirm_no":
         reg_banks = _get_visible_banks("register")
         chg_banks = _get_visible_banks("change")
-        keyboard = [[InlineKeyboardButton(bank, callback_data=f"bank_{bank}_register")] for bank in reg_banks] + \
-                   [[InlineKeyboardButton(bank, callback_data=f"bank_{bank}_change")] for bank in chg_banks]
+        keyboard = [[InlineKeyboardButton(bank, callback_data=BANK_PICK.encode(bank=bank, action="register"))] for bank in reg_banks] + \
+                   [[InlineKeyboardButton(bank, callback_data=BANK_PICK.encode(bank=bank, action="change"))] for bank in chg_banks]
         keyboard.append([InlineKeyboardButton("Назад", callback_data="back_to_main")])
         await query.edit_message_text("Ви не відповідаєте віковим вимогам. Будь ласка, оберіть інший банк.", reply_markup=InlineKeyboardMarkup(keyboard))
         user_states.pop(user_id, None)
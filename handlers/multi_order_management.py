@@ -6,7 +6,10 @@ import logging
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
 
+from capacity_events import FINISHED_STATUSES
 from db import cursor, get_active_orders_for_group, log_action, set_active_order_for_group
+from handlers.callback_router import router
+from queue_scheduler import format_load, occupy_group, release_group
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +48,7 @@ async def show_active_orders(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
 
+@router.route("refresh_active_orders", "switch_primary", "add_active_order", "remove_active_order", "set_primary_{order_id:int}", "add_order_{order_id:int}", "remove_order_{order_id:int}")
 async def handle_active_order_management(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle active order management callbacks"""
     query = update.callback_query
@@ -132,7 +136,7 @@ async def show_add_order_menu(query, group_id: int):
     cursor.execute("""
         SELECT o.id, o.user_id, o.username, o.bank, o.action, o.status
         FROM orders o
-        WHERE o.group_id = ? AND o.status != 'Завершено'
+        WHERE o.group_id = ? AND o.status NOT IN ('Завершено', 'Прострочено')
         AND o.id NOT IN (
             SELECT mao.order_id FROM manager_active_orders mao WHERE mao.group_id = ?
         )
@@ -250,6 +254,17 @@ async def quick_switch_order(update: Update, context: ContextTypes.DEFAULT_TYPE,
         return
 
     order_id, user_id, username, bank, action, status, order_group_id = order
+    moves_slot = order_group_id != group_id and status not in FINISHED_STATUSES
+
+    # An open order takes a slot in this group: refuse the move if the group is full
+    cursor.execute("SELECT id, load, capacity FROM manager_groups WHERE group_id=?", (group_id,))
+    target = cursor.fetchone()
+    if moves_slot and target and target[1] >= target[2]:
+        await update.message.reply_text(
+            f"❌ Група заповнена ({format_load(target[1], target[2])}). "
+            f"Завершіть одне із замовлень або збільште місткість через /group_capacity, щоб взяти #{order_id}."
+        )
+        return
 
     # Add to active orders and set as primary
     set_active_order_for_group(group_id, order_id, is_primary=True)
@@ -257,6 +272,12 @@ async def quick_switch_order(update: Update, context: ContextTypes.DEFAULT_TYPE,
     # Update order's group if different
     if order_group_id != group_id:
         cursor.execute("UPDATE orders SET group_id=? WHERE id=?", (group_id, order_id))
+        if moves_slot:
+            # the order's slot moves with it; the old group may take someone from the queue
+            if order_group_id:
+                release_group(order_group_id)
+            if target:
+                occupy_group(target[0])
         cursor.connection.commit()
         log_action(order_id, f"manager_{update.effective_user.id}", "reassign_group", f"from:{order_group_id} to:{group_id}")
 
@@ -9,9 +9,13 @@ from telegram import Update
 from telegram.ext import ContextTypes
 
 from db import create_order_form, cursor, log_action
+from rate_limiter import PRIORITY_BULK
 
 logger = logging.getLogger(__name__)
 
+# Form fan-out to groups must not delay replies to users
+BULK = {"priority": PRIORITY_BULK}
+
 async def generate_order_form(update: Update, context: ContextTypes.DEFAULT_TYPE, order_id: int):
     """Generate and send order form/questionnaire when order is completed"""
     try:
@@ -171,7 +175,8 @@ async def _send_form_to_groups(context: ContextTypes.DEFAULT_TYPE, order_id: int
                 await context.bot.send_message(
                     chat_id=ADMIN_GROUP_ID,
                     text=form_text,
-                    parse_mode='HTML'
+                    parse_mode='HTML',
+                    rate_limit_args=BULK,
                 )
 
                 # Send photos if any
@@ -180,7 +185,8 @@ async def _send_form_to_groups(context: ContextTypes.DEFAULT_TYPE, order_id: int
                         await context.bot.send_photo(
                             chat_id=ADMIN_GROUP_ID,
                             photo=photo['file_id'],
-                            caption=f"Order #{order_id} - Етап {photo['stage'] + 1}"
+                            caption=f"Order #{order_id} - Етап {photo['stage'] + 1}",
+                            rate_limit_args=BULK,
                         )
                     except Exception as e:
                         logger.warning(f"Failed to send photo to admin group: {e}")
@@ -194,7 +200,8 @@ async def _send_form_to_groups(context: ContextTypes.DEFAULT_TYPE, order_id: int
                 await context.bot.send_message(
                     chat_id=order_group_id,
                     text=f"📋 <b>Анкета завершеного замовлення</b>\n\n{form_text}",
-                    parse_mode='HTML'
+                    parse_mode='HTML',
+                    rate_limit_args=BULK,
                 )
             except Exception as e:
                 logger.warning(f"Failed to send form to manager group {order_group_id}: {e}")
@@ -207,7 +214,8 @@ async def _send_form_to_groups(context: ContextTypes.DEFAULT_TYPE, order_id: int
                     await context.bot.send_message(
                         chat_id=group_id,
                         text=f"📋 <b>Нова завершена анкета для {bank}</b>\n\n{form_text}",
-                        parse_mode='HTML'
+                        parse_mode='HTML',
+                        rate_limit_args=BULK,
                     )
                 except Exception as e:
                     logger.warning(f"Failed to send form to bank group {group_id}: {e}")
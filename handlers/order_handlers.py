@@ -1,7 +1,10 @@
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from db import cursor, is_admin
+from capacity_events import FINISHED_STATUSES
+from db import cursor, is_admin, log_action
+from handlers.callback_codec import ORDER_KEEPALIVE
+from handlers.callback_router import router
 
 
 def _fmt_bool(v) -> str:
@@ -22,6 +25,23 @@ async def myorders(update: Update, context: ContextTypes.DEFAULT_TYPE):
         lines.append(f"• #{oid} — {bank}/{action}, етап {stage + 1}, {status}, створено {created}")
     await update.message.reply_text("\n".join(lines))
 
+@router.route(ORDER_KEEPALIVE)
+async def order_keepalive(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """The client answered the inactivity warning (order_reaper.py); the logged action restarts the idle clock."""
+    query = update.callback_query
+    order_id = context.match["order_id"]
+    cursor.execute(f"SELECT 1 FROM orders WHERE id=? AND user_id=? AND status NOT IN ({','.join('?' * len(FINISHED_STATUSES))})",
+                   (order_id, query.from_user.id, *FINISHED_STATUSES))
+    if not cursor.fetchone():
+        await query.answer("Замовлення вже закрито.", show_alert=True)
+        return
+    log_action(order_id, "user", "keepalive")
+    await query.answer("✅ Замовлення залишається активним.")
+    try:
+        await query.edit_message_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+
 async def order_card(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if not is_admin(user_id):
@@ -1,19 +1,80 @@
 import asyncio
 import os
-from typing import List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, Update
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, ConversationHandler
 
-from db import ADMIN_GROUP_ID, conn, cursor, logger
-from states import INSTRUCTIONS, MANAGER_MESSAGE, REJECT_REASON, find_age_requirement, get_required_photos, user_states
-
-# Debounce/aggregation for photo albums and series
+from capacity_events import FINISHED_STATUSES
+from db import ADMIN_GROUP_ID, conn, cursor, get_stage_progress, log_action, logger, set_stage_required
+from handlers.album_aggregator import AlbumAggregator
+from handlers.callback_codec import (
+    PHOTO_APPROVE,
+    PHOTO_FINISH,
+    PHOTO_MESSAGE,
+    PHOTO_REJECT,
+    PHOTO_REJECT_TEMPLATE,
+    PHOTO_SKIP_STAGE,
+    REVIEW_APPLY,
+    REVIEW_APPROVE_ALL,
+    REVIEW_BACK,
+    REVIEW_REASON,
+    REVIEW_REASON_CUSTOM,
+    REVIEW_REJECT_ALL,
+    REVIEW_TOGGLE,
+)
+from handlers.callback_router import router
+from handlers.evaluation_coalescer import EvaluationCoalescer
+from handlers.photo_hash import (
+    PHASH_ENABLED,
+    PHASH_INDEX_PHOTOS,
+    PHASH_MAX_DISTANCE,
+    PHASH_WORKERS,
+    QUALITY_ENABLED,
+    BKTree,
+    PhotoHasher,
+    from_signed64,
+    to_signed64,
+)
+from handlers.photo_quality import assess_quality
+from outbox import enqueue_message, outbox_dispatcher
+from queue_eta import (
+    format_status,
+    queue_estimator,
+    queue_status_notifier,
+    record_service_time,
+    remember_status_message,
+)
+from queue_policy import queue_policy
+from queue_scheduler import FreeGroup, QueueEntry, occupy_group, queue_scheduler, release_group
+from rate_limiter import PRIORITY_NORMAL
+from states import (
+    INSTRUCTIONS,
+    MANAGER_MESSAGE,
+    REJECT_REASON,
+    find_age_requirement,
+    get_quality_thresholds,
+    get_required_photos,
+    user_states,
+)
+
+# Debounce/aggregation for photo albums and series.
+# Upper bound of the idle window; the actual window is learned from inter-photo gaps.
 DEBOUNCE_SECONDS = 1.8
-# album_key -> list[Tuple[file_id, file_unique_id]]
-pending_albums: dict[Tuple[int, int, int, int], List[Tuple[str, str]]] = {}
-# album_key -> asyncio.Task
-pending_timers: dict[Tuple[int, int, int, int], asyncio.Task] = {}
+
+# How submissions are posted to the admin group:
+# album     — one media group + one control message with a consolidated keyboard;
+#             rejections get their reason from the same templates (or typed text) as per_photo
+# per_photo — every photo separately with its own moderation keyboard (legacy)
+REVIEW_MODE = os.getenv("REVIEW_MODE", "album").strip().lower()
+# Fallback reason of a rejection that was applied without one
+REVIEW_REJECT_REASON = "Відхилено менеджером"
+# Review posts yield to direct replies to users when the outbound scheduler is saturated
+_REVIEW_PRIORITY = {"priority": PRIORITY_NORMAL}
+
+# Quiet window after the last moderation decision before the stage is evaluated
+STAGE_EVAL_QUIET_SECONDS = float(os.getenv("STAGE_EVAL_QUIET_SECONDS", "1.0"))
 
 # Шаблони причин відхилення
 REJECT_TEMPLATES = {
@@ -22,6 +83,12 @@ REJECT_TEMPLATES = {
     "no_name": "Відсутні ПІБ/ключові поля",
     "crop": "Скрін обрізаний — частина інформації відсутня",
 }
+REJECT_TEMPLATE_BUTTONS = {
+    "blurry": "🔍 Розмито",
+    "wrong_screen": "🧭 Не той екран",
+    "no_name": "🪪 Немає ПІБ",
+    "crop": "✂️ Обрізано",
+}
 
 
 # ============= Core handlers (photos review flow) =============
@@ -54,35 +121,34 @@ async def handle_photos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     media_group_id = getattr(msg, "media_group_id", None)
     group_discriminator = media_group_id if media_group_id is not None else msg.message_id
     album_key = (user_id, order_id, current_stage_db, group_discriminator)
-    album_list = pending_albums.setdefault(album_key, [])
-    if file_unique_id not in [fu for _, fu in album_list]:
-        album_list.append((file_id, file_unique_id))
-    prev_timer = pending_timers.get(album_key)
-    if prev_timer and not prev_timer.done():
-        prev_timer.cancel()
-    pending_timers[album_key] = context.application.create_task(
-        _debounced_send_album(album_key, username, context)
-    )
+    expected = None
+    if media_group_id is not None:
+        expected = _expected_album_size(state, order_id, current_stage_db)
+    album_aggregator.add(album_key, file_id, file_unique_id, username, context.bot,
+                         in_album=media_group_id is not None, expected=expected)
     try:
         await msg.reply_text("✅ Ваші скріни на перевірці. Очікуйте рішення менеджера.")
     except Exception:
         pass
 
 
-async def _debounced_send_album(album_key: Tuple[int, int, int, int], username: str, context: ContextTypes.DEFAULT_TYPE):
-    """After debounce, persist album photos, link replacements for rejected ones, and send to managers group."""
-    try:
-        await asyncio.sleep(DEBOUNCE_SECONDS)
-    except asyncio.CancelledError:
-        return
+def _expected_album_size(state: dict, order_id: int, stage_db: int) -> Optional[int]:
+    """How many photos are still missing for the stage, so the album can be closed as soon as they arrived."""
+    required = get_required_photos(state.get("bank"), state.get("action"), stage_db - 1)
+    if not required:
+        return None
+    progress = get_stage_progress(order_id, stage_db)
+    remaining = required - (progress[0] + progress[1] if progress else 0)
+    return remaining if remaining > 0 else None
 
-    user_id, order_id, stage_db, _ = album_key
-    # Pull the album from memory
-    photos = pending_albums.pop(album_key, [])
-    pending_timers.pop(album_key, None)
 
+async def _flush_album(album_key: Tuple[int, int, int, int], photos: List[Tuple[str, str]], username: str, bot: Any):
+    """After debounce, persist album photos, link replacements for rejected ones, and send to managers group."""
+    user_id, order_id, stage_db, discriminator = album_key
     if not photos:
         return
+    # a Telegram album (media_group_id is a string; single photos are keyed by their int message_id)
+    media_group_id = discriminator if isinstance(discriminator, str) else None
 
     # Prepare DB state
     # 1) Get list of currently active rejected photos for this order/stage (to pair with replacements)
@@ -144,6 +210,11 @@ async def _debounced_send_album(album_key: Tuple[int, int, int, int], username:
         conn.commit()
         return
 
+    # Keep required_photos next to the stage counters, so evaluation is a single-row read
+    st = user_states.get(user_id, {})
+    if st.get("bank") and st.get("action") is not None:
+        set_stage_required(order_id, stage_db, get_required_photos(st["bank"], st["action"], stage_db - 1))
+
     # Update order status to "waiting for review"
     try:
         cursor.execute(
@@ -155,26 +226,206 @@ async def _debounced_send_album(album_key: Tuple[int, int, int, int], username:
 
     conn.commit()
 
+    notes, auto_rejected = await _screen_photos(bot, user_id, order_id, stage_db, photos, inserted)
+    if auto_rejected:
+        await _notify_auto_rejected(bot, user_id, auto_rejected)
+        inserted = [(fid, pid) for fid, pid in inserted if pid not in auto_rejected]
+        if not inserted:
+            return
+
+    if REVIEW_MODE == "per_photo":
+        await _send_per_photo_review(bot, user_id, stage_db, username, inserted, notes)
+    else:
+        await _send_album_review(bot, user_id, order_id, stage_db, inserted, media_group_id)
+
+
+# ============= Near-duplicate detection (perceptual hash) =============
+
+photo_hasher = PhotoHasher(PHASH_WORKERS)
+# BK-tree over the pHashes of the last PHASH_INDEX_PHOTOS photos, items are (photo_db_id, order_id);
+# loaded lazily from order_photos, new photos are added as they are screened
+_phash_index: Optional[BKTree] = None
+
+
+def _duplicate_index() -> BKTree:
+    global _phash_index
+    if _phash_index is not None and _phash_index.size > PHASH_INDEX_PHOTOS * 3 // 2:
+        _phash_index = None  # a BK-tree can't drop old photos; reload the recent window
+    if _phash_index is None:
+        index = BKTree()
+        cursor.execute("SELECT MAX(id) FROM order_photos")
+        newest = cursor.fetchone()[0] or 0
+        cursor.execute(
+            "SELECT id, order_id, phash FROM order_photos WHERE id > ? AND phash IS NOT NULL",
+            (newest - PHASH_INDEX_PHOTOS,),
+        )
+        for pid, oid, value in cursor.fetchall():
+            index.add(from_signed64(value), (pid, oid))
+        _phash_index = index
+        logger.info("Perceptual hash index loaded: %d photos", index.size)
+    return _phash_index
+
+
+def _find_duplicate(value: int, order_id: int) -> Optional[Tuple[int, int, int]]:
+    """
+    Closest photo of another order as (photo_db_id, order_id, distance); exact hits come from the
+    indexed column. Photos of the same order are skipped: resubmitting a rejected screenshot isn't reuse.
+    """
+    cursor.execute(
+        "SELECT id, order_id FROM order_photos WHERE phash=? AND order_id!=? ORDER BY id ASC LIMIT 1",
+        (to_signed64(value), order_id),
+    )
+    exact = cursor.fetchone()
+    if exact:
+        return exact[0], exact[1], 0
+    for dist, (pid, oid) in _duplicate_index().search(value, PHASH_MAX_DISTANCE):
+        if oid != order_id:
+            return pid, oid, dist
+    return None
+
+
+async def _screen_photos(bot: Any, user_id: int, order_id: int, stage_db: int, photos: List[Tuple[str, str]],
+                         inserted: List[Tuple[str, int]]) -> Tuple[Dict[int, List[str]], Dict[int, str]]:
+    """
+    Analyze newly submitted photos once (perceptual hash + blur/crop metrics) in the process pool.
+    Stores phash / dup_of / quality_note and auto-rejects photos that clearly fail the quality check.
+    Returns (caption notes per photo_db_id, auto-rejected photo_db_id -> reason).
+    """
+    if not (PHASH_ENABLED or QUALITY_ENABLED) or not inserted:
+        return {}, {}
+    unique_ids = dict(photos)
+    marks = ",".join("?" * len(inserted))
+    cursor.execute(
+        f"SELECT id FROM order_photos WHERE id IN ({marks}) AND phash IS NOT NULL",
+        [pid for _, pid in inserted],
+    )
+    already_analyzed = {row[0] for row in cursor.fetchall()}
+    todo = [(fid, pid) for fid, pid in inserted if pid not in already_analyzed]
+    if not todo:
+        return {}, {}
+
+    results = await asyncio.gather(
+        *(photo_hasher.analyze_telegram_file(bot, fid, unique_ids.get(fid, fid)) for fid, _ in todo)
+    )
+    st = user_states.get(user_id, {})
+    thresholds = get_quality_thresholds(st.get("bank"), st.get("action"), stage_db - 1)
+    notes: Dict[int, List[str]] = {}
+    auto_rejected: Dict[int, str] = {}
+    index = _duplicate_index() if PHASH_ENABLED else None
+    for (_, pid), analysis in zip(todo, results):
+        if analysis is None:
+            continue
+        value = analysis.phash
+        match = _find_duplicate(value, order_id) if index is not None else None
+        quality_note = None
+        if QUALITY_ENABLED:
+            verdict = assess_quality(analysis.quality, thresholds)
+            if verdict.issue:
+                quality_note = f"{verdict.issue}:{verdict.confidence:.2f}"
+            if verdict.auto_reject:
+                auto_rejected[pid] = REJECT_TEMPLATES.get(verdict.issue, "Відхилено (шаблон)")
+        cursor.execute(
+            "UPDATE order_photos SET phash=?, dup_of=?, quality_note=? WHERE id=?",
+            (to_signed64(value), match[0] if match else None, quality_note, pid),
+        )
+        if pid in auto_rejected:
+            cursor.execute(
+                "UPDATE order_photos SET confirmed=-1, reason=? WHERE id=? AND confirmed=0",
+                (auto_rejected[pid], pid),
+            )
+        if index is not None:
+            index.add(value, (pid, order_id))
+        flags = _photo_flags(match[0] if match else None, match[1] if match else None, quality_note)
+        if flags:
+            notes[pid] = flags
+    conn.commit()
+    if notes:
+        logger.info("Screening flags for order %s: %s (auto-rejected: %s)", order_id, notes, list(auto_rejected))
+    return notes, auto_rejected
+
+
+_QUALITY_LABELS = {"blurry": "розмито", "crop": "обрізано"}
+
+
+def _photo_flags(dup_photo_id: Optional[int], dup_order_id: Optional[int], quality_note: Optional[str]) -> List[str]:
+    """Caption lines for automatic checks: near-duplicate and quality pre-screening."""
+    flags = []
+    if dup_photo_id:
+        flags.append(f"⚠️ Схожий на скрін ID {dup_photo_id} (замовлення #{dup_order_id})")
+    if quality_note:
+        issue, _, confidence = quality_note.partition(":")
+        try:
+            percent = f" ({float(confidence):.0%})"
+        except ValueError:
+            percent = ""
+        flags.append(f"🤖 Можливо {_QUALITY_LABELS.get(issue, issue)}{percent}")
+    return flags
+
+
+async def _notify_auto_rejected(bot: Any, user_id: int, auto_rejected: Dict[int, str]):
+    lines = [f"{i}. Скрін ID {pid}: {reason}" for i, (pid, reason) in enumerate(auto_rejected.items(), start=1)]
+    try:
+        await bot.send_message(
+            chat_id=user_id,
+            text="❌ Деякі скріни не пройшли автоматичну перевірку якості:\n" + "\n".join(lines)
+                 + "\n\nНадішліть, будь ласка, чіткі та повні скріни на заміну.",
+        )
+    except Exception as e:
+        logger.warning("Не вдалося повідомити користувача %s про автовідхилення: %s", user_id, e)
+
+
+def _stage_buttons(user_id: int, stage_db: int) -> List[InlineKeyboardButton]:
+    """Skip the stage / finish the order / message the client; shared by both review modes."""
+    return [
+        InlineKeyboardButton("↪️ Skip етап", callback_data=PHOTO_SKIP_STAGE.encode(user_id=user_id, stage=stage_db)),
+        InlineKeyboardButton("🏁 Finish замовлення", callback_data=PHOTO_FINISH.encode(user_id=user_id)),
+        InlineKeyboardButton("💬 Msg користувачу", callback_data=PHOTO_MESSAGE.encode(user_id=user_id)),
+    ]
+
+
+async def _edit_control(query: Any, text: str, markup: Optional[InlineKeyboardMarkup] = None) -> None:
+    """Edit the message a moderation button belongs to: a photo caption or a text control message."""
+    try:
+        if query.message and query.message.photo:
+            await query.edit_message_caption(caption=text, parse_mode="HTML", reply_markup=markup)
+        else:
+            await query.edit_message_text(text=text, parse_mode="HTML", reply_markup=markup)
+    except Exception as e:
+        logger.debug("Moderation message not edited: %s", e)
+
+
+async def _report_on_control(query: Any, text: str) -> None:
+    """Outcome of a moderation button: under the album review it was pressed on, else instead of the caption."""
+    message = query.message
+    review_id = None
+    if message is not None:
+        cursor.execute(
+            "SELECT id FROM photo_reviews WHERE chat_id=? AND message_id=?", (message.chat_id, message.message_id)
+        )
+        row = cursor.fetchone()
+        review_id = row[0] if row else None
+    if review_id is None:
+        await _edit_control(query, text)
+        return
+    review_text, markup = _render_review(review_id)
+    await _edit_control(query, f"{review_text}\n\n{text}", markup)
+
+
+async def _send_per_photo_review(bot: Any, user_id: int, stage_db: int, username: str,
+                                 inserted: List[Tuple[str, int]],
+                                 notes: Optional[Dict[int, List[str]]] = None):
     # Клавіатура модерації з шаблонами, skip/finish/msg
     def moderation_keyboard(u_id: int, p_id: int, stage: int):
-        tmpl_row = [
-            InlineKeyboardButton("🔍 Розмито", callback_data=f"rejtmpl_{u_id}_{p_id}_blurry"),
-            InlineKeyboardButton("🧭 Не той екран", callback_data=f"rejtmpl_{u_id}_{p_id}_wrong_screen"),
-        ]
-        tmpl_row2 = [
-            InlineKeyboardButton("🪪 Немає ПІБ", callback_data=f"rejtmpl_{u_id}_{p_id}_no_name"),
-            InlineKeyboardButton("✂️ Обрізано", callback_data=f"rejtmpl_{u_id}_{p_id}_crop"),
+        tmpl = [
+            InlineKeyboardButton(label, callback_data=PHOTO_REJECT_TEMPLATE.encode(user_id=u_id, photo_id=p_id, key=key))
+            for key, label in REJECT_TEMPLATE_BUTTONS.items()
         ]
+        tmpl_row, tmpl_row2 = tmpl[:2], tmpl[2:]
         action_row = [
-            InlineKeyboardButton("✅ Підтвердити", callback_data=f"approve_{u_id}_{p_id}"),
-            InlineKeyboardButton("❌ Інше (ввести)", callback_data=f"reject_{u_id}_{p_id}"),
+            InlineKeyboardButton("✅ Підтвердити", callback_data=PHOTO_APPROVE.encode(user_id=u_id, photo_id=p_id)),
+            InlineKeyboardButton("❌ Інше (ввести)", callback_data=PHOTO_REJECT.encode(user_id=u_id, photo_id=p_id)),
         ]
-        stage_row = [
-            InlineKeyboardButton("↪️ Skip етап", callback_data=f"skip_{u_id}_{stage}"),
-            InlineKeyboardButton("🏁 Finish замовлення", callback_data=f"finish_{u_id}"),
-            InlineKeyboardButton("💬 Msg користувачу", callback_data=f"msg_{u_id}"),
-        ]
-        return InlineKeyboardMarkup([action_row, tmpl_row, tmpl_row2, stage_row])
+        return InlineKeyboardMarkup([action_row, tmpl_row, tmpl_row2, _stage_buttons(u_id, stage)])
 
     # Надсилаємо кожне фото з кнопками
     total_photos = len(inserted)
@@ -191,92 +442,382 @@ async def _debounced_send_album(album_key: Tuple[int, int, int, int], username:
             f"📍 Етап: {stage_db}\n"
             f"🆔 ID скріну: {photo_db_id}"
         )
+        for note in (notes or {}).get(photo_db_id, []):
+            caption += "\n" + note
         try:
-            await context.bot.send_photo(
+            await bot.send_photo(
                 chat_id=ADMIN_GROUP_ID,
                 photo=file_id,
                 caption=caption,
                 parse_mode="HTML",
                 reply_markup=moderation_keyboard(user_id, photo_db_id, stage_db),
+                rate_limit_args=_REVIEW_PRIORITY,
             )
         except Exception as e:
             logger.warning("Не вдалося переслати фото в адмін-групу: %s", e)
 
 
-async def handle_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# ============= Album review (one media group + one control message) =============
+
+_DECISION_ICONS = {0: "⏳", 1: "✅", -1: "❌"}
+
+
+def _create_review(user_id: int, order_id: int, stage_db: int, photo_ids: List[int],
+                   media_group_id: Optional[str] = None) -> int:
+    cursor.execute(
+        "INSERT INTO photo_reviews (user_id, order_id, stage, media_group_id) VALUES (?, ?, ?, ?)",
+        (user_id, order_id, stage_db, media_group_id),
+    )
+    review_id = cursor.lastrowid
+    _attach_to_review(review_id, photo_ids)
+    return review_id
+
+
+def _attach_to_review(review_id: int, photo_ids: List[int]) -> None:
+    cursor.executemany(
+        "UPDATE order_photos SET review_id=?, review_draft=NULL WHERE id=?",
+        [(review_id, pid) for pid in photo_ids],
+    )
+    conn.commit()
+
+
+def _load_review(review_id: int) -> Optional[Tuple[int, int, int]]:
+    """(user_id, order_id, stage_db) of a review or None."""
+    cursor.execute("SELECT user_id, order_id, stage FROM photo_reviews WHERE id=?", (review_id,))
+    return cursor.fetchone()
+
+
+def _render_review(review_id: int) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Control message text and keyboard reflecting current decisions and drafts."""
+    cursor.execute(
+        "SELECT r.user_id, r.stage, o.username, o.bank, o.action FROM photo_reviews r "
+        "LEFT JOIN orders o ON o.id = r.order_id WHERE r.id=?",
+        (review_id,),
+    )
+    row = cursor.fetchone()
+    if not row:
+        return "⚠️ Перевірку не знайдено.", None
+    user_id, stage_db, username, bank, action = row
+    cursor.execute(
+        "SELECT p.id, p.confirmed, p.review_draft, COALESCE(p.reason, ''), p.dup_of, d.order_id, p.quality_note "
+        "FROM order_photos p LEFT JOIN order_photos d ON d.id = p.dup_of "
+        "WHERE p.review_id=? ORDER BY p.id ASC",
+        (review_id,),
+    )
+    photos = cursor.fetchall()
+
+    lines = [
+        f"📌 <b>Перевірка скрінів ({len(photos)} шт.)</b>",
+        f"👤 Користувач: @{username or 'Без_ніка'} (ID: {user_id})",
+        f"🏦 Банк: {bank or '—'}",
+        f"🔄 Операція: {action or '—'}",
+        f"📍 Етап: {stage_db}",
+        "",
+    ]
+    toggles = []
+    drafts = 0
+    for idx, (pid, confirmed, draft, reason, dup_of, dup_order_id, quality_note) in enumerate(photos, start=1):
+        if confirmed != 0:
+            status = _DECISION_ICONS[confirmed] + (f" {reason}" if confirmed == -1 and reason else "")
+            label = f"{idx} {_DECISION_ICONS[confirmed]}"
+        elif draft in (1, -1):
+            drafts += 1
+            status = f"⏳ → {_DECISION_ICONS[draft]} (не застосовано)"
+            label = f"{idx} → {_DECISION_ICONS[draft]}"
+        else:
+            status = "⏳ очікує"
+            label = f"{idx} ⏳"
+        lines.append(f"{idx}. 🆔 {pid} — {status}")
+        lines.extend("    " + flag for flag in _photo_flags(dup_of, dup_order_id, quality_note))
+        toggles.append(InlineKeyboardButton(label, callback_data=REVIEW_TOGGLE.encode(review_id=review_id, photo_id=pid)))
+
+    if all(p[1] != 0 for p in photos):
+        return "\n".join(lines), None
+
+    keyboard = [toggles[i:i + 5] for i in range(0, len(toggles), 5)]
+    keyboard.append([
+        InlineKeyboardButton("✅ Підтвердити всі", callback_data=REVIEW_APPROVE_ALL.encode(review_id=review_id)),
+        InlineKeyboardButton("❌ Відхилити всі", callback_data=REVIEW_REJECT_ALL.encode(review_id=review_id)),
+    ])
+    keyboard.append(_stage_buttons(user_id, stage_db))
+    if drafts:
+        keyboard.append([InlineKeyboardButton(f"💾 Застосувати ({drafts})", callback_data=REVIEW_APPLY.encode(review_id=review_id))])
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+
+def _render_reason_picker(review_id: int, scope: str) -> Tuple[str, InlineKeyboardMarkup]:
+    """Control message asking for the reason of the photos about to be rejected."""
+    text, _ = _render_review(review_id)
+    count = _rejections_pending(review_id, scope)
+    templates = [
+        InlineKeyboardButton(label, callback_data=REVIEW_REASON.encode(review_id=review_id, scope=scope, key=key))
+        for key, label in REJECT_TEMPLATE_BUTTONS.items()
+    ]
+    keyboard = [templates[i:i + 2] for i in range(0, len(templates), 2)]
+    keyboard.append([
+        InlineKeyboardButton("✍️ Інша причина", callback_data=REVIEW_REASON_CUSTOM.encode(review_id=review_id, scope=scope)),
+        InlineKeyboardButton("🔙 Назад", callback_data=REVIEW_BACK.encode(review_id=review_id)),
+    ])
+    return f"{text}\n\n❌ Причина відхилення ({count} скр.):", InlineKeyboardMarkup(keyboard)
+
+
+def _rejections_pending(review_id: int, scope: str) -> int:
+    """Photos a rejection of `scope` would reject: every pending one ("all") or the reject drafts ("drafts")."""
+    if scope == "all":
+        cursor.execute("SELECT COUNT(*) FROM order_photos WHERE review_id=? AND confirmed=0", (review_id,))
+    else:
+        cursor.execute(
+            "SELECT COUNT(*) FROM order_photos WHERE review_id=? AND confirmed=0 AND review_draft=-1", (review_id,)
+        )
+    return cursor.fetchone()[0]
+
+
+def _toggle_review_draft(review_id: int, photo_db_id: int) -> bool:
+    """Cycle the draft decision of a pending photo: none -> approve -> reject -> none."""
+    cursor.execute(
+        "UPDATE order_photos SET review_draft = CASE review_draft WHEN 1 THEN -1 WHEN -1 THEN NULL ELSE 1 END "
+        "WHERE id=? AND review_id=? AND confirmed=0",
+        (photo_db_id, review_id),
+    )
+    changed = cursor.rowcount > 0
+    conn.commit()
+    return changed
+
+
+def _apply_review_decisions(review_id: int, decision: Optional[int] = None, reason: str = REVIEW_REJECT_REASON) -> int:
     """
-    Inline buttons in the admin group:
-    - approve_{user_id}_{photo_db_id}
-    - reject_{user_id}_{photo_db_id}
-    - rejtmpl_{user_id}_{photo_db_id}_{key}
-    - skip_{user_id}_{stage_db}
-    - finish_{user_id}
-    - msg_{user_id}
+    Apply decisions of a review in one transaction.
+    decision=None applies the toggled drafts; 1 / -1 approves / rejects every photo still pending.
+    Rejected photos get `reason`. Returns the number of photos decided.
     """
-    query = update.callback_query
-    await query.answer()
-    raw = query.data
+    try:
+        if decision is None:
+            cursor.execute(
+                "UPDATE order_photos SET confirmed=review_draft, "
+                "reason=CASE WHEN review_draft=-1 THEN ? ELSE reason END, review_draft=NULL "
+                "WHERE review_id=? AND confirmed=0 AND review_draft IN (1, -1)",
+                (reason, review_id),
+            )
+        else:
+            cursor.execute(
+                "UPDATE order_photos SET confirmed=?, reason=?, review_draft=NULL "
+                "WHERE review_id=? AND confirmed=0",
+                (decision, reason if decision == -1 else None, review_id),
+            )
+        changed = cursor.rowcount
+        conn.commit()
+        return changed
+    except Exception as e:
+        logger.warning("Review %s: failed to apply decisions: %s", review_id, e)
+        conn.rollback()
+        return 0
 
+
+async def _send_album_review(bot: Any, user_id: int, order_id: int, stage_db: int, inserted: List[Tuple[str, int]],
+                             media_group_id: Optional[str] = None):
+    if media_group_id is not None:
+        # photos of an album that arrived after it was closed as complete join its posted review
+        cursor.execute(
+            "SELECT id, chat_id, message_id FROM photo_reviews "
+            "WHERE order_id=? AND stage=? AND media_group_id=? AND message_id IS NOT NULL ORDER BY id DESC LIMIT 1",
+            (order_id, stage_db, media_group_id),
+        )
+        row = cursor.fetchone()
+        if row:
+            await _extend_album_review(bot, *row, inserted)
+            return
+    review_id = _create_review(user_id, order_id, stage_db, [pid for _, pid in inserted], media_group_id)
+    text, markup = _render_review(review_id)
     try:
-        parts = raw.split("_")
-        action = parts[0]
-    except Exception:
+        if len(inserted) == 1:
+            # send_media_group needs 2..10 items; a single photo carries the controls itself
+            control = await bot.send_photo(
+                chat_id=ADMIN_GROUP_ID, photo=inserted[0][0], caption=text, parse_mode="HTML", reply_markup=markup,
+                rate_limit_args=_REVIEW_PRIORITY,
+            )
+        else:
+            media = [
+                InputMediaPhoto(media=file_id, caption=f"{idx}/{len(inserted)} · ID {pid}")
+                for idx, (file_id, pid) in enumerate(inserted, start=1)
+            ]
+            await bot.send_media_group(chat_id=ADMIN_GROUP_ID, media=media, rate_limit_args=_REVIEW_PRIORITY)
+            control = await bot.send_message(
+                chat_id=ADMIN_GROUP_ID, text=text, parse_mode="HTML", reply_markup=markup,
+                rate_limit_args=_REVIEW_PRIORITY,
+            )
+    except Exception as e:
+        logger.warning("Не вдалося переслати альбом в адмін-групу: %s", e)
+        return
+    cursor.execute(
+        "UPDATE photo_reviews SET chat_id=?, message_id=? WHERE id=?",
+        (control.chat_id, control.message_id, review_id),
+    )
+    conn.commit()
+
+
+async def _extend_album_review(bot: Any, review_id: int, chat_id: int, message_id: int,
+                               inserted: List[Tuple[str, int]]):
+    """Late photos of a posted album: added to its review, posted as a reply to the control message."""
+    _attach_to_review(review_id, [pid for _, pid in inserted])
+    try:
+        if len(inserted) == 1:
+            await bot.send_photo(
+                chat_id=chat_id, photo=inserted[0][0], caption=f"+ ID {inserted[0][1]}",
+                reply_to_message_id=message_id, rate_limit_args=_REVIEW_PRIORITY,
+            )
+        else:
+            media = [InputMediaPhoto(media=file_id, caption=f"+ ID {pid}") for file_id, pid in inserted]
+            await bot.send_media_group(
+                chat_id=chat_id, media=media, reply_to_message_id=message_id, rate_limit_args=_REVIEW_PRIORITY,
+            )
+    except Exception as e:
+        logger.warning("Не вдалося переслати скріни альбому в адмін-групу: %s", e)
+    text, markup = _render_review(review_id)
+    try:
+        await bot.edit_message_text(
+            chat_id=chat_id, message_id=message_id, text=text, parse_mode="HTML", reply_markup=markup,
+        )
+    except BadRequest:
+        # a single-photo review carries its controls in the caption
         try:
-            await query.edit_message_caption(caption="⚠️ Некоректні дані.")
-        except Exception:
-            pass
-        return ConversationHandler.END
+            await bot.edit_message_caption(
+                chat_id=chat_id, message_id=message_id, caption=text, parse_mode="HTML", reply_markup=markup,
+            )
+        except Exception as e:
+            logger.debug("Review %s: control message not edited: %s", review_id, e)
+    except Exception as e:
+        logger.debug("Review %s: control message not edited: %s", review_id, e)
+
+
+@router.route(REVIEW_TOGGLE, REVIEW_APPROVE_ALL, REVIEW_REJECT_ALL, REVIEW_APPLY,
+              REVIEW_REASON, REVIEW_REASON_CUSTOM, REVIEW_BACK)
+async def handle_review_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Consolidated album review keyboard (payloads in handlers/callback_codec.py):
+    - review_toggle — toggle draft decision of one photo
+    - review_approve_all — approve every pending photo
+    - review_reject_all / review_apply — reject every pending photo / apply toggled drafts;
+      when something gets rejected, the reason is picked first:
+    - review_reason — a REJECT_TEMPLATES reason, review_reason_custom — typed in the chat
+      (see moderation_text_input), review_back — back to the review
+    """
+    query = update.callback_query
+    op = context.match.name
+    review_id, photo_db_id = context.match["review_id"], context.match.get("photo_id")
+
+    review = _load_review(review_id)
+    if not review:
+        await query.answer("⚠️ Перевірку не знайдено.")
+        return
+    user_id, order_id, stage_db = review
+
+    if op in ("review_reject_all", "review_apply"):
+        scope = "all" if op == "review_reject_all" else "drafts"
+        if _rejections_pending(review_id, scope):
+            await query.answer()
+            await _edit_control(query, *_render_reason_picker(review_id, scope))
+            return
+    if op == "review_reason_custom":
+        _set_pending_input(context, review_reason={
+            "review_id": review_id, "scope": context.match["scope"],
+            "chat_id": query.message.chat_id, "message_id": query.message.message_id,
+            "caption": bool(query.message.photo),
+        })
+        await query.answer()
+        text, _ = _render_review(review_id)
+        back = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data=REVIEW_BACK.encode(review_id=review_id))]])
+        await _edit_control(query, f"{text}\n\n✍️ Введіть у чаті причину відхилення.", back)
+        return
+
+    decided = 0
+    if op == "review_toggle":
+        if not _toggle_review_draft(review_id, photo_db_id):
+            await query.answer("Рішення по цьому скріну вже прийнято.")
+            return
+        await query.answer()
+    elif op in ("review_approve_all", "review_apply", "review_reason"):
+        if op == "review_reason":
+            decision = -1 if context.match["scope"] == "all" else None
+            reason = REJECT_TEMPLATES.get(context.match["key"], "Відхилено (шаблон)")
+        else:
+            decision, reason = (1 if op == "review_approve_all" else None), REVIEW_REJECT_REASON
+        decided = _apply_review_decisions(review_id, decision, reason)
+        await query.answer(f"Застосовано: {decided}" if decided else "Немає змін.")
+        if decided:
+            log_action(order_id, f"manager:{query.from_user.id}", "photo_review", f"{op}:{review_id}:{decided}")
+    else:
+        # review_back, or nothing left to reject
+        pending = context.user_data.get("review_reason")
+        if pending and pending["review_id"] == review_id:
+            context.user_data.pop("review_reason", None)
+        await query.answer(None if op == "review_back" else "Немає змін.")
+
+    await _edit_control(query, *_render_review(review_id))
+
+    if decided and _ensure_user_state(user_id):
+        stage_evaluator.mark_dirty(user_id, order_id, stage_db, context)
 
-    # Розбір параметрів по діях
+
+async def review_reason_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Reason typed after review_reason_custom: rejects the photos and restores the control message."""
+    pending = context.user_data.pop("review_reason", None)
+    reason = update.message.text.strip() if update.message and update.message.text else ""
+    review = _load_review(pending["review_id"]) if pending else None
+    if not review:
+        return
+    user_id, order_id, stage_db = review
+    review_id = pending["review_id"]
+    decided = _apply_review_decisions(review_id, -1 if pending["scope"] == "all" else None, reason or "Не вказано")
+    if decided:
+        log_action(order_id, f"manager:{update.effective_user.id}", "photo_review",
+                   f"review_reason_custom:{review_id}:{decided}")
+    text, markup = _render_review(review_id)
     try:
-        if action in ("approve", "reject"):
-            _, str_user_id, str_photo_db_id = parts
-            user_id = int(str_user_id)
-            photo_db_id = int(str_photo_db_id)
-        elif action == "rejtmpl":
-            _, str_user_id, str_photo_db_id, key = parts
-            user_id = int(str_user_id)
-            photo_db_id = int(str_photo_db_id)
-        elif action == "skip":
-            _, str_user_id, str_stage = parts
-            user_id = int(str_user_id)
-            stage_db = int(str_stage)
-        elif action in ("finish", "msg"):
-            _, str_user_id = parts
-            user_id = int(str_user_id)
+        if pending["caption"]:
+            await context.bot.edit_message_caption(
+                chat_id=pending["chat_id"], message_id=pending["message_id"],
+                caption=text, parse_mode="HTML", reply_markup=markup,
+            )
         else:
-            raise ValueError("Unknown action")
+            await context.bot.edit_message_text(
+                chat_id=pending["chat_id"], message_id=pending["message_id"],
+                text=text, parse_mode="HTML", reply_markup=markup,
+            )
+    except Exception as e:
+        logger.debug("Review %s: control message not edited: %s", review_id, e)
+    try:
+        await update.message.reply_text(f"❌ Відхилено: {decided}. Причину збережено.")
     except Exception:
-        try:
-            await query.edit_message_caption(caption="⚠️ Формат кнопки невірний.")
-        except Exception:
-            pass
-        return ConversationHandler.END
+        pass
+    if decided and _ensure_user_state(user_id):
+        stage_evaluator.mark_dirty(user_id, order_id, stage_db, context)
+
+
+# One scheduler for all pending albums (see handlers/album_aggregator.py)
+album_aggregator = AlbumAggregator(_flush_album, DEBOUNCE_SECONDS)
+
+
+@router.route(PHOTO_APPROVE, PHOTO_REJECT, PHOTO_REJECT_TEMPLATE, PHOTO_SKIP_STAGE, PHOTO_FINISH, PHOTO_MESSAGE)
+async def handle_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Per-photo moderation buttons in the admin group (payloads in handlers/callback_codec.py):
+    approve / reject / rejtmpl (template key) of one photo, skip of a stage,
+    finish of the order and msg to the user (the last three also under album reviews).
+    Text asked for by reject / msg arrives through moderation_text_input.
+    """
+    query = update.callback_query
+    await query.answer()
+
+    action = context.match.name
+    user_id = context.match["user_id"]
+    photo_db_id = context.match.get("photo_id")
+    key = context.match.get("key")
+    stage_db = context.match.get("stage")
 
     # Ensure local cache of user's state exists
-    state = user_states.get(user_id)
-    if not state:
-        cursor.execute(
-            "SELECT id, username, bank, action, stage FROM orders WHERE user_id=? ORDER BY id DESC LIMIT 1",
-            (user_id,),
-        )
-        r = cursor.fetchone()
-        if r:
-            order_id, username, bank, action_db, stage0 = r[0], (r[1] or "Без_ніка"), r[2], r[3], r[4]
-            user_states[user_id] = {
-                "order_id": order_id,
-                "bank": bank,
-                "action": action_db,
-                "stage": stage0,
-                "age_required": find_age_requirement(bank, action_db),
-                "username": username,
-            }
-        else:
-            try:
-                await query.edit_message_caption(caption="⚠️ Користувача не знайдено в сесії")
-            except Exception:
-                pass
-            return ConversationHandler.END
+    if not _ensure_user_state(user_id):
+        await _report_on_control(query, "⚠️ Користувача не знайдено в сесії")
+        return ConversationHandler.END
 
     order_id = user_states[user_id]["order_id"]
     current_stage_db = user_states[user_id]["stage"] + 1  # 1-based для фото
@@ -284,20 +825,13 @@ async def handle_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE
     if action == "approve":
         cursor.execute("UPDATE order_photos SET confirmed=1 WHERE id=?", (photo_db_id,))
         conn.commit()
-        try:
-            await query.edit_message_caption(caption="✅ Скрін підтверджено менеджером.")
-        except Exception:
-            pass
-        await _evaluate_stage_and_notify(user_id, order_id, current_stage_db, context)
+        await _report_on_control(query, "✅ Скрін підтверджено менеджером.")
+        stage_evaluator.mark_dirty(user_id, order_id, current_stage_db, context)
         return ConversationHandler.END
 
     if action == "reject":
-        context.user_data['reject_user_id'] = user_id
-        context.user_data['photo_db_id'] = photo_db_id
-        try:
-            await query.edit_message_caption(caption="❌ Введіть у чаті причину відхилення цього скріну.")
-        except Exception:
-            pass
+        _set_pending_input(context, reject_user_id=user_id, photo_db_id=photo_db_id)
+        await _report_on_control(query, "❌ Введіть у чаті причину відхилення цього скріну.")
         return REJECT_REASON
 
     if action == "rejtmpl":
@@ -305,11 +839,8 @@ async def handle_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE
         reason = REJECT_TEMPLATES.get(key, "Відхилено (шаблон)")
         cursor.execute("UPDATE order_photos SET confirmed=-1, reason=? WHERE id=?", (reason, photo_db_id))
         conn.commit()
-        try:
-            await query.edit_message_caption(caption=f"❌ Відхилено: {reason}")
-        except Exception:
-            pass
-        await _evaluate_stage_and_notify(user_id, order_id, current_stage_db, context)
+        await _report_on_control(query, f"❌ Відхилено: {reason}")
+        stage_evaluator.mark_dirty(user_id, order_id, current_stage_db, context)
         return ConversationHandler.END
 
     if action == "skip":
@@ -319,50 +850,63 @@ async def handle_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE
             (order_id, stage_db)
         )
         conn.commit()
-        try:
-            await query.edit_message_caption(caption=f"↪️ Етап {stage_db} пропущено менеджером.")
-        except Exception:
-            pass
-        await _evaluate_stage_and_notify(user_id, order_id, stage_db, context)
+        await _report_on_control(query, f"↪️ Етап {stage_db} пропущено менеджером.")
+        stage_evaluator.mark_dirty(user_id, order_id, stage_db, context)
         return ConversationHandler.END
 
     if action == "finish":
         # Завершення замовлення користувача
         try:
             _finish_user_latest_order_and_free_group(user_id)
-            try:
-                await query.edit_message_caption(caption="🏁 Замовлення користувача завершено менеджером.")
-            except Exception:
-                pass
+            await _report_on_control(query, "🏁 Замовлення користувача завершено менеджером.")
             # Повідомляємо користувача
             try:
                 await context.bot.send_message(chat_id=user_id, text="🏁 Ваше замовлення було завершено менеджером.")
             except Exception:
                 pass
-            # Підхоплюємо з черги
-            try:
-                await assign_queued_clients_to_free_groups(context)
-            except Exception:
-                pass
         except Exception as e:
             logger.exception("finish action error: %s", e)
         return ConversationHandler.END
 
     if action == "msg":
-        context.user_data['msg_user_id'] = user_id
-        try:
-            await query.edit_message_caption(caption="💬 Введіть текст повідомлення для користувача в чаті.")
-        except Exception:
-            pass
+        _set_pending_input(context, msg_user_id=user_id)
+        await _report_on_control(query, "💬 Введіть текст повідомлення для користувача в чаті.")
         return MANAGER_MESSAGE
 
     return ConversationHandler.END
 
 
+_PENDING_INPUT_KEYS = ("reject_user_id", "photo_db_id", "msg_user_id", "review_reason")
+
+
+def _set_pending_input(context: ContextTypes.DEFAULT_TYPE, **values: Any) -> None:
+    """Remember what the manager's next text in the admin group is for; replaces an earlier request."""
+    for key in _PENDING_INPUT_KEYS:
+        context.user_data.pop(key, None)
+    context.user_data.update(values)
+
+
+async def moderation_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """
+    Text a manager sends in the admin group after a button asked for it: a rejection reason
+    (per photo or for an album review) or a message to the client. True if it was consumed.
+    Called first by the admin group's text handler (stage2_group_text).
+    """
+    if context.user_data.get("review_reason"):
+        await review_reason_input(update, context)
+    elif context.user_data.get("reject_user_id"):
+        await reject_reason_handler(update, context)
+    elif context.user_data.get("msg_user_id"):
+        await manager_message_handler(update, context)
+    else:
+        return False
+    return True
+
+
 async def reject_reason_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin writes the reason after pressing Reject button."""
-    user_id = context.user_data.get('reject_user_id')
-    photo_db_id = context.user_data.get('photo_db_id')
+    user_id = context.user_data.pop('reject_user_id', None)
+    photo_db_id = context.user_data.pop('photo_db_id', None)
     if not user_id or not photo_db_id:
         try:
             await update.message.reply_text("⚠️ Немає контексту для відхилення.")
@@ -387,14 +931,14 @@ async def reject_reason_handler(update: Update, context: ContextTypes.DEFAULT_TY
     if state:
         order_id = state["order_id"]
         stage_db = state["stage"] + 1
-        await _evaluate_stage_and_notify(user_id, order_id, stage_db, context)
+        stage_evaluator.mark_dirty(user_id, order_id, stage_db, context)
 
     return ConversationHandler.END
 
 
 async def manager_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Manager sends a freeform message to user after pressing Msg button."""
-    user_id = context.user_data.get('msg_user_id')
+    user_id = context.user_data.pop('msg_user_id', None)
     if not user_id:
         return ConversationHandler.END
     message = update.message.text
@@ -408,6 +952,29 @@ async def manager_message_handler(update: Update, context: ContextTypes.DEFAULT_
 
 # ============= Helpers =============
 
+def _ensure_user_state(user_id: int) -> bool:
+    """Restore user_states[user_id] from the latest order if the in-memory session is gone."""
+    if user_states.get(user_id):
+        return True
+    cursor.execute(
+        "SELECT id, username, bank, action, stage FROM orders WHERE user_id=? ORDER BY id DESC LIMIT 1",
+        (user_id,),
+    )
+    r = cursor.fetchone()
+    if not r:
+        return False
+    order_id, username, bank, action_db, stage0 = r[0], (r[1] or "Без_ніка"), r[2], r[3], r[4]
+    user_states[user_id] = {
+        "order_id": order_id,
+        "bank": bank,
+        "action": action_db,
+        "stage": stage0,
+        "age_required": find_age_requirement(bank, action_db),
+        "username": username,
+    }
+    return True
+
+
 async def _evaluate_stage_and_notify(user_id: int, order_id: int, stage_db: int, context: ContextTypes.DEFAULT_TYPE):
     """
     Evaluate the current stage for a user:
@@ -416,26 +983,23 @@ async def _evaluate_stage_and_notify(user_id: int, order_id: int, stage_db: int,
     - If required_photos is defined and approved_count >= required_photos -> advance stage.
     - Else if all active photos are approved -> advance.
     """
-    # Consider only active photos for the current stage
-    cursor.execute(
-        "SELECT id, confirmed, COALESCE(reason, '') FROM order_photos "
-        "WHERE order_id=? AND stage=? AND active=1 ORDER BY id ASC",
-        (order_id, stage_db),
-    )
-    rows = cursor.fetchall()
-    if not rows:
+    # Evaluation of a stage the user has already left (e.g. late decision on an old album)
+    known_stage0 = user_states.get(user_id, {}).get("stage")
+    if known_stage0 is not None and known_stage0 + 1 > stage_db:
         return
+    # Counters of active photos for the current stage (order_stage_progress, kept up to date by triggers)
+    progress = get_stage_progress(order_id, stage_db)
+    if not progress or not any(progress[:3]):
+        return
+    pending_count, approved_count, rejected_count, required_photos = progress
+    all_approved = pending_count == 0 and rejected_count == 0
 
-    approved_count = sum(1 for r in rows if r[1] == 1)
-    pending_count = sum(1 for r in rows if r[1] == 0)
-    rejected_rows = [(r[0], r[2]) for r in rows if r[1] == -1]
-    all_approved = all(r[1] == 1 for r in rows)
-
-    # required_photos для цього банку/екшену/етапу (stage0 = stage_db-1)
-    state = user_states.get(user_id, {})
-    bank = state.get("bank")
-    action = state.get("action")
-    required_photos = get_required_photos(bank, action, stage_db - 1) if bank and action is not None else None
+    if required_photos is None:
+        # required_photos для цього банку/екшену/етапу (stage0 = stage_db-1)
+        state = user_states.get(user_id, {})
+        bank = state.get("bank")
+        action = state.get("action")
+        required_photos = get_required_photos(bank, action, stage_db - 1) if bank and action is not None else None
 
     threshold_reached = (required_photos is not None and approved_count >= required_photos)
 
@@ -465,7 +1029,13 @@ async def _evaluate_stage_and_notify(user_id: int, order_id: int, stage_db: int,
         return
 
     # Якщо не досягнуто порогу і є відхилені — пояснити, що потрібно замінити
-    if rejected_rows and not threshold_reached:
+    if rejected_count and not threshold_reached:
+        cursor.execute(
+            "SELECT id, COALESCE(reason, '') FROM order_photos "
+            "WHERE order_id=? AND stage=? AND active=1 AND confirmed=-1 ORDER BY id ASC",
+            (order_id, stage_db),
+        )
+        rejected_rows = cursor.fetchall()
         lines = []
         for i, (pid, reason) in enumerate(rejected_rows, start=1):
             lines.append(f"{i}. Скрін ID {pid}: {reason or 'без причини'}")
@@ -482,13 +1052,19 @@ async def _evaluate_stage_and_notify(user_id: int, order_id: int, stage_db: int,
     return
 
 
-def create_order_in_db(user_id: int, username: str, bank: str, action: str) -> int:
+# Decisions mark (order, stage) dirty; evaluation runs once per burst (see handlers/evaluation_coalescer.py)
+stage_evaluator = EvaluationCoalescer(_evaluate_stage_and_notify, STAGE_EVAL_QUIET_SECONDS)
+
+
+def create_order_in_db(user_id: int, username: str, bank: str, action: str, commit: bool = True) -> int:
     cursor.execute(
         "INSERT INTO orders (user_id, username, bank, action, stage, status) VALUES (?, ?, ?, ?, ?, ?)",
         (user_id, username, bank, action, 0, "На етапі 1")
     )
-    conn.commit()  # FIX: було без дужок
-    return cursor.lastrowid
+    order_id = cursor.lastrowid
+    if commit:
+        conn.commit()  # FIX: було без дужок
+    return order_id
 
 
 def update_order_stage_db(order_id: int, new_stage: int, status: str = None):
@@ -499,44 +1075,47 @@ def update_order_stage_db(order_id: int, new_stage: int, status: str = None):
     conn.commit()
 
 
-def set_order_group_db(order_id: int, group_chat_id: int):
+def set_order_group_db(order_id: int, group_chat_id: int, commit: bool = True):
     cursor.execute("UPDATE orders SET group_id=? WHERE id=?", (group_chat_id, order_id))
-    conn.commit()
-
-
-def free_group_db_by_chatid(group_chat_id: int):
-    cursor.execute("UPDATE manager_groups SET busy=0 WHERE group_id=?", (group_chat_id,))
-    conn.commit()
+    if commit:
+        conn.commit()
 
 
-def occupy_group_db_by_dbid(group_db_id: int):
-    cursor.execute("UPDATE manager_groups SET busy=1 WHERE id=?", (group_db_id,))
-    conn.commit()
+def free_group_db_by_chatid(group_chat_id: int, commit: bool = True):
+    # One order less for the group; the capacity dispatcher hands the slot to the queue
+    release_group(group_chat_id)
+    if commit:
+        conn.commit()
 
 
-def get_free_groups(limit: int = None):
-    q = "SELECT id, group_id FROM manager_groups WHERE busy=0 ORDER BY id ASC"
-    if limit:
-        q += f" LIMIT {limit}"
-    cursor.execute(q)
-    return cursor.fetchall()
+def close_order(order_id: int, status: str, group_chat_id: Optional[int]) -> bool:
+    """
+    Move an open order to a finished status; its service time is recorded and its group slot
+    released only by the call that actually closed it (caller commits). False if it was already finished.
+    """
+    cursor.execute(
+        f"UPDATE orders SET status=? WHERE id=? AND status NOT IN ({','.join('?' * len(FINISHED_STATUSES))})",
+        (status, order_id, *FINISHED_STATUSES),
+    )
+    if cursor.rowcount != 1:
+        return False
+    record_service_time(order_id)
+    if group_chat_id:
+        free_group_db_by_chatid(group_chat_id, commit=False)
+    return True
 
 
-def pop_queue_next():
-    cursor.execute("SELECT id, user_id, username, bank, action FROM queue ORDER BY id ASC LIMIT 1")
-    row = cursor.fetchone()
-    if not row:
-        return None
-    qid, user_id, username, bank, action = row
-    cursor.execute("DELETE FROM queue WHERE id=?", (qid,))
-    conn.commit()
-    return (user_id, username, bank, action)
+def occupy_group_db_by_dbid(group_db_id: int, commit: bool = True):
+    occupy_group(group_db_id)
+    if commit:
+        conn.commit()
 
 
-def enqueue_user(user_id: int, username: str, bank: str, action: str):
-    cursor.execute("INSERT INTO queue (user_id, username, bank, action) VALUES (?, ?, ?, ?)",
-                   (user_id, username, bank, action))
+def enqueue_user(user_id: int, username: str, bank: str, action: str) -> int:
+    cursor.execute("INSERT INTO queue (user_id, username, bank, action, priority) VALUES (?, ?, ?, ?, ?)",
+                   (user_id, username, bank, action, queue_policy.score(user_id, bank, action)))
     conn.commit()
+    return cursor.lastrowid
 
 
 def get_last_order_for_user(user_id: int):
@@ -571,11 +1150,11 @@ async def assign_group_or_queue(order_id: int, user_id: int, username: str, bank
     
     logger.info(f"Group assignment attempt: Total groups: {total_groups}, Free groups: {free_groups_count}, Bank: {bank}")
     
-    # First try to find bank-specific groups
+    # Bank-specific groups first, then the least loaded one
     cursor.execute("""
         SELECT id, group_id, name FROM manager_groups
         WHERE busy=0 AND (bank=? OR is_admin_group=1)
-        ORDER BY CASE WHEN bank=? THEN 0 ELSE 1 END, id ASC
+        ORDER BY CASE WHEN bank=? THEN 0 ELSE 1 END, CAST(load AS REAL) / capacity, id ASC
         LIMIT 1
     """, (bank, bank))
     free_group = cursor.fetchone()
@@ -605,19 +1184,26 @@ async def assign_group_or_queue(order_id: int, user_id: int, username: str, bank
             return False
     else:
         try:
-            enqueue_user(user_id, username, bank, action)
+            queue_id = enqueue_user(user_id, username, bank, action)
             logger.info("User %s (order %s) enqueued - no free groups available", user_id, order_id)
             
             # More informative message based on the situation
             if total_groups == 0:
                 message = "⏳ Менеджерські групи ще не налаштовані. Ви в черзі."
             elif free_groups_count == 0:
-                message = "⏳ Усі менеджери зайняті. Ви в черзі. Отримаєте повідомлення, коли звільниться менеджер."
+                message = "⏳ Усі менеджери зайняті. Ви в черзі."
             else:
                 message = f"⏳ Немає доступних груп для банку {bank}. Ви в черзі."
-                
+            # Position and ETA; queue_status_notifier edits them in place while the user waits
+            position = queue_estimator.for_user(user_id)
+            status_text = format_status(position) if position else None
+            if status_text:
+                message += "\n" + status_text
+
             try:
-                await context.bot.send_message(chat_id=user_id, text=message)
+                sent = await context.bot.send_message(chat_id=user_id, text=message)
+                if position and position.queue_id == queue_id:
+                    remember_status_message(queue_id, sent.message_id, status_text)
             except Exception:
                 logger.warning("Не вдалося повідомити користувача в черзі (ID=%s)", user_id)
         except Exception as e:
@@ -625,30 +1211,36 @@ async def assign_group_or_queue(order_id: int, user_id: int, username: str, bank
         return False
 
 
-async def assign_queued_clients_to_free_groups(context: ContextTypes.DEFAULT_TYPE):
-    try:
-        free_groups = get_free_groups()
-        if not free_groups:
-            return
-
-        for group_db_id, group_chat_id in free_groups:
-            next_client = pop_queue_next()
-            if not next_client:
-                break
-            user_id, username, bank, action = next_client
-
-            new_order_id = create_order_in_db(user_id, username, bank, action)
+def _assign_queued_client(group: FreeGroup, client: QueueEntry) -> Tuple[int, Optional[int]]:
+    # Runs in the queue claim's transaction: order, group assignment and the user's notification commit with it
+    new_order_id = create_order_in_db(client.user_id, client.username, client.bank, client.action, commit=False)
+    occupy_group_db_by_dbid(group.id, commit=False)
+    set_order_group_db(new_order_id, group.group_id, commit=False)
+    outbox_id = enqueue_message(client.user_id, "✅ Звільнилося місце! Починаємо реєстрацію.",
+                                f"queue_assigned:{new_order_id}")
+    return new_order_id, outbox_id
 
-            try:
-                occupy_group_db_by_dbid(group_db_id)
-                set_order_group_db(new_order_id, group_chat_id)
-            except Exception as e:
-                logger.exception("Error occupying group or setting order group: %s", e)
 
+async def assign_queued_clients_to_free_groups(context: ContextTypes.DEFAULT_TYPE):
+    # Run by capacity_dispatcher only (capacity_events.py); elsewhere publish a capacity event instead
+    try:
+        # Every free group gets the oldest client of its bank (admin groups: of any bank)
+        matched = queue_scheduler.match(_assign_queued_client)
+        if matched:
+            queue_status_notifier.wake()  # everyone behind moved up
+        for group, client, (new_order_id, outbox_id) in matched:
+            user_id, bank, action = client.user_id, client.bank, client.action
             user_states[user_id] = {"order_id": new_order_id, "bank": bank, "action": action, "stage": 0,
                                     "age_required": find_age_requirement(bank, action)}
+            # Like a direct assignment: managers of a group with several orders switch between them with /o
+            try:
+                from handlers.multi_order_management import auto_add_new_order_to_active
+                await auto_add_new_order_to_active(context, new_order_id, group.group_id)
+            except Exception as e:
+                logger.warning("Failed to auto-add order to active list: %s", e)
+            # Deliver before the instruction; if it fails the outbox dispatcher retries it
+            await outbox_dispatcher.deliver(context.bot, outbox_id)
             try:
-                await context.bot.send_message(chat_id=user_id, text="✅ Звільнилося місце! Починаємо реєстрацію.")
                 await send_instruction(user_id, context)
             except Exception as e:
                 logger.warning("Не вдалося повідомити користувача після призначення з черги: %s", e)
@@ -713,14 +1305,11 @@ async def send_instruction(user_id: int, context, order_id: int = None):
     #  - all steps passed (stage0 >= len(instructions))
     #  - Stage2 either not required (stage0 <1) or already complete (stage2_complete == True)
     if stage0 >= len(instructions) and (stage0 < 1 or stage2_complete):
-        cursor.execute("UPDATE orders SET status='Завершено' WHERE id=?", (order_id,))
+        closed = close_order(order_id, "Завершено", group_id)
         conn.commit()
-        if group_id:
-            try:
-                cursor.execute("UPDATE manager_groups SET busy=0 WHERE group_id=?", (group_id,))
-                conn.commit()
-            except Exception:
-                pass
+        if not closed:
+            user_states.pop(user_id, None)
+            return
         try:
             await context.bot.send_message(chat_id=user_id, text="✅ Ваше замовлення завершено. Дякуємо!")
             await context.bot.send_message(chat_id=ADMIN_GROUP_ID, text=f"✅ Замовлення {order_id} виконано.")
@@ -779,14 +1368,15 @@ async def send_instruction(user_id: int, context, order_id: int = None):
 
 
 def _finish_user_latest_order_and_free_group(user_id: int):
-    cursor.execute("SELECT id, group_id FROM orders WHERE user_id=? AND status!='Завершено' ORDER BY id DESC LIMIT 1",
-                   (user_id,))
+    cursor.execute(
+        f"SELECT id, group_id FROM orders WHERE user_id=? AND status NOT IN ({','.join('?' * len(FINISHED_STATUSES))}) "
+        "ORDER BY id DESC LIMIT 1",
+        (user_id, *FINISHED_STATUSES),
+    )
     row = cursor.fetchone()
     if not row:
         return
     order_id, group_chat_id = row
-    cursor.execute("UPDATE orders SET status='Завершено' WHERE id=?", (order_id,))
-    if group_chat_id:
-        cursor.execute("UPDATE manager_groups SET busy=0 WHERE group_id=?", (group_chat_id,))
+    close_order(order_id, "Завершено", group_chat_id)
     conn.commit()
     user_states.pop(user_id, None)
@@ -0,0 +1,211 @@
+"""
+Perceptual hashing of submitted screenshots for near-duplicate detection.
+
+The pHash is computed with NumPy in a process pool (CPU-bound work stays off
+the event loop); near-duplicates are found with a BK-tree over Hamming distance.
+The same worker call also measures image quality (see photo_quality), so every
+file is downloaded and decoded once.
+Hashing runs in worker processes, so this module does not import `db`.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import signal
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Generic, List, NamedTuple, Optional, Tuple, TypeVar
+
+from handlers.photo_quality import QualityMetrics, measure_quality
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:  # optional: duplicate detection is disabled without numpy/Pillow
+    np = None
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+_DCT_SIZE = 32
+_DCT_KEEP = 8
+
+
+def hashing_available() -> bool:
+    return np is not None and Image is not None
+
+
+def _gray(data: bytes, size: Tuple[int, int]) -> "np.ndarray":
+    with Image.open(io.BytesIO(data)) as img:
+        return np.asarray(img.convert("L").resize(size, Image.LANCZOS), dtype=np.float64)
+
+
+def _bits_to_int(bits: "np.ndarray") -> int:
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+_dct_matrix_cache: Dict[int, "np.ndarray"] = {}
+
+
+def _dct_matrix(n: int) -> "np.ndarray":
+    m = _dct_matrix_cache.get(n)
+    if m is None:
+        k = np.arange(n)[:, None]
+        i = np.arange(n)[None, :]
+        m = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+        m[0, :] /= np.sqrt(2.0)
+        _dct_matrix_cache[n] = m
+    return m
+
+
+def phash(data: bytes) -> int:
+    """
+    64-bit DCT hash: low-frequency 8x8 DCT block of a 32x32 thumbnail compared to its median.
+    Top-level so it can run in a worker process.
+    """
+    pixels = _gray(data, (_DCT_SIZE, _DCT_SIZE))
+    m = _dct_matrix(_DCT_SIZE)
+    low = (m @ pixels @ m.T)[:_DCT_KEEP, :_DCT_KEEP]
+    # DC term only carries average brightness; keep it out of the median
+    median = np.median(low.ravel()[1:])
+    return _bits_to_int(low > median)
+
+
+class PhotoAnalysis(NamedTuple):
+    phash: int
+    quality: QualityMetrics
+
+
+def analyze_image(data: bytes) -> PhotoAnalysis:
+    """Hash and quality metrics in one worker call."""
+    return PhotoAnalysis(phash(data), measure_quality(data))
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def to_signed64(value: int) -> int:
+    """SQLite INTEGER is signed 64-bit."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def from_signed64(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+T = TypeVar("T")
+
+
+class BKTree(Generic[T]):
+    """Burkhard-Keller tree over Hamming distance; each node keeps all items with the same hash."""
+
+    def __init__(self):
+        # node: [hash, items, {distance: child}]
+        self._root: Optional[list] = None
+        self.size = 0
+
+    def add(self, value: int, item: T) -> None:
+        self.size += 1
+        if self._root is None:
+            self._root = [value, [item], {}]
+            return
+        node = self._root
+        while True:
+            d = hamming(value, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, T]]:
+        """All (distance, item) within max_distance, closest first."""
+        if self._root is None:
+            return []
+        found: List[Tuple[int, T]] = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= max_distance:
+                found.extend((d, item) for item in node[1])
+            for dist, child in node[2].items():
+                if d - max_distance <= dist <= d + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda x: x[0])
+        return found
+
+
+def _worker_init():
+    # Forked workers inherit db.py's SIGINT/SIGTERM handlers (lock cleanup, conn.close); shutdown is the parent's job
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, signal.SIG_IGN if sig == signal.SIGINT else signal.SIG_DFL)
+
+
+class PhotoHasher:
+    """Downloads each file once and analyzes it (hash + quality) in a shared process pool."""
+
+    def __init__(self, max_workers: int = 2, cache_size: int = 2048):
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # file_unique_id -> PhotoAnalysis, least recently used first
+        self._cache: "OrderedDict[str, PhotoAnalysis]" = OrderedDict()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # fork: spawn/forkserver would re-import the bot's __main__ (and db.py with its lock file) in
+            # every worker. Forked workers never touch the inherited sqlite connection and exit via os._exit.
+            method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+            self._pool = ProcessPoolExecutor(
+                self.max_workers, mp_context=multiprocessing.get_context(method), initializer=_worker_init
+            )
+        return self._pool
+
+    async def hash_bytes(self, data: bytes) -> int:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor(), phash, data)
+
+    async def analyze_bytes(self, data: bytes) -> PhotoAnalysis:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor(), analyze_image, data)
+
+    async def analyze_telegram_file(self, bot: Any, file_id: str, file_unique_id: str) -> Optional[PhotoAnalysis]:
+        cached = self._cache.get(file_unique_id)
+        if cached is not None:
+            self._cache.move_to_end(file_unique_id)
+            return cached
+        try:
+            tg_file = await bot.get_file(file_id)
+            data = bytes(await tg_file.download_as_bytearray())
+            analysis = await self.analyze_bytes(data)
+        except Exception as e:
+            logger.warning("Photo analysis failed for %s: %s", file_unique_id, e)
+            return None
+        self._cache[file_unique_id] = analysis
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return analysis
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# Env-tunable defaults
+PHASH_ENABLED = os.getenv("PHASH_ENABLED", "1") not in ("0", "false", "no") and hashing_available()
+QUALITY_ENABLED = os.getenv("QUALITY_ENABLED", "1") not in ("0", "false", "no") and hashing_available()
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "6"))
+PHASH_WORKERS = int(os.getenv("PHASH_WORKERS", "2"))
+# near-duplicates are searched among this many most recent photos (exact copies among all of them)
+PHASH_INDEX_PHOTOS = int(os.getenv("PHASH_INDEX_PHOTOS", "100000"))
@@ -0,0 +1,103 @@
+"""
+Image-quality pre-screening of screenshots (blur / crop) before they reach managers.
+
+Blur is measured as variance of the Laplacian on a fixed-width grayscale copy;
+crop is detected from resolution and from the aspect ratio expected for the
+instruction step. Thresholds come from env defaults and can be overridden per
+step with a "quality" dict in INSTRUCTIONS (see states.get_quality_thresholds).
+Like photo_hash, this module runs in pool workers and does not import `db`.
+"""
+import io
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:  # optional, see photo_hash.hashing_available()
+    np = None
+    Image = None
+
+# Blur is measured at this width so the score does not depend on the upload resolution
+_BLUR_WIDTH = 720
+
+
+def _env_float(name: str, default: Optional[float]) -> Optional[float]:
+    raw = os.getenv(name)
+    if raw is None or raw.strip() == "":
+        return default
+    return float(raw)
+
+
+DEFAULT_THRESHOLDS: Dict[str, Any] = {
+    "min_blur": _env_float("QUALITY_MIN_BLUR", 60.0),        # variance of Laplacian below this is blurry
+    "min_side": _env_float("QUALITY_MIN_SIDE", 480.0),       # shorter side in px below this looks cropped
+    "aspect": _env_float("QUALITY_ASPECT", None),            # expected height/width, None = not checked
+    "aspect_tolerance": _env_float("QUALITY_ASPECT_TOLERANCE", 0.2),
+    "auto_reject": os.getenv("QUALITY_AUTO_REJECT", "0") in ("1", "true", "yes"),
+    "reject_confidence": _env_float("QUALITY_REJECT_CONFIDENCE", 0.9),
+}
+
+
+class QualityMetrics(NamedTuple):
+    blur: float
+    width: int
+    height: int
+
+
+class QualityVerdict(NamedTuple):
+    issue: Optional[str]   # REJECT_TEMPLATES key: "blurry" / "crop", None if fine
+    confidence: float      # 0..1
+    auto_reject: bool
+
+
+def laplacian_variance(gray: "np.ndarray") -> float:
+    """Variance of the 4-neighbour Laplacian; low values mean few sharp edges."""
+    lap = (
+        gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+        - 4.0 * gray[1:-1, 1:-1]
+    )
+    return float(lap.var())
+
+
+def measure_quality(data: bytes) -> QualityMetrics:
+    with Image.open(io.BytesIO(data)) as img:
+        width, height = img.size
+        gray = img.convert("L")
+        if width > _BLUR_WIDTH:
+            gray = gray.resize((_BLUR_WIDTH, max(3, round(height * _BLUR_WIDTH / width))), Image.BILINEAR)
+        pixels = np.asarray(gray, dtype=np.float64)
+    return QualityMetrics(laplacian_variance(pixels), width, height)
+
+
+def _clamp01(value: float) -> float:
+    return max(0.0, min(1.0, value))
+
+
+def assess_quality(metrics: QualityMetrics, overrides: Optional[Dict[str, Any]] = None) -> QualityVerdict:
+    """Pick the most confident issue; auto_reject only if enabled for the step and confident enough."""
+    t = dict(DEFAULT_THRESHOLDS)
+    t.update(overrides or {})
+    candidates: List[Tuple[float, str]] = []
+
+    min_blur = t.get("min_blur")
+    if min_blur and metrics.blur < min_blur:
+        candidates.append((_clamp01(1.0 - metrics.blur / min_blur), "blurry"))
+
+    min_side = t.get("min_side")
+    short_side = min(metrics.width, metrics.height)
+    if min_side and short_side < min_side:
+        candidates.append((_clamp01(1.0 - short_side / min_side), "crop"))
+
+    aspect = t.get("aspect")
+    tolerance = t.get("aspect_tolerance") or 0.0
+    if aspect and metrics.width:
+        deviation = abs(metrics.height / metrics.width - aspect) / aspect
+        if deviation > tolerance:
+            candidates.append((_clamp01((deviation - tolerance) / max(tolerance, 0.05)), "crop"))
+
+    if not candidates:
+        return QualityVerdict(None, 0.0, False)
+    confidence, issue = max(candidates)
+    auto = bool(t.get("auto_reject")) and confidence >= (t.get("reject_confidence") or 1.0)
+    return QualityVerdict(issue, round(confidence, 2), auto)
@@ -0,0 +1,108 @@
+"""
+Inline button routes of the modules client_bot loads lazily.
+
+The modules themselves still declare their routes with `@router.route(...)`;
+this manifest repeats them so the router can serve the buttons before the
+module is imported. test_lazy_loading.py fails when the two drift apart.
+"""
+from typing import Dict, List, Union
+
+from handlers.callback_codec import (
+    BANK_DELETE,
+    BANK_DELETE_CONFIRM,
+    BANK_EDIT,
+    BANK_EDIT_FIELD,
+    BANK_TOGGLE,
+    GROUP_BANK_PICK,
+    REUSE_CANCEL,
+    REUSE_CONFIRM,
+    STAGE_CLEAR,
+    STAGE_EDIT,
+    STAGES_EDIT,
+    STAGES_REORDER,
+    TEMPLATE_CREATE,
+    TEMPLATE_DELETE,
+    TEMPLATE_DELETE_CONFIRM,
+    TEMPLATE_EDIT,
+    Payload,
+)
+from handlers.callback_router import CallbackRouter, router
+from handlers.lazy import lazy
+
+Spec = Union[str, Payload]
+
+# module -> handler function -> callback_data it serves
+LAZY_ROUTES: Dict[str, Dict[str, List[Spec]]] = {
+    "handlers.bank_management": {
+        "banks_management_menu": ["banks_menu"],
+        "list_banks_handler": ["banks_list"],
+        "instructions_menu_handler": ["instructions_menu"],
+        "groups_menu_handler": ["groups_menu"],
+        "list_groups_handler": ["groups_list"],
+        "edit_bank_handler": ["banks_edit"],
+        "delete_bank_handler": ["banks_delete"],
+        "edit_bank_settings_handler": [BANK_EDIT],
+        "toggle_bank_setting_handler": [BANK_TOGGLE, BANK_EDIT_FIELD],
+        "confirm_delete_bank_handler": [BANK_DELETE],
+        "final_delete_bank_handler": [BANK_DELETE_CONFIRM],
+        "add_bank_group_handler": ["groups_add_bank"],
+        "add_admin_group_handler": ["groups_add_admin"],
+        "select_bank_for_group_handler": [GROUP_BANK_PICK],
+        "delete_group_handler": ["groups_delete"],
+        "confirm_delete_group_handler": ["delete_group_{group_id:int}"],
+        "final_delete_group_handler": ["confirm_delete_group_{group_id:int}"],
+        "form_templates_menu_handler": ["form_templates_menu"],
+        "form_templates_list_handler": ["form_templates_list"],
+        "form_templates_create_handler": ["form_templates_create"],
+        "form_templates_edit_handler": ["form_templates_edit"],
+        "form_templates_delete_handler": ["form_templates_delete"],
+        "create_template_handler": [TEMPLATE_CREATE],
+        "edit_template_handler_specific": [TEMPLATE_EDIT],
+        "delete_template_handler_specific": [TEMPLATE_DELETE],
+        "confirm_delete_template_handler": [TEMPLATE_DELETE_CONFIRM],
+        "migrate_from_file_handler": ["migrate_from_file"],
+        "confirm_migrate_from_file_handler": ["confirm_migrate_from_file"],
+    },
+    "handlers.instruction_management": {
+        "instructions_list_handler": ["instructions_list"],
+        "instruction_add_another_handler": ["instr_add_another"],
+        "instructions_edit_handler": ["instructions_edit"],
+        "edit_bank_stages_handler": [STAGES_EDIT],
+        "edit_stage_handler": [STAGE_EDIT],
+        "clear_stage_content_handler": [STAGE_CLEAR],
+        "instructions_reorder_handler": ["instructions_reorder"],
+        "reorder_bank_stages_handler": [STAGES_REORDER],
+        "sync_to_file_callback": ["sync_to_file"],
+    },
+    "handlers.admin_interface": {
+        "admin_interface_callback": [
+            "admin_banks", "back_to_admin",
+            "admin_groups", "admin_orders", "admin_admins", "admin_stats", "admin_system", "admin_templates",
+            "admin_help",
+            "orders_active", "orders_queue", "orders_history", "orders_finish", "orders_stats", "orders_forms",
+            "admins_list", "admins_add", "admins_remove",
+            "stats_general", "stats_banks", "stats_groups", "stats_period", "stats_export",
+            "system_general", "system_bank_visibility", "system_cleanup", "system_backup", "system_restart",
+            "system_outbox", "system_outbox_retry",
+            "templates_list", "templates_set", "templates_del", "templates_messages", "templates_instructions",
+            "templates_sync",
+        ],
+    },
+    "handlers.data_validation": {
+        "handle_data_reuse_confirmation": [REUSE_CONFIRM, REUSE_CANCEL],
+    },
+    "handlers.multi_order_management": {
+        "handle_active_order_management": [
+            "refresh_active_orders", "switch_primary", "add_active_order", "remove_active_order",
+            "set_primary_{order_id:int}", "add_order_{order_id:int}", "remove_order_{order_id:int}",
+        ],
+    },
+}
+
+
+def declare_lazy_routes(target: CallbackRouter = router) -> None:
+    for module, handlers in LAZY_ROUTES.items():
+        for name, specs in handlers.items():
+            callback = lazy(module, name)
+            for spec in specs:
+                target.add(spec, callback)
@@ -5,6 +5,7 @@ from telegram import Update
 from telegram.ext import ContextTypes
 
 from db import ADMIN_GROUP_ID, conn, cursor, log_action, logger
+from outbox import enqueue_message, outbox_dispatcher
 
 CODE_RE = re.compile(r"^\d{3,8}$")
 ORDER_TAG_RE = re.compile(r"#(\d+)")
@@ -26,14 +27,14 @@ def get_group_current_order(context: ContextTypes.DEFAULT_TYPE, chat_id: int) ->
 
 def set_group_current_order(context: ContextTypes.DEFAULT_TYPE, chat_id: int, order_id: int):
     try:
-        context.application.chat_data.setdefault(chat_id, {})
         context.application.chat_data[chat_id]["current_order_id"] = order_id
+        context.application.mark_data_for_update_persistence(chat_ids=chat_id)
     except Exception:
         pass
 
 def get_active_order_for_group(chat_id: int) -> Optional[int]:
     cursor.execute(
-        "SELECT id FROM orders WHERE group_id=? AND status!='Завершено' ORDER BY id DESC LIMIT 1",
+        "SELECT id FROM orders WHERE group_id=? AND status NOT IN ('Завершено', 'Прострочено') ORDER BY id DESC LIMIT 1",
         (chat_id,)
     )
     row = cursor.fetchone()
@@ -42,7 +43,7 @@ def get_active_order_for_group(chat_id: int) -> Optional[int]:
 def get_active_order_for_user(user_id: int) -> Optional[tuple]:
     cursor.execute(
         "SELECT id, user_id, username, bank, action, stage, status, group_id FROM orders "
-        "WHERE user_id=? AND status!='Завершено' ORDER BY id DESC LIMIT 1",
+        "WHERE user_id=? AND status NOT IN ('Завершено', 'Прострочено') ORDER BY id DESC LIMIT 1",
         (user_id,)
     )
     return cursor.fetchone()
@@ -109,21 +110,26 @@ async def stage2_group_text_bridge(update: Update, context: ContextTypes.DEFAULT
 
     # 3) Якщо лише цифри → це код
     if CODE_RE.fullmatch(text):
+        # Status and the code message commit together; the message id makes a re-delivered update a no-op
         try:
             cursor.execute("UPDATE orders SET phone_code_status='delivered' WHERE id=?", (order_id,))
+            outbox_id = enqueue_message(
+                user_id,
+                f"🔐 Код: {text}\nВведіть його у застосунку і після верифікації натисніть '📞 Номер підтверджено'.",
+                f"code:{chat_id}:{msg.message_id}",
+            )
             conn.commit()
         except Exception as e:
-            logger.warning("Failed to update code status: %s", e)
+            conn.rollback()
+            logger.warning("Failed to store code for order %s: %s", order_id, e)
+            await msg.reply_text("⚠️ Не вдалося зберегти код, спробуйте ще раз.")
+            return
         log_action(order_id, "manager", "provide_code_auto", text)
 
-        await msg.reply_text(f"✅ Код надіслано користувачу (Order {order_id}).")
-        try:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=f"🔐 Код: {text}\nВведіть його у застосунку і після верифікації натисніть '📞 Номер підтверджено'."
-            )
-        except Exception as e:
-            logger.warning("Send code to user fail: %s", e)
+        if outbox_id is None or await outbox_dispatcher.deliver(context.bot, outbox_id):
+            await msg.reply_text(f"✅ Код надіслано користувачу (Order {order_id}).")
+        else:
+            await msg.reply_text(f"⏳ Код збережено (Order {order_id}), бот доставить його повторною спробою.")
         return
 
     # 4) Інакше — пересилаємо як повідомлення менеджера
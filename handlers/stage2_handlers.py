@@ -1,12 +1,14 @@
 import re
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import datetime
+from typing import List, Optional
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes, ConversationHandler
 
 from db import ADMIN_GROUP_ID, conn, cursor, log_action, logger
 from handlers.templates_store import get_template
+from outbox import enqueue_message, outbox_dispatcher
+from scheduled_events import ScheduledEvent, cancel, event_scheduler, schedule
 from states import (
     STAGE2_MANAGER_WAIT_CODE,
     STAGE2_MANAGER_WAIT_DATA,
@@ -32,13 +34,14 @@ def _get_order_core(order_id: int):
         FROM orders WHERE id=?""", (order_id,))
     return cursor.fetchone()
 
-def _update_order(order_id: int, **fields):
+def _update_order(order_id: int, commit: bool = True, **fields):
     if not fields:
         return
     sets = ", ".join(f"{k}=?" for k in fields)
     vals = list(fields.values()) + [order_id]
     cursor.execute(f"UPDATE orders SET {sets} WHERE id=?", vals)
-    conn.commit()
+    if commit:
+        conn.commit()
 
 def _get_order_group_chat(order_id: int) -> int:
     cursor.execute("SELECT group_id FROM orders WHERE id=?", (order_id,))
@@ -52,7 +55,7 @@ def _get_user_active_order(user_id: int):
                phone_code_status,phone_code_session,phone_code_last_sent_at,
                phone_code_attempts,stage2_status,stage2_restart_count,stage2_complete
         FROM orders
-        WHERE user_id=? AND status!='Завершено'
+        WHERE user_id=? AND status NOT IN ('Завершено', 'Прострочено')
         ORDER BY id DESC LIMIT 1
     """, (user_id,))
     return cursor.fetchone()
@@ -183,8 +186,10 @@ def _extract_order_id(data: str) -> Optional[int]:
 
 def _set_current_stage2_order(context: ContextTypes.DEFAULT_TYPE, chat_id: int, order_id: int):
     try:
-        context.application.chat_data.setdefault(chat_id, {})
+        # application.chat_data is a read-only mapping over a defaultdict: indexing creates the entry
         context.application.chat_data[chat_id]["stage2_current_order_id"] = order_id
+        # Usually called for another chat than the update's one, so persistence must be told explicitly
+        context.application.mark_data_for_update_persistence(chat_ids=chat_id)
     except Exception:
         pass
 
@@ -211,58 +216,55 @@ def _expand_template_if_any(text: str, order_id: int) -> str:
         action=action or ""
     )
 
-# ================== Code reminder jobs ==================
+# ================== Code reminders (scheduled_events.py) ==================
 
-async def _code_reminder_job(context: ContextTypes.DEFAULT_TYPE):
-    job = context.job
-    data = job.data or {}
-    order_id = data.get("order_id")
-    chat_id = data.get("chat_id")
-    if not order_id or not chat_id:
-        return
-    cursor.execute("SELECT phone_code_status FROM orders WHERE id=?", (order_id,))
-    r = cursor.fetchone()
-    if not r:
-        return
-    status = r[0]
-    if status == "requested":
+CODE_REMINDER = "code_reminder"
+
+async def _code_reminders(bot, events: List[ScheduledEvent]):
+    """Remind the groups of every order in the batch that still waits for its code."""
+    order_ids = [e.payload["order_id"] for e in events]
+    cursor.execute(f"SELECT id FROM orders WHERE id IN ({','.join('?' * len(order_ids))}) "
+                   "AND phone_code_status='requested' AND status!='Прострочено'", order_ids)
+    waiting = {row[0] for row in cursor.fetchall()}
+    for event in events:
+        order_id, chat_id = event.payload["order_id"], event.payload["chat_id"]
+        if order_id not in waiting:
+            continue
         try:
-            await context.bot.send_message(
+            await bot.send_message(
                 chat_id=chat_id,
                 text=f"⏰ Нагадування: користувач по Order {order_id} очікує код уже {CODE_REMINDER_MINUTES} хв."
             )
         except Exception:
             pass
 
-def _schedule_code_reminder(order_id: int, chat_id: int, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        job_queue = context.application.job_queue
-        # Cancel old
-        _cancel_code_reminder(order_id, context)
-        job_queue.run_once(
-            _code_reminder_job,
-            when=timedelta(minutes=CODE_REMINDER_MINUTES),
-            data={"order_id": order_id, "chat_id": chat_id},
-            name=f"code_reminder_{order_id}"
-        )
-    except Exception as e:
-        logger.warning("schedule code reminder failed: %s", e)
+event_scheduler.register(CODE_REMINDER, _code_reminders)
 
-def _cancel_code_reminder(order_id: int, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        job_queue = context.application.job_queue
-        for job in job_queue.get_jobs_by_name(f"code_reminder_{order_id}"):
-            job.schedule_removal()
-    except Exception:
-        pass
+def _schedule_code_reminder(order_id: int, chat_id: int):
+    # Re-requesting the code moves the pending reminder
+    schedule(CODE_REMINDER, f"{CODE_REMINDER}:{order_id}", delay=CODE_REMINDER_MINUTES * 60,
+             payload={"order_id": order_id, "chat_id": chat_id})
+    conn.commit()
+
+def _cancel_code_reminder(order_id: int):
+    cancel(f"{CODE_REMINDER}:{order_id}")
+    conn.commit()
 
 # ================== Notifications to manager groups ==================
 
-async def _notify_managers_after_data(order_id: int, context: ContextTypes.DEFAULT_TYPE):
-    order = _get_order_core(order_id)
+def _enqueue_managers_after_data(order_id: int, context: ContextTypes.DEFAULT_TYPE,
+                                 submission_id: int) -> Optional[int]:
+    """
+    Put the 'data received' alert for the order's group into the outbox (caller commits).
+    `submission_id` (the manager's message with the data) keys the alert: a retry of the same
+    update is stored once, corrected data sent later in the same cycle gets its own alert.
+    """
+    cursor.execute("SELECT user_id, username, bank, action, stage2_restart_count FROM orders WHERE id=?",
+                   (order_id,))
+    order = cursor.fetchone()
     if not order:
-        return
-    (_, user_id, username, bank, action, *_rest) = order
+        return None
+    user_id, username, bank, action, restart_count = order
     chat_id = _get_order_group_chat(order_id)
     txt = (f"📨 Дані отримано (Order {order_id}).\n"
            f"👤 @{username or 'Без_ніка'} (ID: {user_id})\n"
@@ -271,16 +273,10 @@ async def _notify_managers_after_data(order_id: int, context: ContextTypes.DEFAU
            f"Підказка: надішліть у чат <лише цифри 3–8> — це буде код користувачу.\n"
            f"Будь-який інший текст — повідомлення користувачу.\n"
            f"Також можна: #<id> або /o <id> щоб перемкнутися на інший ордер.")
-    try:
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=txt,
-            reply_markup=_manager_actions_keyboard(order_id)
-        )
-        _set_current_stage2_order(context, chat_id, order_id)
-        log_action(order_id, "system", "provide_data_notify")
-    except Exception as e:
-        logger.warning("Failed to notify managers after data: %s", e)
+    outbox_id = enqueue_message(chat_id, txt, f"data_notify:{order_id}:{restart_count or 0}:{submission_id}",
+                                reply_markup=_manager_actions_keyboard(order_id))
+    _set_current_stage2_order(context, chat_id, order_id)
+    return outbox_id
 
 async def _notify_managers_request_code(order_id: int, context: ContextTypes.DEFAULT_TYPE):
     order = _get_order_core(order_id)
@@ -299,7 +295,7 @@ async def _notify_managers_request_code(order_id: int, context: ContextTypes.DEF
             reply_markup=_manager_actions_keyboard(order_id)
         )
         _set_current_stage2_order(context, chat_id, order_id)
-        _schedule_code_reminder(order_id, chat_id, context)
+        _schedule_code_reminder(order_id, chat_id)
         log_action(order_id, "system", "request_code_notify")
     except Exception as e:
         logger.warning("Failed to notify managers request code: %s", e)
@@ -367,7 +363,7 @@ async def user_stage2_callback(update: Update, context: ContextTypes.DEFAULT_TYP
             await _send_stage2_ui(user_id, order_id, context)
             return
         _update_order(order_id, phone_verified=1, phone_code_status="confirmed")
-        _cancel_code_reminder(order_id, context)
+        _cancel_code_reminder(order_id)
         log_action(order_id, "user", "phone_confirm")
         if email_verified:
             _update_order(order_id, stage2_complete=1)
@@ -485,6 +481,10 @@ async def stage2_group_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
     if not msg or not msg.text:
         return
+    # a rejection reason / message to the client asked for by a photo moderation button
+    from handlers.photo_handlers import moderation_text_input
+    if await moderation_text_input(update, context):
+        return
     chat_id = msg.chat_id
     text = msg.text.strip()
 
@@ -506,6 +506,7 @@ async def stage2_group_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     order_id = chat_store.get("stage2_current_order_id")
 
     if not order_id:
+        # served by the partial index ix_orders_stage2_waiting; keep the status list literal
         cursor.execute("""
             SELECT id FROM orders
             WHERE stage2_status IN ('waiting_manager_data','data_received')
@@ -528,7 +529,7 @@ async def stage2_group_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 3) Code?
     if CODE_RE.fullmatch(text):
         _update_order(order_id, phone_code_status="delivered")
-        _cancel_code_reminder(order_id, context)
+        _cancel_code_reminder(order_id)
         log_action(order_id, "manager", "provide_code_auto", text)
 
         await msg.reply_text(f"✅ Код надіслано користувачу (Order {order_id}).",
@@ -620,10 +621,14 @@ async def manager_enter_data(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # Data needs confirmation, conversation will continue via callback
         return ConversationHandler.END
 
+    # Data and the managers' alert are committed together, the alert is delivered via the outbox
     _update_order(order_id,
+                  commit=False,
                   phone_number=p,
                   email=e,
                   stage2_status="data_received")
+    outbox_id = _enqueue_managers_after_data(order_id, context, update.message.message_id)
+    conn.commit()
     log_action(order_id, "manager", "provide_data", f"{p}|{e}")
 
     await update.message.reply_text(f"✅ Дані збережено: {p} | {e}",
@@ -633,7 +638,9 @@ async def manager_enter_data(update: Update, context: ContextTypes.DEFAULT_TYPE)
                      f"Можете підтвердити пошту / номер або натиснути '🔑 Запросити код' (не обовʼязково).",
                      )
     await _send_stage2_ui(user_id, order_id, context)
-    await _notify_managers_after_data(order_id, context)
+    if outbox_id is not None:
+        log_action(order_id, "system", "provide_data_notify")
+        await outbox_dispatcher.deliver(context.bot, outbox_id)
 
     context.user_data.pop('stage2_partial_phone', None)
     context.user_data.pop('stage2_partial_email', None)
@@ -653,7 +660,7 @@ async def manager_enter_code(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return STAGE2_MANAGER_WAIT_CODE
 
     _update_order(order_id, phone_code_status="delivered")
-    _cancel_code_reminder(order_id, context)
+    _cancel_code_reminder(order_id)
     log_action(order_id, "manager", "provide_code", code)
 
     cursor.execute("SELECT user_id FROM orders WHERE id=?", (order_id,))
@@ -40,5 +40,6 @@ def build_stage2_handlers():
         fallbacks=[],
         per_chat=True,
         per_message=False,
-        name="stage2_conv"
+        name="stage2_conv",
+        persistent=True
     )
@@ -2,6 +2,7 @@ from telegram import Update
 from telegram.ext import ContextTypes
 
 from handlers.photo_handlers import get_last_order_for_user
+from queue_eta import format_status, queue_estimator
 
 
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -12,4 +13,7 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     order_id, bank, action, stage, status_text, group_id = order
     text = f"📌 OrderID: {order_id}\n🏦 {bank} — {action}\n📍 {status_text}\nЕтап: {stage+1}"
+    position = queue_estimator.for_user(user_id)
+    if position:
+        text += "\n\n" + format_status(position)
     await update.message.reply_text(text)
@@ -0,0 +1,95 @@
+"""
+Small in-process metric primitives shared by the bot's schedulers.
+"""
+import time
+from bisect import bisect_left
+from typing import Dict, Optional, Sequence
+
+# Upper bounds in seconds; a last +Inf bucket is implied
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class Summary:
+    """count / sum / max accumulator for one metric."""
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def as_dict(self) -> Dict[str, float]:
+        avg = self.total / self.count if self.count else 0.0
+        return {"count": self.count, "avg": round(avg, 3), "max": round(self.max, 3)}
+
+
+class Histogram(Summary):
+    """Summary plus per-bucket counts (Prometheus `le` buckets) for percentiles."""
+    __slots__ = ("buckets", "counts")
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__()
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float):
+        super().observe(value)
+        self.counts[bisect_left(self.buckets, value)] += 1
+
+    def merge(self, other: "Histogram"):
+        """Add the observations of a histogram with the same buckets."""
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile, capped at the largest value seen."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def as_dict(self) -> Dict[str, float]:
+        d = super().as_dict()
+        d["p50"] = round(self.quantile(0.5), 4)
+        d["p95"] = round(self.quantile(0.95), 4)
+        return d
+
+
+class RateMeter:
+    """Events per second over the last `seconds`, counted in one-second buckets."""
+    __slots__ = ("total", "_counts", "_seconds")
+
+    def __init__(self, seconds: int = 300):
+        self.total = 0
+        self._counts = [0] * seconds
+        self._seconds = [-1] * seconds  # which second each bucket currently counts
+
+    def mark(self, now: Optional[float] = None):
+        second = int(time.monotonic() if now is None else now)
+        i = second % len(self._counts)
+        if self._seconds[i] != second:
+            self._seconds[i] = second
+            self._counts[i] = 0
+        self._counts[i] += 1
+        self.total += 1
+
+    def rate(self, window: int = 60, now: Optional[float] = None) -> float:
+        """Events per second over the last `window` seconds (at most the meter's span)."""
+        second = int(time.monotonic() if now is None else now)
+        window = min(window, len(self._counts))
+        events = sum(n for n, s in zip(self._counts, self._seconds) if second - window < s <= second)
+        return events / window
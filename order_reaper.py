@@ -0,0 +1,194 @@
+"""
+Expiry of abandoned orders.
+
+An order whose client went quiet keeps its group slot (load/busy and its
+manager_active_orders rows) until someone closes it. `orders.last_activity`
+(unix time) is bumped by triggers on every order_actions_log and order_photos
+row, and a partial index over it covers only open orders, so a pass reads just
+the orders that have been idle long enough, however large the table grows.
+
+A pass runs every ORDER_REAPER_SECONDS as a recurring scheduled event
+(scheduled_events.py). The idle limit is ORDER_IDLE_MINUTES, overridden per
+stage by ORDER_IDLE_STAGE_MINUTES ("1:60,3:240", stages numbered from 1 as the
+client sees them). ORDER_IDLE_WARN_MINUTES before the limit the client gets
+one warning with a "still here" button; any activity, including that button,
+restarts the clock and re-arms the warning. An order is expired only after its
+client was warned and had the full warning window, so orders that came due
+while the bot was down are warned first rather than closed on startup.
+
+Expired orders are closed together in one transaction: status
+EXPIRED_STATUS, removed from manager_active_orders, their groups released
+(release_group publishes the capacity event that hands the slots to the queue)
+and the client and the group notified through the outbox.
+"""
+import os
+import time
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from capacity_events import EXPIRED_STATUS, OPEN_ORDER_SQL
+from db import conn, cursor, logger
+from handlers.callback_codec import ORDER_KEEPALIVE
+from outbox import enqueue_message, outbox_dispatcher
+from queue_scheduler import release_group
+from scheduled_events import ScheduledEvent, event_scheduler, schedule
+from states import user_states
+
+ORDER_IDLE_MINUTES = float(os.getenv("ORDER_IDLE_MINUTES", "180"))
+ORDER_IDLE_STAGE_MINUTES = os.getenv("ORDER_IDLE_STAGE_MINUTES", "")
+ORDER_IDLE_WARN_MINUTES = float(os.getenv("ORDER_IDLE_WARN_MINUTES", "30"))
+ORDER_REAPER_SECONDS = float(os.getenv("ORDER_REAPER_SECONDS", "60"))
+
+REAPER_EVENT = "order_reaper"
+
+
+class IdleOrder(NamedTuple):
+    id: int
+    user_id: int
+    group_id: Optional[int]  # Telegram chat id
+    stage: int  # 0-based, as orders.stage
+    last_activity: float
+    warned_at: Optional[float]
+
+
+def parse_stage_minutes(spec: str) -> Dict[int, float]:
+    """"1:60,3:240" -> {0: 60.0, 2: 240.0}: idle limits in minutes keyed by orders.stage."""
+    limits = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        stage, _, minutes = item.partition(":")
+        try:
+            limits[int(stage) - 1] = float(minutes)
+        except ValueError:
+            logger.warning("Ignoring ORDER_IDLE_STAGE_MINUTES entry %r", item)
+    return limits
+
+
+def keepalive_keyboard(order_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton(
+        "✅ Я тут, продовжую", callback_data=ORDER_KEEPALIVE.encode(order_id=order_id))]])
+
+
+class OrderReaper:
+    def __init__(self, idle_minutes: float = ORDER_IDLE_MINUTES, stage_minutes: Optional[Dict[int, float]] = None,
+                 warn_minutes: float = ORDER_IDLE_WARN_MINUTES, interval: float = ORDER_REAPER_SECONDS):
+        self.idle_seconds = idle_minutes * 60
+        self.stage_seconds = {stage: minutes * 60 for stage, minutes in
+                              (parse_stage_minutes(ORDER_IDLE_STAGE_MINUTES) if stage_minutes is None
+                               else stage_minutes).items()}
+        self.warn_seconds = warn_minutes * 60
+        self.interval = interval
+
+        self.passes = 0
+        self.warned = 0
+        self.expired = 0
+        self.failed = 0
+
+    def limit(self, stage: int) -> float:
+        """Idle seconds after which an order at `stage` expires."""
+        return self.stage_seconds.get(stage, self.idle_seconds)
+
+    def start(self) -> None:
+        """Schedule the first pass; each pass schedules the next."""
+        schedule(REAPER_EVENT, REAPER_EVENT)
+        conn.commit()
+
+    async def sweep(self, bot: Any, events: List[ScheduledEvent]) -> None:
+        try:
+            self.run_once()
+        except Exception as e:
+            conn.rollback()
+            self.failed += 1
+            logger.exception("Order reaper pass failed: %s", e)
+        finally:
+            schedule(REAPER_EVENT, REAPER_EVENT, delay=self.interval)
+            conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"passes": self.passes, "warned": self.warned, "expired": self.expired, "failed": self.failed}
+
+    def idle_orders(self, now: float) -> List[IdleOrder]:
+        """
+        Open orders idle for at least the shortest limit minus the warning window, longest idle first.
+        Orders without a group belong to clients waiting in the queue and are left alone.
+        """
+        shortest = min([self.idle_seconds, *self.stage_seconds.values()])
+        cursor.execute(
+            f"SELECT id, user_id, group_id, stage, last_activity, expiry_warned_at FROM orders "
+            f"WHERE last_activity < ? AND {OPEN_ORDER_SQL} AND group_id IS NOT NULL ORDER BY last_activity",
+            (now - max(shortest - self.warn_seconds, 0),),
+        )
+        return [IdleOrder(*row) for row in cursor.fetchall()]
+
+    def run_once(self, now: Optional[float] = None) -> Tuple[int, int]:
+        """Warn and expire the idle orders; returns (warned, expired)."""
+        now = time.time() if now is None else now
+        to_warn, to_expire = [], []
+        for order in self.idle_orders(now):
+            expires_at = order.last_activity + self.limit(order.stage or 0)
+            if now < expires_at - self.warn_seconds:
+                continue
+            warned = order.warned_at is not None and order.warned_at >= order.last_activity
+            if not warned:
+                to_warn.append(order)
+            elif now >= max(expires_at, order.warned_at + self.warn_seconds):
+                to_expire.append(order)
+        if to_warn:
+            self._warn(to_warn, now)
+        expired = self._expire(to_expire) if to_expire else []
+        if to_warn or expired:
+            outbox_dispatcher.wake()
+        self.passes += 1
+        self.warned += len(to_warn)
+        self.expired += len(expired)
+        return len(to_warn), len(expired)
+
+    def _warn(self, orders: List[IdleOrder], now: float):
+        minutes = round(self.warn_seconds / 60)
+        for order in orders:
+            cursor.execute("UPDATE orders SET expiry_warned_at=? WHERE id=?", (now, order.id))
+            enqueue_message(
+                order.user_id,
+                f"⏳ Замовлення #{order.id} неактивне. Якщо ви не продовжите протягом {minutes} хв, "
+                "його буде автоматично скасовано, а місце передано наступному клієнту.",
+                f"order_idle_warn:{order.id}:{order.last_activity}",
+                reply_markup=keepalive_keyboard(order.id),
+            )
+        conn.commit()
+
+    def _expire(self, orders: List[IdleOrder]) -> List[Tuple[int, int, Optional[int]]]:
+        """Close the orders in one transaction; returns (order_id, user_id, group_id) of those still open."""
+        ids = [order.id for order in orders]
+        placeholders = ",".join("?" * len(ids))
+        cursor.execute(
+            f"UPDATE orders SET status=? WHERE id IN ({placeholders}) AND {OPEN_ORDER_SQL} RETURNING id, user_id, group_id",
+            (EXPIRED_STATUS, *ids),
+        )
+        rows = cursor.fetchall()
+        cursor.execute(f"DELETE FROM manager_active_orders WHERE order_id IN ({placeholders})", ids)
+        for group_chat_id, count in Counter(group_id for _, _, group_id in rows if group_id).items():
+            release_group(group_chat_id, count)
+        for order_id, user_id, group_chat_id in rows:
+            cursor.execute("INSERT INTO order_actions_log (order_id, actor, action_type) VALUES (?, 'system', 'expired')",
+                           (order_id,))
+            enqueue_message(user_id, f"⌛ Замовлення #{order_id} скасовано через неактивність. "
+                                     "Щоб почати знову, скористайтеся командою /start.",
+                            f"order_expired:{order_id}")
+            if group_chat_id:
+                enqueue_message(group_chat_id, f"⌛ Замовлення #{order_id} автоматично закрито: клієнт неактивний.",
+                                f"order_expired_group:{order_id}")
+        conn.commit()
+        for order_id, user_id, _ in rows:
+            state = user_states.get(user_id)
+            if state and state.get("order_id") == order_id:
+                user_states.pop(user_id, None)
+        if rows:
+            logger.info("Expired %s idle orders: %s", len(rows), [order_id for order_id, _, _ in rows])
+        return rows
+
+
+order_reaper = OrderReaper()
+event_scheduler.register(REAPER_EVENT, order_reaper.sweep)
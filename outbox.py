@@ -0,0 +1,233 @@
+"""
+Transactional outbox for notifications that must survive crashes and network errors.
+
+Producers call `enqueue_message` on the shared cursor in the same transaction as
+the state change the message announces, and commit both together. The
+OutboxDispatcher then delivers pending rows, retrying with exponential backoff.
+
+Delivery is at-least-once. If the process dies between the send and the 'sent'
+update, the message goes out again after restart. The producer's idempotency key
+makes re-running a producer a no-op. Rows that fail permanently (bot blocked,
+chat not found) or use up their attempts become dead letters. Admins can see and
+re-queue them in the admin interface (⚙️ Система → 📮 Outbox).
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden
+
+from db import conn, cursor, logger
+
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_KEEP_DAYS = int(os.getenv("OUTBOX_KEEP_DAYS", "7"))
+
+_BATCH = 50
+_BACKOFF_BASE = 2.0
+_BACKOFF_MAX = 600.0
+_PURGE_EVERY = 3600.0
+
+# id, chat_id, text, options, attempts
+_Row = Tuple[int, int, str, Optional[str], int]
+
+
+def enqueue_message(chat_id: int, text: str, idem_key: str, parse_mode: Optional[str] = None,
+                    reply_markup: Optional[InlineKeyboardMarkup] = None) -> Optional[int]:
+    """Add a message to the outbox (caller commits). Returns its id, or None if idem_key was already used."""
+    options: Dict[str, Any] = {}
+    if parse_mode:
+        options["parse_mode"] = parse_mode
+    if reply_markup is not None:
+        options["reply_markup"] = reply_markup.to_dict()
+    cursor.execute(
+        "INSERT INTO outbox (idem_key, chat_id, text, options, next_attempt_at) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(idem_key) DO NOTHING RETURNING id",
+        (idem_key, chat_id, text, json.dumps(options, ensure_ascii=False) if options else None, time.time()),
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def outbox_counts() -> Dict[str, int]:
+    cursor.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status")
+    return dict(cursor.fetchall())
+
+
+def dead_letters(limit: int = 20) -> List[tuple]:
+    """Newest dead letters: (id, chat_id, text, attempts, last_error, created_at)."""
+    cursor.execute(
+        "SELECT id, chat_id, text, attempts, last_error, created_at FROM outbox "
+        "WHERE status='dead' ORDER BY id DESC LIMIT ?",
+        (limit,),
+    )
+    return cursor.fetchall()
+
+
+def requeue_dead() -> int:
+    """Give every dead letter a fresh set of attempts."""
+    cursor.execute(
+        "UPDATE outbox SET status='pending', attempts=0, next_attempt_at=? WHERE status='dead'",
+        (time.time(),),
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(_BACKOFF_MAX, _BACKOFF_BASE * (2 ** (attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class OutboxDispatcher:
+    def __init__(self, poll_seconds: float = OUTBOX_POLL_SECONDS, max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self._bot: Any = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._last_purge = 0.0
+
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+
+    def start(self, bot: Any) -> None:
+        self._bot = bot
+        # Rows claimed by a process that died mid-send are delivered again (at-least-once)
+        cursor.execute("UPDATE outbox SET status='pending' WHERE status='sending'")
+        conn.commit()
+        self._wake = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self) -> None:
+        """Tell the dispatcher new rows were committed; no-op before start()."""
+        if self._wake is not None:
+            self._wake.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sent": self.sent, "retried": self.retried, "dead": self.dead, "rows": outbox_counts()}
+
+    async def deliver(self, bot: Any, outbox_id: Optional[int]) -> bool:
+        """Send one committed row right away (keeps order with direct sends that follow it).
+
+        On failure the row stays in the outbox and the dispatcher retries it later.
+        """
+        if outbox_id is None:
+            return False
+        rows = self._claim("id = ?", (outbox_id,))
+        if not rows:
+            return False
+        return await self._send(bot, rows[0])
+
+    async def run_once(self, bot: Any) -> int:
+        """Deliver up to one batch of due rows, oldest first; returns how many were attempted."""
+        rows = self._claim(
+            "id IN (SELECT id FROM outbox WHERE status='pending' AND next_attempt_at <= ? "
+            "ORDER BY next_attempt_at LIMIT ?)",
+            (time.time(), _BATCH),
+        )
+        for row in rows:
+            await self._send(bot, row)
+        return len(rows)
+
+    # ---------- internals ----------
+
+    def _claim(self, where: str, params: tuple) -> List[_Row]:
+        cursor.execute(
+            f"UPDATE outbox SET status='sending' WHERE status='pending' AND {where} "
+            "RETURNING id, chat_id, text, options, attempts",
+            params,
+        )
+        rows = cursor.fetchall()
+        conn.commit()
+        return sorted(rows)
+
+    async def _send(self, bot: Any, row: _Row) -> bool:
+        outbox_id, chat_id, text, options, attempts = row
+        attempts += 1
+        kwargs = json.loads(options) if options else {}
+        if "reply_markup" in kwargs:
+            kwargs["reply_markup"] = InlineKeyboardMarkup.de_json(kwargs["reply_markup"], bot)
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        except (Forbidden, BadRequest) as e:
+            self._mark_dead(outbox_id, attempts, e)
+            return False
+        except Exception as e:
+            if attempts >= self.max_attempts:
+                self._mark_dead(outbox_id, attempts, e)
+            else:
+                self.retried += 1
+                cursor.execute(
+                    "UPDATE outbox SET status='pending', attempts=?, next_attempt_at=?, last_error=? WHERE id=?",
+                    (attempts, time.time() + _backoff(attempts), str(e), outbox_id),
+                )
+                conn.commit()
+                logger.warning("Outbox %s to %s failed (attempt %d), will retry: %s", outbox_id, chat_id, attempts, e)
+            return False
+        cursor.execute(
+            "UPDATE outbox SET status='sent', attempts=?, sent_at=CURRENT_TIMESTAMP, last_error=NULL WHERE id=?",
+            (attempts, outbox_id),
+        )
+        conn.commit()
+        self.sent += 1
+        return True
+
+    def _mark_dead(self, outbox_id: int, attempts: int, error: Exception):
+        self.dead += 1
+        cursor.execute(
+            "UPDATE outbox SET status='dead', attempts=?, last_error=? WHERE id=?",
+            (attempts, str(error), outbox_id),
+        )
+        conn.commit()
+        logger.warning("Outbox %s moved to dead letters after %d attempt(s): %s", outbox_id, attempts, error)
+
+    def _purge_sent(self):
+        cursor.execute(
+            "DELETE FROM outbox WHERE status='sent' AND sent_at < datetime('now', ?)",
+            (f"-{OUTBOX_KEEP_DAYS} days",),
+        )
+        conn.commit()
+
+    def _next_wait(self) -> float:
+        cursor.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status='pending'")
+        due = cursor.fetchone()[0]
+        if due is None:
+            return self.poll_seconds
+        return max(0.0, min(self.poll_seconds, due - time.time()))
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            attempted = 0
+            try:
+                if time.monotonic() - self._last_purge >= _PURGE_EVERY:
+                    self._last_purge = time.monotonic()
+                    self._purge_sent()
+                attempted = await self.run_once(self._bot)
+                wait = 0.0 if attempted >= _BATCH else self._next_wait()
+            except Exception as e:
+                logger.warning("Outbox dispatcher error: %s", e)
+                wait = self.poll_seconds
+            if wait > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+
+
+outbox_dispatcher = OutboxDispatcher()
@@ -0,0 +1,202 @@
+"""
+SQLite-backed persistence for python-telegram-bot.
+
+Stores chat_data, user_data, bot_data and ConversationHandler states in the
+`persistence_store` table of the main bot database, so manager context
+(current order of a group, pending reject reason, conversation steps) survives
+restarts and deploys.
+
+Only entries whose serialized value actually changed since the last write are
+flushed; everything dirty from one `Application.update_persistence` run is
+written in a single transaction.
+"""
+import asyncio
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db import conn, logger
+
+# How often (seconds) the Application pushes in-memory data to the persistence
+PERSISTENCE_FLUSH_SECONDS = float(os.getenv("PERSISTENCE_FLUSH_SECONDS", "30"))
+
+_NS_CHAT = "chat_data"
+_NS_USER = "user_data"
+_NS_BOT = "bot_data"
+_NS_CONV_PREFIX = "conv:"
+
+# (namespace, key) -> serialized JSON, or None to delete the row
+PendingWrites = Dict[Tuple[str, str], Optional[str]]
+
+
+def _dumps(data: Any) -> Optional[str]:
+    try:
+        return json.dumps(data, ensure_ascii=False, sort_keys=True)
+    except (TypeError, ValueError) as e:
+        logger.warning("Persistence: value is not JSON-serializable, skipped: %s", e)
+        return None
+
+
+def _conv_key_to_str(key: Tuple) -> str:
+    return json.dumps(list(key))
+
+
+def _conv_key_from_str(raw: str) -> Tuple:
+    return tuple(json.loads(raw))
+
+
+class SQLitePersistence(BasePersistence):
+    """BasePersistence implementation on top of the shared sqlite connection with dirty-tracking."""
+
+    def __init__(self, update_interval: float = PERSISTENCE_FLUSH_SECONDS):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        # Last value known to be in the DB, used to skip unchanged entries
+        self._snapshot: Dict[Tuple[str, str], str] = {}
+        self._pending: PendingWrites = {}
+        self._write_scheduled = False
+
+    # ---------- loading ----------
+
+    def _load_namespace(self, namespace: str) -> Dict[str, Any]:
+        result = {}
+        rows = conn.execute(
+            "SELECT key, data FROM persistence_store WHERE namespace=?", (namespace,)
+        ).fetchall()
+        for key, raw in rows:
+            try:
+                result[key] = json.loads(raw)
+            except Exception as e:
+                logger.warning("Persistence: corrupted row %s/%s dropped: %s", namespace, key, e)
+                continue
+            self._snapshot[(namespace, key)] = raw
+        return result
+
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {int(k): v for k, v in self._load_namespace(_NS_CHAT).items()}
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        return {int(k): v for k, v in self._load_namespace(_NS_USER).items()}
+
+    async def get_bot_data(self) -> Dict:
+        return self._load_namespace(_NS_BOT).get("", {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        loaded = self._load_namespace(_NS_CONV_PREFIX + name)
+        return {_conv_key_from_str(k): v for k, v in loaded.items()}
+
+    # ---------- dirty tracking ----------
+
+    def _mark(self, namespace: str, key: str, serialized: Optional[str]):
+        ident = (namespace, key)
+        if serialized is not None and self._snapshot.get(ident) == serialized:
+            self._pending.pop(ident, None)
+            return
+        if serialized is None and ident not in self._snapshot:
+            self._pending.pop(ident, None)
+            return
+        self._pending[ident] = serialized
+        self._schedule_write()
+
+    def _schedule_write(self):
+        # All update_* coroutines of one Application.update_persistence run are started
+        # before this callback fires, so they end up in one transaction.
+        if self._write_scheduled:
+            return
+        try:
+            asyncio.get_running_loop().call_soon(self._write_pending)
+            self._write_scheduled = True
+        except RuntimeError:
+            self._write_pending()
+
+    def _write_pending(self):
+        self._write_scheduled = False
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            for (namespace, key), serialized in pending.items():
+                if serialized is None:
+                    conn.execute("DELETE FROM persistence_store WHERE namespace=? AND key=?", (namespace, key))
+                else:
+                    conn.execute(
+                        "INSERT INTO persistence_store (namespace, key, data, updated_at) "
+                        "VALUES (?, ?, ?, CURRENT_TIMESTAMP) "
+                        "ON CONFLICT(namespace, key) DO UPDATE SET data=excluded.data, updated_at=excluded.updated_at",
+                        (namespace, key, serialized),
+                    )
+            conn.commit()
+        except Exception as e:
+            logger.warning("Persistence flush failed (%d entries kept for retry): %s", len(pending), e)
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            # Newer pending values win over the failed batch
+            pending.update(self._pending)
+            self._pending = pending
+            return
+        for ident, serialized in pending.items():
+            if serialized is None:
+                self._snapshot.pop(ident, None)
+            else:
+                self._snapshot[ident] = serialized
+        logger.debug("Persistence: flushed %d changed entries", len(pending))
+
+    # ---------- updates from Application ----------
+
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        serialized = _dumps(data)
+        if serialized is not None:
+            self._mark(_NS_CHAT, str(chat_id), serialized)
+
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        serialized = _dumps(data)
+        if serialized is not None:
+            self._mark(_NS_USER, str(user_id), serialized)
+
+    async def update_bot_data(self, data: Dict) -> None:
+        serialized = _dumps(data)
+        if serialized is not None:
+            self._mark(_NS_BOT, "", serialized)
+
+    async def update_callback_data(self, data) -> None:
+        return
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]) -> None:
+        namespace = _NS_CONV_PREFIX + name
+        if new_state is None:
+            self._mark(namespace, _conv_key_to_str(key), None)
+            return
+        serialized = _dumps(new_state)
+        if serialized is not None:
+            self._mark(namespace, _conv_key_to_str(key), serialized)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._mark(_NS_CHAT, str(chat_id), None)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._mark(_NS_USER, str(user_id), None)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        return
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        return
+
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        return
+
+    async def flush(self) -> None:
+        self._write_pending()
+
+    def pending_count(self) -> int:
+        """Number of changed entries waiting for the next write."""
+        return len(self._pending)
@@ -0,0 +1,267 @@
+"""
+SQL profiler for the shared connection.
+
+Every statement run through db.conn or db.cursor is timed by kind (SELECT,
+INSERT, ...) as a histogram for /metrics, and per fingerprint - the statement
+with literals, placeholder lists and whitespace normalized - as count/total/max
+together with the line of code that first issued it. Statements slower than
+SQL_SLOW_MS are logged with the line that ran them.
+
+The first time a fingerprint is seen its EXPLAIN QUERY PLAN is read, and a
+full scan ("SCAN <table>", covering-index scans included; walking a partial
+index is not one) of one of SQL_AUDIT_TABLES is logged once and listed by
+/sql. With SQL_STRICT_SCANS set
+to a list of tables (the test suite sets "orders,order_photos", see
+conftest.py) such a statement raises FullScanError instead of running, unless
+it is issued from one of KNOWN_SCANS - reports that read a whole table on
+purpose - or from a test file.
+"""
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from metrics import DB_BUCKETS, Histogram, Summary
+
+SQL_SLOW_MS = float(os.getenv("SQL_SLOW_MS", "100"))
+SQL_EXPLAIN = os.getenv("SQL_EXPLAIN", "1") != "0"
+SQL_AUDIT_TABLES = os.getenv("SQL_AUDIT_TABLES", "orders,order_photos,order_actions_log,order_forms,outbox")
+SQL_STRICT_SCANS = os.getenv("SQL_STRICT_SCANS", "")
+
+# "module.function" sites whose statements may scan audited tables: admin
+# reports and broadcasts that aggregate over every order by design
+KNOWN_SCANS = frozenset({
+    "db.ensure_schema",  # one-off last_activity backfill
+    "db.rebuild_stage_progress",  # startup rebuild of the counters
+    "admin_handlers.history",
+    "admin_handlers.finish_all_orders",
+    "admin_handlers.orders_stats",
+    "admin_handlers.broadcast_cmd",
+    "admin_interface.orders_history",
+    "admin_interface.orders_stats",
+    "admin_interface.stats_general",
+    "admin_interface.stats_banks",
+})
+
+_MAX_STATEMENTS = 2000  # distinct fingerprints kept; later ones are timed by kind only
+_EXPLAINED = {"SELECT", "UPDATE", "DELETE", "INSERT", "REPLACE", "WITH"}
+_THIS_FILE = os.path.normcase(__file__)
+
+logger = logging.getLogger(__name__)
+
+_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.I)
+_SPACE = re.compile(r"\s+")
+_TABLE_REF = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.I)
+_NOT_ALIAS = {"where", "join", "left", "right", "inner", "outer", "cross", "on", "using", "set", "order", "group",
+              "limit", "values", "select", "default", "returning", "natural", "having", "union", "except",
+              "intersect", "window", "indexed", "not"}
+_SCAN = re.compile(r"^SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?")
+
+
+class FullScanError(sqlite3.DatabaseError):
+    """A statement would scan a whole table listed in SQL_STRICT_SCANS."""
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql: str) -> str:
+    """Statement shape: literals become ?, `IN (?, ?, ...)` becomes `IN (...)`, whitespace collapses."""
+    sql = _COMMENT.sub(" ", sql)
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("IN (...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+def statement_kind(sql: str) -> str:
+    words = sql.split(None, 1)
+    return words[0].upper() if words else "?"
+
+
+def table_aliases(sql: str) -> Dict[str, str]:
+    """Names a statement refers to its tables by (alias or table name) -> table name."""
+    aliases = {}
+    for table, alias in _TABLE_REF.findall(sql):
+        aliases[table.lower()] = table.lower()
+        if alias and alias.lower() not in _NOT_ALIAS:
+            aliases[alias.lower()] = table.lower()
+    return aliases
+
+
+def scanned_tables(sql: str, plan: Iterable[str], partial_indexes: Iterable[str] = ()) -> List[str]:
+    """Tables a query plan reads in full; walking a partial index reads only the rows it covers."""
+    aliases = table_aliases(sql)
+    partial = {name.lower() for name in partial_indexes}
+    tables = []
+    for detail in plan:
+        match = _SCAN.match(detail)
+        if match and match.group(1).lower() in aliases and (match.group(2) or "").lower() not in partial:
+            tables.append(aliases[match.group(1).lower()])
+    return tables
+
+
+def partial_indexes(connection: sqlite3.Connection) -> List[str]:
+    rows = sqlite3.Cursor(connection).execute(
+        "SELECT name FROM sqlite_master WHERE type='index' AND sql LIKE '% WHERE %'").fetchall()
+    return [name for name, in rows]
+
+
+def _tables(spec: str) -> frozenset:
+    return frozenset(table.strip().lower() for table in spec.split(",") if table.strip())
+
+
+def call_site(depth: int = 2) -> Tuple[str, str]:
+    """("file.py:line", "module.function") of the nearest caller outside this module."""
+    frame = sys._getframe(depth)
+    while frame is not None and os.path.normcase(frame.f_code.co_filename) == _THIS_FILE:
+        frame = frame.f_back
+    if frame is None:
+        return "?", "?"
+    path = os.path.basename(frame.f_code.co_filename)
+    module = frame.f_globals.get("__name__", path).rsplit(".", 1)[-1]
+    return f"{path}:{frame.f_lineno}", f"{module}.{frame.f_code.co_name}"
+
+
+class StatementStats:
+    __slots__ = ("timing", "kind", "site", "function", "plan", "scans", "slow")
+
+    def __init__(self, kind: str, site: str, function: str):
+        self.timing = Summary()
+        self.kind = kind
+        self.site = site
+        self.function = function
+        self.plan: Optional[List[str]] = None  # None: not explained
+        self.scans: List[str] = []
+        self.slow = 0
+
+
+class QueryProfiler:
+    def __init__(self, slow_ms: float = SQL_SLOW_MS, audit_tables: str = SQL_AUDIT_TABLES,
+                 strict_tables: str = SQL_STRICT_SCANS, explain: bool = SQL_EXPLAIN,
+                 known_scans: Iterable[str] = KNOWN_SCANS):
+        self.slow_seconds = slow_ms / 1000
+        self.audit_tables = _tables(audit_tables)
+        self.strict_tables = _tables(strict_tables)
+        self.explain = explain
+        self.known_scans = frozenset(known_scans)
+
+        self.kinds: Dict[str, Histogram] = defaultdict(lambda: Histogram(DB_BUCKETS))
+        self.statements: Dict[str, StatementStats] = {}
+        self.slow = 0
+        self.blocked = 0
+
+    def reset(self):
+        """Drop the per-statement numbers; plans are read again as statements come back."""
+        self.statements.clear()
+        self.kinds.clear()
+        self.slow = 0
+
+    def prepare(self, connection: sqlite3.Connection, sql: str, parameters: Any = ()) -> Optional[StatementStats]:
+        """Stats entry of the statement, explained on first sight; raises FullScanError in strict mode."""
+        key = fingerprint(sql)
+        entry = self.statements.get(key)
+        if entry is None:
+            if len(self.statements) >= _MAX_STATEMENTS:
+                return None
+            entry = self.statements[key] = StatementStats(statement_kind(key), *call_site(3))
+            if self.explain and entry.kind in _EXPLAINED:
+                self._explain(connection, sql, parameters, entry)
+        if entry.scans and self.strict_tables.intersection(entry.scans):
+            site, function = call_site(3)
+            if function not in self.known_scans and not os.path.basename(site).startswith("test_"):
+                self.blocked += 1
+                raise FullScanError(f"Full scan of {', '.join(entry.scans)} at {site}: {key}")
+        return entry
+
+    def _explain(self, connection: sqlite3.Connection, sql: str, parameters: Any, entry: StatementStats):
+        try:
+            # a plain cursor, so the EXPLAIN is not profiled itself
+            rows = sqlite3.Cursor(connection).execute("EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+        except sqlite3.Error:
+            return  # the statement itself will report what is wrong with it
+        entry.plan = [row[-1] for row in rows]
+        scans = scanned_tables(sql, entry.plan, partial_indexes(connection)) if any(
+            detail.startswith("SCAN ") for detail in entry.plan) else []
+        entry.scans = [table for table in scans if table in self.audit_tables]
+        if entry.scans:
+            logger.warning("Full scan of %s at %s (%s): %s", ", ".join(entry.scans), entry.site, entry.function,
+                           fingerprint(sql))
+
+    def record(self, entry: Optional[StatementStats], sql: str, seconds: float):
+        kind = entry.kind if entry is not None else statement_kind(sql)
+        self.kinds[kind].observe(seconds)
+        if entry is not None:
+            entry.timing.observe(seconds)
+        if seconds >= self.slow_seconds:
+            self.slow += 1
+            if entry is not None:
+                entry.slow += 1
+            site, function = call_site(3)
+            logger.warning("Slow query %.0f ms at %s (%s): %s", seconds * 1000, site, function, fingerprint(sql))
+
+    def top(self, limit: int = 10, by: str = "total") -> List[Tuple[str, StatementStats]]:
+        """Statements ranked by total, max or count."""
+        return sorted(self.statements.items(), key=lambda item: getattr(item[1].timing, by), reverse=True)[:limit]
+
+    def scans(self) -> List[Tuple[str, StatementStats]]:
+        return [(key, entry) for key, entry in self.statements.items() if entry.scans]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "statements": len(self.statements),
+            "executed": sum(entry.timing.count for entry in self.statements.values()),
+            "slow": self.slow,
+            "scans": sum(1 for entry in self.statements.values() if entry.scans),
+            "blocked": self.blocked,
+        }
+
+
+query_profiler = QueryProfiler()
+
+
+def _timed(run, sql: str, parameters: Any, connection: sqlite3.Connection):
+    entry = query_profiler.prepare(connection, sql, parameters)
+    started = time.perf_counter()
+    try:
+        return run()
+    finally:
+        query_profiler.record(entry, sql, time.perf_counter() - started)
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        return _timed(lambda: super(ProfiledCursor, self).execute(sql, parameters), sql, parameters, self.connection)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not isinstance(seq_of_parameters, (list, tuple)):
+            seq_of_parameters = list(seq_of_parameters)
+        first = seq_of_parameters[0] if seq_of_parameters else ()
+        return _timed(lambda: super(ProfiledCursor, self).executemany(sql, seq_of_parameters),
+                      sql, first, self.connection)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            query_profiler.kinds["SCRIPT"].observe(time.perf_counter() - started)
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Connection whose cursors, and execute() shortcuts, go through the profiler."""
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,235 @@
+"""
+Queue positions and waiting-time estimates for queued users.
+
+Every finished order feeds its duration into exponentially weighted averages
+per (bank, group), per bank and overall (`service_times`). A queued client's
+ETA is its position among the clients of the same bank divided by the rate at
+which the groups that can serve that bank finish orders: bank groups fully,
+admin groups in proportion to the bank's share of the queue (they take the
+oldest client of any bank, see queue_scheduler.py).
+
+QueueStatusNotifier keeps each user's "you are in the queue" message up to
+date by editing it. Edits are throttled: at most QUEUE_ETA_EDITS_PER_RUN per
+refresh, front of the queue first, a message at most once per
+QUEUE_ETA_MIN_EDIT_SECONDS and only when its rounded text changed, all at bulk
+priority, so a thousand-deep queue costs a few edits a minute. Refreshes are a
+recurring scheduled event (scheduled_events.py); wake() moves the next one to
+now.
+"""
+import math
+import os
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from telegram.error import BadRequest, Forbidden
+
+from db import conn, cursor, logger
+from rate_limiter import PRIORITY_BULK
+from scheduled_events import ScheduledEvent, event_scheduler, schedule
+
+QUEUE_ETA_REFRESH_SECONDS = float(os.getenv("QUEUE_ETA_REFRESH_SECONDS", "60"))
+QUEUE_ETA_EDITS_PER_RUN = int(os.getenv("QUEUE_ETA_EDITS_PER_RUN", "20"))
+QUEUE_ETA_MIN_EDIT_SECONDS = float(os.getenv("QUEUE_ETA_MIN_EDIT_SECONDS", "300"))
+QUEUE_ETA_ALPHA = float(os.getenv("QUEUE_ETA_ALPHA", "0.2"))
+QUEUE_ETA_DEFAULT_MINUTES = float(os.getenv("QUEUE_ETA_DEFAULT_MINUTES", "30"))
+
+# Orders left open for days (abandoned, closed by /finish_all_orders later) would swamp the average
+_MAX_SAMPLE_SECONDS = 6 * 3600
+_BULK = {"priority": PRIORITY_BULK}
+REFRESH_EVENT = "queue_eta_refresh"
+
+
+class QueuePosition(NamedTuple):
+    queue_id: int
+    user_id: int
+    bank: str
+    position: int  # 1-based, among the clients of the same bank
+    eta_seconds: Optional[float]  # None when no group can serve the bank
+    message_id: Optional[int]
+    status_text: Optional[str]
+    status_updated_at: Optional[float]
+
+
+def record_service_time(order_id: int):
+    """Fold the duration of a finished order into the averages (caller commits)."""
+    cursor.execute(
+        "SELECT bank, group_id, (julianday('now') - julianday(created_at)) * 86400 FROM orders WHERE id=?",
+        (order_id,),
+    )
+    row = cursor.fetchone()
+    if not row or not row[1] or row[2] is None or row[2] <= 0:
+        return
+    bank, group_id, seconds = row[0] or "", row[1], min(row[2], _MAX_SAMPLE_SECONDS)
+    for key in ((bank, group_id), (bank, 0), ("", 0)):
+        cursor.execute(
+            "INSERT INTO service_times (bank, group_id, avg_seconds) VALUES (?, ?, ?) "
+            "ON CONFLICT(bank, group_id) DO UPDATE SET "
+            "avg_seconds = avg_seconds + ? * (excluded.avg_seconds - avg_seconds), "
+            "samples = samples + 1, updated_at = CURRENT_TIMESTAMP",
+            (*key, seconds, QUEUE_ETA_ALPHA),
+        )
+
+
+def format_eta(seconds: Optional[float]) -> str:
+    """Coarse on purpose: the text (and so the message) changes only every few minutes."""
+    if seconds is None:
+        return "поки невідомо"
+    if seconds < 3600:
+        return f"~{max(5, math.ceil(seconds / 300) * 5)} хв"
+    return f"~{math.ceil(seconds / 1800) / 2:g} год"
+
+
+def format_status(position: QueuePosition) -> str:
+    return (f"📍 Ваше місце в черзі: {position.position} ({position.bank})\n"
+            f"🕒 Орієнтовний час очікування: {format_eta(position.eta_seconds)}\n"
+            "Отримаєте повідомлення, коли звільниться менеджер.")
+
+
+class QueueEstimator:
+    def __init__(self, default_seconds: float = QUEUE_ETA_DEFAULT_MINUTES * 60):
+        self.default_seconds = default_seconds
+
+    def _service_times(self) -> Dict[Tuple[str, int], float]:
+        cursor.execute("SELECT bank, group_id, avg_seconds FROM service_times")
+        return {(bank, group_id): avg for bank, group_id, avg in cursor.fetchall()}
+
+    def _bank_rates(self, counts: Dict[str, int]) -> Dict[str, float]:
+        """Orders per second the groups finish for each queued bank."""
+        averages = self._service_times()
+
+        def seconds(bank: str, group_id: int) -> float:
+            for key in ((bank, group_id), (bank, 0), ("", 0)):
+                if key in averages:
+                    return max(averages[key], 1.0)
+            return self.default_seconds
+
+        cursor.execute(
+            "SELECT group_id, bank, is_admin_group, capacity FROM manager_groups "
+            "WHERE capacity > 0 AND (is_admin_group=1 OR bank IS NOT NULL)"
+        )
+        groups = cursor.fetchall()
+        total = sum(counts.values())
+        rates = {}
+        for bank, count in counts.items():
+            rate = 0.0
+            for group_id, group_bank, is_admin, capacity in groups:
+                if is_admin:
+                    rate += capacity / seconds(bank, group_id) * count / total
+                elif group_bank == bank:
+                    rate += capacity / seconds(bank, group_id)
+            rates[bank] = rate
+        return rates
+
+    def snapshot(self) -> List[QueuePosition]:
+        """Position and ETA of every queued client, in one pass over the queue."""
+        cursor.execute(
+            "SELECT id, user_id, bank, status_message_id, status_text, status_updated_at "
+            "FROM queue ORDER BY bank, priority, id"
+        )
+        rows = cursor.fetchall()
+        counts: Dict[str, int] = {}
+        for row in rows:
+            counts[row[2]] = counts.get(row[2], 0) + 1
+        rates = self._bank_rates(counts)
+
+        positions = []
+        bank, position = None, 0
+        for queue_id, user_id, row_bank, message_id, text, updated_at in rows:
+            position = position + 1 if row_bank == bank else 1
+            bank = row_bank
+            rate = rates.get(bank, 0.0)
+            eta = position / rate if rate > 0 else None
+            positions.append(QueuePosition(queue_id, user_id, bank, position, eta, message_id, text, updated_at))
+        return positions
+
+    def for_user(self, user_id: int) -> Optional[QueuePosition]:
+        """The user's first queue entry, or None if they are not queued."""
+        return next((p for p in sorted(self.snapshot(), key=lambda p: p.position) if p.user_id == user_id), None)
+
+
+def remember_status_message(queue_id: int, message_id: int, status_text: str):
+    """Attach the user's queue message to their queue entry so it can be kept up to date."""
+    cursor.execute(
+        "UPDATE queue SET status_message_id=?, status_text=?, status_updated_at=? WHERE id=?",
+        (message_id, status_text, time.time(), queue_id),
+    )
+    conn.commit()
+
+
+class QueueStatusNotifier:
+    def __init__(self, estimator: QueueEstimator, refresh_seconds: float = QUEUE_ETA_REFRESH_SECONDS,
+                 edits_per_run: int = QUEUE_ETA_EDITS_PER_RUN, min_edit_seconds: float = QUEUE_ETA_MIN_EDIT_SECONDS):
+        self.estimator = estimator
+        self.refresh_seconds = refresh_seconds
+        self.edits_per_run = edits_per_run
+        self.min_edit_seconds = min_edit_seconds
+
+        self.edits = 0
+        self.deferred = 0  # changed texts left for a later run by the per-run cap
+        self.failed = 0
+
+    def start(self) -> None:
+        """Schedule the first refresh; each refresh schedules the next."""
+        self.wake()
+
+    def wake(self) -> None:
+        """The queue moved; refresh now instead of at the next interval."""
+        schedule(REFRESH_EVENT, REFRESH_EVENT)
+        conn.commit()
+
+    async def refresh(self, bot: Any, events: List[ScheduledEvent]) -> None:
+        try:
+            await self.run_once(bot)
+        finally:
+            schedule(REFRESH_EVENT, REFRESH_EVENT, delay=self.refresh_seconds)
+            conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"edits": self.edits, "deferred": self.deferred, "failed": self.failed}
+
+    async def run_once(self, bot: Any, now: Optional[float] = None) -> int:
+        """Edit the messages whose text changed, front of the queue first; returns how many were edited."""
+        now = time.time() if now is None else now
+        due = []
+        for position in self.estimator.snapshot():
+            if position.message_id is None:
+                continue
+            text = format_status(position)
+            if text == position.status_text:
+                continue
+            if now - (position.status_updated_at or 0) < self.min_edit_seconds:
+                continue
+            due.append((position, text))
+        due.sort(key=lambda item: (item[0].position, item[0].queue_id))
+        self.deferred += max(0, len(due) - self.edits_per_run)
+
+        edited = 0
+        for position, text in due[:self.edits_per_run]:
+            try:
+                await bot.edit_message_text(chat_id=position.user_id, message_id=position.message_id,
+                                            text="⏳ Ви в черзі.\n" + text, rate_limit_args=_BULK)
+            except Forbidden:
+                cursor.execute("UPDATE queue SET status_message_id=NULL WHERE id=?", (position.queue_id,))
+                conn.commit()
+                continue
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    # message deleted by the user or too old to edit: stop trying
+                    cursor.execute("UPDATE queue SET status_message_id=NULL WHERE id=?", (position.queue_id,))
+                    conn.commit()
+                    continue
+            except Exception as e:
+                self.failed += 1
+                logger.warning("Queue status edit for user %s failed: %s", position.user_id, e)
+                continue
+            cursor.execute("UPDATE queue SET status_text=?, status_updated_at=? WHERE id=?",
+                           (text, now, position.queue_id))
+            conn.commit()
+            edited += 1
+        self.edits += edited
+        return edited
+
+
+queue_estimator = QueueEstimator()
+queue_status_notifier = QueueStatusNotifier(queue_estimator)
+event_scheduler.register(REFRESH_EVENT, queue_status_notifier.refresh)
@@ -0,0 +1,108 @@
+"""
+Priority of queued clients.
+
+Each queue row gets a `priority` when it is enqueued: the time it arrived
+minus the credit (in seconds) the policy's rules give it, i.e. a virtual
+arrival time. Claims take the lowest priority first (queue(bank, priority, id)
+and queue(priority, id) indexes, see queue_scheduler.py), so choosing the next
+client costs one index lookup however many rules there are.
+
+Waiting ages every client at the same rate, so scoring once is enough: a
+credit of N minutes is the same as having arrived N minutes earlier. A client
+can only be overtaken by someone who arrived less than the largest credit
+difference later, so nobody starves; with no rules the queue is plain FIFO.
+
+A rule is any callable taking a ScoreContext and returning seconds of credit
+(negative moves the client back). The default policy:
+
+- sla_rule: banks with an SLA target (`banks.sla_minutes`, set with
+  /bank_sla) tighter than QUEUE_SLA_MINUTES move forward by the difference,
+  looser ones move back;
+- price_rule: one QUEUE_PRICE_TIER_MINUTES step for every QUEUE_PRICE_TIERS
+  threshold the bank's price for the action reaches;
+- repeat_rule: QUEUE_REPEAT_BOOST_MINUTES for clients with a finished order.
+"""
+import os
+import re
+import time
+from typing import Callable, List, NamedTuple, Optional, Sequence
+
+from db import cursor
+
+QUEUE_SLA_MINUTES = float(os.getenv("QUEUE_SLA_MINUTES", "60"))
+QUEUE_PRICE_TIERS = [float(t) for t in os.getenv("QUEUE_PRICE_TIERS", "500,1000,2000").split(",") if t.strip()]
+QUEUE_PRICE_TIER_MINUTES = float(os.getenv("QUEUE_PRICE_TIER_MINUTES", "10"))
+QUEUE_REPEAT_BOOST_MINUTES = float(os.getenv("QUEUE_REPEAT_BOOST_MINUTES", "15"))
+
+_NUMBER = re.compile(r"\d[\d\s]*(?:[.,]\d+)?")
+
+
+class ScoreContext(NamedTuple):
+    user_id: int
+    bank: str
+    action: str
+    enqueued_at: float  # unix time
+
+
+Rule = Callable[[ScoreContext], float]
+
+
+def parse_price(price: Optional[str]) -> Optional[float]:
+    """The first number in a free-text price ("1 500 грн" -> 1500.0), None if there is none."""
+    match = _NUMBER.search(price or "")
+    if not match:
+        return None
+    return float(re.sub(r"\s", "", match.group()).replace(",", "."))
+
+
+def sla_rule(default_minutes: float = QUEUE_SLA_MINUTES) -> Rule:
+    def sla(ctx: ScoreContext) -> float:
+        cursor.execute("SELECT sla_minutes FROM banks WHERE name=?", (ctx.bank,))
+        row = cursor.fetchone()
+        if not row or row[0] is None:
+            return 0.0
+        return (default_minutes - row[0]) * 60
+    return sla
+
+
+def price_rule(tiers: Sequence[float] = QUEUE_PRICE_TIERS, minutes: float = QUEUE_PRICE_TIER_MINUTES) -> Rule:
+    def price(ctx: ScoreContext) -> float:
+        cursor.execute("SELECT price, register_price, change_price FROM banks WHERE name=?", (ctx.bank,))
+        row = cursor.fetchone()
+        if not row:
+            return 0.0
+        general, register, change = row
+        value = parse_price((register if ctx.action == "register" else change) or general)
+        if value is None:
+            return 0.0
+        return sum(1 for tier in tiers if value >= tier) * minutes * 60
+    return price
+
+
+def repeat_rule(minutes: float = QUEUE_REPEAT_BOOST_MINUTES) -> Rule:
+    def repeat(ctx: ScoreContext) -> float:
+        cursor.execute("SELECT 1 FROM orders WHERE user_id=? AND status='Завершено' LIMIT 1", (ctx.user_id,))
+        return minutes * 60 if cursor.fetchone() else 0.0
+    return repeat
+
+
+class QueuePolicy:
+    def __init__(self, rules: Sequence[Rule] = ()):
+        self.rules: List[Rule] = list(rules)
+
+    def score(self, user_id: int, bank: str, action: str, enqueued_at: Optional[float] = None) -> float:
+        """Priority for a client enqueued at `enqueued_at` (now by default); lower is served first."""
+        ctx = ScoreContext(user_id, bank, action, time.time() if enqueued_at is None else enqueued_at)
+        return ctx.enqueued_at - sum(rule(ctx) for rule in self.rules)
+
+    def rescore(self) -> int:
+        """Recompute every queued client's priority, e.g. after a bank's SLA changed (caller commits)."""
+        cursor.execute("SELECT id, user_id, bank, action, CAST(strftime('%s', created_at) AS REAL) FROM queue")
+        rows = cursor.fetchall()
+        cursor.executemany("UPDATE queue SET priority=? WHERE id=?",
+                           [(self.score(user_id, bank, action, enqueued_at), queue_id)
+                            for queue_id, user_id, bank, action, enqueued_at in rows])
+        return len(rows)
+
+
+queue_policy = QueuePolicy([sla_rule(), price_rule(), repeat_rule()])
@@ -0,0 +1,149 @@
+"""
+Matching of queued clients with free manager groups.
+
+A bank group serves the clients of its bank; an admin group (is_admin_group=1)
+serves every bank. For each free group the scheduler claims the compatible
+queue row with the lowest priority (see queue_policy.py) with a single `DELETE ... RETURNING`, so a row cannot be
+handed out twice, and the caller's assignment (order, group, notification)
+commits in the same transaction as the claim.
+
+Bank groups are matched before admin groups: they can only take their own
+bank's clients, so letting an admin group go first could take the one client
+a bank group was able to serve and leave another bank's client waiting.
+Within a bank, clients are served by priority, then oldest first.
+
+A group works on up to `capacity` orders at once; `load` counts the orders it
+has, and `busy` is kept equal to `load >= capacity` so "busy=0" still means
+"can take one more". A pass fills every free slot, least utilized group
+first, and `occupy_group`/`release_group` are the only writers of the counters
+(besides the reconciliation sweep in capacity_events.py).
+"""
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple, TypeVar
+
+from capacity_events import capacity_dispatcher
+from db import conn, cursor, logger
+from metrics import Summary
+
+T = TypeVar("T")
+
+
+class QueueEntry(NamedTuple):
+    id: int
+    user_id: int
+    username: Optional[str]
+    bank: str
+    action: str
+
+
+class FreeGroup(NamedTuple):
+    id: int  # manager_groups.id
+    group_id: int  # Telegram chat id
+    bank: Optional[str]
+    is_admin_group: bool
+    load: int = 0
+    capacity: int = 1
+
+
+_RETURNING = "RETURNING id, user_id, username, bank, action"
+
+
+def occupy_group(group_db_id: int):
+    """Count one more order for the group (caller commits)."""
+    cursor.execute("UPDATE manager_groups SET load = load + 1, busy = (load + 1 >= capacity) WHERE id=?",
+                   (group_db_id,))
+
+
+def release_group(group_chat_id: int, orders: int = 1):
+    """Count `orders` fewer orders for the group (caller commits); the capacity dispatcher then matches the queue."""
+    cursor.execute(
+        "UPDATE manager_groups SET load = MAX(load - ?, 0), busy = (MAX(load - ?, 0) >= capacity) WHERE group_id=?",
+        (orders, orders, group_chat_id),
+    )
+    capacity_dispatcher.publish("released", group_chat_id)
+
+
+def utilization(load: int, capacity: int) -> float:
+    return load / capacity if capacity else 1.0
+
+
+def format_load(load: int, capacity: int) -> str:
+    """"2/3 (67%)" for admin views."""
+    return f"{load}/{capacity} ({utilization(load, capacity):.0%})"
+
+
+class QueueScheduler:
+    def __init__(self):
+        self.claimed = 0
+        self.failed = 0
+        self.timing = Summary()
+
+    def free_groups(self) -> List[FreeGroup]:
+        """Groups with a free slot that can serve someone, bank groups first."""
+        cursor.execute(
+            "SELECT id, group_id, bank, is_admin_group, load, capacity FROM manager_groups "
+            "WHERE busy=0 AND (is_admin_group=1 OR bank IS NOT NULL) "
+            "ORDER BY is_admin_group, id"
+        )
+        return [FreeGroup(gid, chat_id, bank, bool(is_admin), load, capacity)
+                for gid, chat_id, bank, is_admin, load, capacity in cursor.fetchall()]
+
+    def claim(self, group: FreeGroup) -> Optional[QueueEntry]:
+        """Remove and return the first queue row `group` can serve, by priority (caller commits)."""
+        if group.is_admin_group:
+            cursor.execute(
+                f"DELETE FROM queue WHERE id = (SELECT id FROM queue ORDER BY priority, id LIMIT 1) {_RETURNING}"
+            )
+        else:
+            cursor.execute(
+                f"DELETE FROM queue WHERE id = (SELECT id FROM queue WHERE bank=? ORDER BY priority, id LIMIT 1) {_RETURNING}",
+                (group.bank,),
+            )
+        row = cursor.fetchone()
+        return QueueEntry(*row) if row else None
+
+    def match(self, assign: Callable[[FreeGroup, QueueEntry], T],
+              groups: Optional[Sequence[FreeGroup]] = None) -> List[Tuple[FreeGroup, QueueEntry, T]]:
+        """
+        Claim a client for every free slot and call `assign(group, entry)` for it
+        (`assign` occupies the slot); each claim commits together with what
+        `assign` wrote, or is rolled back if it raises. Does not await, so no
+        other handler can take the same slot in between. Returns the committed
+        (group, entry, assign result) triples.
+        """
+        started = time.perf_counter()
+        if groups is None:
+            groups = self.free_groups()
+        # one entry per free slot: bank groups first, then by the group's utilization when the slot is taken
+        slots = [(group.is_admin_group, utilization(group.load + n, group.capacity), group.id, group)
+                 for group in groups for n in range(group.capacity - group.load)]
+        slots.sort(key=lambda slot: slot[:3])
+        matched = []
+        drained: Set[str] = set()  # banks with nothing queued, for the rest of this pass
+        for *_, group in slots:
+            if not group.is_admin_group and group.bank in drained:
+                continue
+            try:
+                entry = self.claim(group)
+                if entry is None:
+                    if group.is_admin_group:
+                        break  # admin groups take any bank, so the queue is empty
+                    drained.add(group.bank)
+                    continue
+                result = assign(group, entry)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                self.failed += 1
+                logger.exception("Error assigning queued client to group %s: %s", group.group_id, e)
+                continue
+            self.claimed += 1
+            matched.append((group, entry, result))
+        self.timing.observe(time.perf_counter() - started)
+        return matched
+
+    def stats(self) -> Dict[str, Any]:
+        return {"claimed": self.claimed, "failed": self.failed, "match": self.timing.as_dict()}
+
+
+queue_scheduler = QueueScheduler()
@@ -0,0 +1,243 @@
+"""
+Outbound scheduler for every Bot API call (python-telegram-bot BaseRateLimiter).
+
+Requests that post into a chat pass two token buckets before they are sent:
+a per-chat one (private chats 1 msg/s, groups 20 msg/min) and a global one
+(30 msg/s). Edits don't count towards the group limit of new messages and
+get a looser per-chat bucket of their own (1/s in any chat), so live
+counters and review keyboards don't queue behind moderation posts.
+Per-chat waiting is FIFO; the global bucket is handed out by
+priority, so interactive replies overtake bulk notifications when the bot is
+saturated. RetryAfter from Telegram blocks the affected bucket and the request
+is retried instead of being dropped by the call site.
+
+Call sites choose a priority with
+    bot.send_message(..., rate_limit_args={"priority": PRIORITY_BULK})
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import Histogram, Summary
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0  # replies to users (default)
+PRIORITY_NORMAL = 1       # moderation posts and other admin-group traffic
+PRIORITY_BULK = 2         # broadcasts, form fan-out, mass notifications
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_NORMAL: "normal", PRIORITY_BULK: "bulk"}
+
+RATE_PRIVATE_PER_SEC = float(os.getenv("RATE_PRIVATE_PER_SEC", "1"))
+RATE_GROUP_PER_MIN = float(os.getenv("RATE_GROUP_PER_MIN", "20"))
+RATE_GLOBAL_PER_SEC = float(os.getenv("RATE_GLOBAL_PER_SEC", "30"))
+RATE_EDIT_PER_SEC = float(os.getenv("RATE_EDIT_PER_SEC", "1"))
+RATE_MAX_RETRIES = int(os.getenv("RATE_MAX_RETRIES", "3"))
+
+# Endpoints that put something into a chat and count towards Telegram's flood limits
+_LIMITED_PREFIXES = ("send", "copy", "forward", "edit")
+_MAX_BUCKETS = 10000
+
+
+def _retry_seconds(error: RetryAfter) -> float:
+    value = error.retry_after
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def time_until_available(self, now: float, cost: float = 1) -> float:
+        self._refill(now)
+        wait = max(0.0, (cost - self.tokens) / self.rate) if self.tokens < cost else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def take(self, now: float, cost: float = 1):
+        self._refill(now)
+        self.tokens -= cost
+
+    def reserve(self, now: float, cost: float = 1) -> float:
+        """Take tokens now (possibly going negative) and return how long the caller has to wait."""
+        self._refill(now)
+        self.tokens -= cost
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def block(self, until: float):
+        self.blocked_until = max(self.blocked_until, until)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class OutboundScheduler(BaseRateLimiter[Dict[str, Any]]):
+    def __init__(self, private_per_sec: float = RATE_PRIVATE_PER_SEC, group_per_min: float = RATE_GROUP_PER_MIN,
+                 global_per_sec: float = RATE_GLOBAL_PER_SEC, max_retries: int = RATE_MAX_RETRIES,
+                 edit_per_sec: float = RATE_EDIT_PER_SEC):
+        self.private_rate = private_per_sec
+        self.group_rate = group_per_min / 60.0
+        self.edit_rate = edit_per_sec
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_per_sec, global_per_sec, time.monotonic())
+        # chat_id -> bucket for new messages, ("edit", chat_id) -> bucket for edits
+        self._chats: Dict[Union[int, str, Tuple[str, Union[int, str]]], TokenBucket] = {}
+        # (priority, seq, future, cost) waiting for a global token
+        self._waiters: List[Tuple[int, int, asyncio.Future, float]] = []
+        self._seq = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        self.queue_depth: Dict[int, int] = {p: 0 for p in PRIORITY_NAMES}
+        self.wait_time: Dict[int, Summary] = {p: Summary() for p in PRIORITY_NAMES}
+        self.sent = 0
+        self.retry_after = 0
+        self.failed_after_retries = 0
+        # Bot API round trip per method, after any wait for tokens; see telemetry.py
+        self.api_latency: Dict[str, Histogram] = defaultdict(Histogram)
+        self.api_errors: Counter = Counter()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._dispatcher and not self._dispatcher.done():
+            self._dispatcher.cancel()
+        for _, _, fut, _ in self._waiters:
+            if not fut.done():
+                fut.cancel()
+        self._waiters.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": {PRIORITY_NAMES[p]: n for p, n in self.queue_depth.items()},
+            "wait_s": {PRIORITY_NAMES[p]: s.as_dict() for p, s in self.wait_time.items()},
+            "sent": self.sent,
+            "retry_after": self.retry_after,
+            "failed_after_retries": self.failed_after_retries,
+            "chat_buckets": len(self._chats),
+        }
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ):
+        chat_id = data.get("chat_id")
+        if chat_id is None or not endpoint.lower().startswith(_LIMITED_PREFIXES):
+            return await self._call(callback, args, kwargs, endpoint, None)
+        key = ("edit", chat_id) if endpoint.lower().startswith("edit") else chat_id
+
+        priority = (rate_limit_args or {}).get("priority", PRIORITY_INTERACTIVE)
+        if priority not in PRIORITY_NAMES:
+            priority = PRIORITY_INTERACTIVE
+        # An album is delivered as several messages
+        cost = max(1, len(data.get("media") or ())) if endpoint.lower() == "sendmediagroup" else 1
+
+        enqueued = time.monotonic()
+        self.queue_depth[priority] += 1
+        try:
+            wait = self._chat_bucket(key, enqueued).reserve(enqueued, cost)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self._acquire_global(priority, cost)
+        finally:
+            self.queue_depth[priority] -= 1
+        self.wait_time[priority].observe(time.monotonic() - enqueued)
+        return await self._call(callback, args, kwargs, endpoint, key)
+
+    # ---------- internals ----------
+
+    def _chat_bucket(self, key: Union[int, str, Tuple[str, Union[int, str]]], now: float) -> TokenBucket:
+        bucket = self._chats.get(key)
+        if bucket is None:
+            if len(self._chats) >= _MAX_BUCKETS:
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle(now)}
+            if isinstance(key, tuple):
+                bucket = TokenBucket(self.edit_rate, 3, now)
+            else:
+                private = isinstance(key, int) and key > 0
+                rate = self.private_rate if private else self.group_rate
+                # groups may burst a few messages, private chats get a strict 1/s
+                bucket = TokenBucket(rate, 1 if private else 3, now)
+            self._chats[key] = bucket
+        return bucket
+
+    async def _acquire_global(self, priority: int, cost: float):
+        now = time.monotonic()
+        if not self._waiters and self._global.time_until_available(now, cost) == 0:
+            self._global.take(now, cost)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut, cost))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+        await fut
+
+    async def _dispatch(self):
+        while self._waiters:
+            _, _, fut, cost = self._waiters[0]
+            now = time.monotonic()
+            wait = self._global.time_until_available(now, cost)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self._global.take(now, cost)
+            fut.set_result(None)
+
+    async def _call(self, callback, args, kwargs, endpoint: str, key: Optional[Union[int, str, tuple]]):
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                result = await callback(*args, **kwargs)
+                self.api_latency[endpoint].observe(time.perf_counter() - started)
+                self.sent += 1
+                return result
+            except RetryAfter as e:
+                self.api_latency[endpoint].observe(time.perf_counter() - started)
+                self.api_errors[endpoint] += 1
+                self.retry_after += 1
+                attempt += 1
+                delay = _retry_seconds(e)
+                until = time.monotonic() + delay
+                if key is not None:
+                    self._chat_bucket(key, time.monotonic()).block(until)
+                else:
+                    self._global.block(until)
+                if attempt > self.max_retries:
+                    self.failed_after_retries += 1
+                    logger.warning("%s to %s: giving up after %d RetryAfter", endpoint, key, attempt - 1)
+                    raise
+                logger.warning("%s to %s: flood limit, retry %d in %.1fs", endpoint, key, attempt, delay)
+                await asyncio.sleep(delay)
+            except Exception:
+                self.api_latency[endpoint].observe(time.perf_counter() - started)
+                self.api_errors[endpoint] += 1
+                raise
@@ -0,0 +1,229 @@
+"""
+Persistent timed events driven by one sweeper task.
+
+`schedule(kind, key, delay=...)` stores an event in `scheduled_events` (caller
+commits) and `cancel(key)` deletes it; the key is unique, so scheduling it
+again moves the event instead of adding a second one. Handlers are registered
+per kind and receive every event of their kind that came due in the same
+tick as one batch: `async def handler(bot, events: List[ScheduledEvent])`.
+
+The sweeper keeps the ids of pending events in a hierarchical timing wheel
+(64 one-second slots, then 64 slots of 64 s, of 64² s, of 64³ s; later events
+wait in an overflow list), so scheduling is O(1) and each tick only looks at
+the slot that is due. Cancelled or moved events are not searched for in the
+wheel: firing deletes the row with `due_at <= now`, so a stale wheel entry
+finds nothing (or a row that is not due yet) and is skipped. The wheel is
+rebuilt from the table at startup, so events survive restarts; ones that
+came due while the bot was down fire on the first tick.
+
+Delivery is at-most-once: the row is deleted before its handler runs. Events
+of a kind with no registered handler stay in the table until the next start.
+"""
+import asyncio
+import json
+import math
+import os
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from db import conn, cursor, logger
+from metrics import Summary
+
+SCHEDULER_TICK_SECONDS = float(os.getenv("SCHEDULER_TICK_SECONDS", "1"))
+
+_SLOTS = 64
+_LEVELS = 4
+_CHUNK = 500  # ids per DELETE, below SQLite's variable limit
+
+
+class ScheduledEvent(NamedTuple):
+    id: int
+    kind: str
+    key: str
+    due_at: float
+    payload: Any
+
+
+Handler = Callable[[Any, List[ScheduledEvent]], Awaitable[Any]]
+
+
+class TimingWheel:
+    """Hierarchical timing wheel over integer ticks; `advance` returns the items due up to a time."""
+
+    def __init__(self, now: float, tick: float = 1.0, slots: int = _SLOTS, levels: int = _LEVELS):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.current = int(now // tick)  # next tick to process
+        self._wheels: List[List[List[Tuple[int, Any]]]] = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._overflow: List[Tuple[int, Any]] = []
+        self.size = 0
+
+    def add(self, due_at: float, item: Any) -> None:
+        # never early: the item fires on the first tick at or after due_at
+        self._place(max(math.ceil(due_at / self.tick), self.current), item)
+        self.size += 1
+
+    def _place(self, t: int, item: Any) -> None:
+        delta = t - self.current
+        span = 1
+        for level in range(self.levels):
+            if delta < span * self.slots:
+                self._wheels[level][(t // span) % self.slots].append((t, item))
+                return
+            span *= self.slots
+        self._overflow.append((t, item))
+
+    def _cascade(self) -> None:
+        """At a level boundary, move that level's current slot down to the finer levels."""
+        span = self.slots
+        for level in range(1, self.levels):
+            if self.current % span:
+                return
+            index = (self.current // span) % self.slots
+            bucket, self._wheels[level][index] = self._wheels[level][index], []
+            for t, item in bucket:
+                self._place(t, item)
+            span *= self.slots
+        if self.current % span == 0 and self._overflow:
+            overflow, self._overflow = self._overflow, []
+            for t, item in overflow:
+                self._place(t, item)
+
+    def advance(self, now: float) -> List[Any]:
+        target = int(now // self.tick)
+        due: List[Any] = []
+        while self.current <= target:
+            self._cascade()
+            index = self.current % self.slots
+            bucket, self._wheels[0][index] = self._wheels[0][index], []
+            due.extend(item for _, item in bucket)
+            self.current += 1
+        self.size -= len(due)
+        return due
+
+
+def schedule(kind: str, key: str, delay: float = 0.0, payload: Any = None, due_at: Optional[float] = None) -> int:
+    """Store (or move) the event `key` (caller commits); returns its id."""
+    due_at = time.time() + delay if due_at is None else due_at
+    cursor.execute(
+        "INSERT INTO scheduled_events (kind, key, due_at, payload) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET kind=excluded.kind, due_at=excluded.due_at, payload=excluded.payload "
+        "RETURNING id",
+        (kind, key, due_at, json.dumps(payload, ensure_ascii=False) if payload is not None else None),
+    )
+    event_id = cursor.fetchone()[0]
+    event_scheduler.track(event_id, due_at)
+    return event_id
+
+
+def cancel(key: str) -> bool:
+    """Delete the pending event `key` (caller commits); False if there was none."""
+    cursor.execute("DELETE FROM scheduled_events WHERE key=?", (key,))
+    return cursor.rowcount > 0
+
+
+class EventScheduler:
+    def __init__(self, tick: float = SCHEDULER_TICK_SECONDS):
+        self.tick = tick
+        self.handlers: Dict[str, Handler] = {}
+        self._wheel: Optional[TimingWheel] = None
+        self._bot: Any = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.fired = 0
+        self.batches = 0
+        self.failed = 0
+        self.lag = Summary()  # seconds between due_at and firing
+
+    def register(self, kind: str, handler: Handler) -> None:
+        self.handlers[kind] = handler
+
+    def track(self, event_id: int, due_at: float) -> None:
+        """Put a stored event on the wheel; no-op before start(), which loads the table."""
+        if self._wheel is not None:
+            self._wheel.add(due_at, event_id)
+
+    def load(self, now: Optional[float] = None) -> int:
+        """(Re)build the wheel from the table; returns the number of pending events."""
+        self._wheel = TimingWheel(time.time() if now is None else now, self.tick)
+        cursor.execute("SELECT id, due_at FROM scheduled_events")
+        for event_id, due_at in cursor.fetchall():
+            self._wheel.add(due_at, event_id)
+        return self._wheel.size
+
+    def start(self, bot: Any) -> None:
+        self._bot = bot
+        logger.info("Event scheduler started with %s pending events", self.load())
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._wheel = None
+
+    def stats(self) -> Dict[str, Any]:
+        # wheel: entries on the wheel, including cancelled/moved ones not yet swept
+        return {"wheel": self._wheel.size if self._wheel else 0, "fired": self.fired, "batches": self.batches,
+                "failed": self.failed, "lag": self.lag.as_dict()}
+
+    def _claim(self, ids: List[int], now: float) -> List[ScheduledEvent]:
+        kinds = list(self.handlers)
+        if not kinds:
+            return []
+        events = []
+        for start in range(0, len(ids), _CHUNK):
+            chunk = ids[start:start + _CHUNK]
+            cursor.execute(
+                f"DELETE FROM scheduled_events WHERE id IN ({','.join('?' * len(chunk))}) "
+                f"AND due_at <= ? AND kind IN ({','.join('?' * len(kinds))}) "
+                "RETURNING id, kind, key, due_at, payload",
+                (*chunk, now, *kinds),
+            )
+            events.extend(ScheduledEvent(event_id, kind, key, due_at, json.loads(payload) if payload else None)
+                          for event_id, kind, key, due_at, payload in cursor.fetchall())
+        conn.commit()
+        return events
+
+    async def run_once(self, bot: Any, now: Optional[float] = None) -> int:
+        """Fire the events due by `now`, one handler call per kind; returns how many fired."""
+        if self._wheel is None:
+            return 0
+        now = time.time() if now is None else now
+        ids = self._wheel.advance(now)
+        if not ids:
+            return 0
+        by_kind: Dict[str, List[ScheduledEvent]] = defaultdict(list)
+        for event in self._claim(ids, now):
+            by_kind[event.kind].append(event)
+            self.lag.observe(now - event.due_at)
+        fired = 0
+        for kind, events in by_kind.items():
+            events.sort(key=lambda e: e.due_at)
+            try:
+                await self.handlers[kind](bot, events)
+            except Exception as e:
+                self.failed += len(events)
+                logger.exception("Scheduled %s events failed: %s", kind, e)
+                continue
+            self.batches += 1
+            fired += len(events)
+        self.fired += fired
+        return fired
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once(self._bot)
+            except Exception as e:
+                logger.warning("Event scheduler error: %s", e)
+            await asyncio.sleep(self.tick - time.time() % self.tick)
+
+
+event_scheduler = EventScheduler()
@@ -17,6 +17,9 @@ MANAGER_MESSAGE = 2
 STAGE2_MANAGER_WAIT_DATA = 10
 STAGE2_MANAGER_WAIT_CODE = 11
 STAGE2_MANAGER_WAIT_MSG = 12   # новий стан для повідомлення користувачу (Stage2)
+# Admin conversations; defined here so client_bot can build them without importing the handler modules
+BANK_NAME_INPUT, BANK_PRICE_INPUT, BANK_DESCRIPTION_INPUT, BANK_MIN_AGE_INPUT, BANK_SETTINGS_INPUT = range(5)
+INSTR_BANK_SELECT, INSTR_ACTION_SELECT, INSTR_STAGE_TYPE_SELECT, INSTR_STAGE_CONFIG, INSTR_TEXT_INPUT, INSTR_PHOTO_INPUT = range(10, 16)
 
 def find_age_requirement(bank: str, action: str) -> Optional[int]:
     steps = INSTRUCTIONS.get(bank, {}).get(action, [])
@@ -40,3 +43,17 @@ def get_required_photos(bank: str, action: str, stage0: int) -> Optional[int]:
     except Exception:
         pass
     return None
+
+def get_quality_thresholds(bank: str, action: str, stage0: int) -> Dict[str, Any]:
+    """
+    Повертає перевизначення порогів якості скрінів (поле "quality" кроку, 0-based),
+    наприклад {"min_blur": 80, "aspect": 2.16, "auto_reject": True}. Див. handlers/photo_quality.py.
+    """
+    try:
+        steps = INSTRUCTIONS.get(bank, {}).get(action, [])
+        step = steps[stage0]
+        if isinstance(step, dict) and isinstance(step.get("quality"), dict):
+            return dict(step["quality"])
+    except Exception:
+        pass
+    return {}
@@ -0,0 +1,322 @@
+"""
+Request-path metrics: per-handler latency and errors, update rates, Bot API
+and database timings, served as Prometheus text together with every
+component's stats().
+
+`instrument(application)` runs once all handlers are registered. It wraps the
+callback of every handler (conversation steps included) to record its latency
+and exceptions under the callback's name, and adds a TypeHandler at group -1
+that counts each update by type before any other handler sees it. Inline
+buttons go through the callback router, which already times every route; its
+routes are reported as handlers under their callbacks' names.
+
+Bot API round trips are timed per method by the rate limiter
+(rate_limiter.py), statements per kind by the SQL profiler (query_profiler.py).
+
+GET /metrics is served on the webhook server in webhook mode and on
+METRICS_LISTEN:METRICS_PORT in polling mode (off unless METRICS_PORT is set).
+With METRICS_TOKEN set, scrapes must send "Authorization: Bearer <token>".
+Admins get a summary of the same numbers with /perf.
+"""
+import hmac
+import os
+import time
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, BaseHandler, ConversationHandler, TypeHandler
+
+from capacity_events import capacity_dispatcher
+from db import logger
+from handlers.callback_router import router
+from handlers.photo_handlers import album_aggregator, stage_evaluator
+from metrics import Histogram, RateMeter
+from order_reaper import order_reaper
+from outbox import outbox_dispatcher
+from query_profiler import query_profiler
+from queue_eta import queue_status_notifier
+from queue_scheduler import queue_scheduler
+from scheduled_events import event_scheduler
+from webhook import HTTPServer, Response, RouteHandler
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+_PERF_TOP = 8
+
+
+def callback_name(callback: Any) -> str:
+    """Name a handler callback is reported under: function, lazy callback or bound method name."""
+    name = getattr(callback, "name", None)  # LazyCallback
+    if isinstance(name, str):
+        return name
+    return getattr(callback, "__name__", None) or type(callback).__name__
+
+
+def _rate_limiter(application: Any) -> Any:
+    return getattr(application.bot, "rate_limiter", None)
+
+
+def update_type(update: Any) -> str:
+    for kind in Update.ALL_TYPES:
+        if getattr(update, kind, None) is not None:
+            return kind
+    return "other"
+
+
+class HandlerMetrics:
+    def __init__(self):
+        self.latency: Dict[str, Histogram] = defaultdict(Histogram)
+        self.errors: Counter = Counter()
+        self.updates: Counter = Counter()  # by update type
+        self.rate = RateMeter()
+
+    def observe(self, name: str, seconds: float, failed: bool = False):
+        self.latency[name].observe(seconds)
+        if failed:
+            self.errors[name] += 1
+
+    async def count_update(self, update: Any, context: Any) -> None:
+        self.updates[update_type(update)] += 1
+        self.rate.mark()
+
+    def timed(self, callback: Callable) -> Callable:
+        name = callback_name(callback)
+
+        async def timed_callback(update, context):
+            started = time.perf_counter()
+            failed = False
+            try:
+                return await callback(update, context)
+            except ApplicationHandlerStop:
+                raise
+            except Exception:
+                failed = True
+                raise
+            finally:
+                self.observe(name, time.perf_counter() - started, failed)
+
+        timed_callback.__wrapped__ = callback
+        timed_callback.__name__ = name
+        return timed_callback
+
+    def handlers(self) -> Dict[str, Tuple[Histogram, int]]:
+        """Latency and errors per handler name, callback router routes included."""
+        merged: Dict[str, Histogram] = {}
+        errors = Counter(self.errors)
+        for name, hist in self.latency.items():
+            merged[name] = Histogram(hist.buckets)
+            merged[name].merge(hist)
+        for route in router.routes:
+            if not route.timing.count:
+                continue
+            name = callback_name(route.func)
+            merged.setdefault(name, Histogram(route.timing.buckets)).merge(route.timing)
+            errors[name] += route.errors
+        return {name: (hist, errors[name]) for name, hist in merged.items()}
+
+
+handler_metrics = HandlerMetrics()
+
+
+def _instrument(handlers: Iterable[BaseHandler]) -> int:
+    wrapped = 0
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            nested = list(handler.entry_points) + list(handler.fallbacks)
+            for state_handlers in handler.states.values():
+                nested.extend(state_handlers)
+            wrapped += _instrument(nested)
+        elif handler.callback in (router.dispatch, handler_metrics.count_update) \
+                or getattr(handler.callback, "__wrapped__", None) is not None:
+            continue  # routes are timed by the router; ours or already wrapped
+        else:
+            handler.callback = handler_metrics.timed(handler.callback)
+            wrapped += 1
+    return wrapped
+
+
+def instrument(application: Any) -> int:
+    """Time every registered handler and count updates at group -1; returns the number of handlers wrapped."""
+    wrapped = sum(_instrument(handlers) for handlers in application.handlers.values())
+    if not any(h.callback == handler_metrics.count_update for h in application.handlers.get(-1, [])):
+        application.add_handler(TypeHandler(Update, handler_metrics.count_update), group=-1)
+    return wrapped
+
+
+def component_stats(application: Any) -> Dict[str, Dict[str, Any]]:
+    stats = {
+        "router": router.stats(),
+        "outbox": outbox_dispatcher.stats(),
+        "event_scheduler": event_scheduler.stats(),
+        "queue_scheduler": queue_scheduler.stats(),
+        "queue_status": queue_status_notifier.stats(),
+        "capacity": capacity_dispatcher.stats(),
+        "order_reaper": order_reaper.stats(),
+        "album_aggregator": album_aggregator.stats(),
+        "stage_evaluator": stage_evaluator.stats(),
+        "sql": query_profiler.stats(),
+    }
+    stats["router"].pop("timings", None)  # reported as handler latency
+    for name, component in (("updates", application.update_processor), ("rate_limiter", _rate_limiter(application))):
+        if hasattr(component, "stats"):
+            stats[name] = component.stats()
+    return stats
+
+
+# ---------- Prometheus text format ----------
+
+def _label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _histogram_lines(metric: str, label: str, series: Dict[str, Histogram]) -> List[str]:
+    lines = [f"# TYPE {metric} histogram"]
+    for key, hist in sorted(series.items()):
+        labels = f'{label}="{_label(key)}"'
+        cumulative = 0
+        for bound, n in zip(list(hist.buckets) + ["+Inf"], hist.counts):
+            cumulative += n
+            lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{metric}_sum{{{labels}}} {hist.total:.6f}")
+        lines.append(f"{metric}_count{{{labels}}} {hist.count}")
+    return lines
+
+
+def _counter_lines(metric: str, label: str, counts: Dict[str, int]) -> List[str]:
+    lines = [f"# TYPE {metric} counter"]
+    lines.extend(f'{metric}{{{label}="{_label(key)}"}} {n}' for key, n in sorted(counts.items()))
+    return lines
+
+
+def _flatten(prefix: str, value: Any, out: List[Tuple[str, float]]):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else str(key), item, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out.append((prefix, value))
+
+
+def prometheus_text(application: Any) -> str:
+    handlers = handler_metrics.handlers()
+    api = getattr(_rate_limiter(application), "api_latency", {})
+    api_errors = getattr(_rate_limiter(application), "api_errors", {})
+    lines = _counter_lines("bot_updates_total", "type", handler_metrics.updates)
+    lines.append("# TYPE bot_update_rate gauge")
+    lines.extend(f'bot_update_rate{{window="{w}"}} {handler_metrics.rate.rate(w):.4f}' for w in (60, 300))
+    lines += _histogram_lines("bot_handler_latency_seconds", "handler", {n: h for n, (h, _) in handlers.items()})
+    lines += _counter_lines("bot_handler_errors_total", "handler", {n: e for n, (_, e) in handlers.items()})
+    lines += _histogram_lines("bot_api_latency_seconds", "method", dict(api))
+    lines += _counter_lines("bot_api_errors_total", "method", dict(api_errors))
+    lines += _histogram_lines("bot_db_latency_seconds", "statement", dict(query_profiler.kinds))
+    lines.append("# TYPE bot_component gauge")
+    for component, stats in component_stats(application).items():
+        values: List[Tuple[str, float]] = []
+        _flatten("", stats, values)
+        lines.extend(f'bot_component{{component="{component}",key="{_label(key)}"}} {value}' for key, value in values)
+    return "\n".join(lines) + "\n"
+
+
+def metrics_route(application: Any, token: str = METRICS_TOKEN) -> RouteHandler:
+    async def metrics(headers: Dict[str, str], body: bytes) -> Response:
+        if token and not hmac.compare_digest(headers.get("authorization", ""), f"Bearer {token}"):
+            return 403, "text/plain", b"forbidden"
+        return 200, "text/plain; version=0.0.4", prometheus_text(application).encode()
+    return metrics
+
+
+_metrics_server: Optional[HTTPServer] = None
+
+
+async def start_metrics_server(application: Any, host: str = METRICS_LISTEN, port: int = METRICS_PORT) -> HTTPServer:
+    """Standalone /metrics server for polling mode."""
+    global _metrics_server
+    _metrics_server = HTTPServer(host, port)
+    _metrics_server.add_route("GET", "/metrics", metrics_route(application))
+    await _metrics_server.start()
+    logger.info("Metrics on http://%s:%s/metrics", _metrics_server.host, _metrics_server.port)
+    return _metrics_server
+
+
+async def stop_metrics_server() -> None:
+    global _metrics_server
+    if _metrics_server is not None:
+        await _metrics_server.stop()
+        _metrics_server = None
+
+
+# ---------- /perf ----------
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.0f} мс" if seconds < 1 else f"{seconds:.1f} с"
+
+
+def _timing_lines(series: Dict[str, Histogram], errors: Dict[str, int], limit: int = _PERF_TOP) -> List[str]:
+    ranked = sorted(series.items(), key=lambda item: item[1].quantile(0.95), reverse=True)[:limit]
+    lines = []
+    for name, hist in ranked:
+        line = f"• {name}: {hist.count}×, p95 {_ms(hist.quantile(0.95))}, сер. {_ms(hist.total / hist.count)}, " \
+               f"макс. {_ms(hist.max)}"
+        if errors.get(name):
+            line += f", помилок {errors[name]}"
+        lines.append(line)
+    return lines or ["• —"]
+
+
+def format_perf(application: Any) -> str:
+    rate = handler_metrics.rate
+    handlers = handler_metrics.handlers()
+    lines = [
+        "📈 Продуктивність",
+        f"Оновлень: {rate.total} ({rate.rate(60):.2f}/с за хв, {rate.rate(300):.2f}/с за 5 хв)",
+        "За типом: " + (", ".join(f"{kind} {n}" for kind, n in handler_metrics.updates.most_common()) or "—"),
+        "",
+        "🐢 Обробники (найповільніші за p95):",
+        *_timing_lines({n: h for n, (h, _) in handlers.items()}, {n: e for n, (_, e) in handlers.items()}),
+        "",
+        "🌐 Bot API:",
+        *_timing_lines(dict(getattr(_rate_limiter(application), "api_latency", {})),
+                       dict(getattr(_rate_limiter(application), "api_errors", {}))),
+        "",
+        "🗄 БД:",
+        *_timing_lines(dict(query_profiler.kinds), {}),
+        "",
+        "⚙️ Компоненти:",
+    ]
+    for component, stats in component_stats(application).items():
+        scalars = [f"{key}={value}" for key, value in stats.items()
+                   if isinstance(value, (int, float)) and not isinstance(value, bool)]
+        if scalars:
+            lines.append(f"• {component}: " + ", ".join(scalars))
+    return "\n".join(lines)
+
+
+# ---------- /sql ----------
+
+_SQL_TEXT = 160  # characters of a statement shown
+
+
+def format_sql(by: str = "total", limit: int = 10) -> str:
+    """Statements ranked by total time, max time or count, then the full scans found by EXPLAIN."""
+    stats = query_profiler.stats()
+    lines = [
+        "🗄 Запити до БД",
+        f"Різних: {stats['statements']}, виконань: {stats['executed']}, повільних: {stats['slow']}, "
+        f"зі скануванням таблиці: {stats['scans']}",
+        "",
+        {"total": "⏱ За сумарним часом:", "max": "🐢 За найдовшим виконанням:", "count": "🔁 За кількістю:"}[by],
+    ]
+    for statement, entry in query_profiler.top(limit, by):
+        timing = entry.timing
+        lines.append(f"• {_ms(timing.total)} Σ, {timing.count}×, макс. {_ms(timing.max)} — {entry.site}")
+        lines.append(f"  {statement[:_SQL_TEXT]}")
+    lines += ["", "🔍 Повні сканування:"]
+    scans = query_profiler.scans()
+    for statement, entry in scans[:limit]:
+        lines.append(f"• {', '.join(entry.scans)} — {entry.site} ({entry.function}), {entry.timing.count}×")
+        lines.append(f"  {statement[:_SQL_TEXT]}")
+    if not scans:
+        lines.append("• —")
+    return "\n".join(lines)[:4096]
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Tests for the single-scheduler album aggregator
+"""
+import asyncio
+import sys
+
+sys.path.insert(0, '.')
+
+from handlers.album_aggregator import AlbumAggregator
+
+
+def test_albums_are_debounced_by_one_loop():
+    """Photos of one album are flushed together; albums with different keys flush separately"""
+    print("📸 Testing album aggregation...")
+    flushed = []
+
+    async def on_flush(key, photos, username, bot):
+        flushed.append((key, list(photos), username))
+
+    async def scenario():
+        agg = AlbumAggregator(on_flush, debounce_seconds=0.05)
+        for i in range(3):
+            agg.add("album-1", f"f{i}", f"u{i}", "alice", None)
+        agg.add("album-1", "f0-again", "u0", "alice", None)  # duplicate file_unique_id
+        agg.add("album-2", "g0", "v0", "bob", None)
+        loop_task = agg._loop_task
+        await asyncio.sleep(0.02)
+        agg.add("album-1", "f3", "u3", "alice", None)  # re-arms album-1 only
+        assert agg._loop_task is loop_task, "All albums must share one scheduler task"
+        await asyncio.sleep(0.15)
+        stats = agg.stats()
+        await agg.shutdown()
+        return stats
+
+    stats = asyncio.run(scenario())
+    by_key = {key: photos for key, photos, _ in flushed}
+    assert len(flushed) == 2
+    assert [fu for _, fu in by_key["album-1"]] == ["u0", "u1", "u2", "u3"]
+    assert [fu for _, fu in by_key["album-2"]] == ["v0"]
+    assert stats["pending_albums"] == 0
+    assert stats["album_size"]["count"] == 2 and stats["album_size"]["max"] == 4
+    print("✅ Album aggregation test passed")
+
+
+def test_shutdown_and_overflow_flush():
+    """Shutdown flushes pending albums immediately; overflow flushes the oldest album early"""
+    print("🛑 Testing aggregator shutdown/overflow...")
+    flushed = []
+
+    async def on_flush(key, photos, username, bot):
+        flushed.append(key)
+
+    async def scenario():
+        agg = AlbumAggregator(on_flush, debounce_seconds=60, max_pending_albums=2)
+        agg.add("a", "f", "u-a", "x", None)
+        agg.add("b", "f", "u-b", "x", None)
+        agg.add("c", "f", "u-c", "x", None)  # pushes "a" out early
+        await asyncio.sleep(0)
+        forced = list(flushed)
+        await agg.shutdown()
+        return forced, agg.stats()
+
+    forced, stats = asyncio.run(scenario())
+    assert forced == ["a"]
+    assert sorted(flushed) == ["a", "b", "c"]
+    assert stats["forced_flushes"] == 1 and stats["pending_albums"] == 0
+    print("✅ Aggregator shutdown/overflow test passed")
+
+
+def test_adaptive_close():
+    """Single photos flush at once, complete albums close early, idle window shrinks to observed gaps"""
+    print("⚡ Testing adaptive album debounce...")
+    flushed = []
+
+    async def on_flush(key, photos, username, bot):
+        flushed.append((key, len(photos)))
+
+    async def scenario():
+        agg = AlbumAggregator(on_flush, debounce_seconds=5, min_debounce_seconds=0.05)
+        agg.add("single", "f", "s0", "x", None, in_album=False)
+        agg.add("album", "f0", "a0", "x", None, expected=2)
+        agg.add("album", "f1", "a1", "x", None, expected=2)
+        await asyncio.sleep(0.01)
+        early = list(flushed)
+        window_before = agg.current_window()
+        # Teach the estimator a typical album gap of ~10ms
+        for n in range(6):
+            agg.add("learn", f"l{n}", f"l{n}", "x", None)
+            await asyncio.sleep(0.01)
+        await agg.shutdown()
+        return early, window_before, agg.current_window(), agg.stats()
+
+    early, window_before, window_after, stats = asyncio.run(scenario())
+    assert ("single", 1) in early, "Photo without media_group_id must not wait"
+    assert ("album", 2) in early, "Album must close once the expected count arrived"
+    assert window_before == 5
+    assert window_after < 1, f"Idle window should adapt to observed gaps, got {window_after}"
+    assert stats["close_reasons"]["single"] == 1 and stats["close_reasons"]["complete"] == 1
+    print("✅ Adaptive album debounce test passed")
+
+
+def test_late_photos_flush_after_the_album():
+    """A photo arriving after its album closed as complete is flushed only once the album's flush finished"""
+    print("🐢 Testing late album photos...")
+    events = []
+
+    async def on_flush(key, photos, username, bot):
+        events.append(("start", key, [fu for _, fu in photos]))
+        await asyncio.sleep(0.05)  # posting the album takes a while
+        events.append(("done", key))
+
+    async def scenario():
+        agg = AlbumAggregator(on_flush, debounce_seconds=5, min_debounce_seconds=0.01)
+        agg.add("album", "f0", "a0", "x", None, expected=2)
+        agg.add("album", "f1", "a1", "x", None, expected=2)  # complete: closes at once
+        agg.add("other", "g0", "b0", "x", None, in_album=False)
+        await asyncio.sleep(0.01)
+        agg.add("album", "f2", "a2", "x", None, expected=1)  # third part of the same album
+        await asyncio.sleep(0.2)
+        await agg.shutdown()
+        return agg
+
+    agg = asyncio.run(scenario())
+    album = [e for e in events if e[1] == "album"]
+    assert album == [("start", "album", ["a0", "a1"]), ("done", "album"),
+                     ("start", "album", ["a2"]), ("done", "album")], album
+    assert events.index(("start", "other", ["b0"])) < events.index(("done", "album")), "Other keys do not wait"
+    assert agg.stats()["in_flight_flushes"] == 0 and not agg._key_flushes
+    print("✅ Late album photos test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_albums_are_debounced_by_one_loop()
+        test_shutdown_and_overflow_flush()
+        test_adaptive_close()
+        test_late_photos_flush_after_the_album()
+        print("\n🎉 All album aggregator tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
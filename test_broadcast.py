@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Tests for the bounded-concurrency broadcast engine
+"""
+import asyncio
+import sys
+
+sys.path.insert(0, '.')
+
+from telegram.error import Forbidden
+
+from handlers.broadcast import run_broadcast
+
+ADMIN_CHAT = -100
+
+
+class FakeMessage:
+    def __init__(self, chat_id, message_id):
+        self.chat_id = chat_id
+        self.message_id = message_id
+
+
+class FakeBot:
+    def __init__(self, blocked=()):
+        self.blocked = set(blocked)
+        self.delivered = []
+        self.edits = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id == ADMIN_CHAT:
+            return FakeMessage(chat_id, 1)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.005)
+            if chat_id in self.blocked:
+                raise Forbidden("bot was blocked by the user")
+            self.delivered.append(chat_id)
+        finally:
+            self.in_flight -= 1
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        self.edits.append(text)
+
+
+def test_bounded_fan_out_with_progress():
+    """At most `concurrency` sends in flight, duplicates dropped, blocked users counted, progress reported"""
+    print("📣 Testing broadcast fan-out...")
+    bot = FakeBot(blocked={7, 8})
+    targets = list(range(1, 41)) + [1, 2, 3]
+
+    result = asyncio.run(run_broadcast(bot, targets, "hi", title="Test", progress_chat_id=ADMIN_CHAT, concurrency=4))
+
+    assert bot.max_in_flight == 4, bot.max_in_flight
+    assert sorted(bot.delivered) == [i for i in range(1, 41) if i not in (7, 8)]
+    assert (result.total, result.sent, result.blocked, result.failed) == (40, 38, 2, 0)
+    assert bot.edits and bot.edits[-1].startswith("✅ Test: 40/40"), bot.edits
+    print("✅ Broadcast fan-out test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_bounded_fan_out_with_progress()
+        print("\n🎉 All broadcast tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
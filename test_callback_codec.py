@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Tests for the compact callback_data codec (fuzzed round trips of every payload)
+"""
+import random
+import sys
+
+sys.path.insert(0, '.')
+
+from db import add_bank, conn, cursor
+from handlers.callback_codec import (
+    BANK_PICK,
+    INSTR_BANK,
+    MAX_CALLBACK_BYTES,
+    PHOTO_APPROVE,
+    PHOTO_REJECT_TEMPLATE,
+    REVIEW_TOGGLE,
+    STAGE_EDIT,
+    STAGES_REORDER,
+    Bank,
+    Choice,
+    Int,
+    Text,
+    codec,
+    from_base36,
+    to_base36,
+)
+from handlers.callback_router import CallbackRouter
+
+TEST_BANKS = [
+    "test_codec ПриватБанк Business",
+    "test_codec Монобанк_Платинум",
+    "test_codec A.B_C",
+    "test_codec " + "Ощадбанк" * 4,
+]
+
+
+def _cleanup():
+    cursor.execute("DELETE FROM banks WHERE name LIKE 'test_codec%'")
+    conn.commit()
+
+
+def _random_value(rng, field):
+    if isinstance(field, Bank):
+        return rng.choice(TEST_BANKS)
+    if isinstance(field, Choice):
+        return rng.choice(field.values)
+    if isinstance(field, Int):
+        return rng.choice([0, 1, -1, rng.randint(-10 ** 13, 10 ** 13), rng.randint(0, 10 ** 6)])
+    if isinstance(field, Text):
+        return "".join(rng.choice("ab_.-9") for _ in range(rng.randint(1, 12)))
+    raise AssertionError(f"no generator for {field!r}")
+
+
+def test_base36():
+    """Signed base-36 round trip; non-canonical forms are rejected"""
+    print("🔢 Testing base-36 integers...")
+    rng = random.Random(36)
+    for value in [0, 1, 35, 36, -1, -4930176305, 7797088374] + [rng.randint(-10 ** 15, 10 ** 15) for _ in range(500)]:
+        assert from_base36(to_base36(value)) == value
+    for bad in ["", "-", "00", "01", "-0", "A", "1.2", "+1"]:
+        try:
+            from_base36(bad)
+            raise AssertionError(f"{bad!r} accepted")
+        except ValueError:
+            pass
+    print("✅ Base-36 test passed")
+
+
+def test_fuzz_round_trip_every_payload():
+    """Random values of every registered payload survive encode/decode, directly and through the router"""
+    print("🎲 Fuzzing callback payloads...")
+    _cleanup()
+    for name in TEST_BANKS:
+        assert add_bank(name)
+    try:
+        router = CallbackRouter()
+        for payload in codec.payloads.values():
+            router.add(payload, lambda update, context: None)
+        assert not router.validate()
+
+        rng = random.Random(40)
+        for payload in codec.payloads.values():
+            for _ in range(200):
+                values = {name: _random_value(rng, field) for name, field in payload.fields}
+                data = payload.encode(**values)
+                assert len(data.encode("utf-8")) <= MAX_CALLBACK_BYTES, data
+                assert codec.decode(data) == (payload, values), (payload, values, data)
+                match = router.resolve(data)
+                assert match.name == payload.name and match.args == values, (data, match.args)
+        print(f"   {len(codec.payloads)} payload types round-tripped")
+    finally:
+        _cleanup()
+    print("✅ Payload round-trip test passed")
+
+
+def test_legacy_formats():
+    """callback_data from before the codec decodes to its payload and reaches the payload's handler"""
+    print("🕰 Testing pre-codec callback data...")
+    cases = {
+        "bank_ПриватБанк Business_register": (BANK_PICK, {"bank": "ПриватБанк Business", "action": "register"}),
+        "approve_4930176305_12": (PHOTO_APPROVE, {"user_id": 4930176305, "photo_id": 12}),
+        "rejtmpl_5_6_wrong_screen": (PHOTO_REJECT_TEMPLATE, {"user_id": 5, "photo_id": 6, "key": "wrong_screen"}),
+        "rvt_3_44": (REVIEW_TOGGLE, {"review_id": 3, "photo_id": 44}),
+        "edit_stage_Mono_bank_change_2": (STAGE_EDIT, {"bank": "Mono_bank", "action": "change", "step": 2}),
+        "reorder_stages_A.B": (STAGES_REORDER, {"bank": "A.B"}),
+        "reorder_bank_A.B": (STAGES_REORDER, {"bank": "A.B"}),
+        "instr_bank_ПриватБанк Business": (INSTR_BANK, {"bank": "ПриватБанк Business"}),
+    }
+    router = CallbackRouter()
+    for payload in codec.payloads.values():
+        router.add(payload, lambda update, context: None)
+    for data, (payload, values) in cases.items():
+        assert codec.decode(data) == (payload, values), data
+        match = router.resolve(data)
+        assert match.name == payload.name and match.args == values, (data, match)
+    # the longer legacy prefix wins, as in the router
+    assert codec.decode("edit_bank_stages_Mono")[0].name == "edit_bank_stages"
+    assert codec.decode("edit_bank_Mono")[0].name == "edit_bank"
+    assert codec.decode("edit_price_Mono")[1] == {"field": "price", "bank": "Mono"}
+    for data in ["approve_1", "approve_x_2", "edit_stage_Mono_other_1", "bank_Mono_delete", "rva_"]:
+        assert codec.decode(data) is None and router.resolve(data) is None, data
+    print("✅ Legacy format test passed")
+
+
+def test_garbage_is_rejected():
+    """Mutated and foreign data never raises and never decodes to a deleted bank"""
+    print("🧹 Testing malformed callback data...")
+    rng = random.Random(64)
+    alphabet = "abcdefghijklmnopqrstuvwxyzABCD0123456789._-Ї"
+    for _ in range(3000):
+        data = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 20)))
+        result = codec.decode(data)
+        if result is not None:
+            payload, values = result
+            assert payload.encode(**values) == data or any(isinstance(f, Text) for _, f in payload.fields) \
+                or any(data.startswith(fmt.prefix) for fmt in payload.legacy)
+    for bad in ["b.", "b.1", "b.1.0.0", "pa.1", "pa.1.-0"]:
+        assert codec.decode(bad) is None, bad
+    # deleted or never existing banks do not decode
+    assert codec.decode("b.zzzzzz.0") is None
+    try:
+        codec.payloads["b"].encode(bank="test_codec missing", action="register")
+        raise AssertionError("unknown bank encoded")
+    except ValueError:
+        pass
+    print("✅ Malformed data test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_base36()
+        test_fuzz_round_trip_every_payload()
+        test_legacy_formats()
+        test_garbage_is_rejected()
+        print("\n🎉 All callback codec tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Tests for the prefix-trie callback router
+"""
+import asyncio
+import sys
+
+sys.path.insert(0, '.')
+
+from telegram import CallbackQuery, Update, User
+
+from handlers.callback_router import CallbackRouter, RouteConflictError
+
+
+async def _noop(update, context):
+    return None
+
+
+def _query_update(data):
+    query = CallbackQuery(id="1", from_user=User(1, "Test", False), chat_instance="1", data=data)
+    return Update(update_id=1, callback_query=query)
+
+
+class _Context:
+    """The part of CallbackContext the router uses"""
+    def __init__(self):
+        self.matches = None
+
+    @property
+    def match(self):
+        return self.matches[0] if self.matches else None
+
+
+def test_resolution_and_typed_args():
+    """Longest prefix wins, typed fields are parsed, unparseable data falls back to shorter prefixes"""
+    print("🧭 Testing callback route resolution...")
+    router = CallbackRouter()
+
+    @router.route("edit_bank_{bank}")
+    async def edit_bank(update, context):
+        pass
+
+    @router.route("edit_bank_stages_{bank}")
+    async def edit_stages(update, context):
+        pass
+
+    @router.route("bank_{bank}_{action:register|change}", "menu_banks")
+    async def menu(update, context):
+        pass
+
+    @router.route("delete_group_{group_id:int}")
+    async def delete_group(update, context):
+        pass
+
+    @router.route("age_confirm_*")
+    async def age(update, context):
+        pass
+
+    m = router.resolve("edit_bank_stages_Mono")
+    assert m.route.func is edit_stages and m["bank"] == "Mono"
+    assert router.resolve("edit_bank_Mono").route.func is edit_bank
+    m = router.resolve("bank_Privat_24_change")
+    assert m.route.func is menu and m.args == {"bank": "Privat_24", "action": "change"}
+    assert router.resolve("menu_banks").args == {}
+    assert router.resolve("menu_banks_x") is None, "Exact routes do not match longer data"
+    assert router.resolve("bank_save") is None and router.resolve("bank_reg_yes") is None
+    assert router.resolve("delete_group_-1001").args == {"group_id": -1001}
+    assert router.resolve("delete_group_abc") is None
+    assert router.resolve("age_confirm_") is not None and router.resolve("age_confirm_no").route.func is age
+    assert router.resolve(None) is None
+    print("✅ Route resolution test passed")
+
+
+def test_validation():
+    """Identical shapes are rejected, unreachable and foreign-overlapping routes reported"""
+    print("🧪 Testing route validation...")
+    router = CallbackRouter()
+    router.add("rvt_{review_id:int}", _noop)
+
+    async def other(update, context):
+        pass
+
+    router.add("rvt_{id:int}", other)
+    try:
+        router.validate()
+        raise AssertionError("ambiguous routes must be rejected")
+    except RouteConflictError:
+        pass
+
+    router = CallbackRouter()
+    router.add("orders_*", _noop)
+    router.add("orders_{order_id:int}", _noop)
+    router.add("groups_{anything}", _noop)
+    router.add("groups_list", _noop)   # exact routes are tried first, so still reachable
+    router.add("groups_{name}_x", _noop)
+    problems = router.validate(foreign_patterns=["^menu_coop$", "^groups_"])
+    assert any("'groups_{name}_x'" in p and "shadowed" in p for p in problems), problems
+    assert not any("'groups_list'" in p and "shadowed" in p for p in problems), problems
+    assert sum("overlaps" in p for p in problems) == 3, problems
+    assert not any("'orders_{order_id:int}'" in p for p in problems), "Typed routes precede wildcards"
+    print("✅ Route validation test passed")
+
+
+def test_dispatch_records_timings():
+    """dispatch() runs the resolved handler, exposes its fields and records per-route timings"""
+    print("⏱ Testing routed dispatch...")
+    router = CallbackRouter()
+    seen = []
+
+    @router.route("rva_{review_id:int}")
+    async def review(update, context):
+        seen.append(context.match["review_id"])
+        return "done"
+
+    @router.route("boom")
+    async def boom(update, context):
+        raise RuntimeError("handler failed")
+
+    async def scenario():
+        handler = router.handler()
+        update = _query_update("rva_42")
+        match = handler.check_update(update)
+        assert match.route.spec == "rva_{review_id:int}"
+        context = _Context()
+        handler.collect_additional_context(context, update, None, match)
+        result = await router.dispatch(update, context)
+        # without PTB's context.matches the router resolves on its own
+        await router.dispatch(_query_update("rva_7"), _Context())
+        try:
+            await router.dispatch(_query_update("boom"), _Context())
+        except RuntimeError:
+            pass
+        assert handler.check_update(_query_update("unknown")) is None
+        return result
+
+    assert asyncio.run(scenario()) == "done"
+    assert seen == [42, 7]
+    stats = router.stats()
+    assert stats["timings"]["rva_{review_id:int}"]["count"] == 2
+    assert stats["timings"]["boom"]["errors"] == 1
+    assert stats["unmatched"] == 1
+    print("✅ Routed dispatch test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_resolution_and_typed_args()
+        test_validation()
+        test_dispatch_records_timings()
+        print("\n🎉 All callback router tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
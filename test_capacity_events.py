@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Tests for capacity events: the dispatcher that drains the queue and the
+reconciliation sweep that repairs group load drift
+"""
+import asyncio
+import sys
+
+sys.path.insert(0, '.')
+
+from capacity_events import CapacityDispatcher, capacity_dispatcher, reconcile_group_load
+from db import conn, cursor
+from queue_scheduler import QueueScheduler, occupy_group, release_group
+
+TEST_GROUP_BASE = -100460000
+TEST_BANK = "test_capev bank"
+
+
+def _cleanup():
+    cursor.execute("DELETE FROM queue WHERE bank LIKE 'test_capev%'")
+    cursor.execute("DELETE FROM orders WHERE bank LIKE 'test_capev%'")
+    cursor.execute("DELETE FROM manager_groups WHERE group_id BETWEEN ? AND ?",
+                   (TEST_GROUP_BASE - 1000, TEST_GROUP_BASE))
+    conn.commit()
+
+
+def _add_group(n, capacity=1, load=0, busy=0):
+    cursor.execute("INSERT INTO manager_groups (group_id, name, bank, capacity, load, busy) VALUES (?, ?, ?, ?, ?, ?)",
+                   (TEST_GROUP_BASE - n, f"test_capev group {n}", TEST_BANK, capacity, load, busy))
+    return cursor.lastrowid
+
+
+def _order(group_chat_id, status="На етапі 1"):
+    cursor.execute("INSERT INTO orders (user_id, username, bank, action, status, group_id) "
+                   "VALUES (999999461, 'test_capev', ?, 'register', ?, ?)", (TEST_BANK, status, group_chat_id))
+
+
+def _counters(n):
+    cursor.execute("SELECT load, busy FROM manager_groups WHERE group_id=?", (TEST_GROUP_BASE - n,))
+    return cursor.fetchone()
+
+
+def test_reconcile_repairs_drift():
+    """Load and busy are recounted from open orders; consistent groups are left alone"""
+    print("🧾 Testing load reconciliation...")
+    _cleanup()
+    try:
+        _add_group(1, capacity=1, load=1, busy=1)  # manually marked busy, no open order
+        _add_group(2, capacity=2, load=0, busy=0)  # two open orders never counted
+        _add_group(3, capacity=2, load=1, busy=0)  # consistent
+        _order(TEST_GROUP_BASE - 1, "Завершено")
+        _order(TEST_GROUP_BASE - 2)
+        _order(TEST_GROUP_BASE - 2)
+        _order(TEST_GROUP_BASE - 3)
+        _order(TEST_GROUP_BASE - 3, "Незавершено (менеджер)")
+        conn.commit()
+
+        drifted = {d.group_id: d for d in reconcile_group_load() if TEST_GROUP_BASE - 1000 <= d.group_id <= TEST_GROUP_BASE}
+        conn.commit()
+        assert set(drifted) == {TEST_GROUP_BASE - 1, TEST_GROUP_BASE - 2}, drifted
+        assert drifted[TEST_GROUP_BASE - 2].load == 0 and drifted[TEST_GROUP_BASE - 2].open_orders == 2
+        assert (_counters(1), _counters(2), _counters(3)) == ((0, 0), (2, 1), (1, 0))
+        assert not [d for d in reconcile_group_load() if TEST_GROUP_BASE - 1000 <= d.group_id <= TEST_GROUP_BASE]
+    finally:
+        _cleanup()
+    print("✅ Load reconciliation test passed")
+
+
+def test_dispatcher_coalesces_and_serializes():
+    """Bursts of events cause few passes, never two at once, and always one after the last event"""
+    print("📣 Testing capacity dispatcher...")
+
+    async def scenario():
+        running, peak, passes = 0, 0, []
+        dispatcher = CapacityDispatcher(reconcile_seconds=3600)
+
+        async def drain():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            passes.append(dict(dispatcher.events))
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        dispatcher.publish("released", 1)  # before start: counted, handled by the startup pass
+        dispatcher.start(drain)
+        for n in range(50):
+            dispatcher.publish("released", n)
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.05)
+        await dispatcher.stop()
+        return dispatcher, peak, passes
+
+    dispatcher, peak, passes = asyncio.run(scenario())
+    assert peak == 1, f"{peak} passes ran concurrently"
+    assert 2 <= len(passes) < 20, len(passes)
+    # the last pass started after every event was published
+    assert passes[-1] == {"released": 51}, passes[-1]
+    assert dispatcher.stats()["passes"] == len(passes) and dispatcher.stats()["repaired"] >= 0
+    print(f"   51 events -> {len(passes)} passes")
+    print("✅ Capacity dispatcher test passed")
+
+
+def test_freed_capacity_reaches_the_queue():
+    """A released slot and a slot freed by a manual DB edit both go to the waiting client"""
+    print("🔁 Testing event-driven assignment...")
+    _cleanup()
+
+    async def scenario():
+        scheduler = QueueScheduler()
+        group = _add_group(1, capacity=1, load=1, busy=1)  # busy by a manual edit, no open order
+        cursor.execute("INSERT INTO queue (user_id, username, bank, action) VALUES (999999462, 'test_capev', ?, 'register')",
+                       (TEST_BANK,))
+        conn.commit()
+        assigned = []
+
+        def assign(group, entry):
+            occupy_group(group.id)
+            _order(group.group_id)
+            assigned.append(entry.user_id)
+
+        async def drain():
+            scheduler.match(assign, [g for g in scheduler.free_groups() if g.id == group])
+
+        # the process-wide dispatcher, which release_group publishes to
+        dispatcher = capacity_dispatcher
+        released = dispatcher.events["released"]
+        repaired = dispatcher.repaired
+        dispatcher.start(drain)
+        await asyncio.sleep(0.05)
+        # no event was published: the startup sweep repaired the counter and the pass assigned the client
+        assert assigned == [999999462] and dispatcher.repaired > repaired, (assigned, dispatcher.stats())
+
+        cursor.execute("INSERT INTO queue (user_id, username, bank, action) VALUES (999999463, 'test_capev', ?, 'register')",
+                       (TEST_BANK,))
+        conn.commit()
+        await asyncio.sleep(0.02)
+        assert assigned == [999999462], "the group is full"
+
+        cursor.execute("UPDATE orders SET status='Завершено' WHERE bank=? AND user_id=999999461", (TEST_BANK,))
+        release_group(TEST_GROUP_BASE - 1)
+        conn.commit()
+        await asyncio.sleep(0.05)
+        await dispatcher.stop()
+        assert assigned == [999999462, 999999463], assigned
+        assert dispatcher.events["released"] == released + 1
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        _cleanup()
+    print("✅ Event-driven assignment test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_reconcile_repairs_drift()
+        test_dispatcher_coalesces_and_serializes()
+        test_freed_capacity_reaches_the_queue()
+        print("\n🎉 All capacity event tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
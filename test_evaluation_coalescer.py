@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Tests for coalesced stage evaluation
+"""
+import asyncio
+import sys
+
+sys.path.insert(0, '.')
+
+from handlers.evaluation_coalescer import EvaluationCoalescer
+
+
+def test_burst_is_evaluated_once():
+    """A burst of decisions for one (order, stage) results in a single evaluation"""
+    print("🧮 Testing evaluation coalescing...")
+    calls = []
+
+    async def evaluate(user_id, order_id, stage_db, context):
+        calls.append((user_id, order_id, stage_db))
+
+    async def scenario():
+        ev = EvaluationCoalescer(evaluate, quiet_seconds=0.05)
+        for _ in range(5):
+            ev.mark_dirty(1, 10, 1, None)
+            await asyncio.sleep(0.01)
+        ev.mark_dirty(2, 20, 3, None)
+        await asyncio.sleep(0.15)
+        return ev.stats()
+
+    stats = asyncio.run(scenario())
+    assert sorted(calls) == [(1, 10, 1), (2, 20, 3)]
+    assert stats == {"pending": 0, "marked": 6, "coalesced": 4, "evaluated": 2}
+    print("✅ Evaluation coalescing test passed")
+
+
+def test_same_order_is_serialized():
+    """Evaluations of one order never overlap; flush runs pending ones immediately"""
+    print("🔒 Testing per-order evaluation lock...")
+    running = {"now": 0, "max": 0}
+
+    async def evaluate(user_id, order_id, stage_db, context):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        await asyncio.sleep(0.02)
+        running["now"] -= 1
+
+    async def scenario():
+        ev = EvaluationCoalescer(evaluate, quiet_seconds=60)
+        ev.mark_dirty(1, 10, 1, None)
+        ev.mark_dirty(1, 10, 2, None)
+        await ev.flush()
+        return ev
+
+    ev = asyncio.run(scenario())
+    assert running["max"] == 1, "Same order must be evaluated under one lock"
+    assert ev.evaluated == 2 and ev.pending_count() == 0
+    assert not ev._locks, "Idle order locks must be released"
+    print("✅ Per-order evaluation lock test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_burst_is_evaluated_once()
+        test_same_order_is_serialized()
+        print("\n🎉 All evaluation coalescer tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
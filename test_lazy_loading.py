@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Tests for lazy handler loading: the startup import profile (-X importtime) and
+the lazy route manifest
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, '.')
+
+from handlers.callback_router import CallbackRouter, router
+from handlers.lazy import LazyCallback, lazy
+from handlers.routes import LAZY_ROUTES, declare_lazy_routes
+
+LAZY_MODULES = set(LAZY_ROUTES) | {"handlers.admin_handlers"}
+# Cumulative import time of client_bot, in ms; generous so slow CI machines pass
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "3000"))
+
+
+def _import_profile(module):
+    """{module: (self_us, cumulative_us)} from `python -X importtime -c "import <module>"`"""
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, BOT_TOKEN="123:abc", ADMIN_IDS="1", ADMIN_GROUP_ID="-1",
+                   DB_FILE=os.path.join(tmp, "orders.db"), LOCK_FILE=os.path.join(tmp, "bot.lock"))
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                capture_output=True, text=True, env=env, timeout=120)
+    assert result.returncode == 0, result.stderr[-2000:]
+    profile = {}
+    for line in result.stderr.splitlines():
+        # import time:       self [us] |  cumulative | imported package
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        profile[name.strip()] = (int(self_us), int(cumulative_us))
+    return profile
+
+
+def test_startup_import_profile():
+    """Importing client_bot loads no admin module and stays within the import budget"""
+    print("⏱ Profiling client_bot imports...")
+    profile = _import_profile("client_bot")
+    assert "client_bot" in profile, "importtime output not parsed"
+    loaded = LAZY_MODULES & set(profile)
+    assert not loaded, f"imported at startup: {sorted(loaded)}"
+    total_ms = profile["client_bot"][1] / 1000
+    slowest = sorted(profile.items(), key=lambda item: item[1][0], reverse=True)[:5]
+    print(f"   client_bot: {total_ms:.0f} ms cumulative (budget {IMPORT_BUDGET_MS:.0f} ms)")
+    for name, (self_us, _) in slowest:
+        print(f"   {self_us / 1000:7.1f} ms  {name}")
+    assert total_ms <= IMPORT_BUDGET_MS, f"client_bot import took {total_ms:.0f} ms"
+    print("✅ Startup import profile test passed")
+
+
+def test_manifest_matches_module_routes():
+    """Every route of a lazy module is declared in handlers/routes.py and every declaration is bound"""
+    print("📜 Testing lazy route manifest...")
+    declare_lazy_routes()
+    for module in LAZY_ROUTES:
+        __import__(module)
+    router.validate()
+
+    undeclared = [r for r in router.routes
+                  if not isinstance(r.func, LazyCallback) and getattr(r.func, "__module__", None) in LAZY_ROUTES]
+    assert not undeclared, f"missing from LAZY_ROUTES: {undeclared}"
+    unbound = [r for r in router.routes if isinstance(r.func, LazyCallback) and not r.func.loaded]
+    assert not unbound, f"declared but not routed by their module: {unbound}"
+    for module, handlers in LAZY_ROUTES.items():
+        for name in handlers:
+            callback = lazy(module, name)
+            assert callback.resolve() is getattr(sys.modules[module], name)
+    print("✅ Lazy route manifest test passed")
+
+
+def test_lazy_callback_imports_on_first_call():
+    """The module is imported on the first call and binds to routes declared before it"""
+    print("💤 Testing first-call import...")
+    module = "_lazy_probe_handlers"
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, module + ".py"), "w") as f:
+            f.write(
+                "async def probe(update, context):\n"
+                "    return 'probed'\n"
+            )
+        sys.path.insert(0, tmp)
+        try:
+            local = CallbackRouter()
+            callback = LazyCallback(module, "probe")
+            local.add("lazy_probe_{n:int}", callback)
+            assert module not in sys.modules and not callback.loaded
+
+            match = local.resolve("lazy_probe_5")
+            assert match.route.func is callback and match["n"] == 5
+            assert asyncio.run(callback(None, None)) == "probed"
+            assert module in sys.modules and callback.loaded
+
+            # the module's own declaration binds to the lazy route instead of adding a second one
+            local.add("lazy_probe_{n:int}", sys.modules[module].probe)
+            assert len(local.routes) == 1 and local.routes[0].func is callback
+            assert not local.validate()
+        finally:
+            sys.path.remove(tmp)
+            sys.modules.pop(module, None)
+    print("✅ First-call import test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_startup_import_profile()
+        test_manifest_matches_module_routes()
+        test_lazy_callback_imports_on_first_call()
+        print("\n🎉 All lazy loading tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Tests for the stale-order reaper: activity tracking, the indexed idle scan and
+the warn-then-expire flow that frees the group
+"""
+import sys
+import time
+
+sys.path.insert(0, '.')
+
+from capacity_events import EXPIRED_STATUS, OPEN_ORDER_SQL, capacity_dispatcher
+from db import conn, cursor, log_action
+from order_reaper import OrderReaper, parse_stage_minutes
+
+TEST_GROUP = -100480001
+TEST_BANK = "test_reaper bank"
+
+
+def _cleanup():
+    cursor.execute("DELETE FROM outbox WHERE idem_key LIKE 'order_%' AND chat_id IN (?, 999999481)", (TEST_GROUP,))
+    cursor.execute("DELETE FROM manager_active_orders WHERE group_id=?", (TEST_GROUP,))
+    cursor.execute("DELETE FROM orders WHERE bank LIKE 'test_reaper%'")
+    cursor.execute("DELETE FROM queue WHERE bank LIKE 'test_reaper%'")
+    cursor.execute("DELETE FROM manager_groups WHERE group_id=?", (TEST_GROUP,))
+    conn.commit()
+
+
+def _order(last_activity=None, stage=0, status="На етапі 1", group_id=TEST_GROUP):
+    cursor.execute("INSERT INTO orders (user_id, username, bank, action, stage, status, group_id, last_activity) "
+                   "VALUES (999999481, 'test_reaper', ?, 'register', ?, ?, ?, ?)",
+                   (TEST_BANK, stage, status, group_id, last_activity))
+    return cursor.lastrowid
+
+
+def _order_row(order_id):
+    cursor.execute("SELECT status, last_activity, expiry_warned_at FROM orders WHERE id=?", (order_id,))
+    return cursor.fetchone()
+
+
+def test_activity_tracking_and_index():
+    """New orders, logged actions and photos bump last_activity; the idle scan uses the partial index"""
+    print("🕰 Testing activity tracking...")
+    _cleanup()
+    try:
+        before = time.time() - 1
+        order_id = _order()
+        conn.commit()
+        assert _order_row(order_id)[1] >= before
+
+        cursor.execute("UPDATE orders SET last_activity=1000 WHERE id=?", (order_id,))
+        log_action(order_id, "user", "test_reaper")
+        assert _order_row(order_id)[1] >= before
+        cursor.execute("UPDATE orders SET last_activity=1000 WHERE id=?", (order_id,))
+        cursor.execute("INSERT INTO order_photos (order_id, stage, file_id, file_unique_id) VALUES (?, 1, 'f', 'u_test_reaper')",
+                       (order_id,))
+        conn.commit()
+        assert _order_row(order_id)[1] >= before
+
+        assert parse_stage_minutes("1:60, 3:240,bad") == {0: 60.0, 2: 240.0}
+        cursor.execute(f"EXPLAIN QUERY PLAN SELECT id FROM orders WHERE last_activity < ? AND {OPEN_ORDER_SQL} "
+                       "ORDER BY last_activity", (0,))
+        plan = " ".join(row[-1] for row in cursor.fetchall())
+        assert "ix_orders_open_activity" in plan, plan
+    finally:
+        _cleanup()
+    print("✅ Activity tracking test passed")
+
+
+def test_warn_then_expire():
+    """Idle orders are warned, then expired together with their group freed; activity, stage limits and the queue spare orders"""
+    print("⌛ Testing warn-then-expire...")
+    _cleanup()
+    try:
+        now = time.time()
+        cursor.execute("INSERT INTO manager_groups (group_id, name, bank, capacity, load, busy) VALUES (?, ?, ?, 2, 2, 1)",
+                       (TEST_GROUP, "test_reaper group", TEST_BANK))
+        idle = _order(now - 2 * 3600)
+        answered = _order(now - 2 * 3600)
+        slow_stage = _order(now - 2 * 3600, stage=2)  # stage 3 allows 300 minutes
+        finished = _order(now - 2 * 3600, status="Завершено")
+        # a client waiting in the queue: the order has no group until one frees up
+        queued = _order(now - 2 * 3600, group_id=None)
+        cursor.execute("INSERT INTO queue (user_id, username, bank, action) VALUES (999999481, 'test_reaper', ?, 'register')",
+                       (TEST_BANK,))
+        cursor.execute("INSERT INTO manager_active_orders (group_id, order_id, is_primary) VALUES (?, ?, 1)",
+                       (TEST_GROUP, idle))
+        conn.commit()
+        reaper = OrderReaper(idle_minutes=60, stage_minutes={2: 300}, warn_minutes=10)
+        released = capacity_dispatcher.events["released"]
+
+        def mine(orders):
+            return {o.id for o in orders} & {idle, answered, slow_stage, finished, queued}
+
+        assert mine(reaper.idle_orders(now)) == {idle, answered, slow_stage}
+        reaper.run_once(now)
+        assert _order_row(idle)[2] == now and _order_row(answered)[2] == now and _order_row(slow_stage)[2] is None
+        cursor.execute("SELECT COUNT(*) FROM outbox WHERE idem_key LIKE 'order_idle_warn:%' AND chat_id=999999481")
+        assert cursor.fetchone()[0] == 2
+        # the client of `answered` pressed the button
+        log_action(answered, "user", "keepalive")
+
+        # past the limit, but the warning window has not run out yet
+        reaper.run_once(now + 60)
+        assert _order_row(idle)[0] == "На етапі 1"
+
+        reaper.run_once(now + 601)
+        assert [_order_row(order_id)[0] for order_id in (idle, answered, slow_stage, finished, queued)] == \
+            [EXPIRED_STATUS, "На етапі 1", "На етапі 1", "Завершено", "На етапі 1"]
+        assert _order_row(queued)[2] is None, "Queued clients are never warned"
+        cursor.execute("SELECT load, busy FROM manager_groups WHERE group_id=?", (TEST_GROUP,))
+        assert cursor.fetchone() == (1, 0)
+        cursor.execute("SELECT COUNT(*) FROM manager_active_orders WHERE group_id=?", (TEST_GROUP,))
+        assert cursor.fetchone()[0] == 0
+        assert capacity_dispatcher.events["released"] == released + 1
+        cursor.execute("SELECT chat_id FROM outbox WHERE idem_key IN (?, ?)",
+                       (f"order_expired:{idle}", f"order_expired_group:{idle}"))
+        assert sorted(row[0] for row in cursor.fetchall()) == sorted([999999481, TEST_GROUP])
+
+        # expired orders are out of the index; a second pass does nothing to them
+        assert idle not in mine(reaper.idle_orders(now + 601))
+        assert reaper.run_once(now + 602) == (0, 0)
+        assert reaper.stats()["expired"] == 1 and reaper.stats()["warned"] == 2
+    finally:
+        _cleanup()
+    print("✅ Warn-then-expire test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_activity_tracking_and_index()
+        test_warn_then_expire()
+        print("\n🎉 All order reaper tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Tests for the transactional outbox (idempotency, retries, dead letters)
+"""
+import asyncio
+import sys
+
+sys.path.insert(0, '.')
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import Forbidden, NetworkError
+
+from db import conn, cursor
+from outbox import OutboxDispatcher, dead_letters, enqueue_message, requeue_dead
+
+TEST_CHAT = 999999035
+
+
+class FakeBot:
+    def __init__(self, failures):
+        # chat_id -> list of exceptions raised by consecutive sends
+        self.failures = failures
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        pending = self.failures.get(chat_id)
+        if pending:
+            raise pending.pop(0)
+        self.sent.append((chat_id, text, kwargs))
+
+
+def _cleanup():
+    cursor.execute("DELETE FROM outbox WHERE idem_key LIKE 'test:%'")
+    conn.commit()
+
+
+def _status(outbox_id):
+    cursor.execute("SELECT status, attempts FROM outbox WHERE id=?", (outbox_id,))
+    return cursor.fetchone()
+
+
+def test_enqueue_is_transactional_and_idempotent():
+    """Rows appear only on commit; the same key is stored once"""
+    print("📮 Testing outbox enqueue...")
+    _cleanup()
+    markup = InlineKeyboardMarkup([[InlineKeyboardButton("ok", callback_data="x_1")]])
+    first = enqueue_message(TEST_CHAT, "hello", "test:1", reply_markup=markup)
+    conn.rollback()
+    cursor.execute("SELECT COUNT(*) FROM outbox WHERE idem_key='test:1'")
+    assert cursor.fetchone()[0] == 0, "Rolled back state change must not leave a message"
+
+    first = enqueue_message(TEST_CHAT, "hello", "test:1", reply_markup=markup)
+    conn.commit()
+    again = enqueue_message(TEST_CHAT, "hello", "test:1")
+    conn.commit()
+    assert first is not None and again is None
+
+    bot = FakeBot({})
+    assert asyncio.run(OutboxDispatcher().deliver(bot, first))
+    assert _status(first) == ("sent", 1)
+    chat_id, text, kwargs = bot.sent[0]
+    assert kwargs["reply_markup"].inline_keyboard[0][0].callback_data == "x_1"
+    assert not asyncio.run(OutboxDispatcher().deliver(bot, first)), "Sent rows are not delivered twice"
+    _cleanup()
+    print("✅ Outbox enqueue test passed")
+
+
+def test_retries_and_dead_letters():
+    """Transient errors are retried with backoff, permanent ones go to dead letters and can be re-queued"""
+    print("📮 Testing outbox retries...")
+    _cleanup()
+    flaky = enqueue_message(TEST_CHAT, "flaky", "test:flaky")
+    blocked = enqueue_message(TEST_CHAT + 1, "blocked", "test:blocked")
+    conn.commit()
+    bot = FakeBot({TEST_CHAT: [NetworkError("timeout")], TEST_CHAT + 1: [Forbidden("bot was blocked")]})
+    dispatcher = OutboxDispatcher(max_attempts=3)
+
+    asyncio.run(dispatcher.run_once(bot))
+    assert _status(flaky) == ("pending", 1)
+    assert _status(blocked) == ("dead", 1)
+    assert [row[0] for row in dead_letters()][:1] == [blocked]
+
+    cursor.execute("UPDATE outbox SET next_attempt_at=0 WHERE id=?", (flaky,))  # skip the backoff
+    conn.commit()
+    asyncio.run(dispatcher.run_once(bot))
+    assert _status(flaky) == ("sent", 2)
+
+    assert requeue_dead() >= 1
+    asyncio.run(dispatcher.run_once(bot))
+    assert _status(blocked) == ("sent", 1)
+    assert dispatcher.stats()["sent"] == 2 and dispatcher.retried == 1 and dispatcher.dead == 1
+    _cleanup()
+    print("✅ Outbox retries test passed")
+
+
+def test_data_alert_per_submission():
+    """The managers' data alert is stored once per submitted message, so corrected data is announced again"""
+    print("📨 Testing data alert keys...")
+    from types import SimpleNamespace
+
+    from handlers.stage2_handlers import _enqueue_managers_after_data
+
+    cursor.execute("INSERT INTO orders (user_id, username, bank, action, stage, status, group_id) "
+                   "VALUES (?, 'test_outbox', 'test_outbox bank', 'register', 1, 'На етапі 2', ?)",
+                   (TEST_CHAT, -TEST_CHAT))
+    order_id = cursor.lastrowid
+    context = SimpleNamespace(application=None)  # remembering the group's current order is best effort
+    try:
+        first = _enqueue_managers_after_data(order_id, context, 101)
+        retry = _enqueue_managers_after_data(order_id, context, 101)
+        corrected = _enqueue_managers_after_data(order_id, context, 102)
+        conn.commit()
+        assert first is not None and retry is None and corrected not in (None, first)
+    finally:
+        cursor.execute("DELETE FROM outbox WHERE idem_key LIKE ?", (f"data_notify:{order_id}:%",))
+        cursor.execute("DELETE FROM orders WHERE id=?", (order_id,))
+        conn.commit()
+    print("✅ Data alert key test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_enqueue_is_transactional_and_idempotent()
+        test_retries_and_dead_letters()
+        test_data_alert_per_submission()
+        print("\n🎉 All outbox tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        _cleanup()
+        sys.exit(1)
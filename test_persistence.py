@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Tests for SQLite-backed PTB persistence
+"""
+import asyncio
+import sys
+
+sys.path.insert(0, '.')
+
+from db import conn, cursor
+from persistence import SQLitePersistence
+
+TEST_CHAT_ID = -1009999999001
+TEST_USER_ID = 999999001
+TEST_CONV = "test_conv"
+
+
+def _cleanup():
+    cursor.execute("DELETE FROM persistence_store WHERE key IN (?, ?)", (str(TEST_CHAT_ID), str(TEST_USER_ID)))
+    cursor.execute("DELETE FROM persistence_store WHERE namespace=?", ("conv:" + TEST_CONV,))
+    conn.commit()
+
+
+def _row_count(namespace: str, key: str) -> int:
+    cursor.execute("SELECT COUNT(*) FROM persistence_store WHERE namespace=? AND key=?", (namespace, key))
+    return cursor.fetchone()[0]
+
+
+def test_round_trip():
+    """Data written by one persistence instance is loaded by a fresh one"""
+    print("💾 Testing persistence round trip...")
+    _cleanup()
+
+    async def scenario():
+        p = SQLitePersistence()
+        await p.update_chat_data(TEST_CHAT_ID, {"stage2_current_order_id": 42})
+        await p.update_user_data(TEST_USER_ID, {"reject_user_id": 7, "photo_db_id": 11})
+        await p.update_conversation(TEST_CONV, (TEST_CHAT_ID,), 1)
+        await p.flush()
+
+        fresh = SQLitePersistence()
+        chat_data = await fresh.get_chat_data()
+        user_data = await fresh.get_user_data()
+        convs = await fresh.get_conversations(TEST_CONV)
+        return chat_data, user_data, convs
+
+    chat_data, user_data, convs = asyncio.run(scenario())
+    assert chat_data[TEST_CHAT_ID] == {"stage2_current_order_id": 42}
+    assert user_data[TEST_USER_ID]["photo_db_id"] == 11
+    assert convs[(TEST_CHAT_ID,)] == 1
+
+    _cleanup()
+    print("✅ Persistence round trip test passed")
+
+
+def test_dirty_tracking():
+    """Unchanged entries are not queued for writing; ended conversations are deleted"""
+    print("🧹 Testing persistence dirty-tracking...")
+    _cleanup()
+
+    async def scenario():
+        p = SQLitePersistence()
+        await p.update_chat_data(TEST_CHAT_ID, {"current_order_id": 5})
+        await p.flush()
+
+        await p.update_chat_data(TEST_CHAT_ID, {"current_order_id": 5})
+        unchanged_pending = p.pending_count()
+
+        await p.update_chat_data(TEST_CHAT_ID, {"current_order_id": 6})
+        changed_pending = p.pending_count()
+        await p.flush()
+
+        await p.update_conversation(TEST_CONV, (TEST_CHAT_ID,), 2)
+        await p.flush()
+        await p.update_conversation(TEST_CONV, (TEST_CHAT_ID,), None)
+        await p.flush()
+        return unchanged_pending, changed_pending
+
+    unchanged_pending, changed_pending = asyncio.run(scenario())
+    assert unchanged_pending == 0, "Unchanged chat_data must not be rewritten"
+    assert changed_pending == 1, "Changed chat_data must be queued"
+    cursor.execute("SELECT data FROM persistence_store WHERE namespace='chat_data' AND key=?", (str(TEST_CHAT_ID),))
+    assert cursor.fetchone()[0] == '{"current_order_id": 6}'
+    assert _row_count("conv:" + TEST_CONV, f"[{TEST_CHAT_ID}]") == 0, "Ended conversation should be removed"
+
+    _cleanup()
+    print("✅ Persistence dirty-tracking test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_round_trip()
+        test_dirty_tracking()
+        print("\n🎉 All persistence tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        _cleanup()
+        sys.exit(1)
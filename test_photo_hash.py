@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Tests for perceptual hashing / near-duplicate lookup (offline, uses images/ fixtures)
+"""
+import asyncio
+import io
+import sys
+
+sys.path.insert(0, '.')
+
+from PIL import Image
+
+from handlers.photo_hash import BKTree, PhotoHasher, from_signed64, hamming, phash, to_signed64
+
+FIXTURE = "images/privat_step1_1.jpg"
+OTHER_FIXTURES = ["images/pumb_change_card1.jpg", "images/pumb_change_diya3.jpg"]
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _resaved_copy(data: bytes) -> bytes:
+    """Downscaled, slightly cropped and re-encoded copy of a screenshot."""
+    img = Image.open(io.BytesIO(data)).convert("RGB")
+    w, h = img.size
+    img = img.crop((0, int(h * 0.01), w, h - int(h * 0.01))).resize((w * 3 // 4, h * 3 // 4))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=60)
+    return out.getvalue()
+
+
+def test_resaved_copy_is_near_duplicate():
+    """Re-saved/cropped copy stays within the threshold; different screenshots are far apart"""
+    print("🧬 Testing perceptual hashes...")
+    original = _read(FIXTURE)
+    p1, p2 = phash(original), phash(_resaved_copy(original))
+    assert hamming(p1, p2) <= 6, f"pHash distance too large: {hamming(p1, p2)}"
+    for path in OTHER_FIXTURES:
+        other = phash(_read(path))
+        assert hamming(p1, other) > 6, f"{path} should not match {FIXTURE}"
+    assert from_signed64(to_signed64(p1)) == p1
+    print("✅ Perceptual hashes test passed")
+
+
+def test_bk_tree_matches_linear_scan():
+    """BK-tree search returns exactly what a linear scan within the radius returns"""
+    print("🌳 Testing BK-tree search...")
+    import random
+    rnd = random.Random(32)
+    values = [rnd.getrandbits(64) for _ in range(500)]
+    tree = BKTree()
+    for i, v in enumerate(values):
+        tree.add(v, i)
+    tree.add(values[0], "dup")
+    for probe in values[:20]:
+        probe ^= 1 << rnd.randrange(64)
+        expected = sorted(i for i, v in enumerate(values) if hamming(probe, v) <= 8)
+        got = sorted(item for _, item in tree.search(probe, 8) if item != "dup")
+        assert got == expected
+    assert tree.search(values[0], 0)[-1][1] == "dup"
+    print("✅ BK-tree search test passed")
+
+
+def test_hasher_process_pool():
+    """Hashes computed in the process pool equal in-process ones"""
+    print("⚙️ Testing hashing process pool...")
+    data = _read(FIXTURE)
+    hasher = PhotoHasher(max_workers=1)
+    try:
+        result = asyncio.run(hasher.hash_bytes(data))
+    finally:
+        hasher.shutdown()
+    assert result == phash(data)
+    print("✅ Hashing process pool test passed")
+
+
+def test_analysis_cache_is_lru():
+    """A cache hit refreshes the entry, so the least recently used one is evicted"""
+    print("🗃 Testing analysis cache...")
+
+    class _File:
+        async def download_as_bytearray(self):
+            return bytearray(_read(FIXTURE))
+
+    class _Bot:
+        downloads = 0
+
+        async def get_file(self, file_id):
+            _Bot.downloads += 1
+            return _File()
+
+    async def scenario():
+        hasher = PhotoHasher(max_workers=1, cache_size=2)
+        bot = _Bot()
+        try:
+            for unique_id in ("a", "b", "a", "c", "a", "b"):
+                await hasher.analyze_telegram_file(bot, unique_id, unique_id)
+        finally:
+            hasher.shutdown()
+        return list(hasher._cache)
+
+    cached = asyncio.run(scenario())
+    # a, b downloaded; a hit; c evicts b (not a); a hit; b downloaded again, evicting c
+    assert _Bot.downloads == 4 and cached == ["a", "b"], (_Bot.downloads, cached)
+    print("✅ Analysis cache test passed")
+
+
+def test_duplicates_are_looked_up_in_other_orders():
+    """A screenshot resubmitted within its own order isn't flagged; the same one in another order is"""
+    print("🪞 Testing duplicate lookup across orders...")
+    import handlers.photo_handlers as photo_handlers
+    from db import conn, cursor
+
+    value = phash(_read(FIXTURE))
+    near = value ^ 0b101  # a resaved copy, two bits away
+    order_ids, photo_ids = [], []
+    try:
+        for _ in range(2):
+            cursor.execute(
+                "INSERT INTO orders (user_id, username, bank, action, stage, status) VALUES (?, ?, ?, ?, ?, ?)",
+                (999999033, "dup_test", "TestBank", "register", 0, "test"),
+            )
+            order_ids.append(cursor.lastrowid)
+        cursor.execute(
+            "INSERT INTO order_photos (order_id, stage, file_id, file_unique_id, phash) VALUES (?, 1, 'dup0', 'dup0', ?)",
+            (order_ids[0], to_signed64(value)),
+        )
+        photo_ids.append(cursor.lastrowid)
+        conn.commit()
+        photo_handlers._phash_index = None
+        photo_handlers._duplicate_index().add(value, (photo_ids[0], order_ids[0]))
+
+        assert photo_handlers._find_duplicate(value, order_ids[0]) is None
+        assert photo_handlers._find_duplicate(near, order_ids[0]) is None
+        assert photo_handlers._find_duplicate(value, order_ids[1]) == (photo_ids[0], order_ids[0], 0)
+        assert photo_handlers._find_duplicate(near, order_ids[1]) == (photo_ids[0], order_ids[0], 2)
+    finally:
+        photo_handlers._phash_index = None
+        cursor.execute("DELETE FROM order_photos WHERE file_id='dup0'")
+        cursor.execute("DELETE FROM orders WHERE user_id=999999033")
+        conn.commit()
+    print("✅ Duplicate lookup test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_resaved_copy_is_near_duplicate()
+        test_bk_tree_matches_linear_scan()
+        test_hasher_process_pool()
+        test_analysis_cache_is_lru()
+        test_duplicates_are_looked_up_in_other_orders()
+        print("\n🎉 All photo hash tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
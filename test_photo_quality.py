@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Tests for blur/crop pre-screening of screenshots (offline, uses images/ fixtures)
+"""
+import io
+import sys
+
+sys.path.insert(0, '.')
+
+from PIL import Image, ImageFilter
+
+import states
+from handlers.photo_quality import QualityMetrics, assess_quality, measure_quality
+
+FIXTURE = "images/pumb_change_diya1.jpg"
+
+
+def _variant(blur_radius: float = 0, crop_bottom: float = 0) -> bytes:
+    img = Image.open(FIXTURE).convert("RGB")
+    if crop_bottom:
+        w, h = img.size
+        img = img.crop((0, 0, w, int(h * (1 - crop_bottom))))
+    if blur_radius:
+        img = img.filter(ImageFilter.GaussianBlur(blur_radius))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def test_blur_detection():
+    """Sharp screenshot passes, blurred copy is flagged and auto-rejected only when enabled"""
+    print("🔍 Testing blur pre-screening...")
+    sharp = measure_quality(_variant())
+    blurred = measure_quality(_variant(blur_radius=4))
+    assert sharp.blur > 10 * blurred.blur
+
+    assert assess_quality(sharp).issue is None
+    verdict = assess_quality(blurred)
+    assert verdict.issue == "blurry" and verdict.confidence >= 0.9
+    assert not verdict.auto_reject, "Auto-reject is off by default"
+    assert assess_quality(blurred, {"auto_reject": True}).auto_reject
+    print("✅ Blur pre-screening test passed")
+
+
+def test_crop_detection_with_step_thresholds():
+    """Aspect ratio from the step's "quality" settings flags a cut-off screenshot"""
+    print("✂️ Testing crop pre-screening...")
+    states.INSTRUCTIONS["_QualityTestBank"] = {"register": [{"text": "t", "quality": {"aspect": 1280 / 574}}]}
+    try:
+        thresholds = states.get_quality_thresholds("_QualityTestBank", "register", 0)
+        assert states.get_quality_thresholds("_QualityTestBank", "register", 5) == {}
+    finally:
+        del states.INSTRUCTIONS["_QualityTestBank"]
+
+    full = measure_quality(_variant())
+    cropped = measure_quality(_variant(crop_bottom=0.45))
+    assert assess_quality(full, thresholds).issue is None
+    verdict = assess_quality(cropped, thresholds)
+    assert verdict.issue == "crop" and verdict.confidence > 0.5
+
+    tiny = QualityMetrics(blur=500.0, width=200, height=300)
+    assert assess_quality(tiny).issue == "crop", "Too small resolution looks like a crop"
+    print("✅ Crop pre-screening test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_blur_detection()
+        test_crop_detection_with_step_thresholds()
+        print("\n🎉 All photo quality tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Tests for consolidated album review (drafts, bulk decisions, control message rendering, rejection reasons)
+"""
+import asyncio
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, '.')
+
+import handlers.photo_handlers as photo_handlers
+from db import conn, cursor
+from handlers.callback_codec import (
+    PHOTO_SKIP_STAGE,
+    REVIEW_APPLY,
+    REVIEW_REASON,
+    REVIEW_REASON_CUSTOM,
+    REVIEW_REJECT_ALL,
+)
+from handlers.callback_router import router
+from handlers.photo_handlers import (
+    REJECT_TEMPLATES,
+    REVIEW_REJECT_REASON,
+    _apply_review_decisions,
+    _create_review,
+    _render_review,
+    _send_album_review,
+    _toggle_review_draft,
+    handle_review_action,
+    moderation_text_input,
+)
+from states import user_states
+
+TEST_USER_ID = 999999029
+
+
+def _setup(n_photos: int):
+    cursor.execute(
+        "INSERT INTO orders (user_id, username, bank, action, stage, status) VALUES (?, ?, ?, ?, ?, ?)",
+        (TEST_USER_ID, "review_test", "TestBank", "register", 0, "test"),
+    )
+    order_id = cursor.lastrowid
+    photo_ids = []
+    for i in range(n_photos):
+        cursor.execute(
+            "INSERT INTO order_photos (order_id, stage, file_id, file_unique_id) VALUES (?, 1, ?, ?)",
+            (order_id, f"file{i}", f"uniq{i}"),
+        )
+        photo_ids.append(cursor.lastrowid)
+    conn.commit()
+    return order_id, photo_ids
+
+
+def _cleanup():
+    cursor.execute("DELETE FROM photo_reviews WHERE user_id=?", (TEST_USER_ID,))
+    cursor.execute("DELETE FROM order_photos WHERE order_id IN (SELECT id FROM orders WHERE user_id=?)", (TEST_USER_ID,))
+    cursor.execute("DELETE FROM orders WHERE user_id=?", (TEST_USER_ID,))
+    conn.commit()
+    user_states.pop(TEST_USER_ID, None)
+
+
+def _states(photo_ids):
+    marks = ",".join("?" * len(photo_ids))
+    cursor.execute(f"SELECT confirmed FROM order_photos WHERE id IN ({marks}) ORDER BY id", photo_ids)
+    return [r[0] for r in cursor.fetchall()]
+
+
+class _Message:
+    def __init__(self, message_id=None, text=None):
+        self.chat_id, self.message_id, self.text, self.photo = -100999, message_id, text, None
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+class _Query:
+    def __init__(self, data, message):
+        self.data, self.message, self.from_user = data, message, SimpleNamespace(id=1)
+        self.edits = []
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+    async def edit_message_text(self, text, reply_markup=None, **kwargs):
+        self.edits.append((text, reply_markup))
+
+
+class _Bot:
+    def __init__(self):
+        self.edits = []
+        self.sent = []
+
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None, **kwargs):
+        self.edits.append((chat_id, message_id, text, reply_markup))
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        self.sent.append(("album", len(media), kwargs.get("reply_to_message_id")))
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        self.sent.append(("photo", photo, kwargs.get("reply_to_message_id")))
+        return SimpleNamespace(chat_id=chat_id, message_id=500 + len(self.sent))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(("control", text, None))
+        return SimpleNamespace(chat_id=chat_id, message_id=500 + len(self.sent))
+
+
+class _Evaluator:
+    def __init__(self):
+        self.dirty = []
+
+    def mark_dirty(self, user_id, order_id, stage_db, context):
+        self.dirty.append((user_id, order_id, stage_db))
+
+
+def _press(data, message, context):
+    query = _Query(data, message)
+    context.match = router.resolve(data)
+    asyncio.run(handle_review_action(SimpleNamespace(callback_query=query), context))
+    return query
+
+
+def _buttons(markup):
+    return [button.callback_data for row in markup.inline_keyboard for button in row]
+
+
+def test_drafts_applied_in_one_go():
+    """Toggled drafts are only applied by the apply button; keyboard shows drafts and disappears when done"""
+    print("🗳 Testing album review drafts...")
+    _cleanup()
+    order_id, photo_ids = _setup(3)
+    review_id = _create_review(TEST_USER_ID, order_id, 1, photo_ids)
+
+    assert _toggle_review_draft(review_id, photo_ids[0])                          # -> approve
+    assert _toggle_review_draft(review_id, photo_ids[1])                          # -> approve
+    assert _toggle_review_draft(review_id, photo_ids[1])                          # -> reject
+    assert _states(photo_ids) == [0, 0, 0], "Drafts must not touch confirmed"
+
+    text, markup = _render_review(review_id)
+    assert "@review_test" in text and "не застосовано" in text
+    assert markup.inline_keyboard[-1][0].callback_data == REVIEW_APPLY.encode(review_id=review_id)
+
+    assert _apply_review_decisions(review_id) == 2
+    assert _states(photo_ids) == [1, -1, 0]
+    cursor.execute("SELECT reason FROM order_photos WHERE id=?", (photo_ids[1],))
+    assert cursor.fetchone()[0] == REVIEW_REJECT_REASON
+    assert not _toggle_review_draft(review_id, photo_ids[0]), "Decided photo can't be toggled"
+
+    assert _apply_review_decisions(review_id, 1) == 1, "Approve all only touches pending photos"
+    assert _states(photo_ids) == [1, -1, 1]
+    _, markup = _render_review(review_id)
+    assert markup is None, "Keyboard is removed once every photo is decided"
+
+    _cleanup()
+    print("✅ Album review drafts test passed")
+
+
+def test_rejections_ask_for_a_reason():
+    """Reject all / apply with rejections go through a reason picker: a template or text typed in the chat"""
+    print("✍️ Testing album rejection reasons...")
+    _cleanup()
+    order_id, photo_ids = _setup(3)
+    review_id = _create_review(TEST_USER_ID, order_id, 1, photo_ids)
+    control = _Message(message_id=777)
+    cursor.execute("UPDATE photo_reviews SET chat_id=?, message_id=? WHERE id=?", (control.chat_id, 777, review_id))
+    conn.commit()
+    context = SimpleNamespace(user_data={}, bot=_Bot(), match=None)
+    evaluator, photo_handlers.stage_evaluator = photo_handlers.stage_evaluator, _Evaluator()
+    try:
+        _, markup = _render_review(review_id)
+        assert PHOTO_SKIP_STAGE.encode(user_id=TEST_USER_ID, stage=1) in _buttons(markup), "Stage controls in album mode"
+
+        _toggle_review_draft(review_id, photo_ids[0])                      # -> approve
+        _toggle_review_draft(review_id, photo_ids[1])
+        _toggle_review_draft(review_id, photo_ids[1])                      # -> reject
+        query = _press(REVIEW_APPLY.encode(review_id=review_id), control, context)
+        assert _states(photo_ids) == [0, 0, 0], "Nothing is applied before the reason is picked"
+        picker = _buttons(query.edits[-1][1])
+        assert REVIEW_REASON.encode(review_id=review_id, scope="drafts", key="blurry") in picker
+        assert REVIEW_REASON_CUSTOM.encode(review_id=review_id, scope="drafts") in picker
+
+        _press(REVIEW_REASON.encode(review_id=review_id, scope="drafts", key="blurry"), control, context)
+        assert _states(photo_ids) == [1, -1, 0]
+        cursor.execute("SELECT reason FROM order_photos WHERE id=?", (photo_ids[1],))
+        assert cursor.fetchone()[0] == REJECT_TEMPLATES["blurry"]
+
+        _press(REVIEW_REJECT_ALL.encode(review_id=review_id), control, context)
+        _press(REVIEW_REASON_CUSTOM.encode(review_id=review_id, scope="all"), control, context)
+        assert _states(photo_ids) == [1, -1, 0] and context.user_data["review_reason"]["review_id"] == review_id
+
+        typed = SimpleNamespace(message=_Message(text="Не видно суми"), effective_user=SimpleNamespace(id=1))
+        assert asyncio.run(moderation_text_input(typed, context))
+        assert _states(photo_ids) == [1, -1, -1]
+        cursor.execute("SELECT reason FROM order_photos WHERE id=?", (photo_ids[2],))
+        assert cursor.fetchone()[0] == "Не видно суми"
+        chat_id, message_id, _, markup = context.bot.edits[-1]
+        assert (chat_id, message_id, markup) == (control.chat_id, 777, None), "Control message restored, done"
+        assert not asyncio.run(moderation_text_input(typed, context)), "The next text is not a reason any more"
+        assert len(photo_handlers.stage_evaluator.dirty) == 2
+    finally:
+        photo_handlers.stage_evaluator = evaluator
+        _cleanup()
+    print("✅ Album rejection reasons test passed")
+
+
+def test_late_album_photos_join_the_review():
+    """Photos of an album posted after it closed as complete are added to its review, not a second one"""
+    print("🧩 Testing late album photos...")
+    _cleanup()
+    order_id, photo_ids = _setup(4)
+    bot = _Bot()
+    try:
+        asyncio.run(_send_album_review(bot, TEST_USER_ID, order_id, 1, [("file0", photo_ids[0]), ("file1", photo_ids[1])], "mg-1"))
+        asyncio.run(_send_album_review(bot, TEST_USER_ID, order_id, 1, [("file2", photo_ids[2])], "mg-1"))
+        cursor.execute("SELECT id, message_id FROM photo_reviews WHERE user_id=?", (TEST_USER_ID,))
+        reviews = cursor.fetchall()
+        assert len(reviews) == 1, reviews
+        review_id, control_id = reviews[0]
+        cursor.execute("SELECT review_id FROM order_photos WHERE id IN (?, ?, ?)", photo_ids[:3])
+        assert [r[0] for r in cursor.fetchall()] == [review_id] * 3
+        assert bot.sent[-1] == ("photo", "file2", control_id), "Late photo is posted as a reply to the control"
+        assert f"🆔 {photo_ids[2]}" in bot.edits[-1][2] and bot.edits[-1][1] == control_id
+
+        # another album of the same stage gets its own review
+        asyncio.run(_send_album_review(bot, TEST_USER_ID, order_id, 1, [("file3", photo_ids[3])], "mg-2"))
+        cursor.execute("SELECT COUNT(*) FROM photo_reviews WHERE user_id=?", (TEST_USER_ID,))
+        assert cursor.fetchone()[0] == 2
+    finally:
+        _cleanup()
+    print("✅ Late album photos test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_drafts_applied_in_one_go()
+        test_rejections_ask_for_a_reason()
+        test_late_album_photos_join_the_review()
+        print("\n🎉 All photo review tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        _cleanup()
+        sys.exit(1)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Tests for the SQL profiler: statement fingerprints, per-statement timings and
+call sites, the full-scan audit, and a static audit of every query in the bot
+"""
+import ast
+import glob
+import importlib
+import os
+import re
+import sqlite3
+import sys
+
+sys.path.insert(0, '.')
+
+from db import conn, cursor
+from query_profiler import KNOWN_SCANS, FullScanError, fingerprint, partial_indexes, query_profiler, scanned_tables
+
+_SQL = re.compile(r"\s*(SELECT|UPDATE|DELETE|INSERT|REPLACE|WITH)\b", re.I)
+
+
+def test_fingerprint_and_scan_detection():
+    """Literals and placeholder lists collapse; table scans are told apart from searches and partial indexes"""
+    print("🔎 Testing fingerprints and scan detection...")
+    assert fingerprint("SELECT id FROM orders\n   WHERE user_id=42 AND status IN ('a', 'b') -- latest\n") == \
+        "SELECT id FROM orders WHERE user_id=? AND status IN (...)"
+    assert fingerprint("DELETE FROM outbox WHERE id IN (?,?,?)") == fingerprint("DELETE FROM outbox WHERE id IN (?)")
+    assert fingerprint("SELECT * FROM ix_orders2 WHERE x=-1.5") == "SELECT * FROM ix_orders2 WHERE x=?"
+
+    sql = "SELECT o.id FROM orders o LEFT JOIN manager_groups mg ON mg.group_id = o.group_id"
+    assert scanned_tables(sql, ["SCAN o", "SEARCH mg USING INDEX sqlite_autoindex_manager_groups_1 (group_id=?)"]) == \
+        ["orders"]
+    assert scanned_tables("SELECT COUNT(*) FROM orders", ["SCAN orders USING COVERING INDEX ix_orders_user"]) == \
+        ["orders"]
+    assert scanned_tables("SELECT id FROM orders WHERE status NOT IN ('x')",
+                          ["SCAN orders USING INDEX ix_orders_open_activity"], partial_indexes(conn)) == []
+    assert scanned_tables("SELECT id FROM orders WHERE user_id=?", ["SEARCH orders USING INDEX ix_orders_user (user_id=?)"]) == []
+    print("✅ Fingerprint and scan detection test passed")
+
+
+def test_statement_stats_and_strict_mode():
+    """Statements are timed per fingerprint with their call site; strict mode stops new full scans"""
+    print("⏱ Testing statement stats and strict mode...")
+    for user_id in (999999501, 999999502):
+        cursor.execute("SELECT id FROM orders WHERE user_id=? ORDER BY id DESC LIMIT 1", (user_id,))
+    entry = query_profiler.statements[fingerprint("SELECT id FROM orders WHERE user_id=? ORDER BY id DESC LIMIT 1")]
+    assert entry.timing.count >= 2 and entry.kind == "SELECT" and entry.scans == []
+    assert entry.site.startswith("test_query_profiler.py:") and entry.function.endswith("test_statement_stats_and_strict_mode")
+    assert entry.plan and "ix_orders_user" in entry.plan[0]
+
+    slow, strict = query_profiler.slow_seconds, query_profiler.strict_tables
+    query_profiler.slow_seconds, query_profiler.strict_tables = 0.0, frozenset({"orders", "order_photos"})
+    try:
+        before = query_profiler.stats()
+        conn.execute("SELECT COUNT(*) FROM orders WHERE bank LIKE 'test_profiler%'").fetchone()  # tests may scan
+        after = query_profiler.stats()
+        assert after["slow"] == before["slow"] + 1 and after["scans"] == before["scans"] + 1
+
+        # the same statements issued from the bot's modules
+        source = ("from db import cursor\n"
+                  "def new_report():\n"
+                  "    cursor.execute(\"SELECT bank, COUNT(*) FROM orders WHERE action = 'register' GROUP BY bank\")\n"
+                  "def stats_banks():\n"
+                  "    cursor.execute(\"SELECT bank, COUNT(*) FROM orders WHERE action = 'change' GROUP BY bank\")\n")
+        module = {"__name__": "handlers.admin_interface"}
+        exec(compile(source, os.path.join("handlers", "admin_interface.py"), "exec"), module)
+        try:
+            module["new_report"]()
+        except FullScanError as e:
+            assert "orders" in str(e) and "admin_interface.py:3" in str(e)
+        else:
+            raise AssertionError("a new full scan of orders must fail")
+        module["stats_banks"]()  # a known report
+        assert query_profiler.stats()["blocked"] == before["blocked"] + 1
+    finally:
+        query_profiler.slow_seconds, query_profiler.strict_tables = slow, strict
+    print("✅ Statement stats and strict mode test passed")
+
+
+def _render(node, module):
+    """Text of a string literal; f-string fields become the module constant they name, or a placeholder."""
+    if isinstance(node, ast.Constant):
+        return node.value
+    parts = []
+    for value in node.values:
+        if isinstance(value, ast.Constant):
+            parts.append(value.value)
+        elif isinstance(value.value, ast.Name) and isinstance(getattr(module, value.value.id, None), str):
+            parts.append(getattr(module, value.value.id))
+        else:
+            parts.append("?")
+    return "".join(parts)
+
+
+def _queries(path):
+    """(line, "module.function", sql) of every SQL literal inside a function of the file."""
+    name = os.path.splitext(path)[0].replace(os.sep, ".")
+    module = importlib.import_module(name)
+    for function in ast.walk(ast.parse(open(path, encoding="utf-8").read())):
+        if not isinstance(function, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for node in ast.walk(function):
+            if isinstance(node, ast.JoinedStr) or isinstance(node, ast.Constant) and isinstance(node.value, str):
+                sql = _render(node, module)
+                if _SQL.match(sql):
+                    yield node.lineno, f"{name.rsplit('.', 1)[-1]}.{function.name}", sql
+
+
+def test_no_new_full_scans():
+    """No query in the bot scans orders or order_photos, apart from the known reports"""
+    print("🗂 Auditing every query plan...")
+    plain, partial = sqlite3.Cursor(conn), partial_indexes(conn)
+    explained, offenders = 0, []
+    for path in sorted(glob.glob("*.py") + glob.glob(os.path.join("handlers", "*.py"))):
+        if os.path.basename(path).startswith(("test_", "conftest")) or path.endswith(("client_bot.py", "webhook_bench.py")):
+            continue
+        for line, function, sql in _queries(path):
+            try:
+                plan = [row[-1] for row in plain.execute("EXPLAIN QUERY PLAN " + sql, [None] * sql.count("?"))]
+            except sqlite3.Error:
+                continue  # dynamic SQL that only makes sense with its real fragments
+            explained += 1
+            scans = {t for t in scanned_tables(sql, plan, partial) if t in ("orders", "order_photos")}
+            if scans and function not in KNOWN_SCANS:
+                offenders.append(f"{path}:{line} ({function}) scans {', '.join(sorted(scans))}: {fingerprint(sql)[:120]}")
+    assert explained > 100, explained
+    assert not offenders, "\n".join(offenders)
+    print(f"✅ Query plan audit passed ({explained} statements)")
+
+
+if __name__ == "__main__":
+    try:
+        test_fingerprint_and_scan_detection()
+        test_statement_stats_and_strict_mode()
+        test_no_new_full_scans()
+        print("\n🎉 All query profiler tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Tests for queue positions, waiting-time estimates and throttled status edits
+"""
+import asyncio
+import sys
+
+sys.path.insert(0, '.')
+
+from telegram.error import Forbidden
+
+from db import conn, cursor
+from queue_eta import (
+    QueueEstimator,
+    QueueStatusNotifier,
+    format_eta,
+    format_status,
+    record_service_time,
+    remember_status_message,
+)
+
+TEST_GROUP_BASE = -100440000
+BANK_A = "test_eta bankA"
+BANK_B = "test_eta bankB"
+
+
+class FakeBot:
+    def __init__(self, forbidden=()):
+        self.forbidden = set(forbidden)
+        self.edits = []
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        if chat_id in self.forbidden:
+            raise Forbidden("bot was blocked by the user")
+        self.edits.append((chat_id, message_id, text))
+
+
+def _cleanup():
+    cursor.execute("DELETE FROM queue WHERE bank LIKE 'test_eta%'")
+    cursor.execute("DELETE FROM orders WHERE bank LIKE 'test_eta%'")
+    cursor.execute("DELETE FROM service_times WHERE bank LIKE 'test_eta%'")
+    cursor.execute("DELETE FROM manager_groups WHERE group_id BETWEEN ? AND ?",
+                   (TEST_GROUP_BASE - 1000, TEST_GROUP_BASE))
+    conn.commit()
+
+
+def _add_group(n, bank, capacity=1):
+    cursor.execute("INSERT INTO manager_groups (group_id, name, bank, capacity) VALUES (?, ?, ?, ?)",
+                   (TEST_GROUP_BASE - n, f"test_eta group {n}", bank, capacity))
+    conn.commit()
+    return TEST_GROUP_BASE - n
+
+
+def _stash_other_groups():
+    """Groups left by other tests would serve the test banks too; set them aside"""
+    cursor.execute("SELECT * FROM manager_groups WHERE group_id NOT BETWEEN ? AND ?",
+                   (TEST_GROUP_BASE - 1000, TEST_GROUP_BASE))
+    rows = cursor.fetchall()
+    cursor.execute("DELETE FROM manager_groups WHERE group_id NOT BETWEEN ? AND ?",
+                   (TEST_GROUP_BASE - 1000, TEST_GROUP_BASE))
+    conn.commit()
+    return rows
+
+
+def _restore_groups(rows):
+    for row in rows:
+        cursor.execute(f"INSERT INTO manager_groups VALUES ({','.join('?' * len(row))})", row)
+    conn.commit()
+
+
+def _finished_order(bank, group_id, minutes):
+    cursor.execute("INSERT INTO orders (user_id, username, bank, action, status, group_id, created_at) "
+                   "VALUES (1, 'test_eta', ?, 'register', 'Завершено', ?, datetime('now', ?))",
+                   (bank, group_id, f"-{minutes} minutes"))
+    return cursor.lastrowid
+
+
+def _enqueue(user_id, bank):
+    cursor.execute("INSERT INTO queue (user_id, username, bank, action) VALUES (?, 'test_eta', ?, 'register')",
+                   (user_id, bank))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def _average(bank, group_id):
+    cursor.execute("SELECT avg_seconds, samples FROM service_times WHERE bank=? AND group_id=?", (bank, group_id))
+    return cursor.fetchone()
+
+
+def _test_positions(estimator):
+    return [p for p in estimator.snapshot() if p.bank.startswith("test_eta")]
+
+
+def test_service_time_averages():
+    """Finished orders feed exponentially weighted averages per group, per bank and overall"""
+    print("⏱ Testing service time averages...")
+    _cleanup()
+    cursor.execute("SELECT avg_seconds, samples FROM service_times WHERE bank='' AND group_id=0")
+    overall = cursor.fetchone()
+    try:
+        gid = _add_group(1, BANK_A)
+        record_service_time(_finished_order(BANK_A, gid, 10))
+        conn.commit()
+        avg, samples = _average(BANK_A, gid)
+        assert abs(avg - 600) < 5 and samples == 1, (avg, samples)
+
+        record_service_time(_finished_order(BANK_A, gid, 20))
+        conn.commit()
+        avg, samples = _average(BANK_A, gid)
+        # 600 + 0.2 * (1200 - 600)
+        assert abs(avg - 720) < 5 and samples == 2, (avg, samples)
+        assert _average(BANK_A, 0)[1] == 2
+
+        # an order abandoned for days counts as the cap, not as days
+        record_service_time(_finished_order(BANK_A, gid, 5 * 24 * 60))
+        conn.commit()
+        assert _average(BANK_A, gid)[0] < 6 * 3600
+
+        # orders never taken by a group say nothing about service time
+        record_service_time(_finished_order(BANK_A, None, 10))
+        conn.commit()
+        assert _average(BANK_A, gid)[1] == 3
+    finally:
+        cursor.execute("DELETE FROM service_times WHERE bank='' AND group_id=0")
+        if overall:
+            cursor.execute("INSERT INTO service_times (bank, group_id, avg_seconds, samples) VALUES ('', 0, ?, ?)",
+                           overall)
+        _cleanup()
+    print("✅ Service time average test passed")
+
+
+def test_positions_and_eta():
+    """Positions count per bank; the ETA follows the serving groups' rate and falls back to coarser averages"""
+    print("📍 Testing queue positions and ETA...")
+    _cleanup()
+    stashed = _stash_other_groups()
+    try:
+        group = _add_group(1, BANK_A)
+        cursor.execute("INSERT INTO service_times (bank, group_id, avg_seconds) VALUES (?, ?, 600)", (BANK_A, group))
+        conn.commit()
+        a1 = _enqueue(999999441, BANK_A)
+        b1 = _enqueue(999999442, BANK_B)
+        a2 = _enqueue(999999443, BANK_A)
+
+        estimator = QueueEstimator(default_seconds=1800)
+        positions = {p.queue_id: p for p in _test_positions(estimator)}
+        assert (positions[a1].position, positions[a2].position, positions[b1].position) == (1, 2, 1)
+        assert abs(positions[a1].eta_seconds - 600) < 1 and abs(positions[a2].eta_seconds - 1200) < 1
+        # no group serves bank B
+        assert positions[b1].eta_seconds is None and "поки невідомо" in format_status(positions[b1])
+
+        # doubling the capacity halves the wait
+        cursor.execute("UPDATE manager_groups SET capacity=2 WHERE group_id=?", (group,))
+        conn.commit()
+        assert abs(estimator.for_user(999999443).eta_seconds - 600) < 1
+
+        # a new group with no history of its own uses the bank's average
+        cursor.execute("INSERT INTO service_times (bank, group_id, avg_seconds) VALUES (?, 0, 1200)", (BANK_A,))
+        _add_group(2, BANK_B)
+        cursor.execute("INSERT INTO service_times (bank, group_id, avg_seconds) VALUES (?, 0, 900)", (BANK_B,))
+        conn.commit()
+        assert abs(estimator.for_user(999999442).eta_seconds - 900) < 1
+        assert estimator.for_user(1) is None
+
+        assert format_eta(60) == "~5 хв" and format_eta(1210) == "~25 хв" and format_eta(5000) == "~1.5 год"
+    finally:
+        _cleanup()
+        _restore_groups(stashed)
+    print("✅ Queue position and ETA test passed")
+
+
+def test_status_edits_are_throttled():
+    """Edits are capped per run, front of the queue first, and never repeat within the minimum interval"""
+    print("✏️ Testing throttled status edits...")
+    _cleanup()
+    try:
+        group = _add_group(1, BANK_A)
+        cursor.execute("INSERT INTO service_times (bank, group_id, avg_seconds) VALUES (?, ?, 600)", (BANK_A, group))
+        conn.commit()
+        estimator = QueueEstimator()
+        users = [999999450 + i for i in range(6)]
+        for user_id in users:
+            queue_id = _enqueue(user_id, BANK_A)
+            remember_status_message(queue_id, 100 + user_id % 100, "stale text")
+        # remembered a moment ago: nothing is due yet
+        notifier = QueueStatusNotifier(estimator, edits_per_run=4, min_edit_seconds=300)
+        bot = FakeBot(forbidden={users[1]})
+        cursor.execute("SELECT MAX(status_updated_at) FROM queue WHERE bank=?", (BANK_A,))
+        now = cursor.fetchone()[0]
+        assert asyncio.run(notifier.run_once(bot, now=now + 10)) == 0 and not bot.edits
+
+        later = now + 600
+        # users[1] blocked the bot: counts against the cap, and its message is forgotten
+        assert asyncio.run(notifier.run_once(bot, now=later)) == 3
+        assert [chat for chat, _, _ in bot.edits] == [users[0], users[2], users[3]]
+        assert all(text.startswith("⏳ Ви в черзі.\n📍 Ваше місце в черзі: ") for _, _, text in bot.edits)
+        assert notifier.stats()["deferred"] == 2
+        cursor.execute("SELECT status_message_id FROM queue WHERE user_id=?", (users[1],))
+        assert cursor.fetchone()[0] is None
+
+        # next run picks up the rest; the ones already edited are unchanged
+        assert asyncio.run(notifier.run_once(bot, now=later + 60)) == 2
+        assert [chat for chat, _, _ in bot.edits[3:]] == [users[4], users[5]]
+
+        # the front client is served: everyone behind moves up but waits out the interval
+        cursor.execute("DELETE FROM queue WHERE user_id=?", (users[0],))
+        conn.commit()
+        assert asyncio.run(notifier.run_once(bot, now=later + 120)) == 0
+        assert asyncio.run(notifier.run_once(bot, now=later + 600)) == 4
+        assert notifier.stats()["edits"] == 9
+    finally:
+        _cleanup()
+    print("✅ Throttled status edit test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_service_time_averages()
+        test_positions_and_eta()
+        test_status_edits_are_throttled()
+        print("\n🎉 All queue ETA tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
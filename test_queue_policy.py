@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Tests for queue priorities: scoring rules, claim order and a discrete-event
+simulation replaying a few days of arrivals under FIFO and under the policy
+"""
+import heapq
+import random
+import sys
+
+sys.path.insert(0, '.')
+
+from db import conn, cursor
+from queue_policy import QueuePolicy, parse_price, price_rule, repeat_rule, sla_rule
+from queue_scheduler import FreeGroup, QueueScheduler, occupy_group, release_group
+
+TEST_GROUP_BASE = -100450000
+FAST = "test_prio fast"  # 15 minute SLA
+PLAIN = "test_prio plain"
+PREMIUM = "test_prio premium"  # price reaches every tier
+REPEAT_USER = 999999451
+NEW_USER = 999999452
+
+
+def _policy():
+    return QueuePolicy([sla_rule(60), price_rule([500, 1000, 2000], 10), repeat_rule(15)])
+
+
+def _cleanup():
+    cursor.execute("DELETE FROM queue WHERE bank LIKE 'test_prio%'")
+    cursor.execute("DELETE FROM orders WHERE bank LIKE 'test_prio%'")
+    cursor.execute("DELETE FROM banks WHERE name LIKE 'test_prio%'")
+    cursor.execute("DELETE FROM manager_groups WHERE group_id BETWEEN ? AND ?",
+                   (TEST_GROUP_BASE - 1000, TEST_GROUP_BASE))
+    conn.commit()
+
+
+def _setup_banks():
+    cursor.execute("INSERT INTO banks (name, sla_minutes) VALUES (?, 15)", (FAST,))
+    cursor.execute("INSERT INTO banks (name) VALUES (?)", (PLAIN,))
+    cursor.execute("INSERT INTO banks (name, price, change_price) VALUES (?, '2 000 грн', '300')", (PREMIUM,))
+    conn.commit()
+
+
+def _finished_order(user_id):
+    cursor.execute("INSERT INTO orders (user_id, username, bank, action, status) "
+                   "VALUES (?, 'test_prio', ?, 'register', 'Завершено')", (user_id, PLAIN))
+
+
+def _enqueue(policy, user_id, bank, at, action="register"):
+    cursor.execute("INSERT INTO queue (user_id, username, bank, action, priority) VALUES (?, 'test_prio', ?, ?, ?)",
+                   (user_id, bank, action, policy.score(user_id, bank, action, at)))
+    return cursor.lastrowid
+
+
+def test_rules_and_scores():
+    """Each rule's credit, FIFO without rules, and rescoring the waiting clients"""
+    print("🧮 Testing scoring rules...")
+    _cleanup()
+    try:
+        _setup_banks()
+        _finished_order(REPEAT_USER)
+        conn.commit()
+        assert parse_price("1 500 грн") == 1500 and parse_price("від 99,5") == 99.5 and parse_price("договірна") is None
+
+        assert QueuePolicy().score(NEW_USER, FAST, "register", 1000.0) == 1000.0
+        policy = _policy()
+        assert policy.score(NEW_USER, PLAIN, "register", 1e6) == 1e6
+        assert policy.score(NEW_USER, FAST, "register", 1e6) == 1e6 - 45 * 60
+        assert policy.score(NEW_USER, PREMIUM, "register", 1e6) == 1e6 - 30 * 60
+        # the action's own price wins over the general one
+        assert policy.score(NEW_USER, PREMIUM, "change", 1e6) == 1e6
+        assert policy.score(REPEAT_USER, FAST, "register", 1e6) == 1e6 - 60 * 60
+        # a bank with a looser SLA than the default moves back
+        cursor.execute("UPDATE banks SET sla_minutes=90 WHERE name=?", (PLAIN,))
+        assert policy.score(NEW_USER, PLAIN, "register", 1e6) == 1e6 + 30 * 60
+
+        cursor.execute("INSERT INTO queue (user_id, bank, action, created_at) VALUES (?, ?, 'register', '2024-01-01 00:00:00')",
+                       (NEW_USER, FAST))
+        queue_id = cursor.lastrowid
+        assert policy.rescore() >= 1
+        cursor.execute("SELECT priority FROM queue WHERE id=?", (queue_id,))
+        assert cursor.fetchone()[0] == 1704067200 - 45 * 60
+    finally:
+        _cleanup()
+    print("✅ Scoring rule test passed")
+
+
+def test_claims_follow_priority():
+    """Claims take the lowest priority first, FIFO among equals"""
+    print("🥇 Testing claim order...")
+    _cleanup()
+    try:
+        _setup_banks()
+        policy = _policy()
+        plain_first = _enqueue(policy, NEW_USER, PLAIN, 1000.0)
+        plain_second = _enqueue(policy, NEW_USER + 1, PLAIN, 1000.0)
+        fast_later = _enqueue(policy, NEW_USER + 2, FAST, 1000.0 + 30 * 60)
+        fast_too_late = _enqueue(policy, NEW_USER + 3, FAST, 1000.0 + 50 * 60)
+        conn.commit()
+
+        scheduler = QueueScheduler()
+        admin = FreeGroup(0, 0, None, True)
+        # arrived 30 minutes later but 45 minutes of credit; 50 minutes later is too late
+        claimed = [scheduler.claim(admin).id for _ in range(4)]
+        conn.commit()
+        assert claimed == [fast_later, plain_first, plain_second, fast_too_late], claimed
+    finally:
+        _cleanup()
+    print("✅ Claim order test passed")
+
+
+def _arrivals(rng, days=3, per_hour=5.4):
+    """A few days of arrivals: (time, user_id, bank, is_repeat, service seconds)"""
+    arrivals, t = [], 1.7e9
+    end = t + days * 86400
+    while True:
+        t += rng.expovariate(per_hour / 3600)
+        if t > end:
+            return arrivals
+        bank = rng.choices([FAST, PLAIN, PREMIUM], weights=[2, 5, 3])[0]
+        user_id = 999000000 + len(arrivals)
+        arrivals.append((t, user_id, bank, rng.random() < 0.3, rng.expovariate(1 / 1200)))
+
+
+def _simulate(policy, arrivals):
+    """Replay `arrivals` on two admin groups; returns {user_id: (arrived, started, priority)}"""
+    cursor.execute("DELETE FROM queue WHERE bank LIKE 'test_prio%'")
+    cursor.execute("DELETE FROM manager_groups WHERE group_id BETWEEN ? AND ?",
+                   (TEST_GROUP_BASE - 1000, TEST_GROUP_BASE))
+    for n in (1, 2):
+        cursor.execute("INSERT INTO manager_groups (group_id, name, is_admin_group, capacity) VALUES (?, ?, 1, 1)",
+                       (TEST_GROUP_BASE - n, f"test_prio group {n}"))
+    conn.commit()
+    scheduler = QueueScheduler()
+    group_ids = {g.id for g in scheduler.free_groups() if TEST_GROUP_BASE - 1000 <= g.group_id <= TEST_GROUP_BASE}
+
+    events = [(t, n, "arrive", n) for n, (t, *_) in enumerate(arrivals)]
+    heapq.heapify(events)
+    service = {user_id: seconds for _, user_id, _, _, seconds in arrivals}
+    arrived_at = {user_id: t for t, user_id, *_ in arrivals}
+    priorities, results = {}, {}
+    seq = len(events)
+    while events:
+        now, _, kind, payload = heapq.heappop(events)
+        if kind == "arrive":
+            t, user_id, bank, _, _ = arrivals[payload]
+            queue_id = _enqueue(policy, user_id, bank, t)
+            cursor.execute("SELECT priority FROM queue WHERE id=?", (queue_id,))
+            priorities[user_id] = cursor.fetchone()[0]
+        else:
+            release_group(payload)
+        conn.commit()
+
+        def assign(group, entry):
+            occupy_group(group.id)
+            results[entry.user_id] = (arrived_at[entry.user_id], now, priorities[entry.user_id])
+            return group.group_id
+
+        for group, entry, chat_id in scheduler.match(
+                assign, [g for g in scheduler.free_groups() if g.id in group_ids]):
+            seq += 1
+            heapq.heappush(events, (now + service[entry.user_id], seq, "done", chat_id))
+    return results
+
+
+def test_simulation_of_arrivals():
+    """Under the same arrivals the policy meets the tight SLA and serves repeat clients sooner, without starvation"""
+    print("🎲 Simulating FIFO vs priority policy...")
+    _cleanup()
+    rng = random.Random(45)
+    arrivals = _arrivals(rng)
+    try:
+        _setup_banks()
+        repeat_users = {user_id for _, user_id, _, is_repeat, _ in arrivals if is_repeat}
+        for user_id in repeat_users:
+            _finished_order(user_id)
+        conn.commit()
+
+        runs = {"fifo": _simulate(QueuePolicy(), arrivals), "policy": _simulate(_policy(), arrivals)}
+        bank_of = {user_id: bank for _, user_id, bank, _, _ in arrivals}
+
+        def waits(run, keep):
+            return [started - arrived for user_id, (arrived, started, _) in runs[run].items() if keep(user_id)]
+
+        def within(run, bank, minutes):
+            w = waits(run, lambda u: bank_of[u] == bank)
+            return sum(x <= minutes * 60 for x in w) / len(w)
+
+        def mean(values):
+            return sum(values) / len(values)
+
+        for run, results in runs.items():
+            assert len(results) == len(arrivals), f"{run}: {len(results)} of {len(arrivals)} served"
+        fifo_sla, policy_sla = within("fifo", FAST, 15), within("policy", FAST, 15)
+        fifo_repeat = mean(waits("fifo", lambda u: u in repeat_users))
+        policy_repeat = mean(waits("policy", lambda u: u in repeat_users))
+        print(f"   {len(arrivals)} arrivals; fast bank within SLA: FIFO {fifo_sla:.0%}, policy {policy_sla:.0%}; "
+              f"repeat clients' mean wait: FIFO {fifo_repeat / 60:.1f} min, policy {policy_repeat / 60:.1f} min")
+        assert policy_sla > fifo_sla
+        assert policy_repeat < fifo_repeat
+
+        # nobody is overtaken by a client who arrived later than the largest credit difference allows
+        credits = [arrived - priority for arrived, _, priority in runs["policy"].values()]
+        spread = max(credits) - min(credits)
+        served = sorted(runs["policy"].values(), key=lambda r: r[1])
+        latest_arrival = float("-inf")
+        for arrived, started, _ in served:
+            assert latest_arrival - arrived <= spread, (latest_arrival - arrived, spread)
+            latest_arrival = max(latest_arrival, arrived)
+    finally:
+        _cleanup()
+    print("✅ Queue policy simulation passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_rules_and_scores()
+        test_claims_follow_priority()
+        test_simulation_of_arrivals()
+        print("\n🎉 All queue policy tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
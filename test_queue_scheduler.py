@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Tests for bank-aware, capacity-based queue matching (simulation with many banks and groups)
+"""
+import random
+import sys
+import time
+
+sys.path.insert(0, '.')
+
+from db import conn, cursor
+from queue_scheduler import QueueScheduler, occupy_group, release_group
+
+TEST_GROUP_BASE = -100420000
+TEST_BANKS = [f"test_sched bank{i}" for i in range(12)]
+
+
+def _cleanup():
+    cursor.execute("DELETE FROM queue WHERE bank LIKE 'test_sched%'")
+    cursor.execute("DELETE FROM manager_groups WHERE group_id BETWEEN ? AND ?",
+                   (TEST_GROUP_BASE - 1000, TEST_GROUP_BASE))
+    conn.commit()
+
+
+def _add_group(n, bank, is_admin=False, capacity=1):
+    cursor.execute("INSERT INTO manager_groups (group_id, name, bank, is_admin_group, capacity) VALUES (?, ?, ?, ?, ?)",
+                   (TEST_GROUP_BASE - n, f"test_sched group {n}", bank, int(is_admin), capacity))
+    return cursor.lastrowid
+
+
+def _enqueue(rng, bank):
+    cursor.execute("INSERT INTO queue (user_id, username, bank, action) VALUES (?, ?, ?, ?)",
+                   (rng.randint(1, 10 ** 6), "test_sched", bank, rng.choice(["register", "change"])))
+    return cursor.lastrowid
+
+
+def _test_groups(scheduler, group_ids):
+    return [g for g in scheduler.free_groups() if g.id in group_ids]
+
+
+def test_bank_groups_only_get_their_bank():
+    """A bank group never receives another bank's client; admin groups take the oldest of any bank"""
+    print("🏦 Testing bank-aware claims...")
+    _cleanup()
+    rng = random.Random(42)
+    try:
+        mono = _add_group(1, TEST_BANKS[0])
+        admin = _add_group(2, None, is_admin=True)
+        _add_group(3, None)  # neither bank nor admin group: serves nobody
+        conn.commit()
+        first = _enqueue(rng, TEST_BANKS[1])
+        second = _enqueue(rng, TEST_BANKS[0])
+        conn.commit()
+
+        scheduler = QueueScheduler()
+        groups = [g for g in scheduler.free_groups() if TEST_GROUP_BASE - 1000 <= g.group_id <= TEST_GROUP_BASE]
+        assert [g.id for g in groups] == [mono, admin], "Bank groups are matched before admin groups"
+
+        occupied = []
+        matched = scheduler.match(lambda g, e: occupied.append(g.id), groups)
+        assert [(g.id, e.id) for g, e, _ in matched] == [(mono, second), (admin, first)], matched
+        cursor.execute("SELECT COUNT(*) FROM queue WHERE bank LIKE 'test_sched%'")
+        assert cursor.fetchone()[0] == 0
+
+        # a failing assignment leaves the client in the queue
+        third = _enqueue(rng, TEST_BANKS[0])
+        conn.commit()
+
+        def fail(group, entry):
+            raise RuntimeError("assignment failed")
+
+        assert scheduler.match(fail, [g for g in groups if g.id == mono]) == []
+        cursor.execute("SELECT id FROM queue WHERE bank LIKE 'test_sched%'")
+        assert cursor.fetchall() == [(third,)]
+        assert scheduler.stats()["failed"] == 1
+    finally:
+        _cleanup()
+    print("✅ Bank-aware claim test passed")
+
+
+def test_slots_fill_least_loaded_first():
+    """Groups with capacity take several clients per pass, spread to the least utilized group first"""
+    print("⚖️ Testing capacity-based matching...")
+    _cleanup()
+    rng = random.Random(43)
+    try:
+        big = _add_group(1, TEST_BANKS[0], capacity=4)
+        small = _add_group(2, TEST_BANKS[0], capacity=2)
+        occupy_group(big)
+        occupy_group(big)  # 2/4 = 50%, small is 0/2
+        for _ in range(3):
+            _enqueue(rng, TEST_BANKS[0])
+        conn.commit()
+
+        scheduler = QueueScheduler()
+        groups = _test_groups(scheduler, {big, small})
+        assert {(g.id, g.load, g.capacity) for g in groups} == {(big, 2, 4), (small, 0, 2)}
+        matched = scheduler.match(lambda g, e: occupy_group(g.id), groups)
+        # small 0% -> big 50% (tie with small at 50%, lower id first) -> small
+        assert [g.id for g, _, _ in matched] == [small, big, small], [(g.id, g.load) for g, _, _ in matched]
+        cursor.execute("SELECT load, busy FROM manager_groups WHERE id IN (?, ?) ORDER BY id", (big, small))
+        assert cursor.fetchall() == [(3, 0), (2, 1)]
+
+        release_group(TEST_GROUP_BASE - 2, 5)  # never below zero
+        conn.commit()
+        cursor.execute("SELECT load, busy FROM manager_groups WHERE id=?", (small,))
+        assert cursor.fetchone() == (0, 0)
+    finally:
+        _cleanup()
+    print("✅ Capacity-based matching test passed")
+
+
+def test_finishing_twice_releases_once():
+    """Finishing an order that is already finished neither frees its slot again nor counts its service time twice"""
+    print("🏁 Testing repeated finish...")
+    from handlers.photo_handlers import close_order
+
+    _cleanup()
+    try:
+        group = _add_group(1, TEST_BANKS[0], capacity=2)
+        occupy_group(group)
+        occupy_group(group)
+        cursor.execute(
+            "INSERT INTO orders (user_id, username, bank, action, stage, status, group_id, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now', '-10 minutes'))",
+            (999999043, "test_sched", TEST_BANKS[0], "register", 1, "На етапі 2", TEST_GROUP_BASE - 1),
+        )
+        order_id = cursor.lastrowid
+        conn.commit()
+
+        assert close_order(order_id, "Незавершено (менеджер)", TEST_GROUP_BASE - 1)
+        assert not close_order(order_id, "Завершено", TEST_GROUP_BASE - 1)
+        conn.commit()
+        cursor.execute("SELECT status FROM orders WHERE id=?", (order_id,))
+        assert cursor.fetchone()[0] == "Незавершено (менеджер)"
+        cursor.execute("SELECT load FROM manager_groups WHERE id=?", (group,))
+        assert cursor.fetchone()[0] == 1, "The other order still holds its slot"
+        cursor.execute("SELECT samples FROM service_times WHERE bank=? AND group_id=?", (TEST_BANKS[0], TEST_GROUP_BASE - 1))
+        assert cursor.fetchone()[0] == 1
+    finally:
+        cursor.execute("DELETE FROM orders WHERE user_id=999999043")
+        cursor.execute("DELETE FROM service_times WHERE bank LIKE 'test_sched%'")
+        _cleanup()
+    print("✅ Repeated finish test passed")
+
+
+def test_queue_claims_use_bank_index():
+    """Claims search queue(bank, priority, id) / queue(priority, id) instead of scanning and sorting the queue"""
+    print("🔎 Testing claim query plan...")
+    for sql, params, index in (
+        ("SELECT id FROM queue WHERE bank=? ORDER BY priority, id LIMIT 1", ("x",), "ix_queue_bank_priority"),
+        ("SELECT id FROM queue ORDER BY priority, id LIMIT 1", (), "ix_queue_priority"),
+    ):
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        plan = " | ".join(row[-1] for row in cursor.fetchall())
+        assert index in plan and "TEMP B-TREE" not in plan, plan
+    print("✅ Claim query plan test passed")
+
+
+def test_simulation_fairness_and_throughput():
+    """Random arrivals and completions: compatible, FIFO per bank, work-conserving, fast"""
+    print("🎲 Simulating queue matching...")
+    _cleanup()
+    rng = random.Random(2024)
+    try:
+        group_bank, capacity = {}, {}
+        n = 0
+        for bank in TEST_BANKS[:9]:  # the last banks have no group of their own
+            for _ in range(rng.randint(1, 3)):
+                n += 1
+                cap = rng.choice([1, 1, 2, 3])
+                gid = _add_group(n, bank, capacity=cap)
+                group_bank[gid], capacity[gid] = bank, cap
+        for _ in range(3):
+            n += 1
+            gid = _add_group(n, None, is_admin=True)
+            group_bank[gid], capacity[gid] = None, 1
+        conn.commit()
+        chat_id = {g.id: g.group_id for g in _test_groups(QueueScheduler(), group_bank)}
+
+        scheduler = QueueScheduler()
+        orders = []  # (group db id) of every order in progress
+        served = {bank: [] for bank in TEST_BANKS}
+        waiting = {bank: [] for bank in TEST_BANKS}
+        claims = 0
+        match_time = 0.0
+
+        def assign(group, entry):
+            occupy_group(group.id)
+            orders.append(group.id)
+
+        for tick in range(400):
+            for _ in range(rng.randint(0, 8)):
+                bank = rng.choice(TEST_BANKS)
+                waiting[bank].append(_enqueue(rng, bank))
+            for gid in [g for g in orders if rng.random() < 0.3]:
+                release_group(chat_id[gid])
+                orders.remove(gid)
+            conn.commit()
+
+            started = time.perf_counter()
+            matched = scheduler.match(assign, _test_groups(scheduler, group_bank))
+            match_time += time.perf_counter() - started
+            for gid in capacity:
+                assert orders.count(gid) <= capacity[gid], f"tick {tick}: group {gid} over capacity"
+            cursor.execute("SELECT id, load, busy FROM manager_groups WHERE id IN (%s)" % ",".join("?" * len(capacity)),
+                           list(capacity))
+            for gid, load, busy in cursor.fetchall():
+                assert load == orders.count(gid) and busy == (load >= capacity[gid]), (tick, gid, load, busy)
+            for group, entry, _ in matched:
+                assert group.is_admin_group or entry.bank == group.bank, (group, entry)
+                # oldest client of the bank first
+                assert entry.id == waiting[entry.bank].pop(0), (entry, waiting[entry.bank][:3])
+                served[entry.bank].append(entry.id)
+                claims += 1
+
+            # work-conserving: no free group is left with a client it could serve
+            for group in _test_groups(scheduler, group_bank):
+                if group.is_admin_group:
+                    assert not any(waiting.values()), f"tick {tick}: admin group idle with a non-empty queue"
+                else:
+                    assert not waiting[group.bank], f"tick {tick}: group of {group.bank} idle"
+
+        assert claims > 500, claims
+        # banks without their own group are still served, by the admin groups
+        assert all(served[bank] for bank in TEST_BANKS[9:]), served
+        print(f"   {claims} clients matched, {claims / match_time:.0f} claims/s")
+    finally:
+        _cleanup()
+    print("✅ Queue matching simulation passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_bank_groups_only_get_their_bank()
+        test_slots_fill_least_loaded_first()
+        test_finishing_twice_releases_once()
+        test_queue_claims_use_bank_index()
+        test_simulation_fairness_and_throughput()
+        print("\n🎉 All queue scheduler tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Tests for the outbound scheduler (token buckets, priorities, RetryAfter)
+"""
+import asyncio
+import sys
+import time
+
+sys.path.insert(0, '.')
+
+from telegram.error import RetryAfter
+
+from rate_limiter import PRIORITY_BULK, PRIORITY_INTERACTIVE, OutboundScheduler
+
+
+def _send(scheduler, log, chat_id, label, priority=PRIORITY_INTERACTIVE, endpoint="sendMessage"):
+    async def callback():
+        log.append((label, time.monotonic()))
+        return label
+
+    return scheduler.process_request(callback, (), {}, endpoint, {"chat_id": chat_id}, {"priority": priority})
+
+
+def test_per_chat_pacing():
+    """Private chat gets one message per interval; other chats and non-chat calls are not held up"""
+    print("🚦 Testing per-chat pacing...")
+    log = []
+
+    async def scenario():
+        s = OutboundScheduler(private_per_sec=20, group_per_min=600, global_per_sec=1000)
+        start = time.monotonic()
+        await asyncio.gather(*(_send(s, log, 42, f"p{i}") for i in range(3)), _send(s, log, 43, "other"))
+        await _send(s, log, None, "getMe", endpoint="getMe")
+        return start, s.stats()
+
+    start, stats = asyncio.run(scenario())
+    times = {label: t - start for label, t in log}
+    assert times["p0"] < 0.02 and times["other"] < 0.02
+    assert 0.04 <= times["p1"] < 0.09 and 0.09 <= times["p2"] < 0.14, times
+    assert stats["sent"] == 5 and stats["wait_s"]["interactive"]["count"] == 4
+    print("✅ Per-chat pacing test passed")
+
+
+def test_priority_and_retry_after():
+    """Interactive requests overtake queued bulk ones; RetryAfter is retried transparently"""
+    print("🚦 Testing priorities and RetryAfter...")
+    log = []
+
+    async def scenario():
+        s = OutboundScheduler(private_per_sec=1000, group_per_min=60000, global_per_sec=20)
+        s._global.tokens = 0  # saturated: everything has to queue for the global bucket
+        bulk = [asyncio.ensure_future(_send(s, log, 100 + i, f"bulk{i}", PRIORITY_BULK)) for i in range(3)]
+        await asyncio.sleep(0)
+        depth = s.stats()["queue_depth"]["bulk"]
+        urgent = asyncio.ensure_future(_send(s, log, 200, "urgent"))
+        await asyncio.gather(urgent, *bulk)
+
+        attempts = []
+
+        async def flaky():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RetryAfter(0.05)
+            return "ok"
+
+        result = await s.process_request(flaky, (), {}, "sendMessage", {"chat_id": 300}, None)
+        return depth, result, attempts, s.stats()
+
+    depth, result, attempts, stats = asyncio.run(scenario())
+    order = [label for label, _ in log]
+    assert depth == 3
+    assert order[0] == "urgent", order
+    assert order[1:] == ["bulk0", "bulk1", "bulk2"], "Same priority stays FIFO"
+    assert result == "ok" and len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.05
+    assert stats["retry_after"] == 1 and stats["queue_depth"]["bulk"] == 0
+    print("✅ Priority and RetryAfter test passed")
+
+
+def test_edits_have_their_own_bucket():
+    """Edits in a group aren't held up by its new-message limit, and are paced on their own"""
+    print("🚦 Testing edit pacing...")
+    log = []
+
+    async def scenario():
+        s = OutboundScheduler(private_per_sec=1000, group_per_min=60, global_per_sec=1000, edit_per_sec=20)
+        start = time.monotonic()
+        await asyncio.gather(*(_send(s, log, -100, f"m{i}") for i in range(3)))  # the group burst
+        await asyncio.gather(
+            _send(s, log, -100, "m3"),
+            *(_send(s, log, -100, f"e{i}", endpoint="editMessageText") for i in range(4)),
+        )
+        return start
+
+    start = asyncio.run(scenario())
+    times = {label: t - start for label, t in log}
+    assert times["e0"] < 0.02 and times["e2"] < 0.02, times
+    assert 0.04 <= times["e3"] < 0.09, times
+    assert times["m3"] >= 0.9, "A new message still waits for the group bucket"
+    print("✅ Edit pacing test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_per_chat_pacing()
+        test_priority_and_retry_after()
+        test_edits_have_their_own_bucket()
+        print("\n🎉 All rate limiter tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
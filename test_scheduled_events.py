@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Tests for scheduled events: the hierarchical timing wheel, batched firing,
+cancel/move by key, persistence across restarts and the code reminder handler
+"""
+import asyncio
+import random
+import sys
+
+sys.path.insert(0, '.')
+
+from db import conn, cursor
+from scheduled_events import TimingWheel, cancel, event_scheduler, schedule
+
+TEST_KIND = "test_sched_a"
+OTHER_KIND = "test_sched_b"
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def _cleanup():
+    cursor.execute("DELETE FROM scheduled_events WHERE kind LIKE 'test_sched%' OR key LIKE 'code_reminder:test%'")
+    cursor.execute("DELETE FROM orders WHERE bank LIKE 'test_sched%'")
+    conn.commit()
+
+
+def test_timing_wheel_fires_each_item_once_never_early():
+    """Items across every level and the overflow list fire once, on the first advance at or after their time"""
+    print("🎡 Testing timing wheel...")
+    rng = random.Random(47)
+    start = 1000.0
+    # a small wheel (4 slots, 3 levels: horizon 64 ticks) so cascades and overflow happen often
+    wheel = TimingWheel(start, tick=1.0, slots=4, levels=3)
+    due = {}
+    for item in range(2000):
+        due[item] = start + rng.uniform(-5, 300)
+        wheel.add(due[item], item)
+    assert wheel.size == 2000
+
+    fired, previous, now = {}, float("-inf"), start
+    while now < start + 320:
+        for item in wheel.advance(now):
+            assert item not in fired, f"item {item} fired twice"
+            assert due[item] <= now, f"item {item} due {due[item]} fired early at {now}"
+            assert due[item] > previous, f"item {item} due {due[item]} fired late at {now}"
+            fired[item] = now
+        # items added while the wheel runs land relative to its current position
+        if now < start + 200 and rng.random() < 0.2:
+            item = len(due)
+            due[item] = now + rng.uniform(0, 100)
+            wheel.add(due[item], item)
+        previous, now = now, now + rng.choice([1, 1, 1, 2, 7])
+    assert set(fired) == set(due) and wheel.size == 0, (len(fired), len(due), wheel.size)
+    print("✅ Timing wheel test passed")
+
+
+def test_batches_cancel_move_and_restart():
+    """Due events fire in one batch per kind; cancelled and moved events do not fire early; events survive a restart"""
+    print("⏲ Testing scheduled event firing...")
+    _cleanup()
+    batches = []
+
+    async def handler(bot, events):
+        batches.append([(e.kind, e.key, e.payload) for e in events])
+
+    event_scheduler.register(TEST_KIND, handler)
+    event_scheduler.register(OTHER_KIND, handler)
+    try:
+        now = 2_000_000_000.0
+        event_scheduler.load(now)
+        for n in range(3):
+            schedule(TEST_KIND, f"test_sched:a{n}", due_at=now + 10 + n * 0.1, payload={"n": n})
+        schedule(OTHER_KIND, "test_sched:b", due_at=now + 10)
+        schedule(TEST_KIND, "test_sched:cancelled", due_at=now + 10)
+        schedule(TEST_KIND, "test_sched:moved", due_at=now + 10)
+        conn.commit()
+        assert cancel("test_sched:cancelled") and not cancel("test_sched:cancelled")
+        schedule(TEST_KIND, "test_sched:moved", due_at=now + 200, payload="moved")
+        conn.commit()
+
+        assert asyncio.run(event_scheduler.run_once(None, now=now + 5)) == 0
+        assert asyncio.run(event_scheduler.run_once(None, now=now + 11)) == 4
+        assert sorted(batches) == sorted([
+            [(TEST_KIND, f"test_sched:a{n}", {"n": n}) for n in range(3)],
+            [(OTHER_KIND, "test_sched:b", None)],
+        ]), batches
+        cursor.execute("SELECT key FROM scheduled_events WHERE kind LIKE 'test_sched%'")
+        assert cursor.fetchall() == [("test_sched:moved",)]
+
+        # restart: the wheel is rebuilt from the table; an event that came due while down fires at once
+        schedule(TEST_KIND, "test_sched:while_down", due_at=now + 50)
+        conn.commit()
+        assert event_scheduler.load(now + 100) >= 2
+        batches.clear()
+        assert asyncio.run(event_scheduler.run_once(None, now=now + 100)) == 1
+        assert asyncio.run(event_scheduler.run_once(None, now=now + 199)) == 0
+        assert asyncio.run(event_scheduler.run_once(None, now=now + 201)) == 1
+        assert batches == [[(TEST_KIND, "test_sched:while_down", None)], [(TEST_KIND, "test_sched:moved", "moved")]]
+        assert event_scheduler.stats()["lag"]["max"] >= 50
+    finally:
+        event_scheduler.handlers.pop(TEST_KIND, None)
+        event_scheduler.handlers.pop(OTHER_KIND, None)
+        asyncio.run(event_scheduler.stop())
+        _cleanup()
+    print("✅ Scheduled event firing test passed")
+
+
+def test_code_reminders_batch():
+    """One reminder batch reminds only the groups whose order still waits for a code"""
+    print("⏰ Testing code reminder handler...")
+    _cleanup()
+    from handlers.stage2_handlers import CODE_REMINDER, _code_reminders
+    from scheduled_events import ScheduledEvent
+
+    try:
+        orders = []
+        for status in ("requested", "delivered", "requested"):
+            cursor.execute("INSERT INTO orders (user_id, username, bank, action, status, phone_code_status) "
+                           "VALUES (999999471, 'test_sched', 'test_sched bank', 'register', 'На етапі 1', ?)", (status,))
+            orders.append(cursor.lastrowid)
+        conn.commit()
+        events = [ScheduledEvent(n, CODE_REMINDER, f"code_reminder:test{n}", 0.0, {"order_id": order_id, "chat_id": -n})
+                  for n, order_id in enumerate(orders, 1)]
+        bot = FakeBot()
+        asyncio.run(_code_reminders(bot, events))
+        assert [chat for chat, _ in bot.sent] == [-1, -3], bot.sent
+        assert f"Order {orders[0]}" in bot.sent[0][1]
+    finally:
+        _cleanup()
+    print("✅ Code reminder handler test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_timing_wheel_fires_each_item_once_never_early()
+        test_batches_cancel_move_and_restart()
+        test_code_reminders_batch()
+        print("\n🎉 All scheduled event tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
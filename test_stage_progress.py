@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Tests for order_stage_progress counters maintained by triggers
+"""
+import sys
+
+sys.path.insert(0, '.')
+
+from db import conn, cursor, get_stage_progress, rebuild_stage_progress, set_stage_required
+
+TEST_USER_ID = 999999031
+
+
+def _cleanup():
+    cursor.execute("DELETE FROM orders WHERE user_id=?", (TEST_USER_ID,))
+    conn.commit()
+
+
+def _add_photo(order_id: int, stage: int, uniq: str, confirmed: int = 0) -> int:
+    cursor.execute(
+        "INSERT INTO order_photos (order_id, stage, file_id, file_unique_id, confirmed) VALUES (?, ?, ?, ?, ?)",
+        (order_id, stage, "file_" + uniq, uniq, confirmed),
+    )
+    return cursor.lastrowid
+
+
+def test_counters_follow_photo_changes():
+    """Insert / decision / replacement / delete keep counters equal to a full recount"""
+    print("📊 Testing stage progress counters...")
+    _cleanup()
+    cursor.execute("INSERT INTO orders (user_id, username, bank, action, stage) VALUES (?, 'p', 'B', 'register', 0)",
+                   (TEST_USER_ID,))
+    order_id = cursor.lastrowid
+    p1 = _add_photo(order_id, 1, "a")
+    p2 = _add_photo(order_id, 1, "b")
+    p3 = _add_photo(order_id, 1, "c")
+    set_stage_required(order_id, 1, 3)
+    conn.commit()
+    assert get_stage_progress(order_id, 1) == (3, 0, 0, 3)
+
+    cursor.execute("UPDATE order_photos SET confirmed=1 WHERE id IN (?, ?)", (p1, p2))
+    cursor.execute("UPDATE order_photos SET confirmed=-1, reason='x' WHERE id=?", (p3,))
+    conn.commit()
+    assert get_stage_progress(order_id, 1) == (0, 2, 1, 3)
+
+    # Replacement: rejected photo deactivated, new one pending
+    cursor.execute("UPDATE order_photos SET active=0 WHERE id=?", (p3,))
+    p4 = _add_photo(order_id, 1, "d")
+    conn.commit()
+    assert get_stage_progress(order_id, 1) == (1, 2, 0, 3)
+
+    cursor.execute("DELETE FROM order_photos WHERE id=?", (p4,))
+    conn.commit()
+    assert get_stage_progress(order_id, 1) == (0, 2, 0, 3)
+
+    # Full rebuild yields the same numbers and keeps `required`
+    cursor.execute("UPDATE order_stage_progress SET pending=99 WHERE order_id=?", (order_id,))
+    rebuild_stage_progress()
+    assert get_stage_progress(order_id, 1) == (0, 2, 0, 3)
+
+    _cleanup()
+    assert get_stage_progress(order_id, 1) is None, "Counters are removed with the order"
+    print("✅ Stage progress counters test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_counters_follow_photo_changes()
+        print("\n🎉 All stage progress tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        _cleanup()
+        sys.exit(1)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Tests for telemetry: histograms and rate meters, handler instrumentation,
+Bot API and database timings, and the Prometheus text endpoint
+"""
+import asyncio
+import re
+import sys
+
+sys.path.insert(0, '.')
+
+from telegram import Update
+from telegram.error import BadRequest
+from telegram.ext import ApplicationBuilder, CommandHandler, ConversationHandler, MessageHandler, TypeHandler, filters
+
+from db import cursor
+from handlers.callback_router import router
+from metrics import Histogram, RateMeter
+from query_profiler import query_profiler
+from rate_limiter import OutboundScheduler
+from telemetry import format_perf, handler_metrics, instrument, metrics_route, prometheus_text
+
+_SAMPLE = re.compile(r'^[a-z_]+(\{[^}]*\})? -?[0-9.e+-]+$')
+
+
+def _message_update(text="hi"):
+    return Update.de_json({"update_id": 1, "message": {
+        "message_id": 1, "date": 0, "text": text,
+        "chat": {"id": 999999491, "type": "private"},
+        "from": {"id": 999999491, "is_bot": False, "first_name": "test"}}}, None)
+
+
+def test_histogram_and_rate_meter():
+    """Bucket percentiles, merging, and rates over one-second buckets"""
+    print("📊 Testing metric primitives...")
+    hist = Histogram()
+    for value in [0.003] * 90 + [0.2] * 9 + [3.0]:
+        hist.observe(value)
+    assert hist.counts[0] == 90 and hist.quantile(0.5) == 0.005 and hist.quantile(0.95) == 0.25
+    assert hist.quantile(1.0) == 3.0 and hist.as_dict()["p95"] == 0.25 and hist.as_dict()["max"] == 3.0
+    other = Histogram()
+    other.observe(20.0)  # beyond the last bound
+    hist.merge(other)
+    assert hist.count == 101 and hist.counts[-1] == 1 and hist.quantile(1.0) == 20.0
+
+    meter = RateMeter(seconds=10)
+    for second in range(100, 120):
+        for _ in range(3):
+            meter.mark(now=second + 0.5)
+    assert meter.total == 60
+    assert meter.rate(10, now=119.9) == 3.0
+    # old seconds are not counted again once their bucket is reused, and idle seconds count as zero
+    assert meter.rate(10, now=125.0) == 3 * 4 / 10
+    assert meter.rate(10, now=200.0) == 0.0
+    print("✅ Metric primitive test passed")
+
+
+def test_instrumented_handlers():
+    """Handlers (conversation steps too) are timed and their errors counted; updates are counted at group -1"""
+    print("⏱ Testing handler instrumentation...")
+
+    async def fine_handler(update, context):
+        return 7
+
+    async def broken_handler(update, context):
+        raise BadRequest("boom")
+
+    app = ApplicationBuilder().token("123:abc").build()
+    command = CommandHandler("fine", fine_handler)
+    step = MessageHandler(filters.TEXT, broken_handler)
+    app.add_handler(command)
+    app.add_handler(ConversationHandler(entry_points=[step], states={}, fallbacks=[]))
+    app.add_handler(router.handler())
+    assert instrument(app) == 2
+    assert instrument(app) == 0, "a second pass must not wrap again"
+    assert any(isinstance(h, TypeHandler) for h in app.handlers[-1])
+
+    before = handler_metrics.latency["fine_handler"].count
+    errors = handler_metrics.errors["broken_handler"]
+    update = _message_update()
+
+    async def scenario():
+        await handler_metrics.count_update(update, None)
+        assert await command.callback(update, None) == 7
+        try:
+            await step.callback(update, None)
+        except BadRequest:
+            pass
+        else:
+            raise AssertionError("the error must propagate")
+
+    asyncio.run(scenario())
+    assert handler_metrics.latency["fine_handler"].count == before + 1
+    assert handler_metrics.errors["broken_handler"] == errors + 1
+    assert handler_metrics.updates["message"] >= 1 and handler_metrics.rate.total >= 1
+    print("✅ Handler instrumentation test passed")
+
+
+def test_api_and_db_timings_and_endpoint():
+    """Bot API calls are timed per method, statements per kind; /metrics is valid text behind the token"""
+    print("📡 Testing Bot API/DB timings and /metrics...")
+    limiter = OutboundScheduler()
+
+    async def ok(*args, **kwargs):
+        return True
+
+    async def fails(*args, **kwargs):
+        raise BadRequest("chat not found")
+
+    async def scenario():
+        await limiter.process_request(ok, (), {}, "getMe", {}, None)
+        try:
+            await limiter.process_request(fails, (), {}, "getChat", {}, None)
+        except BadRequest:
+            pass
+
+    asyncio.run(scenario())
+    assert limiter.api_latency["getMe"].count == 1 and limiter.api_errors == {"getChat": 1}
+
+    selects = query_profiler.kinds["SELECT"].count
+    cursor.execute("SELECT 1").fetchone()
+    assert query_profiler.kinds["SELECT"].count == selects + 1
+
+    app = ApplicationBuilder().token("123:abc").rate_limiter(limiter).build()
+    text = prometheus_text(app)
+    for line in text.splitlines():
+        assert line.startswith("# TYPE ") or _SAMPLE.match(line), line
+    assert 'bot_api_latency_seconds_count{method="getMe"} 1' in text
+    assert 'bot_api_errors_total{method="getChat"} 1' in text
+    assert 'bot_db_latency_seconds_bucket{statement="SELECT",le="+Inf"}' in text
+    assert 'bot_component{component="outbox",key="sent"}' in text
+
+    route = metrics_route(app, token="s3cret")
+    assert asyncio.run(route({}, b""))[0] == 403
+    status, content_type, body = asyncio.run(route({"authorization": "Bearer s3cret"}, b""))
+    assert status == 200 and content_type.startswith("text/plain") and b"bot_updates_total" in body
+
+    perf = format_perf(app)
+    assert "getMe" in perf and "SELECT" in perf and len(perf) < 4096
+    print("✅ Bot API/DB timing and /metrics test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_histogram_and_rate_meter()
+        test_instrumented_handlers()
+        test_api_and_db_timings_and_endpoint()
+        print("\n🎉 All telemetry tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
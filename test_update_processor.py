@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Tests for concurrent update processing with per-user/per-chat ordering
+"""
+import asyncio
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, '.')
+
+from update_processor import KeyedUpdateProcessor, update_keys
+
+
+def _update(user_id, chat_id):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id), effective_chat=SimpleNamespace(id=chat_id))
+
+
+def test_serialized_per_key_concurrent_across_keys():
+    """Updates of one user run in arrival order one at a time; other users run alongside"""
+    print("🔀 Testing keyed update processing...")
+    log = []
+    running = {"now": 0, "max": 0}
+
+    async def handler(label, user_id, delay):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        log.append(("start", label))
+        await asyncio.sleep(delay)
+        log.append(("end", label))
+        running["now"] -= 1
+
+    async def scenario():
+        p = KeyedUpdateProcessor(max_concurrent_updates=8)
+        await asyncio.gather(
+            p.process_update(_update(1, 1), handler("u1-a", 1, 0.03)),
+            p.process_update(_update(1, -500), handler("u1-group", 1, 0.0)),  # same user, other chat
+            p.process_update(_update(1, 1), handler("u1-b", 1, 0.0)),
+            p.process_update(_update(2, -500), handler("u2-group", 2, 0.0)),  # same group as u1-group
+            p.process_update(_update(3, 3), handler("u3", 3, 0.01)),
+        )
+        return p.stats()
+
+    stats = asyncio.run(scenario())
+    at = {entry: i for i, entry in enumerate(log)}
+    assert at[("start", "u3")] < at[("end", "u1-a")], "Other users are not blocked by a slow handler"
+    assert at[("end", "u1-a")] < at[("start", "u1-group")] < at[("start", "u1-b")], "Per-user order preserved"
+    assert at[("end", "u1-group")] < at[("start", "u2-group")], "Per-chat order preserved"
+    assert running["max"] == 2
+    assert stats["processed"] == 5 and stats["contended"] == 3 and stats["in_flight"] == 0
+    assert stats["locks"] == 0, "Idle locks are dropped"
+    assert update_keys(object()) == []
+    print("✅ Keyed update processing test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_serialized_per_key_concurrent_across_keys()
+        print("\n🎉 All update processor tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
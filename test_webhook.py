@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Tests for the webhook receiver and embedded HTTP server
+"""
+import asyncio
+import json
+import sys
+
+sys.path.insert(0, '.')
+
+import httpx
+from telegram import Update
+from telegram.ext import ApplicationBuilder, TypeHandler
+from telegram.request import BaseRequest
+
+import webhook
+from update_processor import KeyedUpdateProcessor
+from webhook import SECRET_HEADER, HTTPServer, WebhookReceiver
+from webhook_bench import post_updates, synthetic_update
+
+
+async def _with_server(max_queued, scenario):
+    update_queue = asyncio.Queue()
+    receiver = WebhookReceiver(update_queue, secret="s3cret", max_queued=max_queued, record_file="")
+    server = HTTPServer("127.0.0.1", 0)
+    server.add_route("POST", "/telegram", receiver)
+    await server.start()
+    try:
+        return await scenario(f"http://127.0.0.1:{server.port}/telegram", update_queue, receiver)
+    finally:
+        await server.stop()
+
+
+def test_secret_validation_and_queue_bound():
+    """Wrong secret -> 403, garbage -> 400, full queue -> 503 so Telegram redelivers"""
+    print("🌐 Testing webhook receiver...")
+
+    async def scenario(url, update_queue, receiver):
+        report = await post_updates(url, [synthetic_update(i) for i in range(1, 6)], "s3cret", concurrency=2)
+        async with httpx.AsyncClient() as client:
+            forbidden = await client.post(url, content=b"{}", headers={SECRET_HEADER: "wrong"})
+            garbage = await client.post(url, content=b"not json", headers={SECRET_HEADER: "s3cret"})
+            missing = await client.post(url.replace("/telegram", "/nope"), content=b"{}")
+        return report, forbidden.status_code, garbage.status_code, missing.status_code, update_queue, receiver
+
+    report, forbidden, garbage, missing, update_queue, receiver = asyncio.run(_with_server(3, scenario))
+    assert report["statuses"] == {200: 3, 503: 2}, report
+    assert (forbidden, garbage, missing) == (403, 400, 404)
+    assert update_queue.qsize() == 3 and update_queue.get_nowait().update_id in (1, 2, 3)
+    assert receiver.stats()["rejected_full"] == 2 and receiver.rejected_auth == 1
+    print("✅ Webhook receiver test passed")
+
+
+def test_drain_finishes_in_flight_request():
+    """stop() waits for a request that is being handled and then refuses new connections"""
+    print("🌐 Testing webhook drain...")
+
+    async def scenario():
+        server = HTTPServer("127.0.0.1", 0)
+        release = asyncio.Event()
+
+        async def slow(headers, body):
+            await release.wait()
+            return 200, "text/plain", b"done"
+
+        server.add_route("POST", "/slow", slow)
+        await server.start()
+        url = f"http://127.0.0.1:{server.port}/slow"
+        async with httpx.AsyncClient() as client:
+            pending = asyncio.ensure_future(client.post(url))
+            await asyncio.sleep(0.05)
+            stopping = asyncio.ensure_future(server.stop())
+            await asyncio.sleep(0.05)
+            assert not stopping.done(), "stop() must wait for the in-flight request"
+            release.set()
+            response = await pending
+            await stopping
+            try:
+                await client.post(url)
+                refused = False
+            except httpx.HTTPError:
+                refused = True
+        return response.text, refused
+
+    text, refused = asyncio.run(scenario())
+    assert text == "done" and refused
+    print("✅ Webhook drain test passed")
+
+
+def test_malformed_and_slow_requests():
+    """Bad request line or Content-Length -> 400, header flood -> 431, a stalled body is cut off"""
+    print("🌐 Testing malformed requests...")
+
+    async def exchange(port, data):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(data)
+        await writer.drain()
+        try:
+            return await asyncio.wait_for(reader.read(), timeout=2)
+        finally:
+            writer.close()
+
+    async def scenario():
+        server = HTTPServer("127.0.0.1", 0)
+
+        async def ok(headers, body):
+            return 200, "text/plain", b"ok"
+
+        server.add_route("POST", "/ok", ok)
+        await server.start()
+        try:
+            flood = b"".join(b"X-H%d: v\r\n" % i for i in range(200))
+            return [
+                await exchange(server.port, b"GARBAGE\r\n\r\n"),
+                await exchange(server.port, b"POST /ok HTTP/1.1\r\nContent-Length: -1\r\n\r\n"),
+                await exchange(server.port, b"POST /ok HTTP/1.1\r\nContent-Length: abc\r\n\r\n"),
+                await exchange(server.port, b"POST /ok HTTP/1.1\r\n" + flood + b"\r\n"),
+                await exchange(server.port, b"POST /ok HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc"),
+            ]
+        finally:
+            await server.stop()
+
+    deadline = webhook._REQUEST_SECONDS
+    webhook._REQUEST_SECONDS = 0.2
+    try:
+        bad_line, negative, letters, flood, stalled = asyncio.run(scenario())
+    finally:
+        webhook._REQUEST_SECONDS = deadline
+    assert bad_line.startswith(b"HTTP/1.1 400 ") and negative.startswith(b"HTTP/1.1 400 ")
+    assert letters.startswith(b"HTTP/1.1 400 ") and flood.startswith(b"HTTP/1.1 431 ")
+    assert stalled == b"", "A client that never sends the rest of the body is disconnected"
+    print("✅ Malformed requests test passed")
+
+
+class _OfflineRequest(BaseRequest):
+    """Answers getMe locally, so an Application can be initialized without Telegram."""
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        bot = {"id": 123, "is_bot": True, "first_name": "Test", "username": "test_bot"}
+        return 200, json.dumps({"ok": True, "result": bot}).encode()
+
+
+def test_bound_counts_updates_being_handled():
+    """With concurrent processing the bound covers updates taken off the queue but not handled yet"""
+    print("🌐 Testing webhook bound with concurrent updates...")
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow(update, context):
+            await release.wait()
+
+        app = (ApplicationBuilder().token("123:abc").updater(None)
+               .request(_OfflineRequest()).get_updates_request(_OfflineRequest())
+               .concurrent_updates(KeyedUpdateProcessor(max_concurrent_updates=8)).build())
+        app.add_handler(TypeHandler(Update, slow))
+        receiver = WebhookReceiver(app.update_queue, app.bot, secret="s3cret", max_queued=5, record_file="")
+        server = HTTPServer("127.0.0.1", 0)
+        server.add_route("POST", "/telegram", receiver)
+        async with app:
+            await app.start()
+            await server.start()
+            try:
+                url = f"http://127.0.0.1:{server.port}/telegram"
+                updates = [synthetic_update(i, user_id=100000 + i) for i in range(1, 21)]
+                report = await post_updates(url, updates, "s3cret", concurrency=4)
+                busy = receiver.stats()
+                release.set()
+                await app.update_queue.join()
+                after = await post_updates(url, [synthetic_update(21)], "s3cret")
+                await app.update_queue.join()
+            finally:
+                await server.stop()
+                await app.stop()
+        return report, busy, after, receiver.pending()
+
+    report, busy, after, pending = asyncio.run(scenario())
+    assert report["statuses"] == {200: 5, 503: 15}, report
+    assert busy["queued"] == 0 and busy["pending"] == 5, "PTB empties the queue, the bound still holds"
+    assert after["statuses"] == {200: 1} and pending == 0, "Handled updates free their place"
+    print("✅ Concurrent webhook bound test passed")
+
+
+if __name__ == "__main__":
+    try:
+        test_secret_validation_and_queue_bound()
+        test_drain_finishes_in_flight_request()
+        test_malformed_and_slow_requests()
+        test_bound_counts_updates_being_handled()
+        print("\n🎉 All webhook tests passed!")
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,119 @@
+"""
+Concurrent update processing with per-user / per-chat ordering.
+
+PTB runs updates one by one unless `concurrent_updates` is enabled. This
+processor runs them concurrently across chats but serializes every update
+within one user and within one chat: each update takes the asyncio locks of
+its user id and chat id (in a fixed order, so two updates can never deadlock).
+Private chats share the user's id, so they get a single lock.
+
+Handlers still share one sqlite cursor and `user_states`, but a handler only
+yields control at `await`, so an execute/fetch pair without an await in
+between cannot be interleaved with another update.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Dict, List
+
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import Summary
+
+logger = logging.getLogger(__name__)
+
+# 1 restores PTB's sequential processing
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+
+
+def update_keys(update: Any) -> List[int]:
+    """Lock keys of an update: its user and chat ids, sorted; empty for updates without either."""
+    keys = set()
+    user = getattr(update, "effective_user", None)
+    if user is not None:
+        keys.add(user.id)
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None:
+        keys.add(chat.id)
+    return sorted(keys)
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int = UPDATE_CONCURRENCY):
+        super().__init__(max(1, max_concurrent_updates))
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._lock_users: Dict[int, int] = {}
+
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.processed = 0
+        self.contended = 0
+        self.lock_wait = Summary()
+        self.handle_time = Summary()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "processed": self.processed,
+            "contended": self.contended,
+            "lock_wait_s": self.lock_wait.as_dict(),
+            "handle_s": self.handle_time.as_dict(),
+            "locks": len(self._locks),
+        }
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        keys = update_keys(update)
+        locks = [self._acquire_lock_ref(key) for key in keys]
+        waited = time.monotonic()
+        acquired = 0
+        try:
+            if any(lock.locked() for lock in locks):
+                self.contended += 1
+            for lock in locks:
+                await lock.acquire()
+                acquired += 1
+            started = time.monotonic()
+            self.lock_wait.observe(started - waited)
+
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                await coroutine
+            finally:
+                self.in_flight -= 1
+                self.processed += 1
+                self.handle_time.observe(time.monotonic() - started)
+        finally:
+            for lock in locks[:acquired]:
+                lock.release()
+            for key in keys:
+                self._release_lock_ref(key)
+            if acquired < len(locks) and asyncio.iscoroutine(coroutine):
+                # cancelled while waiting: don't leave a never-awaited coroutine behind
+                coroutine.close()
+
+    # ---------- internals ----------
+
+    def _acquire_lock_ref(self, key: int) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._lock_users[key] = self._lock_users.get(key, 0) + 1
+        return lock
+
+    def _release_lock_ref(self, key: int):
+        # Drop locks of idle users/chats so the dict does not grow with every chat ever seen
+        users = self._lock_users.get(key, 1) - 1
+        if users <= 0:
+            self._lock_users.pop(key, None)
+            self._locks.pop(key, None)
+        else:
+            self._lock_users[key] = users
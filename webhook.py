@@ -0,0 +1,306 @@
+"""
+Webhook serving mode (BOT_MODE=webhook) on a small embedded HTTP server.
+
+The server is plain asyncio streams (HTTP/1.1 with keep-alive, Content-Length
+bodies only), which is all Telegram's webhook client and the benchmark harness
+(webhook_bench.py) need, so no web framework is required. A request has to
+arrive in full within _REQUEST_SECONDS and headers are capped, so a slow or
+malformed client can't hold a connection slot. Other modules can
+register extra routes (e.g. health or metrics) with `add_route`.
+
+Updates are accepted only with the right X-Telegram-Bot-Api-Secret-Token and
+put on the Application's update queue. When WEBHOOK_QUEUE_SIZE updates are
+unfinished (still queued or being handled), the server answers 503 and
+Telegram redelivers the update later. On shutdown the listener is closed first, in-flight requests finish, and
+Application.stop() processes everything still queued before post_stop runs.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import os
+import signal
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")          # public base URL, e.g. https://bot.example.com
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Append every accepted update body to this JSONL file (input for webhook_bench.py)
+WEBHOOK_RECORD_FILE = os.getenv("WEBHOOK_RECORD_FILE", "")
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+_MAX_BODY = 1 << 20
+_KEEPALIVE_SECONDS = 75.0
+_REQUEST_SECONDS = 30.0  # from the request line to the end of the body
+_MAX_HEADERS = 100
+_MAX_HEADER_BYTES = 16 << 10
+_DRAIN_SECONDS = 10.0
+_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+            411: "Length Required", 413: "Payload Too Large", 431: "Request Header Fields Too Large",
+            500: "Internal Server Error", 503: "Service Unavailable"}
+
+# (headers with lower-case names, body) -> (status, content type, body)
+Response = Tuple[int, str, bytes]
+RouteHandler = Callable[[Dict[str, str], bytes], Awaitable[Response]]
+
+
+class _RequestError(Exception):
+    """A request the server answers itself, then closes the connection."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.response: Response = (status, "text/plain", message.encode())
+
+
+class HTTPServer:
+    def __init__(self, host: str, port: int, max_body: int = _MAX_BODY):
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+        self._routes: Dict[Tuple[str, str], RouteHandler] = {}
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def add_route(self, method: str, path: str, handler: RouteHandler) -> None:
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve_connection, self.host, self.port)
+        # Port 0 in tests: remember the one the OS picked
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self, drain_seconds: float = _DRAIN_SECONDS) -> None:
+        """Stop accepting, let requests being handled finish, then close idle keep-alive connections."""
+        if self._server is None:
+            return
+        self._server.close()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=drain_seconds)
+        except asyncio.TimeoutError:
+            logger.warning("HTTP server: %d request(s) still running after %.0fs", self._in_flight, drain_seconds)
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=_KEEPALIVE_SECONDS)
+                if not line:
+                    break
+                try:
+                    method, target, version, headers, body = await asyncio.wait_for(
+                        self._read_request(line, reader), timeout=_REQUEST_SECONDS
+                    )
+                except _RequestError as e:
+                    await self._respond(writer, e.response, False)
+                    break
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+                self._in_flight += 1
+                self._idle.clear()
+                try:
+                    response = await self._dispatch(method.upper(), target.split("?", 1)[0], headers, body)
+                finally:
+                    self._in_flight -= 1
+                    if self._in_flight == 0:
+                        self._idle.set()
+                await self._respond(writer, response, keep_alive)
+                if not keep_alive or self._server is None or not self._server.is_serving():
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _read_request(self, line: bytes, reader: asyncio.StreamReader
+                            ) -> Tuple[str, str, str, Dict[str, str], bytes]:
+        """(method, target, version, headers, body) of one request; _RequestError if it can't be served."""
+        parts = line.decode("latin-1").split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            raise _RequestError(400, "bad request line")
+        method, target, version = parts
+        headers: Dict[str, str] = {}
+        size = 0
+        while True:
+            raw = await reader.readline()
+            if raw in (b"\r\n", b"\n", b""):
+                break
+            size += len(raw)
+            if len(headers) >= _MAX_HEADERS or size > _MAX_HEADER_BYTES:
+                raise _RequestError(431, "headers too large")
+            name, _, value = raw.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if "transfer-encoding" in headers:
+            raise _RequestError(411, "length required")
+        length = headers.get("content-length") or "0"
+        if not length.isdigit():
+            raise _RequestError(400, "bad content-length")
+        if int(length) > self.max_body:
+            raise _RequestError(413, "too large")
+        body = await reader.readexactly(int(length)) if int(length) else b""
+        return method, target, version, headers, body
+
+    async def _dispatch(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Response:
+        handler = self._routes.get((method, path))
+        if handler is None:
+            known = any(p == path for _, p in self._routes)
+            return (405, "text/plain", b"method not allowed") if known else (404, "text/plain", b"not found")
+        try:
+            return await handler(headers, body)
+        except Exception as e:
+            logger.exception("HTTP handler %s %s failed: %s", method, path, e)
+            return 500, "text/plain", b"internal error"
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, response: Response, keep_alive: bool):
+        status, content_type, body = response
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+class WebhookReceiver:
+    """POST handler that validates, decodes and enqueues Telegram updates."""
+
+    def __init__(self, update_queue: asyncio.Queue, bot: Any = None, secret: str = WEBHOOK_SECRET,
+                 max_queued: int = WEBHOOK_QUEUE_SIZE, record_file: str = WEBHOOK_RECORD_FILE):
+        self.update_queue = update_queue
+        self.bot = bot
+        self.secret = secret
+        self.max_queued = max_queued
+        self.record_file = record_file
+
+        self.accepted = 0
+        self.rejected_auth = 0
+        self.rejected_full = 0
+        self.bad_requests = 0
+
+    def pending(self) -> int:
+        """
+        Accepted updates not processed yet. With concurrent updates PTB moves every update off the
+        queue into a task at once, so qsize() stays near 0; it calls task_done() only once the
+        update has been handled, which is what the unfinished-task count tracks.
+        """
+        return getattr(self.update_queue, "_unfinished_tasks", self.update_queue.qsize())
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.update_queue.qsize(),
+            "pending": self.pending(),
+            "accepted": self.accepted,
+            "rejected_auth": self.rejected_auth,
+            "rejected_full": self.rejected_full,
+            "bad_requests": self.bad_requests,
+        }
+
+    async def __call__(self, headers: Dict[str, str], body: bytes) -> Response:
+        if self.secret and not hmac.compare_digest(headers.get(SECRET_HEADER, ""), self.secret):
+            self.rejected_auth += 1
+            return 403, "text/plain", b"forbidden"
+        try:
+            update = Update.de_json(json.loads(body), self.bot)
+        except Exception:
+            update = None
+        if update is None:
+            self.bad_requests += 1
+            return 400, "text/plain", b"bad update"
+        if self.pending() >= self.max_queued:
+            # Telegram retries non-2xx answers, so shedding load here loses nothing
+            self.rejected_full += 1
+            return 503, "text/plain", b"busy"
+        self.update_queue.put_nowait(update)
+        self.accepted += 1
+        if self.record_file:
+            self._record(body)
+        return 200, "text/plain", b"ok"
+
+    def _record(self, body: bytes):
+        try:
+            with open(self.record_file, "ab") as f:
+                f.write(body.replace(b"\n", b" ") + b"\n")
+        except OSError as e:
+            logger.warning("Webhook recording failed: %s", e)
+
+
+async def _health(headers: Dict[str, str], body: bytes) -> Response:
+    return 200, "text/plain", b"ok"
+
+
+def build_server(application: Any, host: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT,
+                 path: str = WEBHOOK_PATH, routes: Optional[Dict[str, RouteHandler]] = None
+                 ) -> Tuple[HTTPServer, WebhookReceiver]:
+    """`routes`: extra GET routes by path, e.g. {"/metrics": ...}."""
+    server = HTTPServer(host, port)
+    receiver = WebhookReceiver(application.update_queue, application.bot)
+    server.add_route("POST", path, receiver)
+    server.add_route("GET", "/healthz", _health)
+    for route_path, handler in (routes or {}).items():
+        server.add_route("GET", route_path, handler)
+    return server, receiver
+
+
+async def serve_webhook(application: Any, server: HTTPServer, receiver: WebhookReceiver) -> None:
+    """Application lifecycle of run_polling/run_webhook, with our server in place of the Updater."""
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    async with application:  # initialize() / shutdown()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+        logger.info("Webhook server listening on %s:%s%s", server.host, server.port, WEBHOOK_PATH)
+        try:
+            await stop.wait()
+        finally:
+            started = time.monotonic()
+            await server.stop()
+            # Processes every update that is still queued
+            await application.stop()
+            logger.info("Webhook drained in %.1fs: %s", time.monotonic() - started, receiver.stats())
+            if application.post_stop:
+                await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+def run_webhook(application: Any, routes: Optional[Dict[str, RouteHandler]] = None) -> None:
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET is empty: the webhook endpoint accepts updates from anyone")
+    server, receiver = build_server(application, routes=routes)
+    asyncio.run(serve_webhook(application, server, receiver))
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Webhook load harness: POSTs recorded Update JSON to a webhook endpoint and reports
+throughput and latency, without Telegram in the loop.
+
+    # against a running bot (BOT_MODE=webhook)
+    python webhook_bench.py --url http://127.0.0.1:8080/telegram --secret $WEBHOOK_SECRET \
+        --updates recorded.jsonl --concurrency 20
+
+    # self-contained: local receiver with a simulated handler
+    python webhook_bench.py --local --count 5000 --handler-ms 2
+
+Updates are read from a JSONL file (record one with WEBHOOK_RECORD_FILE) or
+synthesized as private text messages. update_id is rewritten so every POST is unique.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+
+def synthetic_update(update_id: int, user_id: int = 100000, text: str = "/start") -> Dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+            "text": text,
+        },
+    }
+
+
+def load_updates(path: Optional[str], count: int) -> List[Dict]:
+    if not path:
+        return [synthetic_update(i, user_id=100000 + i % 50) for i in range(1, count + 1)]
+    with open(path, encoding="utf-8") as f:
+        recorded = [json.loads(line) for line in f if line.strip()]
+    if not recorded:
+        raise SystemExit(f"{path}: no updates")
+    updates = []
+    for i in range(count):
+        update = dict(recorded[i % len(recorded)])
+        update["update_id"] = i + 1
+        updates.append(update)
+    return updates
+
+
+async def post_updates(url: str, updates: List[Dict], secret: str = "", concurrency: int = 10) -> Dict:
+    """POST every update with `concurrency` keep-alive connections; returns status counts and latency stats."""
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+    queue: asyncio.Queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(json.dumps(update).encode())
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+
+    async def worker(client: httpx.AsyncClient):
+        while not queue.empty():
+            body = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                response = await client.post(url, content=body, headers=headers)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 0
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    started = time.perf_counter()
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    def pct(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+    return {
+        "requests": len(latencies),
+        "statuses": statuses,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+            "p50": round(pct(0.50), 2),
+            "p95": round(pct(0.95), 2),
+            "p99": round(pct(0.99), 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+    }
+
+
+async def run_local(updates: List[Dict], concurrency: int, handler_ms: float, queue_size: int) -> Dict:
+    """Benchmark the real receiver and HTTP server with a consumer that simulates handler time."""
+    from webhook import HTTPServer, WebhookReceiver
+
+    update_queue: asyncio.Queue = asyncio.Queue()
+    receiver = WebhookReceiver(update_queue, secret="bench", max_queued=queue_size, record_file="")
+    server = HTTPServer("127.0.0.1", 0)
+    server.add_route("POST", "/telegram", receiver)
+    await server.start()
+
+    processed = 0
+
+    async def consumer():
+        nonlocal processed
+        while True:
+            await update_queue.get()
+            if handler_ms:
+                await asyncio.sleep(handler_ms / 1000)
+            processed += 1
+            update_queue.task_done()
+
+    consumer_task = asyncio.ensure_future(consumer())
+    try:
+        report = await post_updates(f"http://127.0.0.1:{server.port}/telegram", updates, "bench", concurrency)
+        await update_queue.join()
+    finally:
+        consumer_task.cancel()
+        await server.stop()
+    report["processed"] = processed
+    report["receiver"] = receiver.stats()
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="webhook endpoint of a running bot")
+    parser.add_argument("--secret", default="", help="value of X-Telegram-Bot-Api-Secret-Token")
+    parser.add_argument("--updates", help="JSONL file with recorded updates")
+    parser.add_argument("--count", type=int, default=1000, help="number of POSTs")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--local", action="store_true", help="start a local receiver instead of using --url")
+    parser.add_argument("--handler-ms", type=float, default=0.0, help="simulated handler time (--local)")
+    parser.add_argument("--queue-size", type=int, default=1000, help="receiver queue bound (--local)")
+    args = parser.parse_args(argv)
+
+    if not args.local and not args.url:
+        parser.error("either --url or --local is required")
+    updates = load_updates(args.updates, args.count)
+    if args.local:
+        report = asyncio.run(run_local(updates, args.concurrency, args.handler_ms, args.queue_size))
+    else:
+        report = asyncio.run(post_updates(args.url, updates, args.secret, args.concurrency))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())